@@ -486,6 +486,8 @@ class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
             "requests": 0,
             "method": collections.defaultdict(int),
             "method-t": collections.defaultdict(float),
+            "method-sql-s": collections.defaultdict(int),
+            "method-sql-t": collections.defaultdict(float),
             "500": 0,
             "401": 0,
             "t": 0.0,
@@ -495,6 +497,7 @@ class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
             "T": initTimeHistogram(),
             "T-RESP-WR": initTimeHistogram(),
             "T-MAX": 0.0,
+            "lease": collections.defaultdict(int),
             "cpu": self.systemStats.items["cpu use"],
         }
 
@@ -507,6 +510,9 @@ class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
         current["requests"] += 1
         current["method"][adjustedMethod] += 1
         current["method-t"][adjustedMethod] += stats.get("t", 0.0)
+        if "sql-s" in stats:
+            current["method-sql-s"][adjustedMethod] += int(stats["sql-s"])
+            current["method-sql-t"][adjustedMethod] += float(stats.get("sql-t", 0.0))
         if stats["statusCode"] >= 500:
             current["500"] += 1
         elif stats["statusCode"] == 401:
@@ -516,6 +522,9 @@ class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
         current["slots"] += stats.get("outstandingRequests", 0)
         current["max-slots"] = max(current["max-slots"], self.limiter.maxOutstandingRequests if hasattr(self, "limiter") else 0)
         current["cpu"] += self.systemStats.items["cpu use"]
+        for item in ("lease-granted", "lease-stale", "lease-wait", "lease-timeout",):
+            if item in stats:
+                current["lease"][item[len("lease-"):]] += int(stats[item])
 
         def histogramUpdate(t, key):
             if t >= 60000.0:
@@ -554,6 +563,10 @@ class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
             current["method"][method] += stats["method"][method]
         for method in stats["method-t"].keys():
             current["method-t"][method] += stats["method-t"][method]
+        for method in stats.get("method-sql-s", {}).keys():
+            current["method-sql-s"][method] += stats["method-sql-s"][method]
+        for method in stats.get("method-sql-t", {}).keys():
+            current["method-sql-t"][method] += stats["method-sql-t"][method]
         current["500"] += stats["500"]
         current["401"] += stats["401"]
         current["t"] += stats["t"]
@@ -561,6 +574,8 @@ class RotatingFileAccessLoggingObserver(CommonAccessLoggingObserverExtensions):
         current["slots"] += stats["slots"]
         current["max-slots"] = max(current["max-slots"], stats["max-slots"])
         current["cpu"] += stats["cpu"]
+        for item in stats.get("lease", {}).keys():
+            current["lease"][item] += stats["lease"][item]
 
         def histogramUpdate(t, key):
             if t >= 60000.0:
@@ -213,4 +213,5 @@ class DashboardServer(Factory):
                     expireSeconds=config.DirectoryCaching.CachingSeconds,
                     lookupsBetweenPurges=config.DirectoryCaching.LookupsBetweenPurges,
                     negativeCaching=config.DirectoryCaching.NegativeCachingEnabled,
+                    maxRecordsPerIndex=config.DirectoryCaching.MaxRecordsPerIndex,
                 )
@@ -25,6 +25,8 @@ except ImportError:
     # OS X Server SACLs not supported on this system, make SACL check a no-op
     checkSACL = lambda *ignored: True
 
+from functools import partial
+
 from twext.python.log import Logger
 from twisted.cred.error import LoginFailed, UnauthorizedLogin
 from twisted.internet.defer import inlineCallbacks, returnValue, succeed
@@ -101,7 +103,15 @@ class RootResource(
 
         if config.ResponseCompression:
             from txweb2.filter import gzip
-            self.contentFilters.append((gzip.gzipfilter, True))
+            options = config.ResponseCompressionOptions
+            if options.CacheSize:
+                cache = gzip.CompressedBodyCache(options.CacheSize, options.MaxCachedBodySize)
+            else:
+                cache = None
+            self.contentFilters.append((
+                partial(gzip.gzipfilter, minimumSize=options.MinimumSize, cache=cache),
+                True
+            ))
 
     def deadProperties(self):
         if not hasattr(self, "_dead_properties"):
@@ -387,6 +397,15 @@ class RootResource(
                     response = yield self.responseCache.getResponseForRequest(
                         request
                     )
+                    if getattr(request, "cacheLease", None) is not None:
+                        # Do not keep other requests waiting if this one fails
+                        # before its response is cached
+                        def _releaseCacheLease(request, response):
+                            d = self.responseCache.releaseLeaseForRequest(request)
+                            d.addCallback(lambda _: response)
+                            return d
+                        _releaseCacheLease.handleErrors = True
+                        request.addResponseFilter(_releaseCacheLease)
                     if response is None:
                         request.notInCache = True
                         raise KeyError("Not found in cache.")
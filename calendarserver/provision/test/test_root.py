@@ -15,7 +15,8 @@
 ##
 
 
-from twisted.internet.defer import inlineCallbacks, maybeDeferred, returnValue
+from twisted.internet.defer import inlineCallbacks, maybeDeferred, returnValue, \
+    succeed
 
 from txweb2 import http_headers
 from txweb2 import responsecode
@@ -356,6 +357,45 @@ class SACLCacheTests(RootTests):
             self.fail("Incorrect response for PROPFIND /principals/: %s" % (response.code,))
         self.assertEqual(self.actualRoot.responseCache.cacheHitCount, 1)
 
+    @inlineCallbacks
+    def test_leaseReleasedOnError(self):
+        """
+        A response cache lease granted while locating a resource is released when the
+        request fails before the response can be cached.
+        """
+
+        released = []
+
+        class LeasingResponseCache(SACLCacheTests.StubResponseCacheResource):
+
+            def getResponseForRequest(self, request):
+                request.cacheLease = "token"
+                return None
+
+            def releaseLeaseForRequest(self, request):
+                released.append(request.cacheLease)
+                request.cacheLease = None
+                return succeed(None)
+
+        self.actualRoot.responseCache = LeasingResponseCache()
+        principal = yield self.actualRoot.findPrincipalForAuthID("dreid")
+
+        request = SimpleStoreRequest(
+            self,
+            "PROPFIND",
+            "/nonexistent/child/",
+            headers=http_headers.Headers({
+                'Depth': '1',
+            }),
+            authPrincipal=principal,
+        )
+        d = self.send(request)
+        d.addErrback(request._processingFailed)
+        response = IResponse((yield d))
+
+        self.assertEqual(response.code, responsecode.NOT_FOUND)
+        self.assertEqual(released, ["token"])
+
 
 class WikiTests(RootTests):
 
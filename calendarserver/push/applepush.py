@@ -33,6 +33,7 @@ from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 from twisted.internet.protocol import ClientFactory, ReconnectingClientFactory
 from twistedcaldav.extensions import DAVResource, DAVResourceWithoutChildrenMixin
 from twistedcaldav.resource import ReadOnlyNoCopyResourceMixIn
+from collections import OrderedDict
 import json
 import OpenSSL
 import struct
@@ -126,6 +127,10 @@ class ApplePushNotifierService(service.MultiService):
                     keychainIdentity=settings[protocol]["KeychainIdentity"],
                     staggerNotifications=settings["EnableStaggering"],
                     staggerSeconds=settings["StaggerSeconds"],
+                    batchSize=settings["BatchSize"],
+                    maxQueued=settings["MaxQueuedNotifications"],
+                    tokenBackoffSeconds=settings["TokenBackoffSeconds"],
+                    maxTokenBackoffSeconds=settings["MaxTokenBackoffSeconds"],
                     testConnector=providerTestConnector,
                     reactor=reactor,
                 )
@@ -248,6 +253,7 @@ class APNProviderProtocol(Protocol):
         6: "Invalid topic size",
         7: "Invalid payload size",
         8: "Invalid token",
+        10: "Shutdown",
         255: "None (unknown)",
     }
 
@@ -255,10 +261,20 @@ class APNProviderProtocol(Protocol):
     # token
     TOKEN_REMOVAL_CODES = (5, 8)
 
+    # If error code comes back as one of these, the notification itself was
+    # bad, so stop sending to the associated device token for a while.  Other
+    # codes are server-side or affect every notification, so the token is not
+    # to blame.
+    TOKEN_BACKOFF_CODES = (2, 4, 7)
+
+    # The identifier of a shutdown error is the last notification that
+    # succeeded, not one that failed
+    STATUS_SHUTDOWN = 10
+
     MESSAGE_LENGTH = 6
 
     def makeConnection(self, transport):
-        self.history = TokenHistory()
+        self.history = TokenHistory(maxSize=self.factory.historySize)
         self.log.debug("ProviderProtocol makeConnection")
         Protocol.makeConnection(self, transport)
 
@@ -272,8 +288,10 @@ class APNProviderProtocol(Protocol):
 
     def connectionLost(self, reason=None):
         # self.log.debug("ProviderProtocol connectionLost: {reason}", reason=reason)
-        # Clear the reference to us from the factory
-        self.factory.connection = None
+        # Clear the reference to us from the factory, unless a new connection
+        # has already replaced us
+        if self.factory.connection is self:
+            self.factory.connection = None
 
     @inlineCallbacks
     def dataReceived(self, data, fn=None):
@@ -307,7 +325,12 @@ class APNProviderProtocol(Protocol):
         """
         Handles an error message we've received on the provider channel.
         If the error code is one that indicates a bad token, remove all
-        subscriptions corresponding to that token.
+        subscriptions corresponding to that token; if it indicates a bad
+        notification, stop sending to that token for a while.
+
+        The APN server drops every notification written after the one in
+        error and closes the connection, so those notifications are queued
+        to be resent once we have reconnected.
 
         @param status: The status value returned from APN Feedback server
         @type status: C{int}
@@ -318,22 +341,42 @@ class APNProviderProtocol(Protocol):
         """
         msg = self.STATUS_CODES.get(status, "Unknown status code")
         self.log.info("Received APN error {status} on identifier {id}: {msg}", status=status, id=identifier, msg=msg)
-        if status in self.TOKEN_REMOVAL_CODES:
-            token = self.history.extractIdentifier(identifier)
-            if token is not None:
+
+        # Stop using this connection, so that new notifications are queued
+        # rather than lost, and resend the ones the server dropped
+        if self.factory.connection is self:
+            self.factory.connection = None
+            self.transport.loseConnection()
+        resend = self.history.extractAfter(identifier)
+        if resend:
+            self.log.info(
+                "Resending {num} APN notifications sent after identifier {id}",
+                num=len(resend), id=identifier,
+            )
+            self.factory.service.requeueNotifications(resend)
+
+        if status == self.STATUS_SHUTDOWN:
+            return
+        token = self.history.extractIdentifier(identifier)
+        if token is None:
+            return
+        if status in self.TOKEN_BACKOFF_CODES:
+            # Hold off sending to this token for a while
+            self.factory.service.tokenFailed(token)
+        elif status in self.TOKEN_REMOVAL_CODES:
+            self.log.debug(
+                "Removing subscriptions for bad token: {token}",
+                token=token,
+            )
+            txn = self.factory.store.newTransaction(label="APNProviderProtocol.processError")
+            subscriptions = (yield txn.apnSubscriptionsByToken(token))
+            for record in subscriptions:
                 self.log.debug(
-                    "Removing subscriptions for bad token: {token}",
-                    token=token,
+                    "Removing subscription: {token} {key}",
+                    token=token, key=record.resourceKey
                 )
-                txn = self.factory.store.newTransaction(label="APNProviderProtocol.processError")
-                subscriptions = (yield txn.apnSubscriptionsByToken(token))
-                for record in subscriptions:
-                    self.log.debug(
-                        "Removing subscription: {token} {key}",
-                        token=token, key=record.resourceKey
-                    )
-                    yield txn.removeAPNSubscription(token, record.resourceKey)
-                yield txn.commit()
+                yield txn.removeAPNSubscription(token, record.resourceKey)
+            yield txn.commit()
 
     def sendNotification(self, token, key, dataChangedTimestamp, priority):
         """
@@ -348,30 +391,71 @@ class APNProviderProtocol(Protocol):
             which triggered this notification
         @type key: C{int}
         """
+        self.sendNotifications([(token, key, dataChangedTimestamp, priority,)])
 
-        if not (token and key and dataChangedTimestamp):
-            return
+    def sendNotifications(self, notifications):
+        """
+        Sends a batch of push notification messages with a single write to the
+        transport.
 
-        try:
-            binaryToken = token.replace(" ", "").decode("hex")
-        except:
-            self.log.error("Invalid APN token in database: {token}", token=token)
-            return
-        tokenLength = len(binaryToken)
+        @param notifications: the notifications to send
+        @type notifications: iterable of C{tuple} of token, key, dataChangedTimestamp
+            and priority (see L{sendNotification})
+        """
 
-        identifier = self.history.add(token)
-        apnsPriority = ApplePushPriority.lookupByValue(priority.value).value
-        payload = json.dumps(
-            {
-                "key": key,
-                "dataChangedTimestamp": dataChangedTimestamp,
-                "pushRequestSubmittedTimestamp": int(time.time()),
-            }
-        )
-        payloadLength = len(payload)
-        self.log.debug(
-            "Sending APNS notification to {token}: id={id} payload={payload} priority={priority}",
-            token=token, id=identifier, payload=payload, priority=apnsPriority)
+        now = int(time.time())
+        payloads = {}
+        frames = []
+        for token, key, dataChangedTimestamp, priority in notifications:
+            if not (token and key and dataChangedTimestamp):
+                continue
+
+            try:
+                binaryToken = token.replace(" ", "").decode("hex")
+            except:
+                self.log.error("Invalid APN token in database: {token}", token=token)
+                continue
+
+            # Every token for a key gets the same payload
+            payload = payloads.get((key, dataChangedTimestamp,))
+            if payload is None:
+                payload = payloads[(key, dataChangedTimestamp,)] = json.dumps(
+                    {
+                        "key": key,
+                        "dataChangedTimestamp": dataChangedTimestamp,
+                        "pushRequestSubmittedTimestamp": now,
+                    }
+                )
+
+            identifier = self.history.add(token, (token, key, dataChangedTimestamp, priority,))
+            apnsPriority = ApplePushPriority.lookupByValue(priority.value).value
+            self.log.debug(
+                "Sending APNS notification to {token}: id={id} payload={payload} priority={priority}",
+                token=token, id=identifier, payload=payload, priority=apnsPriority)
+            frames.append(self.frame(binaryToken, payload, identifier, now + 72 * 60 * 60, apnsPriority))
+
+        if frames:
+            self.transport.write("".join(frames))
+
+    @classmethod
+    def frame(cls, binaryToken, payload, identifier, expiration, apnsPriority):
+        """
+        Build the binary notification message.
+
+        @param binaryToken: the device token
+        @type binaryToken: C{str}
+        @param payload: the JSON payload
+        @type payload: C{str}
+        @param identifier: the notification identifier
+        @type identifier: C{int}
+        @param expiration: when the notification expires (UNIX epoch seconds)
+        @type expiration: C{int}
+        @param apnsPriority: the APNS priority value
+        @type apnsPriority: C{int}
+
+        @return: the message
+        @rtype: C{str}
+        """
 
         """
         Notification format
@@ -387,8 +471,11 @@ class APNProviderProtocol(Protocol):
             at a time that conservces power on the device receiving it)
         """
 
+        tokenLength = len(binaryToken)
+        payloadLength = len(payload)
+
         # Frame struct.pack format                ! Network byte order
-        command = self.COMMAND_PROVIDER             # B
+        command = cls.COMMAND_PROVIDER              # B
         frameLength = (  # I
             # Item 1 (Device token)
             1 +  # Item number                       # B
@@ -412,34 +499,32 @@ class APNProviderProtocol(Protocol):
             1    # Priority                         # B
         )
 
-        self.transport.write(
-            struct.pack(
-                "!BIBH%dsBH%dsBHIBHIBHB" % (tokenLength, payloadLength,),
+        return struct.pack(
+            "!BIBH%dsBH%dsBHIBHIBHB" % (tokenLength, payloadLength,),
 
-                command,                         # Command
-                frameLength,                     # Frame length
+            command,                         # Command
+            frameLength,                     # Frame length
 
-                1,                               # Item 1 (Device token)
-                tokenLength,                     # Token Length
-                binaryToken,                     # Token
+            1,                               # Item 1 (Device token)
+            tokenLength,                     # Token Length
+            binaryToken,                     # Token
 
-                2,                               # Item 2 (Payload)
-                payloadLength,                   # Payload length
-                payload,                         # Payload
+            2,                               # Item 2 (Payload)
+            payloadLength,                   # Payload length
+            payload,                         # Payload
 
-                3,                               # Item 3 (Notification ID)
-                4,                               # Notification ID Length
-                identifier,                      # Notification ID
+            3,                               # Item 3 (Notification ID)
+            4,                               # Notification ID Length
+            identifier,                      # Notification ID
 
-                4,                               # Item 4 (Expiration)
-                4,                               # Expiration length
-                int(time.time()) + 72 * 60 * 60,  # Expires in 72 hours
+            4,                               # Item 4 (Expiration)
+            4,                               # Expiration length
+            expiration,                      # Expiration
 
-                5,                               # Item 5 (Priority)
-                1,                               # Priority length
-                apnsPriority,                    # Priority
+            5,                               # Item 5 (Priority)
+            1,                               # Priority length
+            apnsPriority,                    # Priority
 
-            )
         )
 
 
@@ -455,6 +540,9 @@ class APNProviderFactory(ReconnectingClientFactory):
         self.maxDelay = 30  # max seconds between connection attempts
         self.shuttingDown = False
 
+        # Errors can refer to any notification in the most recent batch
+        self.historySize = max(200, service.batchSize)
+
     def clientConnectionMade(self):
         self.log.info("Connection to APN server made")
         self.service.clientConnectionMade()
@@ -536,6 +624,8 @@ class APNProviderService(APNConnectionService):
         self, store, host, port, certPath, keyPath, chainPath="",
         passphrase="", keychainIdentity="", sslMethod="TLSv1_METHOD",
         staggerNotifications=False, staggerSeconds=3,
+        batchSize=1000, maxQueued=10000,
+        tokenBackoffSeconds=60, maxTokenBackoffSeconds=3600,
         testConnector=None, reactor=None
     ):
 
@@ -547,7 +637,20 @@ class APNProviderService(APNConnectionService):
 
         self.store = store
         self.factory = None
+        self.batchSize = batchSize
+
+        # Notifications saved while there is no connection, oldest first, together
+        # with the set of (token, key) pairs in the queue
         self.queue = []
+        self.queued = set()
+        self.maxQueued = maxQueued
+
+        # Tokens APNS reported a (non-fatal) error for: token -> (failure count,
+        # reactor time before which nothing is sent to the token)
+        self.tokenBackoff = OrderedDict()
+        self.tokenBackoffSeconds = tokenBackoffSeconds
+        self.maxTokenBackoffSeconds = maxTokenBackoffSeconds
+
         if staggerNotifications:
             self.scheduler = PushScheduler(
                 self.reactor, self.sendNotification,
@@ -574,18 +677,21 @@ class APNProviderService(APNConnectionService):
             # sent will be put back into the queue.
             queued = list(self.queue)
             self.queue = []
-            for (token, key), dataChangedTimestamp, priority in queued:
-                if token and key and dataChangedTimestamp and priority:
-                    self.sendNotification(
-                        token, key, dataChangedTimestamp,
-                        priority)
+            self.queued = set()
+            notifications = [
+                (token, key, dataChangedTimestamp, priority,)
+                for (token, key), dataChangedTimestamp, priority in queued
+                if token and key and dataChangedTimestamp and priority
+            ]
+            self._sendBatches(notifications)
 
     def scheduleNotifications(self, tokens, key, dataChangedTimestamp, priority):
         """
         The starting point for getting notifications to the APNS server.  If there is
         a connection to the APNS server, these notifications are scheduled (or directly
-        sent if there is no scheduler).  If there is no connection, the notifications
-        are saved for later.
+        sent in batches if there is no scheduler).  If there is no connection, the
+        notifications are saved for later.  Tokens that are backing off after an
+        error are skipped.
 
         @param tokens: The device tokens to schedule notifications for
         @type tokens: List of strings
@@ -595,22 +701,43 @@ class APNProviderService(APNConnectionService):
             which triggered this notification
         @type key: C{int}
         """
+        if self.tokenBackoff:
+            ready = [token for token in tokens if self.tokenReady(token)]
+            if len(ready) != len(tokens):
+                self.log.debug(
+                    "APNProviderService skipping {num} tokens that are backing off for {key}",
+                    num=len(tokens) - len(ready), key=key,
+                )
+            tokens = ready
+
         # Service has reference to factory has reference to protocol instance
         connection = getattr(self.factory, "connection", None)
         if connection is not None:
             if self.scheduler is not None:
                 self.scheduler.schedule(tokens, key, dataChangedTimestamp, priority)
             else:
-                for token in tokens:
-                    self.sendNotification(token, key, dataChangedTimestamp, priority)
+                self._sendBatches([(token, key, dataChangedTimestamp, priority,) for token in tokens])
         else:
             self._saveForWhenConnected(tokens, key, dataChangedTimestamp, priority)
 
+    def _sendBatches(self, notifications):
+        """
+        Send notifications over the current connection, C{batchSize} at a time.
+
+        @param notifications: the notifications to send
+        @type notifications: C{list} of C{tuple} of token, key, dataChangedTimestamp
+            and priority
+        """
+        connection = self.factory.connection
+        for offset in xrange(0, len(notifications), self.batchSize):
+            connection.sendNotifications(notifications[offset:offset + self.batchSize])
+
     def _saveForWhenConnected(self, tokens, key, dataChangedTimestamp, priority):
         """
         Called in order to save notifications that can't be sent now because there
         is no connection to the APNS server.  (token, key) tuples are appended to
-        the queue which is serviced during clientConnectionMade()
+        the queue which is serviced during clientConnectionMade().  If the queue
+        grows beyond C{maxQueued} the oldest notifications are dropped.
 
         @param tokens: The device tokens to schedule notifications for
         @type tokens: List of C{str}
@@ -622,13 +749,69 @@ class APNProviderService(APNConnectionService):
         """
         for token in tokens:
             tokenKeyPair = (token, key)
-            for existingPair, _ignore_timstamp, priority in self.queue:
-                if tokenKeyPair == existingPair:
-                    self.log.debug("APNProviderService has no connection; skipping duplicate: {token} {key}", token=token, key=key)
-                    break  # Already scheduled
+            if tokenKeyPair in self.queued:
+                self.log.debug("APNProviderService has no connection; skipping duplicate: {token} {key}", token=token, key=key)
             else:
                 self.log.debug("APNProviderService has no connection; queuing: {token} {key}", token=token, key=key)
-                self.queue.append(((token, key), dataChangedTimestamp, priority))
+                self.queue.append((tokenKeyPair, dataChangedTimestamp, priority))
+                self.queued.add(tokenKeyPair)
+
+        # Drop the oldest in one go, rather than one at a time
+        if self.maxQueued and len(self.queue) > self.maxQueued:
+            excess = len(self.queue) - self.maxQueued
+            self.log.warn("APNProviderService has no connection; dropping {num} oldest notifications", num=excess)
+            for tokenKeyPair, _ignore_timestamp, _ignore_priority in self.queue[:excess]:
+                self.queued.discard(tokenKeyPair)
+            del self.queue[:excess]
+
+    def requeueNotifications(self, notifications):
+        """
+        Queue notifications the APN server dropped after an error, to be sent
+        again once the connection has been re-established.
+
+        @param notifications: the notifications to resend
+        @type notifications: C{list} of C{tuple} of token, key, dataChangedTimestamp
+            and priority
+        """
+        for token, key, dataChangedTimestamp, priority in notifications:
+            self._saveForWhenConnected([token], key, dataChangedTimestamp, priority)
+
+    def tokenFailed(self, token):
+        """
+        APNS reported an error sending to the token, so do not send to it for a
+        while.  The delay doubles on each consecutive failure, up to
+        C{maxTokenBackoffSeconds}.
+
+        @param token: The device token
+        @type token: C{str}
+        """
+        failures = self.tokenBackoff.pop(token, (0, 0,))[0] + 1
+        delay = min(self.tokenBackoffSeconds * (2 ** (failures - 1)), self.maxTokenBackoffSeconds)
+        self.tokenBackoff[token] = (failures, self.reactor.seconds() + delay,)
+        self.log.debug("APNProviderService backing off {token} for {delay} seconds", token=token, delay=delay)
+
+        # Bound the size using the same limit as the queue
+        while self.maxQueued and len(self.tokenBackoff) > self.maxQueued:
+            self.tokenBackoff.popitem(last=False)
+
+    def tokenReady(self, token):
+        """
+        Determine whether notifications can be sent to the token.  A token that has
+        not failed for C{maxTokenBackoffSeconds} after its backoff ended is forgotten.
+
+        @param token: The device token
+        @type token: C{str}
+        @rtype: C{bool}
+        """
+        entry = self.tokenBackoff.get(token)
+        if entry is None:
+            return True
+        now = self.reactor.seconds()
+        if now < entry[1]:
+            return False
+        if now >= entry[1] + self.maxTokenBackoffSeconds:
+            del self.tokenBackoff[token]
+        return True
 
     def sendNotification(self, token, key, dataChangedTimestamp, priority):
         """
@@ -19,19 +19,21 @@ Notification framework for Calendar Server
 """
 
 from twext.enterprise.dal.record import fromTable
-from twext.enterprise.dal.syntax import Delete, Select, Parameter
+from twext.enterprise.dal.syntax import Delete, Select, Parameter, Update
 from twext.enterprise.jobs.jobitem import JobItem
 from twext.enterprise.jobs.workitem import WorkItem, WORK_PRIORITY_HIGH, \
     WORK_WEIGHT_1
 from twext.python.log import Logger
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, returnValue
 
 from txdav.common.datastore.sql_tables import schema
+from txdav.common.icommondatastore import AllRetriesFailed
 from txdav.idav import IStoreNotifierFactory, IStoreNotifier
 
 from zope.interface.declarations import implements
 
+from collections import OrderedDict
 import datetime
 
 from calendarserver.push.ipush import PushPriority
@@ -174,7 +176,7 @@ class NotifierFactory(object):
 
     implements(IStoreNotifierFactory)
 
-    def __init__(self, hostname, coalesceSeconds, reactor=None):
+    def __init__(self, hostname, coalesceSeconds, reactor=None, coalesceWrites=False):
         self.store = None   # Initialized after the store is created
         self.hostname = hostname
         self.coalesceSeconds = coalesceSeconds
@@ -183,17 +185,119 @@ class NotifierFactory(object):
             from twisted.internet import reactor
         self.reactor = reactor
 
+        # When coalescing writes, each push key that has a work item enqueued by this process
+        # maps to a C{tuple} of work ID, C{reactor.seconds()} time at which the work item
+        # becomes runnable, and push priority. Entries are kept in deadline order.
+        self.coalesceWrites = coalesceWrites
+        self._pending = OrderedDict()
+
+        # Push keys sent by transactions that have not yet committed, keyed by transaction
+        self._pendingByTxn = {}
+
     @inlineCallbacks
     def send(self, prefix, id, txn, priority=PushPriority.high):
         """
-        Enqueue a push notification work item on the provided transaction.
+        Enqueue a push notification work item on the provided transaction. If writes are
+        being coalesced and this process already has a work item for the same push key
+        that has not yet run, that work item is re-used (with its priority raised if
+        needed) rather than a new one being enqueued.
         """
-        yield txn.enqueue(
+        pushID = self.pushKeyForId(prefix, id)
+        if not self.coalesceWrites:
+            yield txn.enqueue(
+                PushNotificationWork,
+                pushID=pushID,
+                notBefore=datetime.datetime.utcnow() + datetime.timedelta(seconds=self.coalesceSeconds),
+                pushPriority=priority.value
+            )
+            returnValue(None)
+
+        pendingForTxn = self._pendingByTxn.get(txn)
+        if pendingForTxn is None:
+            pendingForTxn = self._pendingByTxn[txn] = {}
+            txn.postCommit(lambda: self._txnCommitted(txn))
+            txn.postAbort(lambda: self._pendingByTxn.pop(txn, None))
+
+        # Already sent in this transaction, or sent by another transaction in this process
+        # within the coalescing window
+        entry = pendingForTxn.get(pushID)
+        if entry is not None and entry[2] >= priority.value:
+            returnValue(None)
+        if entry is None:
+            self._expirePending()
+            entry = self._pending.get(pushID)
+        if entry is not None:
+            workID, deadline, pushPriority = entry
+            pushPriority = max(pushPriority, priority.value)
+            exists = yield self._raisePriority(txn, workID, pushPriority)
+            if exists:
+                pendingForTxn[pushID] = (workID, deadline, pushPriority,)
+                returnValue(None)
+
+        work = yield txn.enqueue(
             PushNotificationWork,
-            pushID=self.pushKeyForId(prefix, id),
+            pushID=pushID,
             notBefore=datetime.datetime.utcnow() + datetime.timedelta(seconds=self.coalesceSeconds),
             pushPriority=priority.value
         )
+        pendingForTxn[pushID] = (work.workID, self.reactor.seconds() + self.coalesceSeconds, priority.value,)
+
+    @inlineCallbacks
+    def _raisePriority(self, txn, workID, pushPriority):
+        """
+        Make sure the work item with the specified ID has at least the specified priority.
+        The work item row is locked so that it cannot run until C{txn} is done. The lock is
+        taken with NOWAIT in a sub-transaction so that concurrent writers to the same push
+        key never queue (or deadlock) behind each other: if another transaction holds the
+        lock, the caller simply enqueues its own work item.
+
+        @return: a L{Deferred} that fires with C{True} if the work item still exists (i.e.
+            has not run yet) and is now locked, C{False} otherwise
+        """
+        table = PushNotificationWork.table
+
+        @inlineCallbacks
+        def _raise(subtxn):
+            rows = yield Select(
+                [table.WORK_ID],
+                From=table,
+                Where=table.WORK_ID == workID,
+                ForUpdate=True,
+                NoWait=True,
+            ).on(subtxn)
+            if rows:
+                yield Update(
+                    {table.PUSH_PRIORITY: pushPriority},
+                    Where=(table.WORK_ID == workID).And(table.PUSH_PRIORITY < pushPriority),
+                ).on(subtxn)
+            returnValue(bool(rows))
+
+        try:
+            exists = yield txn.subtransaction(_raise, retries=0, failureOK=True)
+        except AllRetriesFailed:
+            exists = False
+        returnValue(exists)
+
+    def _txnCommitted(self, txn):
+        """
+        Work items written by a committed transaction can be re-used by later ones.
+        """
+        for pushID, entry in self._pendingByTxn.pop(txn, {}).items():
+            existing = self._pending.get(pushID)
+            if existing is None or existing[0] != entry[0]:
+                self._pending.pop(pushID, None)
+            self._pending[pushID] = entry
+
+    def _expirePending(self):
+        """
+        Remove entries for work items that are now able to run.
+        """
+        now = self.reactor.seconds()
+        while self._pending:
+            pushID, (_ignore_workID, deadline, _ignore_priority) = next(iter(self._pending.items()))
+            if deadline > now:
+                break
+            del self._pending[pushID]
 
     def newNotifier(self, storeObject):
         return Notifier(self, storeObject)
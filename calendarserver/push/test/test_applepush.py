@@ -18,7 +18,8 @@ import json
 import struct
 import time
 from calendarserver.push.applepush import (
-    ApplePushNotifierService, APNProviderProtocol, ApplePushPriority
+    ApplePushNotifierService, APNProviderProtocol, APNProviderService,
+    ApplePushPriority
 )
 from calendarserver.push.ipush import PushPriority
 from calendarserver.push.util import validToken, TokenHistory
@@ -46,6 +47,10 @@ class ApplePushNotifierServiceTests(StoreTestCase):
             "FeedbackUpdateSeconds": 300,
             "EnableStaggering": True,
             "StaggerSeconds": 3,
+            "BatchSize": 1000,
+            "MaxQueuedNotifications": 10000,
+            "TokenBackoffSeconds": 60,
+            "MaxTokenBackoffSeconds": 3600,
             "CalDAV": {
                 "Enabled": True,
                 "CertificatePath": "caldav.cer",
@@ -156,10 +161,11 @@ class ApplePushNotifierServiceTests(StoreTestCase):
         # The queue should be empty
         self.assertEquals(service.providers["CalDAV"].queue, [])
 
-        # Verify data sent to APN
+        # Verify data sent to APN - both notifications are sent in one write
         providerConnector = service.providers["CalDAV"].testConnector
         rawData = providerConnector.transport.data
-        self.assertEquals(len(rawData), 200)
+        self.assertEquals(len(rawData), 400)
+        rawData = rawData[200:]
         data = struct.unpack("!BI", rawData[:5])
         self.assertEquals(data[0], 2)  # command
         self.assertEquals(data[1], 195)  # frame length
@@ -343,6 +349,119 @@ class ApplePushNotifierServiceTests(StoreTestCase):
 
         service.stopService()
 
+    @inlineCallbacks
+    def test_batchedProvider(self):
+        """
+        Notifications are written to the APN server in batches, the queue of
+        notifications saved while disconnected is capped, and tokens that had an
+        error are backed off.
+        """
+
+        def callWhenRunning(callable, *args):
+            callable(*args)
+        clock = Clock()
+        clock.callWhenRunning = callWhenRunning
+
+        connector = FakeAPNServerConnector()
+        provider = APNProviderService(
+            None, "gateway.push.apple.com", 2195, "caldav.cer", "caldav.pem",
+            batchSize=3, maxQueued=4, tokenBackoffSeconds=60, maxTokenBackoffSeconds=120,
+            testConnector=connector, reactor=clock,
+        )
+        key = "/CalDAV/calendars.example.com/user01/calendar/"
+        tokens = ["%02x" % (i,) * 32 for i in range(1, 7)]
+
+        # Only the newest notifications are kept while disconnected
+        provider.scheduleNotifications(tokens, key, 1000, PushPriority.high)
+        provider.scheduleNotifications(tokens[-1:], key, 1000, PushPriority.high)
+        self.assertEqual([token for (token, _ignore_key), _ignore_ts, _ignore_p in provider.queue], tokens[2:])
+        self.assertEqual(provider.queued, set([(token, key) for token in tokens[2:]]))
+
+        # Connecting sends the queue in batches
+        provider.startService()
+        server = connector.transport
+        self.assertEqual(provider.queue, [])
+        self.assertEqual(server.writes, 2)
+        frames = server.frames()
+        self.assertEqual([frame[0] for frame in frames], tokens[2:])
+        self.assertEqual([frame[1] for frame in frames], [1, 2, 3, 4])
+        self.assertEqual(set([frame[2]["key"] for frame in frames]), set([key]))
+
+        # A payload error backs off the token, and the notifications the
+        # server dropped after it are queued until we reconnect
+        yield provider.factory.connection.processError(7, 2)
+        self.assertFalse(provider.tokenReady(tokens[3]))
+        self.assertTrue(provider.factory.connection is None)
+        self.assertTrue(server.disconnected)
+        self.assertEqual([token for (token, _ignore_key), _ignore_ts, _ignore_p in provider.queue], tokens[4:])
+        provider.scheduleNotifications(tokens[2:4], key, 2000, PushPriority.low)
+        connector.connect(provider, provider.factory)
+        server = connector.transport
+        frames = server.frames()
+        self.assertEqual([frame[0] for frame in frames], tokens[4:] + tokens[2:3])
+        self.assertEqual([frame[2]["dataChangedTimestamp"] for frame in frames], [1000, 1000, 2000])
+        self.assertEqual(frames[2][3], ApplePushPriority.low.value)
+
+        clock.advance(61)
+        provider.scheduleNotifications(tokens[2:4], key, 3000, PushPriority.low)
+        self.assertEqual([frame[0] for frame in server.frames()], tokens[2:4])
+
+        # The second failure doubles the delay
+        yield provider.factory.connection.processError(7, 5)
+        self.assertEqual(provider.tokenBackoff[tokens[3]][0], 2)
+        clock.advance(61)
+        self.assertFalse(provider.tokenReady(tokens[3]))
+        clock.advance(60)
+        self.assertTrue(provider.tokenReady(tokens[3]))
+
+        # Eventually the token is forgotten
+        clock.advance(120)
+        self.assertTrue(provider.tokenReady(tokens[3]))
+        self.assertFalse(tokens[3] in provider.tokenBackoff)
+
+        provider.stopService()
+
+    @inlineCallbacks
+    def test_providerErrorResends(self):
+        """
+        Server-side errors do not back off the token, and a shutdown error
+        resends only the notifications after the last successful one.
+        """
+
+        def callWhenRunning(callable, *args):
+            callable(*args)
+        clock = Clock()
+        clock.callWhenRunning = callWhenRunning
+
+        connector = FakeAPNServerConnector()
+        provider = APNProviderService(
+            None, "gateway.push.apple.com", 2195, "caldav.cer", "caldav.pem",
+            testConnector=connector, reactor=clock,
+        )
+        key = "/CalDAV/calendars.example.com/user01/calendar/"
+        tokens = ["%02x" % (i,) * 32 for i in range(1, 4)]
+        provider.startService()
+        provider.scheduleNotifications(tokens, key, 1000, PushPriority.high)
+        self.assertEqual([frame[1] for frame in connector.transport.frames()], [1, 2, 3])
+
+        # A processing error drops the failed notification without backing
+        # off its token
+        yield provider.factory.connection.processError(1, 1)
+        self.assertTrue(provider.tokenReady(tokens[0]))
+        self.assertEqual(provider.tokenBackoff, {})
+        connector.connect(provider, provider.factory)
+        self.assertEqual([frame[0] for frame in connector.transport.frames()], tokens[1:])
+
+        # On shutdown the identifier is the last notification that succeeded
+        yield provider.factory.connection.processError(10, 1)
+        self.assertEqual(provider.tokenBackoff, {})
+        self.assertEqual([token for (token, _ignore_key), _ignore_ts, _ignore_p in provider.queue], tokens[2:])
+        connector.connect(provider, provider.factory)
+        self.assertEqual([frame[0] for frame in connector.transport.frames()], tokens[2:])
+        self.assertEqual(provider.queue, [])
+
+        provider.stopService()
+
     def test_validToken(self):
         self.assertTrue(validToken("2d0d55cd7f98bcb81c6e24abcdc35168254c7846a43e2828b1ba5a8f82e219df"))
         self.assertTrue(validToken("d0d55cd7f98bcb81c6e24abcdc35168254c7846a43e2828b1ba5a8f82e219d"))
@@ -408,6 +527,18 @@ class ApplePushNotifierServiceTests(StoreTestCase):
             [(4, "four"), (6, "six")]
         )
 
+        # Notifications stored with their tokens can be extracted after an
+        # identifier, and are pruned along with the history
+        history = TokenHistory(maxSize=3)
+        for token in ("one", "two", "three", "four"):
+            history.add(token, (token, "key"))
+        self.assertEquals(sorted(history.notifications.keys()), [2, 3, 4])
+        self.assertEquals(history.extractAfter(2), [("three", "key"), ("four", "key")])
+        self.assertEquals(history.history, [(2, "two")])
+        self.assertEquals(history.extractAfter(2), [])
+        self.assertEquals(history.extractIdentifier(2), "two")
+        self.assertEquals(history.notifications, {})
+
 
 class TestConnector(object):
 
@@ -426,6 +557,64 @@ class StubTransport(object):
 
     def __init__(self):
         self.data = None
+        self.disconnected = False
 
     def write(self, data):
         self.data = data
+
+    def loseConnection(self):
+        self.disconnected = True
+
+
+class FakeAPNServer(object):
+    """
+    A transport that decodes the notifications written to it, as an APN server
+    would.
+    """
+
+    def __init__(self):
+        self.data = ""
+        self.writes = 0
+        self.disconnected = False
+
+    def write(self, data):
+        self.data += data
+        self.writes += 1
+
+    def loseConnection(self):
+        self.disconnected = True
+
+    def frames(self):
+        """
+        Decode and clear the received data.
+
+        @return: the token, identifier, payload and priority of each notification
+        @rtype: C{list} of C{tuple}
+        """
+        frames = []
+        data, self.data = self.data, ""
+        while data:
+            command, frameLength = struct.unpack("!BI", data[:5])
+            assert command == APNProviderProtocol.COMMAND_PROVIDER
+            frame, data = data[5:5 + frameLength], data[5 + frameLength:]
+            items = {}
+            while frame:
+                itemNum, itemLength = struct.unpack("!BH", frame[:3])
+                items[itemNum], frame = frame[3:3 + itemLength], frame[3 + itemLength:]
+            frames.append((
+                items[1].encode("hex"),
+                struct.unpack("!I", items[3])[0],
+                json.loads(items[2]),
+                struct.unpack("!B", items[5])[0],
+            ))
+        return frames
+
+
+class FakeAPNServerConnector(TestConnector):
+
+    def connect(self, service, factory):
+        self.service = service
+        service.protocol = factory.buildProtocol(None)
+        service.connected = 1
+        self.transport = FakeAPNServer()
+        service.protocol.makeConnection(self.transport)
@@ -18,14 +18,17 @@ from twistedcaldav.test.util import StoreTestCase
 from calendarserver.push.notifier import PushDistributor
 from calendarserver.push.notifier import getPubSubAPSConfiguration
 from calendarserver.push.notifier import PushNotificationWork
-from twisted.internet.defer import inlineCallbacks, succeed
+from calendarserver.push.notifier import NotifierFactory as PushNotifierFactory
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 from twistedcaldav.config import ConfigDict
 from txdav.common.datastore.test.util import populateCalendarsFrom
 from txdav.common.datastore.sql_tables import _BIND_MODE_WRITE
 from calendarserver.push.ipush import PushPriority
 from txdav.idav import ChangeCategory
 from twext.enterprise.jobs.jobitem import JobItem
+from twext.enterprise.dal.syntax import Select
 from twisted.internet import reactor
+from twisted.internet.task import Clock
 
 
 class StubService(object):
@@ -367,3 +370,86 @@ class NotifierFactory(StoreTestCase):
                 ("/CalDAV/example.com/user01/notification/", PushPriority.high)])
         )
         yield self.commit()
+
+
+class NotifierFactoryCoalesceTests(StoreTestCase):
+
+    @inlineCallbacks
+    def _workRows(self):
+        table = PushNotificationWork.table
+        rows = yield Select(
+            [table.PUSH_ID, table.PUSH_PRIORITY],
+            From=table,
+        ).on(self.transactionUnderTest())
+        yield self.commit()
+        returnValue(sorted([tuple(row) for row in rows]))
+
+    @inlineCallbacks
+    def test_coalesceWrites(self):
+        """
+        Only one work item is written per push key within the coalescing window, with
+        the highest priority of all the notifications sent.
+        """
+        clock = Clock()
+        factory = PushNotifierFactory("example.com", 60, reactor=clock, coalesceWrites=True)
+
+        txn = self.transactionUnderTest()
+        yield factory.send("CalDAV", "user01", txn, priority=PushPriority.low)
+        yield factory.send("CalDAV", "user01", txn, priority=PushPriority.low)
+        yield self.commit()
+
+        txn = self.transactionUnderTest()
+        yield factory.send("CalDAV", "user01", txn, priority=PushPriority.high)
+        yield factory.send("CalDAV", "user02", txn, priority=PushPriority.medium)
+        yield self.commit()
+
+        rows = yield self._workRows()
+        self.assertEqual(rows, [
+            ("/CalDAV/example.com/user01/", PushPriority.high.value),
+            ("/CalDAV/example.com/user02/", PushPriority.medium.value),
+        ])
+
+        # Aborted transactions do not leave anything to re-use
+        txn = self.transactionUnderTest()
+        yield factory.send("CalDAV", "user03", txn)
+        yield self.abort()
+        self.assertTrue("/CalDAV/example.com/user03/" not in factory._pending)
+
+        # Once the window has passed a new work item is written
+        clock.advance(61)
+        txn = self.transactionUnderTest()
+        yield factory.send("CalDAV", "user01", txn, priority=PushPriority.low)
+        yield self.commit()
+
+        rows = yield self._workRows()
+        self.assertEqual(rows, [
+            ("/CalDAV/example.com/user01/", PushPriority.low.value),
+            ("/CalDAV/example.com/user01/", PushPriority.high.value),
+            ("/CalDAV/example.com/user02/", PushPriority.medium.value),
+        ])
+
+    @inlineCallbacks
+    def test_coalesceWritesLocked(self):
+        """
+        A transaction does not wait for a work item locked by another transaction, it
+        writes its own work item instead.
+        """
+        clock = Clock()
+        factory = PushNotifierFactory("example.com", 60, reactor=clock, coalesceWrites=True)
+
+        txn = self.transactionUnderTest()
+        yield factory.send("CalDAV", "user01", txn, priority=PushPriority.low)
+        yield self.commit()
+
+        txn1 = self.storeUnderTest().newTransaction()
+        yield factory.send("CalDAV", "user01", txn1, priority=PushPriority.medium)
+        txn2 = self.storeUnderTest().newTransaction()
+        yield factory.send("CalDAV", "user01", txn2, priority=PushPriority.high)
+        yield txn2.commit()
+        yield txn1.commit()
+
+        rows = yield self._workRows()
+        self.assertEqual(rows, [
+            ("/CalDAV/example.com/user01/", PushPriority.medium.value),
+            ("/CalDAV/example.com/user01/", PushPriority.high.value),
+        ])
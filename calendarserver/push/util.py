@@ -170,8 +170,9 @@ class TokenHistory(object):
         self.maxSize = maxSize
         self.identifier = 0
         self.history = []
+        self.notifications = {}
 
-    def add(self, token):
+    def add(self, token, notification=None):
         """
         Add a token to the history, and return the new identifier associated
         with this token.  Identifiers begin at 1 and increase each time this
@@ -180,10 +181,17 @@ class TokenHistory(object):
 
         @param token: The token to store
         @type token: C{str}
+        @param notification: The notification sent to the token, kept so it
+            can be resent (see L{extractAfter})
+        @type notification: C{tuple} or C{None}
         @returns: the message identifier associated with this token, C{int}
         """
         self.identifier += 1
         self.history.append((self.identifier, token))
+        if notification is not None:
+            self.notifications[self.identifier] = notification
+        for id, _ignore_token in self.history[:-self.maxSize]:
+            self.notifications.pop(id, None)
         del self.history[:-self.maxSize]
         return self.identifier
 
@@ -201,9 +209,26 @@ class TokenHistory(object):
         for index, (id, token) in enumerate(self.history):
             if id == identifier:
                 del self.history[index]
+                self.notifications.pop(id, None)
                 return token
         return None
 
+    def extractAfter(self, identifier):
+        """
+        Remove every entry with an identifier greater than the given one from
+        the history, and return the notifications that were stored for them.
+
+        @param identifier: The identifier to look after
+        @type identifier: C{int}
+        @returns: the notifications, oldest first, C{list}
+        """
+        notifications = []
+        for id, _ignore_token in self.history:
+            if id > identifier and id in self.notifications:
+                notifications.append(self.notifications.pop(id))
+        self.history = [(id, token) for (id, token) in self.history if id <= identifier]
+        return notifications
+
 
 class PushScheduler(object):
     """
@@ -234,6 +234,7 @@ def storeFromConfigWithDPSClient(config, txnFactory):
             expireSeconds=config.DirectoryCaching.CachingSeconds,
             lookupsBetweenPurges=config.DirectoryCaching.LookupsBetweenPurges,
             negativeCaching=config.DirectoryCaching.NegativeCachingEnabled,
+            maxRecordsPerIndex=config.DirectoryCaching.MaxRecordsPerIndex,
         )
     store.setDirectoryService(directory)
     return store
@@ -259,7 +260,11 @@ def storeFromConfig(config, txnFactory, directoryService):
     #
     notifierFactories = {}
     if config.Notifications.Enabled:
-        notifierFactories["push"] = NotifierFactory(config.ServerHostName, config.Notifications.CoalesceSeconds)
+        notifierFactories["push"] = NotifierFactory(
+            config.ServerHostName,
+            config.Notifications.CoalesceSeconds,
+            coalesceWrites=config.Notifications.CoalesceWrites,
+        )
 
     if config.EnableResponseCache and config.Memcached.Pools.Default.ClientEnabled:
         notifierFactories["cache"] = CacheStoreNotifierFactory()
@@ -284,6 +289,8 @@ def storeFromConfig(config, txnFactory, directoryService):
             logLabels=config.LogDatabase.LabelsInSQL,
             logStats=config.LogDatabase.Statistics,
             logStatsLogFile=config.LogDatabase.StatisticsLogFile,
+            logStatsOnline=config.LogDatabase.OnlineStatistics,
+            logStatsRepeatThreshold=config.LogDatabase.RepeatedStatementThreshold,
             logSQL=config.LogDatabase.SQLStatements,
             logTransactionWaits=config.LogDatabase.TransactionWaitSeconds,
             timeoutTransactions=config.TransactionTimeoutSeconds,
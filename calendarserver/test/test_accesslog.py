@@ -174,3 +174,28 @@ class AccessLog(TestCase):
         observer.stop()
         self.assertTrue("uid" not in stats)
         self.assertTrue("user-agent" not in stats)
+
+    def test_leaseStats(self):
+        """
+        Cache lease items logged with requests are counted in the
+        L{RotatingFileAccessLoggingObserver} stats data.
+        """
+
+        self.patch(config.Stats, "EnableUnixStatsSocket", True)
+
+        logpath = self.mktemp()
+        observer = RotatingFileAccessLoggingObserver(logpath)
+        observer.start()
+        for items in ({"lease-granted": "1"}, {"lease-wait": "1"}, {"lease-wait": "2", "lease-timeout": "1"}, {"lease-stale": "1"}, {},):
+            stats = {
+                "type": "access-log",
+                "log-format": "",
+                "method": "PROPFIND",
+                "uri": "/calendars/",
+                "statusCode": 207,
+            }
+            stats.update(items)
+            observer.logStats(stats)
+        printStats = observer.getStats()
+        observer.stop()
+        self.assertEqual(dict(printStats["current"]["lease"]), {"granted": 1, "wait": 3, "timeout": 1, "stale": 1})
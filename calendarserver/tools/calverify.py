@@ -709,6 +709,28 @@ class CalVerifyService(WorkerService, object):
 
         returnValue(caldata)
 
+    @inlineCallbacks
+    def getIndexedAttendees(self, resid):
+        """
+        Get the lower-cased ATTENDEE addresses in a resource from the attendee
+        index, without parsing the calendar data.
+
+        @return: C{set} of addresses, or C{None} if the resource has no
+            ORGANIZER or ATTENDEE entries in the index
+        """
+        att = schema.CALENDAR_OBJECT_ATTENDEE
+        kwds = {"ResourceID": resid}
+        rows = (yield Select(
+            [att.ORGANIZER, att.CUA],
+            From=att,
+            Where=(
+                att.CALENDAR_OBJECT_RESOURCE_ID == Parameter("ResourceID")
+            ),
+        ).on(self.txn, **kwds))
+        if not rows:
+            returnValue(None)
+        returnValue(set([cuaddr for organizer, cuaddr in rows if not organizer]))
+
     @inlineCallbacks
     def getCalendarForOwnerByUID(self, owner, uid):
         co = schema.CALENDAR_OBJECT
@@ -1732,12 +1754,6 @@ class SchedulingMismatchService(CalVerifyService):
                 t = time.time()
 
             attendee, resid, uid, _ignore_md5, organizer, att_created, att_modified = attendeeEvent
-            calendar = yield self.getCalendar(resid)
-            if calendar is None:
-                continue
-            eachAttendeesOwnStatus = self.buildAttendeeStates(calendar, self.start, self.end, attendee_only=attendee)
-            if attendee not in eachAttendeesOwnStatus:
-                continue
 
             # Only care about data for hosted organizers
             if not organizer.startswith("urn:x-uid:"):
@@ -1757,6 +1773,23 @@ class SchedulingMismatchService(CalVerifyService):
                 # if uid in self.organized_byuid:
                 #     print("Reloaded missing organizer data: %s" % (uid,))
 
+            # Nothing to check when the organizer's copy lists this attendee
+            if uid in self.organized_byuid and attendee in self.matched_attendee_to_organizer[uid]:
+                continue
+
+            # The attendee index can rule out attendee copies that do not list
+            # the attendee at all, before having to parse and expand the data
+            indexedAttendees = yield self.getIndexedAttendees(resid)
+            if indexedAttendees is not None and "urn:x-uid:" + attendee.lower() not in indexedAttendees:
+                continue
+
+            calendar = yield self.getCalendar(resid)
+            if calendar is None:
+                continue
+            eachAttendeesOwnStatus = self.buildAttendeeStates(calendar, self.start, self.end, attendee_only=attendee)
+            if attendee not in eachAttendeesOwnStatus:
+                continue
+
             if uid not in self.organized_byuid:
 
                 # Check whether attendee has all instances cancelled
@@ -1775,7 +1808,7 @@ class SchedulingMismatchService(CalVerifyService):
                     else:
                         self.fixFailed += 1
 
-            elif attendee not in self.matched_attendee_to_organizer[uid]:
+            else:
                 # Check whether attendee has all instances cancelled
                 if self.allCancelled(eachAttendeesOwnStatus):
                     continue
@@ -1097,12 +1097,21 @@ class DirectoryStatsWindow(BaseWindow):
     formatWidth = 89
     additionalRows = 8
 
+    def directoryRecords(self, records):
+        """
+        Split the directory data into the per-method call stats and the in-process
+        cache counters, which are reported under a separate "cache" key.
+        """
+        records = dict(defaultIfNone(records, {}))
+        return records, records.pop("cache", {})
+
     def updateRowCount(self):
-        self.rowCount = len(defaultIfNone(self.readItem("directory"), {}))
+        records, cacheRecords = self.directoryRecords(self.readItem("directory"))
+        self.rowCount = len(records) + len(cacheRecords)
 
     def update(self):
-        records = defaultIfNone(self.clientData(), {})
-        if len(records) != self.rowCount:
+        records, cacheRecords = self.directoryRecords(self.clientData())
+        if len(records) + len(cacheRecords) != self.rowCount:
             self.needsReset = True
             return
 
@@ -1114,7 +1123,7 @@ class DirectoryStatsWindow(BaseWindow):
         s2 = " {:<40}{:>15}{:>15}{:>15} ".format(
             "", "", "(sec)", "(ms)"
         )
-        pt = self.tableHeader((s1, s2,), len(records))
+        pt = self.tableHeader((s1, s2,), len(records) + len(cacheRecords))
 
         overallCount = 0
         overallCountRatio = 0
@@ -1144,6 +1153,16 @@ class DirectoryStatsWindow(BaseWindow):
             )
             self.tableRow(s, pt)
 
+        # Cache counters are not calls, so are not included in the totals
+        for name, value in sorted(cacheRecords.items(), key=lambda x: x[0]):
+            s = " {:<40}{:>15d}{:>15s}{:>15s} ".format(
+                name,
+                value,
+                "",
+                "",
+            )
+            self.tableRow(s, pt)
+
         s = " {:<40}{:>15d}{:>15.1f}{:>15.3f} ".format(
             "Total:",
             overallCount,
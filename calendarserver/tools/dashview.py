@@ -567,6 +567,8 @@ class Aggregator(object):
                 elif isinstance(results[operation_name], list):
                     results[operation_name][0] += operation_details[0]
                     results[operation_name][1] += operation_details[1]
+                elif isinstance(results[operation_name], dict):
+                    results[operation_name] = Aggregator.dictValueSums((results[operation_name], operation_details,))
                 else:
                     results[operation_name] += operation_details
 
@@ -624,7 +626,7 @@ class Aggregator(object):
                 results[key] = max(map(itemgetter(key), serversdata))
 
         # Values that are summed dict values
-        for key in ("method", "method-t", "uid", "user-agent", "T", "T-RESP-WR",):
+        for key in ("method", "method-t", "method-sql-s", "method-sql-t", "uid", "user-agent", "T", "T-RESP-WR", "lease",):
             if key in serversdata[0]:
                 results[key] = Aggregator.dictValueSums(map(itemgetter(key), serversdata))
 
@@ -1394,12 +1396,21 @@ class DirectoryStatsWindow(BaseWindow):
     formatWidth = 89
     additionalRows = 8
 
+    def directoryRecords(self, records):
+        """
+        Split the directory data into the per-method call stats and the in-process
+        cache counters, which are reported under a separate "cache" key.
+        """
+        records = dict(defaultIfNone(records, {}))
+        return records, records.pop("cache", {})
+
     def updateRowCount(self):
-        self.rowCount = len(defaultIfNone(self.clientData(), {}))
+        records, cacheRecords = self.directoryRecords(self.clientData())
+        self.rowCount = len(records) + len(cacheRecords)
 
     def update(self):
-        records = defaultIfNone(self.clientData(), {})
-        if len(records) != self.rowCount:
+        records, cacheRecords = self.directoryRecords(self.clientData())
+        if len(records) + len(cacheRecords) != self.rowCount:
             self.needsReset = True
             return
 
@@ -1411,7 +1422,7 @@ class DirectoryStatsWindow(BaseWindow):
         s2 = " {:<40}{:>15}{:>15}{:>15} ".format(
             "", "", "(sec)", "(ms)"
         )
-        pt = self.tableHeader((s1, s2,), len(records))
+        pt = self.tableHeader((s1, s2,), len(records) + len(cacheRecords))
 
         overallCount = 0
         overallCountRatio = 0
@@ -1441,6 +1452,16 @@ class DirectoryStatsWindow(BaseWindow):
             )
             self.tableRow(s, pt)
 
+        # Cache counters are not calls, so are not included in the totals
+        for name, value in sorted(cacheRecords.items(), key=lambda x: x[0]):
+            s = " {:<40}{:>15d}{:>15s}{:>15s} ".format(
+                name,
+                value,
+                "",
+                "",
+            )
+            self.tableRow(s, pt)
+
         s = " {:<40}{:>15d}{:>15.1f}{:>15.3f} ".format(
             "Total:",
             overallCount,
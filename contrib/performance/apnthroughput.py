@@ -0,0 +1,183 @@
+#!/usr/bin/env python
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Measure how quickly the APN provider can push notifications for a large number
+of device tokens to a local fake APN server (plain TCP, no TLS).
+"""
+
+from __future__ import print_function
+
+from getopt import getopt, GetoptError
+import os
+import struct
+import sys
+import time
+
+from twisted.internet import reactor
+from twisted.internet.defer import Deferred, inlineCallbacks
+from twisted.internet.protocol import Factory, Protocol
+
+from calendarserver.push.applepush import APNProviderService
+from calendarserver.push.ipush import PushPriority
+
+
+def usage(e=None):
+    name = os.path.basename(sys.argv[0])
+    print("usage: %s [options]" % (name,))
+    print("")
+    print("options:")
+    print("  -h --help: print this help and exit")
+    print("  -n: number of device tokens [100000]")
+    print("  -b: batch sizes to compare, comma separated [1,1000]")
+    print("")
+    print("This tool measures APN provider notification throughput.")
+
+    if e:
+        sys.exit(64)
+    else:
+        sys.exit(0)
+
+
+class FakeAPNServerProtocol(Protocol):
+    """
+    Counts the notification frames it receives.
+    """
+
+    def connectionMade(self):
+        self.buffer = ""
+
+    def dataReceived(self, data):
+        self.buffer += data
+        offset = 0
+        frames = 0
+        while len(self.buffer) - offset >= 5:
+            _ignore_command, frameLength = struct.unpack("!BI", self.buffer[offset:offset + 5])
+            if len(self.buffer) - offset < 5 + frameLength:
+                break
+            offset += 5 + frameLength
+            frames += 1
+        self.buffer = self.buffer[offset:]
+        self.factory.received(frames)
+
+
+class FakeAPNServerFactory(Factory):
+
+    protocol = FakeAPNServerProtocol
+
+    def __init__(self):
+        self.count = 0
+        self.expected = 0
+        self.done = None
+
+    def expect(self, count):
+        self.count = 0
+        self.expected = count
+        self.done = Deferred()
+        return self.done
+
+    def received(self, frames):
+        self.count += frames
+        if self.count >= self.expected and self.done is not None:
+            done, self.done = self.done, None
+            done.callback(self.count)
+
+
+class TCPConnector(object):
+    """
+    Connect the provider without TLS.
+    """
+
+    def __init__(self, port):
+        self.port = port
+
+    def connect(self, service, factory):
+        reactor.connectTCP("127.0.0.1", self.port, factory)
+
+
+@inlineCallbacks
+def measure(server, port, count, batchSize):
+    provider = APNProviderService(
+        None, "127.0.0.1", port, "", "",
+        batchSize=batchSize, maxQueued=count,
+        testConnector=TCPConnector(port), reactor=reactor,
+    )
+    connected = Deferred()
+    clientConnectionMade = provider.clientConnectionMade
+
+    def _connected():
+        clientConnectionMade()
+        connected.callback(None)
+    provider.clientConnectionMade = _connected
+    provider.startService()
+    yield connected
+
+    tokens = ["%064x" % (i,) for i in xrange(count)]
+    done = server.expect(count)
+    start = time.time()
+    provider.scheduleNotifications(tokens, "/CalDAV/localhost/user01/calendar/", int(start), PushPriority.high)
+    yield done
+    elapsed = time.time() - start
+    provider.stopService()
+    provider.factory.connection.transport.loseConnection()
+    print("batch size %6d: %d notifications in %.2f secs (%d per sec)" % (batchSize, count, elapsed, count / elapsed))
+
+
+@inlineCallbacks
+def run(count, batchSizes):
+    try:
+        server = FakeAPNServerFactory()
+        port = reactor.listenTCP(0, server, interface="127.0.0.1")
+        for batchSize in batchSizes:
+            yield measure(server, port.getHost().port, count, batchSize)
+        yield port.stopListening()
+    finally:
+        reactor.stop()
+
+
+def main():
+    try:
+        (optargs, _ignore_args) = getopt(
+            sys.argv[1:], "hn:b:", [
+                "help",
+            ],
+        )
+    except GetoptError, e:
+        usage(e)
+
+    count = 100000
+    batchSizes = [1, 1000]
+
+    for opt, arg in optargs:
+        if opt in ("-h", "--help"):
+            usage()
+
+        elif opt in ("-n"):
+            count = int(arg)
+
+        elif opt in ("-b"):
+            batchSizes = [int(size) for size in arg.split(",")]
+
+        else:
+            raise NotImplementedError(opt)
+
+    reactor.callWhenRunning(run, count, batchSizes)
+    reactor.run()
+
+
+if __name__ == "__main__":
+    main()
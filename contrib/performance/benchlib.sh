@@ -31,12 +31,12 @@ CONF=$SOURCE/conf/caldavd-dev.plist
 # Names of benchmarks we can run.  Since ordering makes a difference to how
 # benchmarks are split across multiple hosts, new benchmarks should be appended
 # to this list, not inserted earlier on.
-BENCHMARKS="find_calendars find_events event_move event_delete_attendee event_add_attendee event_change_date event_change_summary event_delete vfreebusy event bounded_recurrence unbounded_recurrence event_autoaccept bounded_recurrence_autoaccept unbounded_recurrence_autoaccept vfreebusy_vary_attendees"
+BENCHMARKS="find_calendars find_events event_move event_delete_attendee event_add_attendee event_change_date event_change_summary event_delete vfreebusy event bounded_recurrence unbounded_recurrence event_autoaccept bounded_recurrence_autoaccept unbounded_recurrence_autoaccept vfreebusy_vary_attendees bounded_daily_recurrence unbounded_daily_recurrence text_search"
 
 # Custom scaling parameters for benchmarks that merit it.  Be careful
 # not to exceed the 99 user limit for benchmarks where the scaling
 # parameter represents a number of users!
-SCALE_PARAMETERS="--parameters find_events:1,10,100,1000,10000 --parameters vfreebusy_vary_attendees:1,9,30"
+SCALE_PARAMETERS="--parameters find_events:1,10,100,1000,10000 --parameters vfreebusy_vary_attendees:1,9,30 --parameters bounded_daily_recurrence:1,20 --parameters unbounded_daily_recurrence:1,20 --parameters text_search:1000,20000"
 
 # Names of metrics we can collect.
 STATISTICS=(HTTP SQL read write pagein pageout)
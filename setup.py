@@ -346,6 +346,7 @@ extras_requirements = {
     "ldap": ["twextpy[ldap]"],
     "opendirectory": ["twextpy[opendirectory]"],
     "postgres": ["twextpy[postgres]", "pg8000"],
+    "sendfile": ["pysendfile"],
 }
 
 if "ORACLE_HOME" in os.environ:
@@ -20,10 +20,13 @@ from txweb2.http import Response
 from txweb2.iweb import IResource
 from txweb2.stream import MemoryStream
 
-from twisted.internet.defer import succeed, inlineCallbacks, returnValue
+from twisted.internet.defer import succeed, inlineCallbacks, returnValue, \
+    gatherResults, FirstError
+from twisted.python.failure import Failure
 
 from twistedcaldav.config import config
 from twistedcaldav.memcachepool import CachePoolUserMixIn, defaultCachePool
+from twistedcaldav.memcacher import Memcacher
 
 from txdav.idav import IStoreNotifierFactory, IStoreNotifier
 
@@ -31,6 +34,7 @@ from zope.interface import implements
 
 import cPickle
 import hashlib
+import time
 import urllib
 import uuid
 
@@ -274,6 +278,7 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
     def __init__(self, docroot, cachePool=None):
         self._docroot = docroot
         self._cachePool = cachePool
+        self._leases = Memcacher("ResponseCache")
 
     @inlineCallbacks
     def _tokenForURI(self, uri, cachePoolHandle=None):
@@ -290,6 +295,31 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
             _ignore_flags, result = result
         returnValue(result)
 
+    @inlineCallbacks
+    def _tokensForURIs(self, uris, cachePoolHandle=None):
+        """
+        Get the current tokens for a set of URIs using a single multi-get.
+
+        @return: a C{dict} mapping each URI to its token
+        """
+        keys = {}
+        for uri in uris:
+            key = uri.encode("utf-8") if isinstance(uri, unicode) else uri
+            keys['cacheToken:%s' % (key,)] = uri
+        if not keys:
+            returnValue({})
+
+        if cachePoolHandle:
+            results = (yield defaultCachePool(cachePoolHandle).getMultiple(keys.keys()))
+        else:
+            results = (yield self.getCachePool().getMultiple(keys.keys()))
+
+        tokens = {}
+        for key, uri in keys.items():
+            result = results.get(key)
+            tokens[uri] = result[-1] if result is not None else None
+        returnValue(tokens)
+
     @inlineCallbacks
     def _tokenForRecord(self, uri, request):
         """
@@ -306,24 +336,44 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
         """
 
         if hasattr(request, "childCacheURIs"):
-            tokens = dict([(uri, (yield self._tokenForURI(uri)),) for uri in request.childCacheURIs])
+            tokens = (yield self._tokensForURIs(request.childCacheURIs))
             returnValue(tokens)
         else:
             returnValue({})
 
     @inlineCallbacks
-    def _getTokens(self, request):
+    def _getTokens(self, request, childURIs=None):
         """
         Tokens are a principal token, directory record token, resource token and list
         of child resource tokens. A change to any one of those will cause cache invalidation.
+        The resource and child tokens are fetched with one multi-get, in parallel with the
+        principal token (which may live in a different cache pool), rather than one round
+        trip per token.
+
+        @param childURIs: the child resource URIs to get tokens for, or L{None} to use
+            the ones recorded in the request's childCacheURIs attribute
+        @type childURIs: iterable of C{str}
         """
-        tokens = []
         pURI, rURI = (yield self._getURIs(request))
-        tokens.append((yield self._tokenForURI(pURI, "PrincipalToken")))
-        tokens.append((yield self._tokenForRecord(pURI, request)))
-        tokens.append((yield self._tokenForURI(rURI)))
-        tokens.append((yield self._tokensForChildren(rURI, request)))
-        returnValue(tokens)
+        recordToken = (yield self._tokenForRecord(pURI, request))
+
+        if childURIs is None:
+            childURIs = getattr(request, "childCacheURIs", ())
+        childURIs = list(childURIs)
+
+        try:
+            principalToken, uriTokens = (yield gatherResults(
+                [
+                    self._tokenForURI(pURI, "PrincipalToken"),
+                    self._tokensForURIs(set([rURI] + childURIs)),
+                ],
+                consumeErrors=True,
+            ))
+        except FirstError, e:
+            e.subFailure.raiseException()
+
+        childTokens = dict([(uri, uriTokens[uri],) for uri in childURIs])
+        returnValue([principalToken, recordToken, uriTokens[rURI], childTokens])
 
     @inlineCallbacks
     def _hashedRequestKey(self, request):
@@ -343,6 +393,9 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
         Try to match a request and a response cache entry. We first get the request key and match that, then pull
         the cache entry and decompose it into tokens and response. We then compare the cached tokens with their current values.
         If all match, we can return the cached response data.
+
+        When an entry is out of date only one request is left to rebuild it (see L{Memcacher.leaseOrWait}). The others
+        wait for the new entry, or get the out of date response if C{config.ResponseCacheServeStale} is set.
         """
         try:
             key = (yield self._hashedRequestKey(request))
@@ -354,70 +407,116 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
                 self.log.debug("Not in cache: {key!r}", key=key)
                 returnValue(None)
 
-            (principalToken, directoryToken, uriToken, childTokens, (code, headers, body)) = cPickle.loads(value)
+            response = (yield self._responseForEntry(request, key, value))
+
+            # Only an entry that was cached before is known to be cached again, so only then is it worth waiting
+            if response is None and config.CacheLeases.Enabled:
+                stale = None
+                if config.ResponseCacheServeStale:
+                    stale = (yield self._responseForEntry(request, key, value, validate=False))
+
+                @inlineCallbacks
+                def _lookup():
+                    _ignore_flags, value = (yield self.getCachePool().get(key))
+                    if value is None:
+                        returnValue(None)
+                    response = (yield self._responseForEntry(request, key, value))
+                    returnValue(response)
+
+                if not hasattr(request, "extendedLogItems"):
+                    request.extendedLogItems = {}
+                response, request.cacheLease = (yield self._leases.leaseOrWait(
+                    key, _lookup, stale, logItems=request.extendedLogItems
+                ))
+
+            returnValue(response)
+
+        except URINotFoundException, e:
+            self.log.debug("Could not locate URI: {e!r}", e=e)
+            returnValue(None)
+
+    @inlineCallbacks
+    def _responseForEntry(self, request, key, value, validate=True):
+        """
+        Decompose a response cache entry and, if its tokens match the current ones
+        (or C{validate} is C{False}), return the cached response.
+
+        @return: a L{Deferred} that fires with the L{Response} or L{None}
+        """
+        (principalToken, directoryToken, uriToken, childTokens, (code, headers, body)) = cPickle.loads(value)
+        self.log.debug(
+            "Found in cache: {key!r} = {value!r}",
+            key=key,
+            value=(
+                principalToken,
+                directoryToken,
+                uriToken,
+                childTokens,
+            )
+        )
+
+        if not validate:
+            returnValue(self._cachedResponse(code, headers, body))
+
+        tokenStart = time.time()
+        currentTokens = (yield self._getTokens(request, childTokens.keys()))
+
+        if currentTokens[0] != principalToken:
             self.log.debug(
-                "Found in cache: {key!r} = {value!r}",
-                key=key,
-                value=(
-                    principalToken,
-                    directoryToken,
-                    uriToken,
-                    childTokens,
-                )
+                "Principal token doesn't match for {key!r}: {currentToken!r} != {principalToken!r}",
+                key=request.cacheKey,
+                currentToken=currentTokens[0],
+                principalToken=principalToken,
             )
+            returnValue(None)
 
-            currentTokens = (yield self._getTokens(request))
+        if currentTokens[1] != directoryToken:
+            self.log.debug(
+                "Directory Record Token doesn't match for {key!r}: {currentToken!r} != {directoryToken!r}",
+                key=request.cacheKey,
+                currentToken=currentTokens[1],
+                directoryToken=directoryToken,
+            )
+            returnValue(None)
 
-            if currentTokens[0] != principalToken:
-                self.log.debug(
-                    "Principal token doesn't match for {key!r}: {currentToken!r} != {principalToken!r}",
-                    key=request.cacheKey,
-                    currentToken=currentTokens[0],
-                    principalToken=principalToken,
-                )
-                returnValue(None)
+        if currentTokens[2] != uriToken:
+            self.log.debug(
+                "URI token doesn't match for {key!r}: {currentToken!r} != {uriToken!r}",
+                key=request.cacheKey,
+                currentToken=currentTokens[2],
+                uriToken=uriToken,
+            )
+            returnValue(None)
 
-            if currentTokens[1] != directoryToken:
+        for childuri, token in childTokens.items():
+            currentToken = currentTokens[3].get(childuri)
+            if currentToken != token:
                 self.log.debug(
-                    "Directory Record Token doesn't match for {key!r}: {currentToken!r} != {directoryToken!r}",
+                    "Child {uri} token doesn't match for {key!r}: {currentToken!r} != {token!r}",
+                    uri=childuri,
                     key=request.cacheKey,
-                    currentToken=currentTokens[1],
-                    directoryToken=directoryToken,
+                    currentToken=currentToken,
+                    token=token,
                 )
                 returnValue(None)
 
-            if currentTokens[2] != uriToken:
-                self.log.debug(
-                    "URI token doesn't match for {key!r}: {currentToken!r} != {uriToken!r}",
-                    key=request.cacheKey,
-                    currentToken=currentTokens[2],
-                    uriToken=uriToken,
-                )
-                returnValue(None)
+        self.log.debug("Response cache matched")
 
-            for childuri, token in childTokens.items():
-                currentToken = (yield self._tokenForURI(childuri))
-                if currentToken != token:
-                    self.log.debug(
-                        "Child {uri} token doesn't match for {key!r}: {currentToken!r} != {token!r}",
-                        uri=childuri,
-                        key=request.cacheKey,
-                        currentToken=currentToken,
-                        token=token,
-                    )
-                    returnValue(None)
+        # Record how many tokens had to be checked and how long that took
+        if not hasattr(request, "extendedLogItems"):
+            request.extendedLogItems = {}
+        request.extendedLogItems["cache-tokens"] = len(childTokens) + 3
+        request.extendedLogItems["cache-ms"] = "%.1f" % ((time.time() - tokenStart) * 1000.0,)
 
-            self.log.debug("Response cache matched")
-            r = Response(code, stream=MemoryStream(body))
+        returnValue(self._cachedResponse(code, headers, body))
 
-            for key, value in headers.iteritems():
-                r.headers.setRawHeaders(key, value)
+    def _cachedResponse(self, code, headers, body):
+        r = Response(code, stream=MemoryStream(body))
 
-            returnValue(r)
+        for key, value in headers.iteritems():
+            r.headers.setRawHeaders(key, value)
 
-        except URINotFoundException, e:
-            self.log.debug("Could not locate URI: {e!r}", e=e)
-            returnValue(None)
+        return r
 
     @inlineCallbacks
     def cacheResponseForRequest(self, request, response):
@@ -466,8 +565,22 @@ class MemcacheResponseCache(BaseResponseCache, CachePoolUserMixIn):
         except URINotFoundException, e:
             self.log.debug("Could not locate URI: {e!r}", e=e)
 
+        yield self.releaseLeaseForRequest(request)
+
         returnValue(response)
 
+    def releaseLeaseForRequest(self, request):
+        """
+        Release the lease granted to a request by L{getResponseForRequest}, if any.
+        This must be called if the request fails before its response is cached, so
+        other requests are not left waiting for it.
+        """
+        token = getattr(request, "cacheLease", None)
+        if token is None:
+            return succeed(None)
+        request.cacheLease = None
+        return self._leases.releaseLease(request.cacheKey, token)
+
 
 class _CachedResponseResource(object):
     implements(IResource)
@@ -493,7 +606,16 @@ class PropfindCacheMixin(object):
 
     @inlineCallbacks
     def renderHTTP(self, request):
-        response = (yield super(PropfindCacheMixin, self).renderHTTP(request))
+        try:
+            response = (yield super(PropfindCacheMixin, self).renderHTTP(request))
+        except Exception:
+            # Do not keep other requests waiting on a response that will not be cached
+            f = Failure()
+            if getattr(request, "cacheLease", None) is not None:
+                resource = (yield request.locateResource("/"))
+                if hasattr(resource, "responseCache"):
+                    yield resource.responseCache.releaseLeaseForRequest(request)
+            f.raiseException()
 
         if request.method == 'PROPFIND':
             resource = (yield request.locateResource("/"))
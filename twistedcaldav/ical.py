@@ -45,7 +45,8 @@ from twistedcaldav.accounting import accountingEnabledForCategory, \
 from twistedcaldav.config import config
 from twistedcaldav.dateops import timeRangesOverlap, normalizeForIndex, differenceDateTime, \
     normalizeForExpand
-from twistedcaldav.instance import InstanceList, InvalidOverriddenInstanceError
+from twistedcaldav.instance import InstanceList, InvalidOverriddenInstanceError, \
+    expansionCache
 from twistedcaldav.timezones import hasTZ
 
 from txdav.caldav.datastore.scheduling.utils import normalizeCUAddr
@@ -607,10 +608,29 @@ class Component (object):
         Invalidate the cached copy of serialized icalendar data
         """
         self._cachedCopy = None
+        self._storedMD5 = None
         parent = getattr(self, "_parent", None)
         if parent is not None:
             parent._markAsDirty()
 
+    def setStoredMD5(self, md5):
+        """
+        Note the MD5 of the stored calendar data this component was parsed from. This
+        identifies the data for caching until the component is changed.
+
+        @param md5: the MD5 of the stored data
+        @type md5: C{str}
+        """
+        self._storedMD5 = md5
+
+    def storedMD5(self):
+        """
+        @return: the MD5 of the stored calendar data this component was parsed from,
+            or L{None} if not known or the component has since been changed
+        @rtype: C{str}
+        """
+        return getattr(self, "_storedMD5", None)
+
     def __repr__(self):
         return (
             "<{self.__class__.__name__}: {pycal!r}>"
@@ -1443,8 +1463,35 @@ class Component (object):
         @return: a set of Instances for each recurrence in the set.
         """
 
-        componentSet = self.subcomponents()
-        return self.expandSetTimeRanges(componentSet, limit, lowerLimit=lowerLimit, ignoreInvalidInstances=ignoreInvalidInstances, normalizeFunction=normalizeFunction)
+        componentSet = list(self.subcomponents())
+
+        # Only recurring data is worth caching, and only data known to be unchanged from
+        # the stored data, which is identified by its MD5
+        md5 = self.storedMD5()
+        if config.ExpansionCacheSize <= 0 or md5 is None or not self.isRecurring():
+            return self.expandSetTimeRanges(componentSet, limit, lowerLimit=lowerLimit, ignoreInvalidInstances=ignoreInvalidInstances, normalizeFunction=normalizeFunction)
+
+        key = (
+            md5,
+            str(limit),
+            limit.getTimezoneID() if limit is not None else None,
+            str(lowerLimit),
+            lowerLimit.getTimezoneID() if lowerLimit is not None else None,
+            ignoreInvalidInstances,
+            normalizeFunction.__name__,
+            config.MaxAllowedInstances,
+        )
+        snapshot = expansionCache.get(key)
+        if snapshot is not None:
+            return InstanceList.fromSnapshot(snapshot, componentSet, ignoreInvalidInstances=ignoreInvalidInstances, normalizeFunction=normalizeFunction)
+
+        instances = self.expandSetTimeRanges(componentSet, limit, lowerLimit=lowerLimit, ignoreInvalidInstances=ignoreInvalidInstances, normalizeFunction=normalizeFunction)
+
+        # Expansion can fix up an invalid RECURRENCE-ID, in which case the data no longer
+        # matches the key
+        if self.storedMD5() == md5:
+            expansionCache.set(key, instances.snapshot(componentSet))
+        return instances
 
     def expandSetTimeRanges(self, componentSet, limit, lowerLimit=None, ignoreInvalidInstances=False, normalizeFunction=normalizeForIndex):
         """
@@ -18,6 +18,8 @@
 iCalendar Recurrence Expansion Utilities
 """
 
+from collections import OrderedDict
+
 from twistedcaldav.config import config
 from twistedcaldav.dateops import normalizeForIndex, differenceDateTime
 
@@ -95,6 +97,10 @@ class Instance(object):
         return not self.overridden and self.start == self.component.getStartDateUTC()
 
 
+def _duplicate(value):
+    return value.duplicate() if isinstance(value, DateTime) else value
+
+
 class InstanceList(object):
 
     def __init__(self, ignoreInvalidInstances=False, normalizeFunction=normalizeForIndex):
@@ -115,6 +121,69 @@ class InstanceList(object):
     def __getitem__(self, key):
         return self.instances[key]
 
+    def snapshot(self, componentSet):
+        """
+        Return a copy of this list suitable for storing in an L{ExpansionCache}. The
+        components each instance belongs to are recorded by their position in
+        C{componentSet}, so that the copy does not refer to the calendar data it was
+        expanded from.
+
+        @param componentSet: the components this list was expanded from
+        @type componentSet: C{list}
+        @return: the snapshot, or L{None} if an instance refers to a component that is
+            not in C{componentSet}
+        @rtype: C{tuple}
+        """
+        positions = dict([(id(component), ctr) for ctr, component in enumerate(componentSet)])
+        if any([id(instance.component) not in positions for instance in self.instances.itervalues()]):
+            return None
+
+        attributes = dict([
+            (attr, _duplicate(getattr(self, attr)))
+            for attr in ("limit", "lowerLimit", "adjustedLowerLimit", "adjustedUpperLimit", "master_cancelled")
+            if hasattr(self, attr)
+        ])
+        instances = [
+            (
+                positions[id(instance.component)],
+                instance.start.duplicate(),
+                instance.end.duplicate(),
+                instance.rid.duplicate(),
+                instance.overridden,
+                instance.future,
+            ) for instance in self.instances.itervalues()
+        ]
+        return (attributes, instances,)
+
+    @classmethod
+    def fromSnapshot(cls, snapshot, componentSet, ignoreInvalidInstances=False, normalizeFunction=normalizeForIndex):
+        """
+        Create a new list from a snapshot, with the instances referring to the matching
+        components in C{componentSet}.
+
+        @param snapshot: the value returned by L{snapshot}
+        @type snapshot: C{tuple}
+        @param componentSet: the components to use for the instances - these must be
+            the same as the ones the snapshot was created from
+        @type componentSet: C{list}
+        @return: the new list
+        @rtype: L{InstanceList}
+        """
+        attributes, instances = snapshot
+        result = cls(ignoreInvalidInstances=ignoreInvalidInstances, normalizeFunction=normalizeFunction)
+        for attr, value in attributes.items():
+            setattr(result, attr, _duplicate(value))
+        for position, start, end, rid, overridden, future in instances:
+            result.instances[str(rid)] = Instance(
+                componentSet[position],
+                start.duplicate(),
+                end.duplicate(),
+                rid.duplicate(),
+                overridden,
+                future,
+            )
+        return result
+
     def expandTimeRanges(self, componentSet, limit, lowerLimit=None):
         """
         Expand the set of recurrence instances up to the specified date limit.
@@ -523,3 +592,54 @@ class InstanceList(object):
         end = self.normalizeFunction(end)
 
         self.addInstance(Instance(component, start, end))
+
+
+class ExpansionCache(object):
+    """
+    A cache of recurrence expansions shared by all the L{Component}s in the process,
+    so that expanding the same calendar data over the same range (e.g., repeated
+    calendar-query, free-busy or scheduling operations on one event) does not need to
+    run the recurrence engine each time. Entries are kept in least-recently-used order
+    and the oldest is discarded once C{config.ExpansionCacheSize} entries are cached.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Return the snapshot cached for C{key}, or L{None}.
+        """
+        try:
+            snapshot = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = snapshot
+        self.hits += 1
+        return snapshot
+
+    def set(self, key, snapshot):
+        """
+        Cache a snapshot (see L{InstanceList.snapshot}) under C{key}.
+        """
+        maxEntries = config.ExpansionCacheSize
+        if maxEntries <= 0 or snapshot is None:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = snapshot
+        while len(self._entries) > maxEntries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+expansionCache = ExpansionCache()
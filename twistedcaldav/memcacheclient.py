@@ -46,11 +46,15 @@ More detailed documentation is available in the L{Client} class.
 
 import sys
 import socket
+import struct
 import time
 import os
 import re
 import types
 
+from bisect import bisect
+from hashlib import md5
+
 from twext.python.log import Logger
 
 from twistedcaldav.config import config
@@ -143,7 +147,8 @@ class ClientFactory(object):
         elif config.Memcached.Pools.Default.ClientEnabled:
             return Client(
                 servers, debug=debug, pickleProtocol=pickleProtocol,
-                pickler=pickler, unpickler=unpickler, pload=pload, pid=pid)
+                pickler=pickler, unpickler=unpickler, pload=pload, pid=pid,
+                ketama=config.Memcached.KetamaHashing)
         else:
             return None
 
@@ -175,6 +180,7 @@ class Client(local):
     _FLAG_COMPRESSED = 1 << 3
 
     _SERVER_RETRIES = 10  # how many times to try finding a free server.
+    _KETAMA_POINTS = 40  # md5 digests (of four ring points each) per unit of server weight.
 
     # exceptions for Client
     class MemcachedKeyError(Exception):
@@ -197,7 +203,7 @@ class Client(local):
 
     def __init__(self, servers, debug=0, pickleProtocol=0,
                  pickler=pickle.Pickler, unpickler=pickle.Unpickler,
-                 pload=None, pid=None):
+                 pload=None, pid=None, ketama=False):
         """
         Create a new Client object with the given list of servers.
 
@@ -211,8 +217,13 @@ class Client(local):
         Useful for cPickle since subclassing isn't allowed.
         @param pid: optional persistent_id function to call on pickle storing.
         Useful for cPickle since subclassing isn't allowed.
+        @param ketama: whether to pick the server for a key with a ketama
+        consistent-hash ring rather than hash modulo the number of servers, so
+        that changing the list of servers only remaps the keys of the servers
+        added or removed.
         """
         local.__init__(self)
+        self.ketama = ketama
         self.set_servers(servers)
         self.debug = debug
         self.stats = {}
@@ -331,18 +342,58 @@ class Client(local):
             for _ignroe_i in range(server.weight):
                 self.buckets.append(server)
 
-    def _get_server(self, key):
-        if isinstance(key, tuple):
-            serverhash, key = key
+        # The ketama ring: each server gets points in proportion to its weight,
+        # derived from its address so every client builds the same ring
+        ring = []
+        if self.ketama:
+            for server in self.servers:
+                for i in range(server.weight * Client._KETAMA_POINTS):
+                    digest = md5("%s-%d" % (server.name(), i)).digest()
+                    for point in struct.unpack("<4I", digest):
+                        ring.append((point, server))
+            ring.sort(key=lambda item: item[0])
+        self.ringPoints = [point for point, _ignore_server in ring]
+        self.ringServers = [server for _ignore_point, server in ring]
+
+    def _server_candidates(self, key):
+        """
+        Generate the servers to try, in order, for a key.
+
+        @param key: the key, or a C{tuple} of C{(hashvalue, key)}
+        @return: an iterator of L{_Host}
+        """
+        if self.ketama:
+            if isinstance(key, tuple):
+                point = key[0] & 0xffffffff
+            else:
+                point = struct.unpack("<I", md5(key).digest()[:4])[0]
+
+            # Walk clockwise round the ring from the key's point, so that the keys
+            # of a dead server fall on the next servers round the ring
+            index = bisect(self.ringPoints, point)
+            tried = set()
+            for i in range(len(self.ringServers)):
+                server = self.ringServers[(index + i) % len(self.ringServers)]
+                if server not in tried:
+                    tried.add(server)
+                    yield server
+                    if len(tried) == min(len(self.servers), Client._SERVER_RETRIES):
+                        break
         else:
-            serverhash = serverHashFunction(key)
+            if isinstance(key, tuple):
+                serverhash = key[0]
+            else:
+                serverhash = serverHashFunction(key)
 
-        for i in range(Client._SERVER_RETRIES):
-            server = self.buckets[serverhash % len(self.buckets)]
+            for i in range(Client._SERVER_RETRIES):
+                yield self.buckets[serverhash % len(self.buckets)]
+                serverhash = serverHashFunction(str(serverhash) + str(i))
+
+    def _get_server(self, key):
+        for server in self._server_candidates(key):
             if server.connect():
                 # print("(using server %s)" % server, end="")
-                return server, key
-            serverhash = serverHashFunction(str(serverhash) + str(i))
+                return server, key[1] if isinstance(key, tuple) else key
         log.error("Memcacheclient _get_server( ) failed to connect")
         return None, None
 
@@ -1200,6 +1251,15 @@ class _Host:
 
         self.buffer = ''
 
+    def name(self):
+        """
+        The server address, independent of its state, as used on the ketama ring.
+        """
+        if self.family == socket.AF_INET:
+            return "%s:%d" % self.address
+        else:
+            return self.address
+
     def _check_dead(self):
         if self.deaduntil and self.deaduntil > time.time():
             return 1
@@ -371,6 +371,9 @@ class MemCachePool(object):
     def get(self, *args, **kwargs):
         return self.performRequest('get', *args, **kwargs)
 
+    def getMultiple(self, *args, **kwargs):
+        return self.performRequest('getMultiple', *args, **kwargs)
+
     def set(self, *args, **kwargs):
         return self.performRequest('set', *args, **kwargs)
 
@@ -17,8 +17,12 @@
 import hashlib
 import cPickle
 import string
+import zlib
+from uuid import uuid4
 
-from twisted.internet.defer import succeed
+from twisted.internet.defer import Deferred, succeed, gatherResults, \
+    inlineCallbacks, returnValue, maybeDeferred
+from twisted.internet.task import deferLater
 
 from twext.python.log import Logger
 
@@ -34,6 +38,12 @@ class Memcacher(CachePoolUserMixIn):
     HASH_LENGTH = 32              # length of hash we will generate
     TRUNCATED_KEY_LENGTH = MEMCACHE_KEY_LIMIT - NAMESPACE_MAX_LENGTH - HASH_LENGTH - 2  # 2 accounts for delimiters
     MEMCACHE_VALUE_LIMIT = 1024 * 1024  # the memcached default value length limit
+    COMPRESS_THRESHOLD = 16 * 1024  # values longer than this are compressed
+    CHUNK_SIZE = MEMCACHE_VALUE_LIMIT - 1024  # longer values are split, leaving room for the item header
+
+    # Flags stored with each value
+    FLAG_COMPRESSED = 1 << 3  # value is zlib compressed
+    FLAG_CHUNKED = 1 << 4     # value is a manifest for chunks stored under other keys
 
     # Translation table: all ctrls (0x00 - 0x1F) and space and 0x7F mapped to _
     keyNormalizeTranslateTable = string.maketrans("".join([chr(i) for i in range(33)]) + chr(0x7F), "_" * 33 + "_")
@@ -53,7 +63,7 @@ class Memcacher(CachePoolUserMixIn):
         """
 
         def __init__(self, pickle=False):
-            self._cache = {}  # (value, expireTime, check-and-set identifier)
+            self._cache = {}  # (value, expireTime, check-and-set identifier, flags)
             self._clock = 0
             self._pickle = pickle
 
@@ -65,21 +75,21 @@ class Memcacher(CachePoolUserMixIn):
             if not self._pickle and not isinstance(value, str):
                 raise ValueError("memcache values must be str type")
 
-        def add(self, key, value, expireTime=0):
+        def add(self, key, value, flags=0, expireTime=0):
             self._check_key(key)
             self._check_value(value)
 
             if len(key) > Memcacher.MEMCACHE_KEY_LIMIT or len(str(value)) > Memcacher.MEMCACHE_VALUE_LIMIT:
                 return succeed(False)
-            if key not in self._cache:
+            if key not in self._cache or self._clock >= self._cache[key][1]:
                 if not expireTime:
                     expireTime = 99999
-                self._cache[key] = (value, self._clock + expireTime, 0)
+                self._cache[key] = (value, self._clock + expireTime, 0, flags)
                 return succeed(True)
             else:
                 return succeed(False)
 
-        def set(self, key, value, expireTime=0):
+        def set(self, key, value, flags=0, expireTime=0):
             self._check_key(key)
             self._check_value(value)
 
@@ -92,7 +102,7 @@ class Memcacher(CachePoolUserMixIn):
                 identifier += 1
             else:
                 identifier = 0
-            self._cache[key] = (value, self._clock + expireTime, identifier)
+            self._cache[key] = (value, self._clock + expireTime, identifier, flags)
             return succeed(True)
 
         def checkAndSet(self, key, value, cas, flags=0, expireTime=0):
@@ -110,24 +120,31 @@ class Memcacher(CachePoolUserMixIn):
                 identifier += 1
             else:
                 return succeed(False)
-            self._cache[key] = (value, self._clock + expireTime, identifier)
+            self._cache[key] = (value, self._clock + expireTime, identifier, flags)
             return succeed(True)
 
         def get(self, key, withIdentifier=False):
+            return succeed(self._lookup(key, withIdentifier))
+
+        def getMultiple(self, keys, withIdentifier=False):
+            return succeed(dict([(key, self._lookup(key, withIdentifier),) for key in keys]))
+
+        def _lookup(self, key, withIdentifier):
             self._check_key(key)
 
             if len(key) > Memcacher.MEMCACHE_KEY_LIMIT:
-                value, expires, identifier = (None, 0, "")
+                value, expires, identifier, flags = (None, 0, "", 0)
             else:
-                value, expires, identifier = self._cache.get(key, (None, 0, ""))
+                value, expires, identifier, flags = self._cache.get(key, (None, 0, "", 0))
                 if self._clock >= expires:
                     value = None
                     identifier = ""
+                    flags = 0
 
             if withIdentifier:
-                return succeed((0, value, str(identifier)))
+                return (flags, value, str(identifier))
             else:
-                return succeed((0, value,))
+                return (flags, value,)
 
         def delete(self, key):
             self._check_key(key)
@@ -147,14 +164,14 @@ class Memcacher(CachePoolUserMixIn):
                 return succeed(False)
             value = self._cache.get(key, None)
             if value is not None:
-                value, expire, identifier = value
+                value, expire, identifier, flags = value
                 try:
                     value = int(value)
                 except ValueError:
                     value = None
                 else:
                     value += delta
-                    self._cache[key] = (str(value), expire, identifier,)
+                    self._cache[key] = (str(value), expire, identifier, flags,)
             return succeed(value)
 
         def decr(self, key, delta=1):
@@ -164,7 +181,7 @@ class Memcacher(CachePoolUserMixIn):
                 return succeed(False)
             value = self._cache.get(key, None)
             if value is not None:
-                value, expire, identifier = value
+                value, expire, identifier, flags = value
                 try:
                     value = int(value)
                 except ValueError:
@@ -173,7 +190,7 @@ class Memcacher(CachePoolUserMixIn):
                     value -= delta
                     if value < 0:
                         value = 0
-                    self._cache[key] = (str(value), expire, identifier,)
+                    self._cache[key] = (str(value), expire, identifier, flags,)
             return succeed(value)
 
         def flushAll(self):
@@ -194,10 +211,10 @@ class Memcacher(CachePoolUserMixIn):
         does not actually cache anything.
         """
 
-        def add(self, key, value, expireTime=0):
+        def add(self, key, value, flags=0, expireTime=0):
             return succeed(True)
 
-        def set(self, key, value, expireTime=0):
+        def set(self, key, value, flags=0, expireTime=0):
             return succeed(True)
 
         def checkAndSet(self, key, value, cas, flags=0, expireTime=0):
@@ -206,6 +223,9 @@ class Memcacher(CachePoolUserMixIn):
         def get(self, key, withIdentifier=False):
             return succeed((0, None,))
 
+        def getMultiple(self, keys, withIdentifier=False):
+            return succeed(dict([(key, (0, None,),) for key in keys]))
+
         def delete(self, key):
             return succeed(True)
 
@@ -243,6 +263,12 @@ class Memcacher(CachePoolUserMixIn):
         self._noInvalidation = no_invalidation
         self._key_normalization = key_normalization
 
+        # Recompute lease counters
+        self.leasesGranted = 0
+        self.leaseWaits = 0
+        self.leaseWaitTimeouts = 0
+        self.leaseStaleServes = 0
+
     def _getMemcacheProtocol(self):
         if self._memcacheProtocol is not None:
             return self._memcacheProtocol
@@ -277,53 +303,182 @@ class Memcacher(CachePoolUserMixIn):
         else:
             return key
 
-    def add(self, key, value, expireTime=0):
-
-        proto = self._getMemcacheProtocol()
+    def _encode(self, value):
+        """
+        Convert a value into what is stored in the cache: pickled if required, and
+        compressed if that makes it smaller. A value that is still too big for a
+        single cache item is split into chunks.
 
+        @return: C{tuple} of (flags, value, chunks) where C{chunks} is a C{list}
+            of C{str}, or C{None} if the value is stored directly
+        """
         my_value = value
         if self._pickle:
             my_value = cPickle.dumps(value)
-        self.log.debug("Adding Cache Token for {k!r}", k=key)
-        return proto.add('%s:%s' % (self._namespace, self._normalizeKey(key)), my_value, expireTime=expireTime)
 
-    def set(self, key, value, expireTime=0):
+        # The null cacher takes any type, and the memory cacher checks the type
+        flags = 0
+        if not isinstance(my_value, str):
+            return flags, my_value, None
 
-        proto = self._getMemcacheProtocol()
+        if len(my_value) > Memcacher.COMPRESS_THRESHOLD:
+            compressed = zlib.compress(my_value)
+            if len(compressed) < len(my_value):
+                my_value = compressed
+                flags |= Memcacher.FLAG_COMPRESSED
 
-        my_value = value
+        if len(my_value) <= Memcacher.CHUNK_SIZE:
+            return flags, my_value, None
+        chunks = [my_value[i:i + Memcacher.CHUNK_SIZE] for i in range(0, len(my_value), Memcacher.CHUNK_SIZE)]
+        return flags | Memcacher.FLAG_CHUNKED, my_value, chunks
+
+    def _decode(self, key, flags, value):
+        """
+        Convert a value read from the cache back into the original value, reading
+        its chunks if it was stored in chunks.
+
+        @return: the value, or a L{Deferred} that fires with it. If any chunk is
+            missing or does not belong to the manifest, the value is L{None}.
+        """
+        if value is None:
+            return None
+
+        if flags & Memcacher.FLAG_CHUNKED:
+            try:
+                version, count, length = value.split(":")
+                count = int(count)
+                length = int(length)
+            except ValueError:
+                self.log.error("Bad chunk manifest for {k!r}", k=key)
+                return None
+
+            def _gotchunks(results):
+                chunks = [results.get(chunkKey, (0, None,))[1] for chunkKey in chunkKeys]
+                if None in chunks or sum(map(len, chunks)) != length:
+                    self.log.debug("Missing chunks for {k!r}", k=key)
+                    return None
+                return self._decodeValue(flags, "".join(chunks))
+
+            chunkKeys = [self._chunkKey(key, version, index) for index in range(count)]
+            d = self._getMemcacheProtocol().getMultiple(chunkKeys)
+            d.addCallback(_gotchunks)
+            return d
+
+        return self._decodeValue(flags, value)
+
+    def _decodeValue(self, flags, value):
+        if flags & Memcacher.FLAG_COMPRESSED:
+            value = zlib.decompress(value)
         if self._pickle:
-            my_value = cPickle.dumps(value)
-        self.log.debug("Setting Cache Token for {k!r}", k=key)
-        return proto.set('%s:%s' % (self._namespace, self._normalizeKey(key)), my_value, expireTime=expireTime)
+            value = cPickle.loads(value)
+        return value
 
-    def checkAndSet(self, key, value, cas, flags=0, expireTime=0):
+    def _chunkKey(self, key, version, index):
+        """
+        The cache key of one chunk of a value. Every write of a chunked value uses
+        a new version, so a manifest never refers to chunks from another write.
+        """
+        return "%s:%s-%s-%d" % (self._namespace, hashlib.md5(key).hexdigest(), version, index,)
 
+    def _store(self, command, key, value, expireTime, *args):
+        """
+        Encode a value and store it with the given protocol command, writing any
+        chunks before the manifest that refers to them.
+        """
         proto = self._getMemcacheProtocol()
+        key = '%s:%s' % (self._namespace, self._normalizeKey(key))
+        flags, my_value, chunks = self._encode(value)
+        if chunks is None:
+            return getattr(proto, command)(key, my_value, *args, flags=flags, expireTime=expireTime)
+
+        def _storedchunks(results):
+            if not all(results):
+                return False
+            return getattr(proto, command)(key, manifest, *args, flags=flags, expireTime=expireTime)
+
+        version = uuid4().hex
+        manifest = "%s:%d:%d" % (version, len(chunks), len(my_value),)
+        d = gatherResults([
+            proto.set(self._chunkKey(key, version, index), chunk, expireTime=expireTime)
+            for index, chunk in enumerate(chunks)
+        ])
+        d.addCallback(_storedchunks)
+        return d
 
-        my_value = value
-        if self._pickle:
-            my_value = cPickle.dumps(value)
+    def add(self, key, value, expireTime=0):
+        self.log.debug("Adding Cache Token for {k!r}", k=key)
+        return self._store("add", key, value, expireTime)
+
+    def set(self, key, value, expireTime=0):
+        self.log.debug("Setting Cache Token for {k!r}", k=key)
+        return self._store("set", key, value, expireTime)
+
+    def checkAndSet(self, key, value, cas, flags=0, expireTime=0):
         self.log.debug("Setting Cache Token for {k!r}", k=key)
-        return proto.checkAndSet('%s:%s' % (self._namespace, self._normalizeKey(key)), my_value, cas, expireTime=expireTime)
+        return self._store("checkAndSet", key, value, expireTime, cas)
 
     def get(self, key, withIdentifier=False):
         def _gotit(result, withIdentifier):
             if withIdentifier:
-                _ignore_flags, identifier, value = result
+                flags, identifier, value = result
             else:
-                _ignore_flags, value = result
-            if self._pickle and value is not None:
-                value = cPickle.loads(value)
+                flags, value = result
+            value = self._decode(normalized, flags, value)
             if withIdentifier:
-                value = (identifier, value)
+                if isinstance(value, Deferred):
+                    value.addCallback(lambda value: (identifier, value))
+                else:
+                    value = (identifier, value)
             return value
 
         self.log.debug("Getting Cache Token for {k!r}", k=key)
-        d = self._getMemcacheProtocol().get('%s:%s' % (self._namespace, self._normalizeKey(key)), withIdentifier=withIdentifier)
+        normalized = '%s:%s' % (self._namespace, self._normalizeKey(key))
+        d = self._getMemcacheProtocol().get(normalized, withIdentifier=withIdentifier)
         d.addCallback(_gotit, withIdentifier)
         return d
 
+    def getMultiple(self, keys, withIdentifier=False):
+        """
+        Get the values for several keys with a single request to the cache.
+
+        @param keys: the keys to lookup
+        @type keys: iterable of C{str}
+
+        @return: a L{Deferred} that fires with a C{dict} mapping each key to its value
+            (which is L{None} if the key is not in the cache)
+        """
+        def _gotthem(results, withIdentifier):
+            values = {}
+            chunked = []
+            for key, normalized in normalizedKeys.items():
+                if withIdentifier:
+                    flags, identifier, value = results.get(normalized, (0, "", None,))
+                else:
+                    flags, value = results.get(normalized, (0, None,))
+                value = self._decode(normalized, flags, value)
+                if isinstance(value, Deferred):
+                    value.addCallback(_gotchunked, values, key, identifier if withIdentifier else None)
+                    chunked.append(value)
+                    continue
+                if withIdentifier:
+                    value = (identifier, value)
+                values[key] = value
+
+            if chunked:
+                return gatherResults(chunked).addCallback(lambda _ignore: values)
+            return values
+
+        def _gotchunked(value, values, key, identifier):
+            values[key] = (identifier, value) if withIdentifier else value
+
+        normalizedKeys = dict([(key, '%s:%s' % (self._namespace, self._normalizeKey(key)),) for key in keys])
+        if not normalizedKeys:
+            return succeed({})
+        self.log.debug("Getting Cache Tokens for {k!r}", k=normalizedKeys.keys())
+        d = self._getMemcacheProtocol().getMultiple(normalizedKeys.values(), withIdentifier=withIdentifier)
+        d.addCallback(_gotthem, withIdentifier)
+        return d
+
     def delete(self, key):
         self.log.debug("Deleting Cache Token for {k!r}", k=key)
         return self._getMemcacheProtocol().delete('%s:%s' % (self._namespace, self._normalizeKey(key)))
@@ -336,6 +491,125 @@ class Memcacher(CachePoolUserMixIn):
         self.log.debug("Decrementing Cache Token for {k!r}", k=key)
         return self._getMemcacheProtocol().incr('%s:%s' % (self._namespace, self._normalizeKey(key)), delta)
 
+    def _leaseKey(self, key):
+        return "%s:lease-%s" % (self._namespace, hashlib.md5(self._normalizeKey(key)).hexdigest(),)
+
+    def acquireLease(self, key):
+        """
+        Try to get the right to recompute the value for a key. Only one worker at a
+        time is granted the lease, which expires after C{config.CacheLeases.LeaseSeconds}
+        in case the worker never stores the new value.
+
+        @return: a L{Deferred} that fires with the lease token if the lease was
+            granted, otherwise L{None}. The token is passed to L{releaseLease}.
+        """
+        token = uuid4().hex
+
+        def _added(result):
+            if result:
+                self.leasesGranted += 1
+                return token
+            return None
+
+        self.log.debug("Acquiring Cache Lease for {k!r}", k=key)
+        d = self._getMemcacheProtocol().add(self._leaseKey(key), token, expireTime=config.CacheLeases.LeaseSeconds)
+        d.addCallback(_added)
+        return d
+
+    @inlineCallbacks
+    def releaseLease(self, key, token):
+        """
+        Release a lease granted by L{acquireLease}. The lease is only removed if it
+        is still the one granted with C{token}, so a holder whose lease expired does
+        not release a lease since granted to another worker.
+
+        @param key: the key of the value
+        @type key: C{str}
+        @param token: the token returned by L{acquireLease}
+        @type token: C{str}
+        """
+        self.log.debug("Releasing Cache Lease for {k!r}", k=key)
+        leaseKey = self._leaseKey(key)
+        _ignore_flags, value = (yield self._getMemcacheProtocol().get(leaseKey))
+        if value == token:
+            yield self._getMemcacheProtocol().delete(leaseKey)
+
+    @inlineCallbacks
+    def leaseOrWait(self, key, lookup, stale=None, reactor=None, logItems=None):
+        """
+        Called when the value for a key is missing or out of date, to stop every
+        worker recomputing it at once. The first worker is granted the lease and
+        recomputes the value. Other workers are given the out of date value if the
+        caller allows it, otherwise they poll for the new value for up to
+        C{config.CacheLeases.WaitSeconds} before giving up and recomputing it
+        themselves.
+
+        @param key: the key of the value
+        @type key: C{str}
+        @param lookup: called with no arguments to get the new value, returning
+            the value (or a L{Deferred} that fires with it), or L{None} if it has
+            not been stored yet
+        @type lookup: C{callable}
+        @param stale: the out of date value to use while another worker is
+            recomputing it, or L{None} to wait for the new value
+        @param reactor: the reactor used to schedule polling
+        @param logItems: items to add to logging, counting when the caller is
+            granted the lease (C{lease-granted}), served a stale value
+            (C{lease-stale}), waits (C{lease-wait}) or gives up waiting
+            (C{lease-timeout})
+        @type logItems: L{dict}
+
+        @return: a L{Deferred} that fires with a C{tuple} of the value to use and
+            the lease token, or L{None} if the lease was not granted. If the value
+            is L{None} the caller has to recompute it, and if it was granted the
+            lease it has to call L{releaseLease} with the token once the new value
+            is stored (or it fails to compute it).
+        """
+        token = (yield self.acquireLease(key))
+        if token is not None:
+            self._logLease(logItems, "lease-granted")
+            returnValue((None, token,))
+
+        if stale is not None:
+            self.leaseStaleServes += 1
+            self._logLease(logItems, "lease-stale")
+            returnValue((stale, None,))
+
+        if reactor is None:
+            from twisted.internet import reactor
+
+        self.leaseWaits += 1
+        self._logLease(logItems, "lease-wait")
+        self.log.debug("Waiting on Cache Lease for {k!r}", k=key)
+        timeout_at = reactor.seconds() + config.CacheLeases.WaitSeconds
+        while reactor.seconds() < timeout_at:
+            yield deferLater(reactor, config.CacheLeases.RetrySeconds, lambda: None)
+            value = (yield maybeDeferred(lookup))
+            if value is not None:
+                returnValue((value, None,))
+
+        self.leaseWaitTimeouts += 1
+        self._logLease(logItems, "lease-timeout")
+        self.log.debug("Timed out waiting on Cache Lease for {k!r}", k=key)
+        returnValue((None, None,))
+
+    def _logLease(self, logItems, item):
+        if logItems is not None:
+            logItems[item] = logItems.get(item, 0) + 1
+
+    def leaseStats(self):
+        """
+        Return the recompute lease counters.
+
+        @rtype: L{dict}
+        """
+        return {
+            "granted": self.leasesGranted,
+            "waits": self.leaseWaits,
+            "wait-timeouts": self.leaseWaitTimeouts,
+            "stale": self.leaseStaleServes,
+        }
+
     def flushAll(self):
         self.log.debug("Flushing All Cache Tokens")
         return self._getMemcacheProtocol().flushAll()
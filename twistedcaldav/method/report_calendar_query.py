@@ -225,19 +225,24 @@ def report_urn_ietf_params_xml_ns_caldav_calendar_query(self, request, calendar_
                     None,
                     names,
                     (davxml.Read(),),
-                    inherited_aces=filteredaces
+                    inherited_aces=filteredaces,
+                    withData=generate_calendar_data or not index_query_ok,
                 )
 
                 for child, child_uri in ok_resources:
                     child_uri_name = child_uri[child_uri.rfind("/") + 1:]
 
-                    if generate_calendar_data or not index_query_ok:
+                    # The index ignores access restrictions, so a restricted resource has to
+                    # be matched against only the properties a non-owner is allowed to see
+                    child_query_ok = index_query_ok and (isowner or not child.accessMode)
+
+                    if generate_calendar_data or not child_query_ok:
                         calendar = (yield child.componentForUser())
                         assert calendar is not None, "Calendar %s is missing from calendar collection %r" % (child_uri_name, self)
                     else:
                         calendar = None
 
-                    yield queryCalendarObjectResource(child, uri, child_uri_name, calendar, timezone, query_ok=index_query_ok, isowner=isowner)
+                    yield queryCalendarObjectResource(child, uri, child_uri_name, calendar, timezone, query_ok=child_query_ok, isowner=isowner)
         else:
             # Get the timezone property from the collection if one was not set in the query,
             # and store in the query object for later use
@@ -198,7 +198,8 @@ def multiget_common(self, request, multiget, collection_type):
                 lambda x: unavailable_resources.append(x),
                 valid_names,
                 (davxml.Read(),),
-                inherited_aces=filteredaces
+                inherited_aces=filteredaces,
+                withData=hasData,
             )
 
             # Get properties for all valid readable resources
@@ -60,12 +60,12 @@ def report_DAV__sync_collection(self, request, sync_collection):
 
     responses = []
 
-    # Do not support limit
-    if sync_collection.sync_limit is not None:
+    # A DAV:limit may cause the results to be truncated (RFC 6578 section 3.6)
+    if sync_collection.sync_limit is not None and sync_collection.sync_limit <= 0:
         raise HTTPError(ErrorResponse(
             responsecode.INSUFFICIENT_STORAGE_SPACE,
             element.NumberOfMatchesWithinLimits(),
-            "Report limit not supported",
+            "Invalid report limit",
         ))
 
     # Process Depth and sync-level for backwards compatibility
@@ -89,7 +89,9 @@ def report_DAV__sync_collection(self, request, sync_collection):
     # the child resource loop and supply those to the checkPrivileges on each child.
     filteredaces = (yield self.inheritedACEsforChildren(request))
 
-    changed, removed, notallowed, newtoken, resourceChanged = yield self.whatchanged(sync_collection.sync_token, depth)
+    changed, removed, notallowed, newtoken, resourceChanged, truncated = yield self.whatchanged(
+        sync_collection.sync_token, depth, limit=sync_collection.sync_limit
+    )
 
     # Now determine which valid resources are readable and which are not
     ok_resources = []
@@ -164,6 +166,16 @@ def report_DAV__sync_collection(self, request, sync_collection):
         request.extendedLogItems = {}
     request.extendedLogItems["responses"] = len(responses)
 
+    # Truncated results are flagged with a 507 response for the request-URI, and the
+    # returned token is used by the client to get the next set of changes
+    if truncated:
+        request.extendedLogItems["truncated"] = True
+        responses.append(element.StatusResponse(
+            element.HRef.fromString(request.uri),
+            element.Status.fromResponseCode(responsecode.INSUFFICIENT_STORAGE_SPACE),
+            element.Error(element.NumberOfMatchesWithinLimits()),
+        ))
+
     responses.append(element.SyncToken.fromString(newtoken))
 
     returnValue(MultiStatusResponse(responses))
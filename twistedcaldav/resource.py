@@ -1201,7 +1201,19 @@ class CalDAVResource (
     # Collection sync stuff
 
     @inlineCallbacks
-    def whatchanged(self, client_token, depth):
+    def whatchanged(self, client_token, depth, limit=None):
+        """
+        Determine what has changed since the supplied sync token. When C{limit} is
+        given the results may be truncated (RFC 6578 section 3.6), in which case the
+        returned token is an intermediate one that the client uses to fetch the next
+        batch of changes. An intermediate token for an initial sync carries the
+        revision at which the initial sync started together with the name of the
+        last resource returned.
+
+        @return: a C{tuple} of changed, removed and not-allowed names, the new sync
+            token, whether the collection itself changed, and whether the results
+            were truncated.
+        """
 
         client_data_token = None
         client_config_token = None
@@ -1218,11 +1230,16 @@ class CalDAVResource (
         current_uuid, current_revision = current_token[6:].split("_", 1)
         current_revision = int(current_revision)
 
+        startAfter = None
         if client_data_token:
             try:
                 if not client_data_token.startswith("data:,"):
                     raise ValueError
                 caluuid, revision = client_data_token[6:].split("_", 1)
+                if ":" in revision:
+                    # Intermediate token from a truncated initial sync
+                    revision, startAfter = revision.split(":", 1)
+                    startAfter = urllib.unquote(startAfter)
                 revision = int(revision)
 
                 # Check client token validity
@@ -1239,8 +1256,19 @@ class CalDAVResource (
         else:
             revision = 0
 
+        # Continuing a truncated initial sync without a limit is just an initial sync
+        if startAfter is not None and limit is None:
+            revision = 0
+            startAfter = None
+
         try:
-            changed, removed, notallowed = yield self._indexWhatChanged(revision, depth)
+            if limit is None:
+                changed, removed, notallowed = yield self._indexWhatChanged(revision, depth)
+                truncatedAt = None
+            else:
+                changed, removed, notallowed, truncatedAt = yield self._indexWhatChangedWithLimit(
+                    0 if startAfter is not None else revision, depth, limit, startAfter
+                )
         except SyncTokenValidException:
             raise HTTPError(ErrorResponse(
                 responsecode.FORBIDDEN,
@@ -1248,6 +1276,28 @@ class CalDAVResource (
                 "Sync token not recognized",
             ))
 
+        if limit is not None and truncatedAt is None and len(changed) + len(removed) + len(notallowed) > limit:
+            raise HTTPError(ErrorResponse(
+                responsecode.INSUFFICIENT_STORAGE_SPACE,
+                element.NumberOfMatchesWithinLimits(),
+                "Report limit exceeded",
+            ))
+
+        if truncatedAt is None:
+            if startAfter is not None:
+                # The initial sync is complete - the client is now in sync as of the
+                # revision at which it started, and later changes are picked up by the
+                # next sync
+                current_token = "data:,%s_%s" % (current_uuid, revision,)
+        elif revision == 0 or startAfter is not None:
+            current_token = "data:,%s_%s:%s" % (
+                current_uuid,
+                revision if startAfter is not None else current_revision,
+                urllib.quote(truncatedAt, safe=""),
+            )
+        else:
+            current_token = "data:,%s_%s" % (current_uuid, truncatedAt,)
+
         if config.EnableConfigSyncToken:
             # Append the app-level portion of sync token (e.g. derived from config)
             newConfigToken = config.syncToken()
@@ -1258,12 +1308,23 @@ class CalDAVResource (
         else:
             resourceChanged = False
 
-        returnValue((changed, removed, notallowed, current_token, resourceChanged))
+        returnValue((changed, removed, notallowed, current_token, resourceChanged, truncatedAt is not None))
 
     def _indexWhatChanged(self, revision, depth):
         # Now handled directly by newstore
         raise NotImplementedError
 
+    def _indexWhatChangedWithLimit(self, revision, depth, limit, startAfter=None):
+        """
+        Variant of L{_indexWhatChanged} that may truncate the results to C{limit}
+        names. A fourth item is returned which is L{None} if the results were not
+        truncated, otherwise the point to resume from. By default results are never
+        truncated.
+        """
+        d = maybeDeferred(self._indexWhatChanged, revision, depth)
+        d.addCallback(lambda result: tuple(result) + (None,))
+        return d
+
     @inlineCallbacks
     def getSyncToken(self):
         """
@@ -2080,7 +2141,7 @@ class CommonHomeResource(PropfindCacheMixin, SharedHomeMixin, CalDAVResource):
     @inlineCallbacks
     def findChildrenFaster(
         self, depth, request, okcallback, badcallback, missingcallback, unavailablecallback,
-        names, privileges, inherited_aces
+        names, privileges, inherited_aces, withData=False
     ):
         """
         Override to pre-load children in certain collection types for better performance.
@@ -2090,7 +2151,7 @@ class CommonHomeResource(PropfindCacheMixin, SharedHomeMixin, CalDAVResource):
             yield self._newStoreHome.loadChildren()
 
         result = (yield super(CommonHomeResource, self).findChildrenFaster(
-            depth, request, okcallback, badcallback, missingcallback, unavailablecallback, names, privileges, inherited_aces
+            depth, request, okcallback, badcallback, missingcallback, unavailablecallback, names, privileges, inherited_aces, withData=withData
         ))
 
         returnValue(result)
@@ -324,6 +324,10 @@ DEFAULT_CONFIG = {
     "UserQuota": 104857600,  # User attachment quota (in bytes - default 100MB)
     "MaximumAttachmentSize": 10485760,  # Maximum size for a single attachment (in bytes - default 10MB)
     "MaximumAttachmentsPerInstance": 5,  # Maximum number of attachments per instance
+    "AttachmentDeduplication": {
+        "Enabled": False,  # Store the data for identical attachments (same MD5) only once
+        "GracePeriodSeconds": 3600,  # Minimum age of unreferenced attachment data before it is removed
+    },
 
     # Resource data
     "MaxCollectionsPerHome": 50,  # Maximum number of calendars/address books allowed in a home
@@ -331,6 +335,8 @@ DEFAULT_CONFIG = {
     "MaxResourceSize": 1048576,  # Maximum resource size (in bytes)
     "MaxAttendeesPerInstance": 100,  # Maximum number of unique attendees
     "MaxAllowedInstances": 3000,  # Maximum number of instances the server will index
+    "ExpansionCacheSize": 1000,  # Number of recurrence expansions cached in each process (0 = no cache)
+    "ParsedComponentCacheSize": 10 * 1024 * 1024,  # Bytes of parsed calendar data cached in each process (0 = no cache)
 
     # Set to URL path of wiki authentication service, e.g. "/auth", in order
     # to use javascript authentication dialog.  Empty string indicates standard
@@ -482,6 +488,8 @@ DEFAULT_CONFIG = {
         "LabelsInSQL": False,
         "Statistics": False,
         "StatisticsLogFile": "sqlstats.log",
+        "OnlineStatistics": False,          # Add per-request SQL statement counts and time to the access log
+        "RepeatedStatementThreshold": 0,    # Log transactions running the same statement more than this many times, 0 = off
         "SQLStatements": False,
         "TransactionWaitSeconds": 0,
     },
@@ -565,6 +573,9 @@ DEFAULT_CONFIG = {
                                      # secondary service MUST define its own writable path if
                                      # not None
         "PrettyPrintJSON": True,    # User friendly JSON output
+        "PreloadIndex": False,      # Parse every timezone and precompute its observances at startup
+        "ExpandStartYear": 1970,    # Observances from the start of this year...
+        "ExpandEndYear": 2037,      # ...to the end of this one are precomputed for expand requests
 
         "SecondaryService": {
             # Only one of these should be used when a secondary service is used
@@ -795,6 +806,7 @@ DEFAULT_CONFIG = {
             "TrackUnscheduledResourceData": True,  # Track who the last modifier of an unscheduled resource event is
             "FakeResourceLocationEmail": False,  # Add fake email addresses to work around client bug
             "LimitFreeBusyAttendees": 30,  # Maximum number of attendees to request freebusy for
+            "FreeBusyParallelRecipients": 5,  # Number of local freebusy recipients to process in parallel: 0 or 1 - serial
             "AttendeeRefreshBatch": 5,  # Number of attendees to do batched refreshes: 0 - no batching
             "AttendeeRefreshCountLimit": 50,  # Number of attendees above which attendee refreshes are suppressed: 0 - no limit
             "UIDLockTimeoutSeconds": 60,  # Time for implicit UID lock timeout
@@ -856,6 +868,7 @@ DEFAULT_CONFIG = {
     "Notifications": {
         "Enabled": False,
         "CoalesceSeconds": 3,
+        "CoalesceWrites": True,  # Re-use pending push work items written by this process
 
         "Services": {
             "APNS": {
@@ -872,6 +885,10 @@ DEFAULT_CONFIG = {
                 "Environment": "PRODUCTION",
                 "EnableStaggering": False,
                 "StaggerSeconds": 3,
+                "BatchSize": 1000,  # Number of notifications sent in one write to the APN server
+                "MaxQueuedNotifications": 10000,  # Maximum number of notifications saved while disconnected (oldest are dropped)
+                "TokenBackoffSeconds": 60,  # Initial seconds to stop sending to a token after an APN error (doubles on each failure)
+                "MaxTokenBackoffSeconds": 3600,  # Maximum seconds to stop sending to a token after an APN error
                 "CalDAV": {
                     "Enabled": False,
                     "CertificatePath": "Certificates/apns:com.apple.calendar.cert.pem",
@@ -909,7 +926,8 @@ DEFAULT_CONFIG = {
     "DirectoryCaching": {
         "CachingSeconds": 60,               # How long to cache in worker and in memcached
         "NegativeCachingEnabled": True,
-        "LookupsBetweenPurges": 10000       # 0 = purging turned off
+        "LookupsBetweenPurges": 10000,      # 0 = purging turned off
+        "MaxRecordsPerIndex": 20000,        # Per-index LRU limit on records cached in each process, 0 = no limit
     },
 
     #
@@ -1006,6 +1024,11 @@ DEFAULT_CONFIG = {
     # Support for Content-Encoding compression options as specified in RFC2616 Section 3.5
     # Defaults off, because it weakens TLS (CRIME attack).
     "ResponseCompression": False,
+    "ResponseCompressionOptions": {
+        "MinimumSize": 1024,                   # Bodies smaller than this (bytes) are sent uncompressed
+        "CacheSize": 20 * 1024 * 1024,         # Total size (bytes) of compressed public GET bodies kept for re-use, keyed by ETag (0 to disable)
+        "MaxCachedBodySize": 5 * 1024 * 1024,  # Largest compressed body (bytes) that will be kept
+    },
 
     # The retry-after value (in seconds) to return with a 503 error
     "HTTPRetryAfter": 180,
@@ -1058,6 +1081,7 @@ DEFAULT_CONFIG = {
         "MaxMemory": 0,  # Megabytes
         "Options": [],
         "ProxyDBKeyNormalization": True,
+        "KetamaHashing": False,  # Consistent hashing of keys to servers
     },
 
     "Postgres": {
@@ -1131,16 +1155,34 @@ DEFAULT_CONFIG = {
 
     "EnableResponseCache": True,
     "ResponseCacheTimeout": 30,  # Minutes
+    "ResponseCacheServeStale": False,  # Serve the previous response while another request rebuilds it
 
     "EnableFreeBusyCache": True,
     "FreeBusyCacheDaysBack": 7,
     "FreeBusyCacheDaysForward": 12 * 7,
+    "FreeBusyCacheServeStale": False,  # Serve the previous free-busy results while another request rebuilds them
+
+    # Only one request at a time rebuilds an out of date free-busy or response
+    # cache entry, the others wait for it (or serve the previous entry if allowed)
+    "CacheLeases": {
+        "Enabled": True,
+        "LeaseSeconds": 10,  # Time a request has to rebuild an entry before another may
+        "WaitSeconds": 0.5,  # Time to wait for the rebuilt entry before rebuilding it too
+        "RetrySeconds": 0.05,  # Interval between checks for the rebuilt entry
+    },
 
     "FreeBusyIndexLowerLimitDays": 365,
     "FreeBusyIndexExpandAheadDays": 365,
     "FreeBusyIndexExpandMaxDays": 5 * 365,
     "FreeBusyIndexDelayedExpand": False,
     "FreeBusyIndexSmartUpdate": True,
+    "FreeBusyIndexIncrementalUpdate": True,  # Only change the instance index rows that differ when re-indexing
+
+    # iCalendar properties (e.g. SUMMARY, LOCATION, DESCRIPTION) whose values are
+    # indexed so that calendar-query text-match tests on them are done in the
+    # database rather than by reading every resource. Changes take effect when the
+    # server is restarted, which re-indexes every existing resource first.
+    "IndexedQueryProperties": [],
 
     # The RootResource uses a twext property store. Specify the class here
     "RootResourcePropStoreClass": "txweb2.dav.xattrprops.xattrPropertyStore",
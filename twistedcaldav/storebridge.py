@@ -24,7 +24,6 @@ from pycalendar.datetime import DateTime
 from twext.enterprise.locking import LockTimeout
 from twext.python.log import Logger
 from twisted.internet.defer import succeed, inlineCallbacks, returnValue, maybeDeferred
-from twisted.internet.protocol import Protocol
 from twisted.python.util import FancyEqMixin
 from twistedcaldav import customxml, carddavxml, caldavxml, ical
 from twistedcaldav.caldavxml import (
@@ -96,7 +95,7 @@ from txweb2.responsecode import (
     FORBIDDEN, NO_CONTENT, NOT_FOUND, CREATED, CONFLICT, PRECONDITION_FAILED,
     BAD_REQUEST, OK, INSUFFICIENT_STORAGE_SPACE, SERVICE_UNAVAILABLE
 )
-from txweb2.stream import ProducerStream, readStream, MemoryStream
+from txweb2.stream import FileStream, readStream, MemoryStream
 from twistedcaldav.timezones import TimezoneException
 
 
@@ -365,6 +364,13 @@ class _CommonHomeChildCollectionMixin(_CommonStoreExceptionHandler):
             (yield self._newStoreObject.resourceNamesSinceToken(revision))
         )
 
+    @inlineCallbacks
+    def _indexWhatChangedWithLimit(self, revision, depth, limit, startAfter=None):
+        # The newstore implementation supports this directly
+        returnValue(
+            (yield self._newStoreObject.resourceNamesSinceToken(revision, limit=limit, startAfter=startAfter))
+        )
+
     @inlineCallbacks
     def makeChild(self, name):
         """
@@ -447,7 +453,7 @@ class _CommonHomeChildCollectionMixin(_CommonStoreExceptionHandler):
     @inlineCallbacks
     def findChildrenFaster(
         self, depth, request, okcallback, badcallback, missingcallback, unavailablecallback,
-        names, privileges, inherited_aces
+        names, privileges, inherited_aces, withData=False
     ):
         """
         Override to pre-load children in certain collection types for better performance.
@@ -455,12 +461,12 @@ class _CommonHomeChildCollectionMixin(_CommonStoreExceptionHandler):
 
         if depth == "1":
             if names:
-                yield self._newStoreObject.objectResourcesWithNames(names)
+                yield self._newStoreObject.objectResourcesWithNames(names, withText=withData)
             else:
                 yield self._newStoreObject.objectResources()
 
         result = (yield super(_CommonHomeChildCollectionMixin, self).findChildrenFaster(
-            depth, request, okcallback, badcallback, missingcallback, unavailablecallback, names, privileges, inherited_aces
+            depth, request, okcallback, badcallback, missingcallback, unavailablecallback, names, privileges, inherited_aces, withData=withData
         ))
 
         returnValue(result)
@@ -2102,20 +2108,10 @@ class CalendarAttachment(_NewStoreFileMetaDataHelper, _GetChildHelper):
             log.debug("Resource not found: {s!r}", s=self)
             raise HTTPError(NOT_FOUND)
 
-        stream = ProducerStream()
-
-        class StreamProtocol(Protocol):
-
-            def connectionMade(self):
-                stream.registerProducer(self.transport, False)
-
-            def dataReceived(self, data):
-                stream.write(data)
-
-            def connectionLost(self, reason):
-                stream.finish()
+        # Serve the content straight from the file so that it can be sent
+        # with sendfile(2) where the connection allows it
         try:
-            self._newStoreAttachment.retrieve(StreamProtocol())
+            stream = FileStream(self._newStoreAttachment.retrieveFile())
         except IOError, e:
             log.error("Unable to read attachment: {s!r}, due to: {ex}", s=self, ex=e)
             raise HTTPError(NOT_FOUND)
@@ -3710,6 +3706,13 @@ class StoreNotificationCollectionResource(_NotificationChildHelper, Notification
             (yield self._newStoreNotifications.resourceNamesSinceToken(revision))
         )
 
+    @inlineCallbacks
+    def _indexWhatChangedWithLimit(self, revision, depth, limit, startAfter=None):
+        # The newstore implementation supports this directly
+        returnValue(
+            (yield self._newStoreNotifications.resourceNamesSinceToken(revision, limit=limit, startAfter=startAfter))
+        )
+
     def deleteNotification(self, request, record):
         return maybeDeferred(
             self._newStoreNotifications.removeNotificationObjectWithName,
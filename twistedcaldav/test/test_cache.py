@@ -27,6 +27,7 @@ from txweb2.http_headers import Headers
 from twistedcaldav.cache import MemcacheResponseCache, CacheStoreNotifier
 from twistedcaldav.cache import MemcacheChangeNotifier
 from twistedcaldav.cache import PropfindCacheMixin
+from twistedcaldav.config import config
 
 from twistedcaldav.test.util import InMemoryMemcacheProtocol
 from twistedcaldav.test.util import TestCase
@@ -393,7 +394,14 @@ class MemcacheResponseCacheTests(BaseCacheTestMixin, TestCase):
         def _getToken(uri, cachePoolHandle=None):
             return succeed(self.tokens.get(uri))
 
+        self.multiGets = []
+
+        def _getTokens(uris, cachePoolHandle=None):
+            self.multiGets.append(sorted(uris))
+            return succeed(dict([(uri, self.tokens.get(uri),) for uri in uris]))
+
         self.rc._tokenForURI = _getToken
+        self.rc._tokensForURIs = _getTokens
 
         self.expected_response = (200, Headers({}), "Foo")
 
@@ -462,6 +470,90 @@ class MemcacheResponseCacheTests(BaseCacheTestMixin, TestCase):
         d.addCallback(self.assertResponse, expected_response)
         return d
 
+    @inlineCallbacks
+    def test_childTokensFetchedTogether(self):
+        """
+        The resource and child tokens are all fetched with a single multi-get, and the
+        number of tokens and time taken are logged on a cache hit.
+        """
+        request = StubRequest(
+            'PROPFIND',
+            '/calendars/__uids__/cdaboo/',
+            '/principals/__uids__/cdaboo/'
+        )
+        response = yield self.rc.getResponseForRequest(request)
+        yield self.assertResponse(response, self.expected_response)
+
+        self.assertEqual(self.multiGets, [[
+            '/calendars/__uids__/cdaboo/',
+            '/calendars/__uids__/cdaboo/calendars/',
+        ]])
+        self.assertEqual(request.extendedLogItems["cache-tokens"], 4)
+        self.assertTrue("cache-ms" in request.extendedLogItems)
+
+    @inlineCallbacks
+    def test_staleResponseWhileRebuilding(self):
+        """
+        When an entry is out of date the first request rebuilds it, and other
+        requests get the out of date response if that is allowed.
+        """
+        self.patch(config, "ResponseCacheServeStale", True)
+        self.tokens['/calendars/__uids__/cdaboo/'] = 'uriToken1'
+
+        def _request():
+            return StubRequest(
+                'PROPFIND',
+                '/calendars/__uids__/cdaboo/',
+                '/principals/__uids__/cdaboo/'
+            )
+
+        leased = _request()
+        response = yield self.rc.getResponseForRequest(leased)
+        self.assertEqual(response, None)
+        self.assertTrue(leased.cacheLease)
+
+        request = _request()
+        response = yield self.rc.getResponseForRequest(request)
+        yield self.assertResponse(response, self.expected_response)
+        self.assertEqual(request.extendedLogItems["lease-stale"], 1)
+        self.assertEqual(request.cacheLease, None)
+        self.assertEqual(self.rc._leases.leaseStats()["stale"], 1)
+
+        # Only the holder releases the lease, after which the next request rebuilds the entry
+        yield self.rc.releaseLeaseForRequest(request)
+        request = _request()
+        response = yield self.rc.getResponseForRequest(request)
+        yield self.assertResponse(response, self.expected_response)
+        self.assertEqual(request.extendedLogItems["lease-stale"], 1)
+
+        yield self.rc.releaseLeaseForRequest(leased)
+        self.assertEqual(leased.cacheLease, None)
+        request = _request()
+        response = yield self.rc.getResponseForRequest(request)
+        self.assertEqual(response, None)
+        self.assertTrue(request.cacheLease)
+
+    @inlineCallbacks
+    def test_tokensForURIs(self):
+        """
+        L{MemcacheResponseCache._tokensForURIs} returns the token for each URI, with
+        L{None} for any that are not cached.
+        """
+        rc = MemcacheResponseCache(None, cachePool=self.memcacheStub)
+        yield self.memcacheStub.set('cacheToken:/calendars/__uids__/cdaboo/', 'uriToken0')
+        yield self.memcacheStub.set('cacheToken:/calendars/__uids__/cdaboo/calendars/', 'childToken0')
+
+        tokens = yield rc._tokensForURIs([
+            '/calendars/__uids__/cdaboo/',
+            '/calendars/__uids__/cdaboo/calendars/',
+            '/calendars/__uids__/cdaboo/tasks/',
+        ])
+        self.assertEqual(tokens, {
+            '/calendars/__uids__/cdaboo/': 'uriToken0',
+            '/calendars/__uids__/cdaboo/calendars/': 'childToken0',
+            '/calendars/__uids__/cdaboo/tasks/': None,
+        })
+
 
 class StubResponseCacheResource(object):
 
@@ -477,6 +569,10 @@ class StubResponseCacheResource(object):
         self.cache[request] = response
         return response
 
+    def releaseLeaseForRequest(self, request):
+        request.cacheLease = None
+        return succeed(None)
+
 
 class TestRenderMixin(object):
     davHeaders = ('foo',)
@@ -493,6 +589,16 @@ class TestCachingResource(PropfindCacheMixin, TestRenderMixin):
         self.response = response
 
 
+class TestFailingRenderMixin(object):
+
+    def renderHTTP(self, request):
+        raise ValueError("render failed")
+
+
+class TestFailingCachingResource(PropfindCacheMixin, TestFailingRenderMixin):
+    pass
+
+
 class TestCacheStoreNotifier(TestCase):
 
     @inlineCallbacks
@@ -577,3 +683,16 @@ class PropfindCacheMixinTests(TestCase):
         d.addCallback(_checkCache)
 
         return d
+
+    @inlineCallbacks
+    def test_releaseLeaseOnError(self):
+        """
+        Test that the cache lease held by a request is released if rendering fails.
+        """
+        request = StubRequest('PROPFIND', '/', '/')
+        request.resources['/'] = self.responseCache
+        request.cacheLease = "token"
+
+        d = maybeDeferred(TestFailingCachingResource().renderHTTP, request)
+        yield self.assertFailure(d, ValueError)
+        self.assertEqual(request.cacheLease, None)
@@ -14,6 +14,7 @@
 # limitations under the License.
 ##
 
+import hashlib
 import os
 from difflib import unified_diff
 import itertools
@@ -26,7 +27,7 @@ from twistedcaldav.dateops import normalizeForExpand
 from twistedcaldav.ical import Component, Property, InvalidICalendarDataError, \
     normalizeCUAddress, normalize_iCalStr, diff_iCalStrs
 from twistedcaldav.ical import iCalendarProductID
-from twistedcaldav.instance import InvalidOverriddenInstanceError
+from twistedcaldav.instance import InvalidOverriddenInstanceError, expansionCache
 import twistedcaldav.test.util
 from twistedcaldav.timezones import TimezoneException
 
@@ -8522,6 +8523,88 @@ END:VCALENDAR
         self.assertEquals(subComponent._parent, None)
         self.assertEquals(component._cachedCopy, None)  # cache is invalidated
 
+    def test_expansionCache(self):
+        """
+        Expanding the same recurring calendar data twice re-uses the cached expansion,
+        with the instances referring to the components of the second object.
+        """
+
+        data = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:12345-67890-1
+DTSTART:20071114T000000Z
+DTSTAMP:20080601T120000Z
+DURATION:PT1H
+RRULE:FREQ=DAILY;COUNT=5
+END:VEVENT
+BEGIN:VEVENT
+UID:12345-67890-1
+RECURRENCE-ID:20071115T000000Z
+DTSTART:20071115T010000Z
+DTSTAMP:20080601T120000Z
+DURATION:PT1H
+END:VEVENT
+END:VCALENDAR
+"""
+
+        self.patch(config, "ExpansionCacheSize", 10)
+        expansionCache.clear()
+        self.addCleanup(expansionCache.clear)
+
+        limit = DateTime(2008, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
+        md5 = hashlib.md5(data).hexdigest()
+
+        # Data not known to be stored is not cached
+        component1 = Component.fromString(data)
+        component1.expandTimeRanges(limit)
+        self.assertEqual(len(expansionCache), 0)
+
+        component1.setStoredMD5(md5)
+        instances1 = component1.expandTimeRanges(limit)
+        self.assertEqual(expansionCache.hits, 0)
+        self.assertEqual(len(expansionCache), 1)
+
+        component2 = Component.fromString(data)
+        component2.setStoredMD5(md5)
+        instances2 = component2.expandTimeRanges(limit)
+        self.assertEqual(expansionCache.hits, 1)
+        self.assertEqual(sorted(instances1.instances.keys()), sorted(instances2.instances.keys()))
+        for key in instances2:
+            instance1 = instances1[key]
+            instance2 = instances2[key]
+            self.assertEqual(instance1.start, instance2.start)
+            self.assertEqual(instance1.end, instance2.end)
+            self.assertEqual(instance1.overridden, instance2.overridden)
+            self.assertTrue(instance2.component in tuple(component2.subcomponents()))
+        self.assertEqual(instances1.limit, instances2.limit)
+
+        # Different window is a different entry
+        component2.expandTimeRanges(DateTime(2007, 11, 16, 0, 0, 0, tzid=Timezone.UTCTimezone))
+        self.assertEqual(expansionCache.hits, 1)
+        self.assertEqual(len(expansionCache), 2)
+
+        # A different instance limit is a different entry
+        maxAllowedInstances = config.MaxAllowedInstances
+        self.patch(config, "MaxAllowedInstances", 10)
+        component2.expandTimeRanges(limit)
+        self.assertEqual(expansionCache.hits, 1)
+        self.assertEqual(len(expansionCache), 3)
+        self.patch(config, "MaxAllowedInstances", maxAllowedInstances)
+
+        # Changed data is no longer cached
+        component2.mainComponent().addProperty(Property("SUMMARY", "Changed"))
+        self.assertEqual(component2.storedMD5(), None)
+        component2.expandTimeRanges(limit)
+        self.assertEqual(expansionCache.hits, 1)
+        self.assertEqual(len(expansionCache), 3)
+
+        # Cache size is bounded
+        self.patch(config, "ExpansionCacheSize", 2)
+        component1.expandTimeRanges(DateTime(2007, 11, 17, 0, 0, 0, tzid=Timezone.UTCTimezone))
+        self.assertEqual(len(expansionCache), 2)
+
     def test_hasDuplicateAlarms(self):
         """
         Test that L{Component.hasDuplicateAlarms} correctly detects, but does not fix, duplicate alarms.
@@ -0,0 +1,95 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Tests for L{twistedcaldav.memcacheclient} server selection.
+"""
+
+from twisted.trial.unittest import TestCase
+
+from twistedcaldav.memcacheclient import Client
+
+
+class ServerSelectionTests(TestCase):
+    """
+    Tests for how L{Client} maps keys to servers.
+    """
+
+    keys = ["key%d" % (i,) for i in range(10000)]
+
+    def servers(self, count):
+        return ["10.0.0.%d:11211" % (i + 1,) for i in range(count)]
+
+    def mapping(self, servers, ketama):
+        """
+        Map each key to the name of the first server that would be tried for it.
+        """
+        client = Client(servers, ketama=ketama)
+        return dict([(key, next(client._server_candidates(key)).name()) for key in self.keys])
+
+    def remapped(self, before, after, ketama):
+        """
+        Percentage of keys that map to a different server after the server list changes.
+        """
+        before = self.mapping(before, ketama)
+        after = self.mapping(after, ketama)
+        moved = len([key for key in self.keys if before[key] != after[key]])
+        return 100.0 * moved / len(self.keys)
+
+    def test_addServer(self):
+        """
+        Adding an eleventh server moves about a tenth of the keys with ketama,
+        and nearly all of them with modulo hashing.
+        """
+        ketama = self.remapped(self.servers(10), self.servers(11), True)
+        modulo = self.remapped(self.servers(10), self.servers(11), False)
+        self.assertTrue(ketama < 15, "ketama remapped %.1f%%" % (ketama,))
+        self.assertTrue(modulo > 80, "modulo remapped %.1f%%" % (modulo,))
+
+    def test_removeServer(self):
+        """
+        Removing a server with ketama only moves the keys that were on it.
+        """
+        servers = self.servers(10)
+        before = self.mapping(servers, True)
+        after = self.mapping(servers[:4] + servers[5:], True)
+        moved = [key for key in self.keys if before[key] != after[key]]
+        self.assertTrue(100.0 * len(moved) / len(self.keys) < 15)
+        self.assertEqual(set([before[key] for key in moved]), set(["10.0.0.5:11211"]))
+
+        modulo = self.remapped(servers, servers[:4] + servers[5:], False)
+        self.assertTrue(modulo > 80, "modulo remapped %.1f%%" % (modulo,))
+
+    def test_weights(self):
+        """
+        Servers get a share of the ketama ring in proportion to their weight.
+        """
+        mapping = self.mapping([("10.0.0.1:11211", 1), ("10.0.0.2:11211", 3)], True)
+        heavy = len([key for key in self.keys if mapping[key] == "10.0.0.2:11211"])
+        self.assertTrue(0.65 < float(heavy) / len(self.keys) < 0.85)
+
+    def test_candidates(self):
+        """
+        With ketama the servers to try for a key are each server once, starting
+        with the one the key maps to.
+        """
+        client = Client(self.servers(5), ketama=True)
+        candidates = [server.name() for server in client._server_candidates("akey")]
+        self.assertEqual(sorted(candidates), sorted(self.servers(5)))
+
+        # Explicit hash values are used as the ring position
+        first = next(client._server_candidates((12345, "akey")))
+        self.assertTrue(first is next(client._server_candidates((12345, "otherkey"))))
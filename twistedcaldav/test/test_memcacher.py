@@ -5,7 +5,10 @@
 Test the memcacher cache abstraction.
 """
 
+import os
+
 from twisted.internet.defer import inlineCallbacks
+from twisted.internet.task import Clock
 
 from twistedcaldav.config import config
 from twistedcaldav.memcacher import Memcacher
@@ -45,6 +48,28 @@ class MemcacherTestCase(TestCase):
             result = yield cacher.get("akey")
             self.assertEquals(None, result)
 
+    @inlineCallbacks
+    def test_getMultiple(self):
+
+        for processType in ("Single", "Combined",):
+            config.ProcessType = processType
+
+            cacher = Memcacher("testing", pickle=True)
+
+            result = yield cacher.set("akey", ["1", "2", "3", ])
+            self.assertTrue(result)
+            result = yield cacher.set("bkey", "bvalue")
+            self.assertTrue(result)
+
+            result = yield cacher.getMultiple(("akey", "bkey", "ckey",))
+            if isinstance(cacher._memcacheProtocol, Memcacher.nullCacher):
+                self.assertEquals(result, {"akey": None, "bkey": None, "ckey": None, })
+            else:
+                self.assertEquals(result, {"akey": ["1", "2", "3", ], "bkey": "bvalue", "ckey": None, })
+
+            result = yield cacher.getMultiple(())
+            self.assertEquals(result, {})
+
     @inlineCallbacks
     def test_delete(self):
 
@@ -200,6 +225,115 @@ class MemcacherTestCase(TestCase):
         value = yield cacher.get("*" * (Memcacher.MEMCACHE_KEY_LIMIT + 10), "*")
         self.assertEquals(value, (None, "",))
 
-        # Value limits
+        # Values over the limit are compressed or chunked
         result = yield cacher.set("*", "*" * (Memcacher.MEMCACHE_VALUE_LIMIT + 10))
-        self.assertFalse(result)
+        self.assertTrue(result)
+        value = yield cacher.get("*")
+        self.assertEquals(value, "*" * (Memcacher.MEMCACHE_VALUE_LIMIT + 10))
+
+    @inlineCallbacks
+    def test_compression(self):
+
+        config.ProcessType = "Single"
+        cacher = Memcacher("testing", key_normalization=False)
+
+        value = "abcdefgh" * (Memcacher.COMPRESS_THRESHOLD / 4)
+        result = yield cacher.set("akey", value)
+        self.assertTrue(result)
+        stored, _ignore_expires, _ignore_identifier, flags = cacher._memcacheProtocol._cache["testing:akey"]
+        self.assertEquals(flags, Memcacher.FLAG_COMPRESSED)
+        self.assertTrue(len(stored) < len(value))
+        self.assertEquals((yield cacher.get("akey")), value)
+
+        # Short values are stored as-is
+        result = yield cacher.set("bkey", "abcdefgh")
+        self.assertEquals(cacher._memcacheProtocol._cache["testing:bkey"][3], 0)
+
+    @inlineCallbacks
+    def test_chunking(self):
+
+        config.ProcessType = "Single"
+        cacher = Memcacher("testing", pickle=True)
+
+        # Random data does not compress
+        value = {"data": os.urandom(Memcacher.CHUNK_SIZE * 2 + 10)}
+        result = yield cacher.set("akey", value)
+        self.assertTrue(result)
+        self.assertEquals((yield cacher.get("akey")), value)
+        self.assertEquals((yield cacher.getMultiple(("akey", "bkey",))), {"akey": value, "bkey": None})
+
+        # A re-write uses new chunks
+        keys = set(cacher._memcacheProtocol._cache.keys())
+        value = {"data": os.urandom(Memcacher.CHUNK_SIZE * 2 + 10)}
+        result = yield cacher.set("akey", value)
+        self.assertTrue(result)
+        self.assertEquals(len(set(cacher._memcacheProtocol._cache.keys()) - keys), 3)
+        self.assertEquals((yield cacher.get("akey")), value)
+
+        # A missing chunk is a miss
+        chunkKey = sorted(set(cacher._memcacheProtocol._cache.keys()) - keys)[0]
+        yield cacher._memcacheProtocol.delete(chunkKey)
+        self.assertEquals((yield cacher.get("akey")), None)
+        self.assertEquals((yield cacher.getMultiple(("akey",))), {"akey": None})
+
+    @inlineCallbacks
+    def test_lease(self):
+
+        config.ProcessType = "Single"
+        cacher = Memcacher("testing")
+
+        token = yield cacher.acquireLease("akey")
+        self.assertNotEqual(token, None)
+        self.assertEquals((yield cacher.acquireLease("akey")), None)
+        self.assertNotEqual((yield cacher.acquireLease("bkey")), None)
+        yield cacher.releaseLease("akey", token)
+        token = yield cacher.acquireLease("akey")
+        self.assertNotEqual(token, None)
+        self.assertEquals(cacher.leaseStats()["granted"], 3)
+
+        # Leases expire in case the holder never stores the value
+        cacher._memcacheProtocol.advanceClock(config.CacheLeases.LeaseSeconds)
+        newToken = yield cacher.acquireLease("akey")
+        self.assertNotEqual(newToken, None)
+
+        # The previous holder does not release the new lease
+        yield cacher.releaseLease("akey", token)
+        self.assertEquals((yield cacher.acquireLease("akey")), None)
+        yield cacher.releaseLease("akey", newToken)
+        self.assertNotEqual((yield cacher.acquireLease("akey")), None)
+
+    @inlineCallbacks
+    def test_leaseOrWait(self):
+
+        config.ProcessType = "Single"
+        cacher = Memcacher("testing")
+        clock = Clock()
+
+        # The first caller gets the lease, then others are served the stale value
+        result, token = yield cacher.leaseOrWait("akey", lambda: cacher.get("akey"), stale="old", reactor=clock)
+        self.assertEquals(result, None)
+        self.assertNotEqual(token, None)
+        result = yield cacher.leaseOrWait("akey", lambda: cacher.get("akey"), stale="old", reactor=clock)
+        self.assertEquals(result, ("old", None,))
+
+        # Or wait for the new value
+        d = cacher.leaseOrWait("akey", lambda: cacher.get("akey"), reactor=clock)
+        clock.advance(config.CacheLeases.RetrySeconds)
+        self.assertFalse(d.called)
+        yield cacher.set("akey", "new")
+        clock.advance(config.CacheLeases.RetrySeconds)
+        self.assertEquals((yield d), ("new", None,))
+
+        # Until they give up
+        logItems = {}
+        result, token = yield cacher.leaseOrWait("bkey", lambda: cacher.get("bkey"), reactor=clock, logItems=logItems)
+        self.assertEquals(result, None)
+        self.assertNotEqual(token, None)
+        self.assertEquals(logItems, {"lease-granted": 1})
+        logItems = {}
+        d = cacher.leaseOrWait("bkey", lambda: cacher.get("bkey"), reactor=clock, logItems=logItems)
+        clock.pump([config.CacheLeases.RetrySeconds] * (int(config.CacheLeases.WaitSeconds / config.CacheLeases.RetrySeconds) + 2))
+        self.assertEquals((yield d), (None, None,))
+        self.assertEquals(logItems, {"lease-wait": 1, "lease-timeout": 1})
+
+        self.assertEquals(cacher.leaseStats(), {"granted": 2, "waits": 2, "wait-timeouts": 1, "stale": 1})
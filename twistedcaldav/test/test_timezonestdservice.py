@@ -14,6 +14,8 @@
 # limitations under the License.
 ##
 
+from pycalendar.datetime import DateTime
+from twistedcaldav.ical import tzexpandlocal
 from twistedcaldav.timezones import TimezoneCache
 from twistedcaldav.timezonestdservice import TimezoneInfo, \
     PrimaryTimezoneDatabase
@@ -149,3 +151,47 @@ class TestPrimaryTimezoneDatabase (twistedcaldav.test.util.TestCase):
         tz1 = db.getTimezone("US/Eastern")
         self.assertTrue(str(tz1).find("VTIMEZONE") != -1)
         self.assertTrue(str(tz1).find("TZID:US/Eastern") != -1)
+
+    def testIndexEntry(self):
+
+        xmlfile = self.mktemp()
+        db = PrimaryTimezoneDatabase(TimezoneCache.getDBPath(), xmlfile)
+        db.createNewDatabase()
+
+        self.assertEqual(db.getIndexEntry("Bogus"), None)
+
+        entry = db.getIndexEntry("America/New_York")
+        self.assertTrue(db.getIndexEntry("America/New_York") is entry)
+        data, etag = entry.getText()
+        self.assertTrue("TZID:America/New_York" in data)
+        self.assertEqual(entry.getText(), (data, etag,))
+
+        # Rebuilt when the database changes
+        db.dtstamp = DateTime.getNowUTC().getXMLText()
+        self.assertFalse(db.getIndexEntry("America/New_York") is entry)
+
+    def testIndexExpand(self):
+        """
+        Expansions answered from the precomputed table match L{tzexpandlocal}.
+        """
+
+        xmlfile = self.mktemp()
+        db = PrimaryTimezoneDatabase(TimezoneCache.getDBPath(), xmlfile)
+        db.createNewDatabase()
+
+        for tzid in ("America/New_York", "US/Eastern", "Asia/Tokyo", "Australia/Sydney",):
+            entry = db.getIndexEntry(tzid)
+            for start, end in (
+                ("2010-01-01T00:00:00Z", "2012-01-01T00:00:00Z"),
+                ("2010-03-01T00:00:00Z", "2010-12-01T00:00:00Z"),
+                ("2010-04-01T00:00:00Z", "2010-05-01T00:00:00Z"),
+                ("1960-01-01T00:00:00Z", "1975-01-01T00:00:00Z"),
+            ):
+                start = DateTime.parseText(start, fullISO=True)
+                end = DateTime.parseText(end, fullISO=True)
+                expected = tzexpandlocal(entry.calendar, start.duplicate(), end, utc_onset=True)
+                self.assertEqual(
+                    [(onset.getText(), offsetFrom, offsetTo) for onset, offsetFrom, offsetTo, _ignore_name in entry.expand(start, end)],
+                    [(onset.getText(), offsetFrom, offsetTo) for onset, offsetFrom, offsetTo, _ignore_name in expected],
+                    "%s %s %s" % (tzid, start, end,),
+                )
@@ -32,7 +32,7 @@ from txweb2.dav.noneprops import NonePropertyStore
 from txweb2.dav.util import joinURL
 from txweb2.http import HTTPError, JSONResponse, StatusResponse
 from txweb2.http import Response
-from txweb2.http_headers import MimeType
+from txweb2.http_headers import ETag, MimeType
 from txweb2.stream import MemoryStream
 from txdav.xml import element as davxml
 
@@ -54,7 +54,9 @@ from twistedcaldav.xmlutil import addSubElement
 from pycalendar.icalendar.calendar import Calendar
 from pycalendar.datetime import DateTime
 from pycalendar.exceptions import InvalidData
+from pycalendar.timezone import Timezone
 
+from bisect import bisect_left
 import hashlib
 import itertools
 import json
@@ -80,7 +82,6 @@ class TimezoneStdServiceResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithou
         DAVResource.__init__(self, principalCollections=parent.principalCollections())
 
         self.parent = parent
-        self.expandcache = {}
         self.primary = True
         self.info_source = None
 
@@ -124,8 +125,11 @@ class TimezoneStdServiceResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithou
         self.info_source = "Secondary"
         self.primary = False
 
+    @inlineCallbacks
     def onStartup(self):
-        return self.timezones.onStartup()
+        yield self.timezones.onStartup()
+        if config.TimezoneService.PreloadIndex:
+            self.timezones.preloadIndex()
 
     def deadProperties(self):
         if not hasattr(self, "_dead_properties"):
@@ -353,7 +357,14 @@ class TimezoneStdServiceResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithou
             "dtstamp": self.timezones.dtstamp,
             "timezones": timezones,
         }
-        return JSONResponse(responsecode.OK, result, pretty=config.TimezoneService.PrettyPrintJSON)
+        response = JSONResponse(responsecode.OK, result, pretty=config.TimezoneService.PrettyPrintJSON)
+
+        # The list only changes along with the database dtstamp and is the
+        # same for every user, so give it a strong ETag and mark it public,
+        # which also lets a compressed copy of it be re-used
+        response.headers.setHeader("etag", ETag(hashlib.md5("%s:%s" % (self.timezones.dtstamp, changedsince or "",)).hexdigest()))
+        response.headers.setHeader("cache-control", {"public": None})
+        return response
 
     def actionGet(self, request, tzid):
         """
@@ -367,15 +378,16 @@ class TimezoneStdServiceResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithou
         if accepted_type is None:
             self.problemReport("invalid-format", "Accept header does not match available media types", responsecode.NOT_ACCEPTABLE)
 
-        calendar = self.timezones.getTimezone(tzid)
-        if calendar is None:
+        entry = self.timezones.getIndexEntry(tzid)
+        if entry is None:
             self.problemReport("tzid-not-found", "Time zone identifier not found", responsecode.NOT_FOUND)
 
-        tzdata = calendar.getText(format=accepted_type if accepted_type != "text/plain" else None)
+        tzdata, etag = entry.getText(accepted_type if accepted_type != "text/plain" else None)
 
         response = Response()
         response.stream = MemoryStream(tzdata)
         response.headers.setHeader("content-type", MimeType.fromString("%s; charset=utf-8" % (accepted_type,)))
+        response.headers.setHeader("etag", etag)
         return response
 
     def actionExpand(self, request, tzid):
@@ -414,15 +426,11 @@ class TimezoneStdServiceResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithou
             if end <= start:
                 self.problemReport("invalid-end", "Invalid end request-URI query parameter value - earlier than start", responsecode.BAD_REQUEST)
 
-        tzdata = self.timezones.getTimezone(tzid)
-        if tzdata is None:
+        entry = self.timezones.getIndexEntry(tzid)
+        if entry is None:
             self.problemReport("tzid-not-found", "Time zone identifier not found", responsecode.NOT_FOUND)
 
-        # Now do the expansion (but use a cache to avoid re-calculating TZs)
-        observances = self.expandcache.get((tzid, start, end), None)
-        if observances is None:
-            observances = tzexpandlocal(tzdata, start, end, utc_onset=True)
-            self.expandcache[(tzid, start, end)] = observances
+        observances = entry.expand(start, end)
 
         # Turn into JSON
         result = {
@@ -437,7 +445,11 @@ class TimezoneStdServiceResource (ReadOnlyNoCopyResourceMixIn, DAVResourceWithou
                 } for onset, utc_offset_from, utc_offset_to, name in observances
             ],
         }
-        return JSONResponse(responsecode.OK, result, pretty=config.TimezoneService.PrettyPrintJSON)
+        response = JSONResponse(responsecode.OK, result, pretty=config.TimezoneService.PrettyPrintJSON)
+        response.headers.setHeader("etag", ETag(hashlib.md5("%s:%s:%s:%s" % (
+            entry.md5, self.timezones.dtstamp, start.getText(), end.getText(),
+        )).hexdigest()))
+        return response
 
     def actionFind(self, request):
         """
@@ -543,6 +555,64 @@ class TimezoneInfo(object):
         xmlutil.addSubElement(node, "md5", self.md5)
 
 
+class TimezoneIndexEntry(object):
+    """
+    Everything needed to answer requests for one timezone from memory: the
+    parsed zone, its serialized forms, and a table of its observances over a
+    fixed range of years that expand requests are answered from.
+    """
+
+    def __init__(self, tzid, calendar, dtstamp, startYear, endYear):
+        self.tzid = tzid
+        self.calendar = calendar
+        self.dtstamp = dtstamp
+        self.rangeStart = DateTime(startYear, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
+        self.rangeEnd = DateTime(endYear + 1, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
+        self.md5 = hashlib.md5(calendar.getText()).hexdigest()
+        self._text = {}
+        self._observances = None
+        self._onsets = None
+
+    def getText(self, format=None):
+        """
+        Serialize the zone.
+
+        @return: C{tuple} of the data and its L{ETag}
+        """
+        if format not in self._text:
+            data = self.calendar.getText(format=format)
+            self._text[format] = (data, ETag(hashlib.md5(data).hexdigest()),)
+        return self._text[format]
+
+    def expand(self, start, end):
+        """
+        Same result as L{tzexpandlocal} with C{utc_onset=True}, but taken from
+        the precomputed table when C{start} and C{end} are inside its range.
+        """
+        if start < self.rangeStart or end > self.rangeEnd:
+            return tzexpandlocal(self.calendar, start, end, utc_onset=True)
+
+        if self._observances is None:
+            self._observances = tzexpandlocal(self.calendar, self.rangeStart.duplicate(), self.rangeEnd, utc_onset=True)
+            self._onsets = [onset.getPosixTime() for onset, _ignore_from, _ignore_to, _ignore_name in self._observances]
+
+        # The first entry of the table is always at the start of the range
+        # so there is always one in effect at or before start
+        first = bisect_left(self._onsets, start.getPosixTime())
+        last = bisect_left(self._onsets, end.getPosixTime())
+        results = self._observances[first:last]
+
+        start = start.duplicate()
+        start.setDateOnly(False)
+        if results:
+            if start != results[0][0]:
+                results.insert(0, (start, results[0][1], results[0][1], results[0][3],))
+        else:
+            _ignore_onset, _ignore_from, offset, name = self._observances[max(first - 1, 0)]
+            results.append((start, offset, offset, name,))
+        return results
+
+
 class CommonTimezoneDatabase(object):
     """
     Maintains the database of timezones read from an XML file.
@@ -554,6 +624,7 @@ class CommonTimezoneDatabase(object):
         self.dtstamp = None
         self.timezones = {}
         self.aliases = {}
+        self.index = {}
 
     def onStartup(self):
         return succeed(None)
@@ -617,6 +688,39 @@ class CommonTimezoneDatabase(object):
 
         return calendar
 
+    def getIndexEntry(self, tzid):
+        """
+        Get the in-memory L{TimezoneIndexEntry} for a timezone, building it
+        if needed. Entries are rebuilt once the database dtstamp changes.
+
+        @return: the L{TimezoneIndexEntry} or C{None} if the timezone is unknown
+        """
+        entry = self.index.get(tzid)
+        if entry is None or entry.dtstamp != self.dtstamp:
+            calendar = self.getTimezone(tzid)
+            if calendar is None:
+                return None
+            entry = TimezoneIndexEntry(
+                tzid,
+                calendar,
+                self.dtstamp,
+                config.TimezoneService.ExpandStartYear,
+                config.TimezoneService.ExpandEndYear,
+            )
+            self.index[tzid] = entry
+        return entry
+
+    def preloadIndex(self):
+        """
+        Build the index entries, including the observance tables, for every
+        timezone and alias up front.
+        """
+        for tzid in itertools.chain(self.timezones.keys(), self.aliases.keys()):
+            entry = self.getIndexEntry(tzid)
+            if entry is not None:
+                entry.expand(entry.rangeStart.duplicate(), entry.rangeEnd)
+        log.info("Preloaded {n} timezones", n=len(self.index))
+
     def _dumpTZs(self):
 
         _ignore, root = xmlutil.newElementTreeWithRoot("timezones")
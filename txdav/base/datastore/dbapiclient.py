@@ -24,6 +24,7 @@ from twext.python.filepath import CachingFilePath
 from txdav.common.icommondatastore import InternalDataStoreError
 
 import datetime
+import time
 
 import pg8000 as postgres
 import six
@@ -79,7 +80,25 @@ class DiagnosticCursorWrapper(object):
         #            "Really executing SQL %r in thread %r\n" %
         #            ((sql % tuple(args)), thread.get_ident())
         #        )
+        statements = self.connectionWrapper.preparedStatements
+        if statements is None:
+            self.realCursor.execute(sql, args)
+            return
+
+        # The driver keys its prepared statements on the SQL and the types of
+        # its parameters
+        key = (sql, self.connectionWrapper.realConnection.make_params(args or ()),)
+        prepared = key in statements
+        start = time.time()
         self.realCursor.execute(sql, args)
+        recordPrepared = getattr(args, "recordPrepared", None)
+        if recordPrepared is not None:
+            recordPrepared(prepared, time.time() - start)
+        if sql.split(None, 1)[0].upper() in ("ALTER", "CREATE",):
+            # The driver discards its prepared statements after a schema change
+            statements.clear()
+        else:
+            statements.add(key)
 
     def close(self):
         self.realCursor.close()
@@ -181,6 +200,10 @@ class DiagnosticConnectionWrapper(object):
         self.label = label
         self.state = 'idle (start)'
 
+        # The SQL and parameter types the driver has prepared on this
+        # connection, for drivers that prepare every statement themselves
+        self.preparedStatements = None
+
     def cursor(self):
         return self.wrapper(self.realConnection.cursor(), self)
 
@@ -436,3 +459,8 @@ def pg8000Preflight(connection, **kwargs):
     connection.realConnection.pg_types[1042] = (postgres.core.FC_BINARY, my_text_recv)
     connection.realConnection.pg_types[1043] = (postgres.core.FC_BINARY, my_text_recv)
     connection.realConnection.pg_types[2275] = (postgres.core.FC_BINARY, my_text_recv)
+
+    # pg8000 runs every statement as a named prepared statement, which it reuses
+    # when the same SQL is run again with the same parameter types on the
+    # connection
+    connection.preparedStatements = set()
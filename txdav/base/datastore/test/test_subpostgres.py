@@ -26,6 +26,7 @@ from twisted.trial.unittest import TestCase
 from twext.python.filepath import CachingFilePath
 
 from txdav.base.datastore.subpostgres import PostgresService
+from txdav.base.datastore.util import StatementArgs
 from twisted.internet.defer import inlineCallbacks, Deferred
 from twisted.application.service import Service
 
@@ -135,3 +136,66 @@ class SubprocessStartup(TestCase):
         cursor.execute("select * from test_dummy_table")
         values = cursor.fetchall()
         self.assertEquals(map(list, values), [["dummy"]])
+
+    @inlineCallbacks
+    def test_preparedStatements(self):
+        """
+        Running the same SQL with the same parameter types again on a connection
+        reuses the statement the driver prepared the first time, until the schema
+        changes.
+        """
+
+        test = self
+
+        class SimpleService3(Service):
+
+            instances = []
+            ready = Deferred()
+
+            def __init__(self, connectionFactory, storageService):
+                self.connection = connectionFactory()
+                test.addCleanup(self.connection.close)
+                self.instances.append(self)
+
+            def startService(self):
+                self.ready.callback(None)
+
+        svc = PostgresService(
+            CachingFilePath("postgres_3.pgdb"),
+            SimpleService3,
+            "create table TEST_DUMMY_TABLE (stub varchar)",
+            databaseName="dummy_db",
+            testMode=True
+        )
+        svc.startService()
+        self.addCleanup(svc.stopService)
+        yield SimpleService3.ready
+        connection = SimpleService3.instances[0].connection
+        cursor = connection.cursor()
+        self.addCleanup(cursor.close)
+        recorded = []
+
+        def execute(sql, args):
+            cursor.execute(sql, StatementArgs(args, lambda prepared, elapsed: recorded.append(prepared)))
+
+        for stub in ("one", "two", "three",):
+            execute("insert into test_dummy_table values (%s)", [stub])
+        execute("select * from test_dummy_table where stub = %s", ["two"])
+        self.assertEquals(map(list, cursor.fetchall()), [["two"]])
+        execute("select * from test_dummy_table where stub = %s", ["three"])
+        self.assertEquals(map(list, cursor.fetchall()), [["three"]])
+        self.assertEquals(recorded, [False, True, True, False, True])
+
+        # The same SQL with different parameter types is prepared again
+        del recorded[:]
+        execute("select %s", ["one"])
+        execute("select %s", [1])
+        execute("select %s", [2])
+        self.assertEquals(recorded, [False, False, True])
+
+        del recorded[:]
+        cursor.execute("create table TEST_DUMMY_TABLE_2 (stub varchar)")
+        self.assertEquals(connection.preparedStatements, set())
+        execute("select * from test_dummy_table where stub = %s", ["one"])
+        self.assertEquals(map(list, cursor.fetchall()), [["one"]])
+        self.assertEquals(recorded, [False])
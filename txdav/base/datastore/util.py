@@ -55,6 +55,26 @@ class cached(object):
         return inner
 
 
+class StatementArgs(list):
+    """
+    The arguments (binds) for an SQL statement, carrying a callback used by the
+    database connection to report whether the statement reused a server-side
+    prepared statement. Statements run in the connection threads, so this is how
+    the result gets back to the statistics of the transaction that ran it.
+    """
+
+    def __init__(self, args, recordPrepared):
+        """
+        @param args: the arguments (binds) to the SQL statement
+        @type args: C{list}
+        @param recordPrepared: called with whether the statement was already
+            prepared on its connection and the time taken in seconds
+        @type recordPrepared: C{callable}
+        """
+        super(StatementArgs, self).__init__(args)
+        self.recordPrepared = recordPrepared
+
+
 class QueryCacher(Memcacher):
     """
     A Memcacher for the object-with-name query (more to come)
@@ -812,6 +812,9 @@ class Attachment(FileMetaDataMixin):
     def retrieve(self, protocol):
         return AttachmentRetrievalTransport(self._path).start(protocol)
 
+    def retrieveFile(self):
+        return self._path.open()
+
     @property
     def _path(self):
         return self._dropboxPath.child(self.name())
@@ -29,16 +29,29 @@ __all__ = [
 ]
 
 
+# Text-match expressions for each match-type, normal and negated
+_textmatchExpressions = {
+    "equals": (expression.isExpression, expression.isnotExpression),
+    "contains": (expression.containsExpression, expression.notcontainsExpression),
+    "starts-with": (expression.startswithExpression, expression.notstartswithExpression),
+    "ends-with": (expression.endswithExpression, expression.notendswithExpression),
+}
+
+
 # SQL Index column (field) names
 
-def buildExpression(filter, fields):
+def buildExpression(filter, fields, properties=()):
     """
     Convert the supplied calendar-query into an expression tree.
 
     @param filter: the L{Filter} for the calendar-query to convert.
+    @param properties: names of the properties held in the property index.
+    @type properties: C{list} of C{str}
     @return: a L{baseExpression} for the expression tree.
     """
 
+    properties = frozenset([name.upper() for name in properties])
+
     # Lets assume we have a valid filter from the outset.
 
     # Top-level filter contains exactly one comp-filter element
@@ -55,12 +68,12 @@ def buildExpression(filter, fields):
         for _ignore in [x for x in vcalfilter.filters if not isinstance(x, ComponentFilter)]:
             raise ValueError
 
-        return compfilterListExpression(vcalfilter.filters, fields, logical)
+        return compfilterListExpression(vcalfilter.filters, fields, properties, logical)
     else:
         return expression.allExpression()
 
 
-def compfilterListExpression(compfilters, fields, logical):
+def compfilterListExpression(compfilters, fields, properties, logical):
     """
     Create an expression for a list of comp-filter elements.
 
@@ -69,12 +82,12 @@ def compfilterListExpression(compfilters, fields, logical):
     """
 
     if len(compfilters) == 1:
-        return compfilterExpression(compfilters[0], fields)
+        return compfilterExpression(compfilters[0], fields, properties)
     else:
-        return logical([compfilterExpression(c, fields) for c in compfilters])
+        return logical([compfilterExpression(c, fields, properties) for c in compfilters])
 
 
-def compfilterExpression(compfilter, fields):
+def compfilterExpression(compfilter, fields, properties=()):
     """
     Create an expression for a single comp-filter element.
 
@@ -101,10 +114,23 @@ def compfilterExpression(compfilter, fields):
         start, end, startfloat, endfloat = getTimerangeArguments(compfilter.qualifier)
         expressions.append(expression.timerangeExpression(start, end, startfloat, endfloat))
 
-    # Handle properties - we can only do UID right now
+    # Handle properties - UID and those in the property index
+    propfilters = [x for x in compfilter.filters if isinstance(x, PropertyFilter)]
+
+    # The property index records properties for the resource as a whole, not for each
+    # component, so we can only use it when matching any component is the same as
+    # matching the resource - i.e. not alongside a time-range or another indexed
+    # property that the same component must also match (UID is the same in all components)
+    indexed = [p for p in propfilters if p.filter_name != "UID"]
+    if indexed and (
+        compfilter.qualifier is not None or
+        len(indexed) > 1 and compfilter.filter_test == "allof"
+    ):
+        raise ValueError
+
     props = []
-    for p in [x for x in compfilter.filters if isinstance(x, PropertyFilter)]:
-        props.append(propfilterExpression(p, fields))
+    for p in propfilters:
+        props.append(propfilterExpression(p, fields, properties))
     if len(props) > 1:
         propsExpression = logical(props)
     elif len(props) == 1:
@@ -135,7 +161,7 @@ def compfilterExpression(compfilter, fields):
     return expression.andExpression(expressions)
 
 
-def propfilterExpression(propfilter, fields):
+def propfilterExpression(propfilter, fields, properties=()):
     """
     Create an expression for a single prop-filter element.
 
@@ -143,8 +169,12 @@ def propfilterExpression(propfilter, fields):
     @return: a L{baseExpression} for the expression tree.
     """
 
-    # Only handle UID right now
+    # Only handle UID, organizers/attendees and indexed properties
     if propfilter.filter_name != "UID":
+        if propfilter.filter_name.upper() in ("ORGANIZER", "ATTENDEE") and "CUA" in fields:
+            return attendeePropfilterExpression(propfilter, fields)
+        elif propfilter.filter_name.upper() in properties:
+            return indexedPropfilterExpression(propfilter, fields)
         raise ValueError
 
     # Handle is-not-defined case
@@ -162,14 +192,7 @@ def propfilterExpression(propfilter, fields):
     # Handle text-match
     tm = None
     if propfilter.qualifier and isinstance(propfilter.qualifier, TextMatch):
-        if propfilter.qualifier.match_type == "equals":
-            tm = expression.isnotExpression if propfilter.qualifier.negate else expression.isExpression
-        elif propfilter.qualifier.match_type == "contains":
-            tm = expression.notcontainsExpression if propfilter.qualifier.negate else expression.containsExpression
-        elif propfilter.qualifier.match_type == "starts-with":
-            tm = expression.notstartswithExpression if propfilter.qualifier.negate else expression.startswithExpression
-        elif propfilter.qualifier.match_type == "ends-with":
-            tm = expression.notendswithExpression if propfilter.qualifier.negate else expression.endswithExpression
+        tm = _textmatchExpressions[propfilter.qualifier.match_type][propfilter.qualifier.negate]
         tm = tm(fields[propfilter.filter_name], propfilter.qualifier.text, propfilter.qualifier.caseless)
 
     # Handle embedded parameters - we do not right now as our Index does not handle them
@@ -194,6 +217,105 @@ def propfilterExpression(propfilter, fields):
         return None
 
 
+def indexedPropfilterExpression(propfilter, fields):
+    """
+    Create an expression for a single prop-filter element on a property that is
+    in the property index. Only tests that the index can answer exactly are
+    supported: presence of the property and caseless text-match.
+
+    @param propfilter: the L{PropertyFilter} element.
+    @return: a L{baseExpression} for the expression tree.
+    """
+
+    # is-not-defined has to hold for a single component, which the index cannot tell
+    if not propfilter.defined:
+        raise ValueError
+
+    # Parameters are not indexed, and time-range is not valid on indexed (text) properties
+    if propfilter.filters or propfilter.qualifier and not isinstance(propfilter.qualifier, TextMatch):
+        raise ValueError
+
+    name = propfilter.filter_name.upper()
+    textmatch = propfilter.qualifier
+    if textmatch is None:
+        return expression.propertyExpression(name, None)
+
+    return expression.propertyExpression(name, indexedTextmatchExpression(textmatch, fields["PROPERTY"]))
+
+
+def attendeePropfilterExpression(propfilter, fields):
+    """
+    Create an expression for a single ORGANIZER or ATTENDEE prop-filter element,
+    using the organizer/attendee index. Only tests that the index can answer
+    exactly are supported: presence of the property, caseless text-match on its
+    value and, for ATTENDEE, tests on the PARTSTAT parameter.
+
+    @param propfilter: the L{PropertyFilter} element.
+    @return: a L{baseExpression} for the expression tree.
+    """
+
+    # is-not-defined has to hold for a single component, which the index cannot tell
+    if not propfilter.defined:
+        raise ValueError
+
+    if propfilter.qualifier and not isinstance(propfilter.qualifier, TextMatch):
+        raise ValueError
+
+    organizer = propfilter.filter_name.upper() == "ORGANIZER"
+
+    # Only PARTSTAT on ATTENDEE is indexed
+    params = []
+    for paramfilter in propfilter.filters:
+        if organizer or paramfilter.filter_name.upper() != "PARTSTAT":
+            raise ValueError
+        if not paramfilter.defined:
+            params.append(expression.isExpression(fields["PARTSTAT"], None, True))
+        elif paramfilter.qualifier is None:
+            params.append(expression.isnotExpression(fields["PARTSTAT"], None, True))
+        else:
+            # A missing PARTSTAT never matches, even when negated, which is also
+            # how SQL treats comparisons with NULL
+            params.append(indexedTextmatchExpression(paramfilter.qualifier, fields["PARTSTAT"]))
+
+    # The property value must match and the parameter tests are combined as the filter says
+    logical = expression.andExpression if propfilter.filter_test == "allof" else expression.orExpression
+    tests = []
+    if propfilter.qualifier is not None:
+        tests.append(indexedTextmatchExpression(propfilter.qualifier, fields["CUA"]))
+    if len(params) > 1:
+        tests.append(logical(params))
+    elif len(params) == 1:
+        tests.append(params[0])
+
+    if len(tests) > 1:
+        test = expression.andExpression(tests)
+    elif len(tests) == 1:
+        test = tests[0]
+    else:
+        test = None
+    return expression.attendeeExpression(organizer, test)
+
+
+def indexedTextmatchExpression(textmatch, field):
+    """
+    Create an expression for a text-match against a lower-cased value in one of
+    the indexes.
+
+    @param textmatch: the L{TextMatch} element.
+    @param field: the index column to match against.
+    @return: a L{baseExpression} for the expression tree.
+    """
+
+    # Indexed values are lower-cased, and the LIKE wildcard/escape characters would
+    # need escaping in the pattern
+    text = unicode(textmatch.text, "utf-8").lower().encode("utf-8")
+    if not textmatch.caseless or textmatch.match_type != "equals" and any([c in text for c in "%_\\"]):
+        raise ValueError
+
+    tm = _textmatchExpressions[textmatch.match_type][textmatch.negate]
+    return tm(field, text, True)
+
+
 def getTimerangeArguments(timerange):
     """
     Get start/end and floating start/end (adjusted for timezone offset) values from the
@@ -14,7 +14,7 @@
 # limitations under the License.
 ##
 
-from twext.enterprise.dal.syntax import Select, Coalesce
+from twext.enterprise.dal.syntax import Select, Coalesce, Parameter
 
 from txdav.common.datastore.query import expression
 from txdav.common.datastore.query.generator import SQLQueryGenerator
@@ -33,6 +33,8 @@ class CalDAVSQLQueryGenerator(SQLQueryGenerator):
 
     _timerange = schema.TIME_RANGE
     _peruser = schema.PERUSER
+    _property = schema.CALENDAR_OBJECT_PROPERTY
+    _attendee = schema.CALENDAR_OBJECT_ATTENDEE
 
     def __init__(self, expr, collection, whereid, userid=None, freebusy=False):
         """
@@ -41,6 +43,10 @@ class CalDAVSQLQueryGenerator(SQLQueryGenerator):
         @type expr: L{expression}
         @param collection: the resource targeted by the query
         @type collection: L{CommonHomeChild}
+        @param whereid: resource-id of the calendar to restrict the query to, or a L{list} of
+            resource-ids to query several calendars at once - in that case the calendar resource-id
+            is returned as an additional, last, column in each row
+        @type whereid: C{int} or L{list} of C{int}
         @param userid: user for whom query is being done - query will be scoped to that user's privileges and their per-user data
         @type userid: C{str}
         @param freebusy: whether or not a freebusy query is being done - if it is, additional time range and peruser information is returned
@@ -50,6 +56,7 @@ class CalDAVSQLQueryGenerator(SQLQueryGenerator):
         self.userid = userid if userid else "."
         self.freebusy = freebusy
         self.usedtimerange = False
+        self.multiple = isinstance(whereid, (list, tuple,))
 
     def generate(self):
         """
@@ -75,11 +82,16 @@ class CalDAVSQLQueryGenerator(SQLQueryGenerator):
                 self._timerange.TRANSPARENT,
                 self._peruser.TRANSPARENT,
             ])
+        if self.multiple:
+            columns.append(obj.CALENDAR_RESOURCE_ID)
 
         # For SQL data DB we need to restrict the query to just the targeted calendar resource-id if provided
         if self.whereid:
 
-            test = expression.isExpression(obj.CALENDAR_RESOURCE_ID, self.whereid, True)
+            if self.multiple:
+                test = expression.inExpression(obj.CALENDAR_RESOURCE_ID, self.whereid, True)
+            else:
+                test = expression.isExpression(obj.CALENDAR_RESOURCE_ID, self.whereid, True)
 
             # Since timerange expression already have the calendar resource-id test in them, do not
             # add the additional term to those. When the additional term is added, add it as the first
@@ -128,7 +140,12 @@ class CalDAVSQLQueryGenerator(SQLQueryGenerator):
         where = self.generateExpression(self.expression)
 
         if self.usedtimerange:
-            where = where.And(self._timerange.CALENDAR_OBJECT_RESOURCE_ID == obj.RESOURCE_ID).And(self._timerange.CALENDAR_RESOURCE_ID == self.whereid)
+            if self.multiple:
+                argname = self.addArgument(self.whereid)
+                calendarTest = self._timerange.CALENDAR_RESOURCE_ID.In(Parameter(argname, len(self.whereid)))
+            else:
+                calendarTest = self._timerange.CALENDAR_RESOURCE_ID == self.whereid
+            where = where.And(self._timerange.CALENDAR_OBJECT_RESOURCE_ID == obj.RESOURCE_ID).And(calendarTest)
 
         # Set of tables depends on use of timespan and fb use
         if self.usedtimerange:
@@ -194,11 +211,43 @@ class CalDAVSQLQueryGenerator(SQLQueryGenerator):
                 )
             self.usedtimerange = True
 
+        # indexed property
+        elif isinstance(expr, expression.propertyExpression):
+            partial = self._indexSubquery(self._property, self._property.NAME == expr.name, expr.test)
+
+        # organizer/attendee
+        elif isinstance(expr, expression.attendeeExpression):
+            partial = self._indexSubquery(self._attendee, self._attendee.ORGANIZER == expr.organizer, expr.test)
+
         else:
             partial = super(CalDAVSQLQueryGenerator, self).generateExpression(expr)
 
         return partial
 
+    def _indexSubquery(self, table, where, test):
+        """
+        Generate a test for the resource having rows in one of the per-component
+        index tables that match the supplied expression.
+
+        @param table: the index table
+        @param where: the DAL expression selecting the kind of row
+        @param test: the L{baseExpression} the row must also match, or C{None}
+        """
+
+        if test is not None:
+            where = where.And(self.generateExpression(test))
+        if self.whereid:
+            if self.multiple:
+                argname = self.addArgument(self.whereid)
+                where = table.CALENDAR_RESOURCE_ID.In(Parameter(argname, len(self.whereid))).And(where)
+            else:
+                where = (table.CALENDAR_RESOURCE_ID == self.whereid).And(where)
+        return self.collection._objectSchema.RESOURCE_ID.In(Select(
+            [table.CALENDAR_OBJECT_RESOURCE_ID],
+            From=table,
+            Where=where,
+        ))
+
     def addArgument(self, arg):
         """
 
@@ -39,6 +39,9 @@ class TestQueryFilter(TestCase):
     _queryFields = {
         "UID": _objectSchema.UID,
         "TYPE": _objectSchema.ICALENDAR_TYPE,
+        "PROPERTY": schema.CALENDAR_OBJECT_PROPERTY.VALUE,
+        "CUA": schema.CALENDAR_OBJECT_ATTENDEE.CUA,
+        "PARTSTAT": schema.CALENDAR_OBJECT_ATTENDEE.PARTSTAT,
     }
 
     def setUp(self):
@@ -128,6 +131,34 @@ class TestQueryFilter(TestCase):
         self.assertEqual(args, {"arg1": ("VEVENT", "VFREEBUSY", "VAVAILABILITY")})
         self.assertEqual(usedtimerange, True)
 
+    def test_query_freebusy_multiple(self):
+        """
+        Freebusy query test - with time range across multiple calendars
+        """
+
+        filter = caldavxml.Filter(
+            caldavxml.ComponentFilter(
+                *[caldavxml.ComponentFilter(
+                    *[caldavxml.TimeRange(**{"start": "20060605T160000Z", "end": "20060605T170000Z"})],
+                    **{"name": ("VEVENT", "VFREEBUSY", "VAVAILABILITY")}
+                )],
+                **{"name": "VCALENDAR"}
+            )
+        )
+        filter = Filter(filter)
+        filter.child.settzinfo(Timezone(tzid="America/New_York"))
+
+        expression = buildExpression(filter, self._queryFields)
+        sql = CalDAVSQLQueryGenerator(expression, self, [1234, 5678], "user01", True)
+        select, args, usedtimerange = sql.generate()
+
+        self.assertEqual(select.toSQL(), SQLFragment(
+            "select distinct RESOURCE_NAME, ICALENDAR_UID, ICALENDAR_TYPE, ORGANIZER, FLOATING, coalesce(ADJUSTED_START_DATE, START_DATE), coalesce(ADJUSTED_END_DATE, END_DATE), FBTYPE, TIME_RANGE.TRANSPARENT, PERUSER.TRANSPARENT, CALENDAR_OBJECT.CALENDAR_RESOURCE_ID from CALENDAR_OBJECT, TIME_RANGE left outer join PERUSER on INSTANCE_ID = TIME_RANGE_INSTANCE_ID and USER_ID = ? where ICALENDAR_TYPE in (?, ?, ?) and (FLOATING = ? and coalesce(ADJUSTED_START_DATE, START_DATE) < ? and coalesce(ADJUSTED_END_DATE, END_DATE) > ? or FLOATING = ? and coalesce(ADJUSTED_START_DATE, START_DATE) < ? and coalesce(ADJUSTED_END_DATE, END_DATE) > ?) and CALENDAR_OBJECT_RESOURCE_ID = RESOURCE_ID and TIME_RANGE.CALENDAR_RESOURCE_ID in (?, ?)",
+            ['user01', Parameter('arg1', 3), False, datetime.datetime(2006, 6, 5, 17, 0), datetime.datetime(2006, 6, 5, 16, 0), True, datetime.datetime(2006, 6, 5, 13, 0), datetime.datetime(2006, 6, 5, 12, 0), Parameter('arg2', 2)]
+        ))
+        self.assertEqual(args, {"arg1": ("VEVENT", "VFREEBUSY", "VAVAILABILITY"), "arg2": [1234, 5678]})
+        self.assertEqual(usedtimerange, True)
+
     def test_query_not_extended(self):
         """
         Query test - two terms not anyof
@@ -193,6 +224,156 @@ class TestQueryFilter(TestCase):
         self.assertEqual(args, {})
         self.assertEqual(usedtimerange, True)
 
+    def _propertyFilter(self, *propfilters, **kwargs):
+        filter = caldavxml.Filter(
+            caldavxml.ComponentFilter(
+                *[caldavxml.ComponentFilter(
+                    *propfilters,
+                    **dict(kwargs, name="VEVENT")
+                )],
+                **{"name": "VCALENDAR"}
+            )
+        )
+        filter = Filter(filter)
+        filter.child.settzinfo(Timezone(tzid="America/New_York"))
+        return filter
+
+    def test_query_indexed_property(self):
+        """
+        Text-match on an indexed property is done via the property index.
+        """
+
+        filter = self._propertyFilter(
+            caldavxml.PropertyFilter(
+                caldavxml.TextMatch.fromString("Team Meeting", True),
+                name="SUMMARY",
+            ),
+        )
+
+        # Not indexed
+        self.assertRaises(ValueError, buildExpression, filter, self._queryFields)
+
+        expression = buildExpression(filter, self._queryFields, ("summary", "location",))
+        sql = CalDAVSQLQueryGenerator(expression, self, 1234)
+        select, args, usedtimerange = sql.generate()
+
+        sql = select.toSQL()
+        self.assertIn(" in (select CALENDAR_OBJECT_RESOURCE_ID from CALENDAR_OBJECT_PROPERTY where ", sql.text)
+        self.assertIn("SUMMARY", sql.parameters)
+        self.assertIn("team meeting", sql.parameters)
+        self.assertEqual(usedtimerange, False)
+
+    def test_query_indexed_property_multiple(self):
+        """
+        Indexed property test across multiple calendars is restricted to those calendars.
+        """
+
+        filter = self._propertyFilter(
+            caldavxml.PropertyFilter(name="LOCATION"),
+        )
+
+        expression = buildExpression(filter, self._queryFields, ("SUMMARY", "LOCATION",))
+        sql = CalDAVSQLQueryGenerator(expression, self, [1234, 5678])
+        select, args, _ignore_usedtimerange = sql.generate()
+
+        self.assertIn("LOCATION", select.toSQL().parameters)
+        self.assertIn([1234, 5678], args.values())
+
+    def test_query_indexed_property_unsupported(self):
+        """
+        Tests that the property index cannot answer exactly are not done via the index.
+        """
+
+        properties = ("SUMMARY", "LOCATION",)
+        for propfilters in (
+            # Case-sensitive
+            (caldavxml.PropertyFilter(caldavxml.TextMatch.fromString("Meeting", False), name="SUMMARY"),),
+            # LIKE wild-card
+            (caldavxml.PropertyFilter(caldavxml.TextMatch.fromString("100%", True), name="SUMMARY"),),
+            # is-not-defined
+            (caldavxml.PropertyFilter(caldavxml.IsNotDefined(), name="SUMMARY"),),
+            # Two properties that must match in the same component
+            (
+                caldavxml.PropertyFilter(caldavxml.TextMatch.fromString("meeting", True), name="SUMMARY"),
+                caldavxml.PropertyFilter(caldavxml.TextMatch.fromString("room", True), name="LOCATION"),
+            ),
+            # Property that must match in the same component as the time-range
+            (
+                caldavxml.TimeRange(**{"start": "20060605T160000Z", "end": "20060605T170000Z"}),
+                caldavxml.PropertyFilter(caldavxml.TextMatch.fromString("meeting", True), name="SUMMARY"),
+            ),
+        ):
+            filter = self._propertyFilter(*propfilters)
+            self.assertRaises(ValueError, buildExpression, filter, self._queryFields, properties)
+
+        # Either of two properties is fine
+        filter = self._propertyFilter(
+            caldavxml.PropertyFilter(caldavxml.TextMatch.fromString("meeting", True), name="SUMMARY"),
+            caldavxml.PropertyFilter(caldavxml.TextMatch.fromString("room", True), name="LOCATION"),
+            test="anyof",
+        )
+        buildExpression(filter, self._queryFields, properties)
+
+    def test_query_attendee(self):
+        """
+        ATTENDEE value and PARTSTAT tests are done via the attendee index.
+        """
+
+        filter = self._propertyFilter(
+            caldavxml.PropertyFilter(
+                caldavxml.TextMatch.fromString("mailto:User01@example.com", True),
+                caldavxml.ParameterFilter(
+                    caldavxml.TextMatch.fromString("NEEDS-ACTION", True),
+                    name="PARTSTAT",
+                ),
+                name="ATTENDEE",
+            ),
+        )
+
+        expression = buildExpression(filter, self._queryFields)
+        sql = CalDAVSQLQueryGenerator(expression, self, 1234)
+        select, _ignore_args, usedtimerange = sql.generate()
+
+        sql = select.toSQL()
+        self.assertIn(" in (select CALENDAR_OBJECT_RESOURCE_ID from CALENDAR_OBJECT_ATTENDEE where ", sql.text)
+        self.assertIn("mailto:user01@example.com", sql.parameters)
+        self.assertIn("needs-action", sql.parameters)
+        self.assertEqual(usedtimerange, False)
+
+        # Attendees without a PARTSTAT
+        filter = self._propertyFilter(
+            caldavxml.PropertyFilter(
+                caldavxml.ParameterFilter(caldavxml.IsNotDefined(), name="PARTSTAT"),
+                name="ATTENDEE",
+            ),
+        )
+        expression = buildExpression(filter, self._queryFields)
+        select, _ignore_args, _ignore_usedtimerange = CalDAVSQLQueryGenerator(expression, self, 1234).generate()
+        self.assertIn(" is null", select.toSQL().text)
+
+    def test_query_attendee_unsupported(self):
+        """
+        Tests that the attendee index cannot answer exactly are not done via the index.
+        """
+
+        for propfilter in (
+            # Case-sensitive
+            caldavxml.PropertyFilter(caldavxml.TextMatch.fromString("mailto:user01@example.com", False), name="ATTENDEE"),
+            # is-not-defined
+            caldavxml.PropertyFilter(caldavxml.IsNotDefined(), name="ORGANIZER"),
+            # Parameters other than PARTSTAT on ATTENDEE
+            caldavxml.PropertyFilter(
+                caldavxml.ParameterFilter(caldavxml.TextMatch.fromString("REQ-PARTICIPANT", True), name="ROLE"),
+                name="ATTENDEE",
+            ),
+            caldavxml.PropertyFilter(
+                caldavxml.ParameterFilter(caldavxml.TextMatch.fromString("ACCEPTED", True), name="PARTSTAT"),
+                name="ORGANIZER",
+            ),
+        ):
+            filter = self._propertyFilter(propfilter)
+            self.assertRaises(ValueError, buildExpression, filter, self._queryFields)
+
     def test_sqllite_query(self):
         """
         Basic query test - single term.
@@ -17,7 +17,8 @@
 from twext.python.log import Logger
 from txweb2.dav.http import ErrorResponse
 
-from twisted.internet.defer import inlineCallbacks, returnValue, succeed
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed, \
+    DeferredList, DeferredSemaphore
 from twisted.logger import LogLevel
 from twisted.python.failure import Failure
 from txweb2 import responsecode
@@ -94,23 +95,64 @@ class ScheduleViaCalDAV(DeliveryService):
         organizerProp = self.scheduler.calendar.getOrganizerProperty()
         uid = self.scheduler.calendar.resourceUID()
 
-        # Freebusy needs to be optimized by doing multiple attendee in parallel if possible
         if self.freebusy:
             # Look for special delegate extended free-busy request
             use_extended_free_busy = self.scheduler.calendar.getExtendedFreeBusy() is not None
 
-            for recipient in self.recipients:
-                event_details = [] if use_extended_free_busy else None
+            # Process multiple attendees in parallel if allowed
+            parallel = config.Scheduling.Options.FreeBusyParallelRecipients
+            if parallel > 1 and len(self.recipients) > 1:
+                yield self.generateFreeBusyResponsesInParallel(parallel, organizerProp, uid, use_extended_free_busy)
+            else:
+                for recipient in self.recipients:
+                    event_details = [] if use_extended_free_busy else None
 
-                # Check access controls - we do not do this right now. But if we ever implement access controls to
-                # determine which users can schedule with other users, here is where we would do that test.
-                yield self.generateFreeBusyResponse(recipient, self.responses, organizerProp, uid, event_details)
+                    # Check access controls - we do not do this right now. But if we ever implement access controls to
+                    # determine which users can schedule with other users, here is where we would do that test.
+                    yield self.generateFreeBusyResponse(recipient, self.responses, organizerProp, uid, event_details)
         else:
             for recipient in self.recipients:
                 # Check access controls - we do not do this right now. But if we ever implement access controls to
                 # determine which users can schedule with other users, here is where we would do that test.
                 yield self.generateResponse(recipient, self.responses)
 
+    @inlineCallbacks
+    def generateFreeBusyResponsesInParallel(self, parallel, organizerProp, uid, use_extended_free_busy):
+        """
+        Generate freebusy responses for multiple recipients at once, with at most C{parallel}
+        of them in progress at any time. The responses for each recipient are collected
+        separately and added to the response queue in the original recipient order once
+        all are done. Each recipient gets its own L{FreebusyQuery} so the
+        MaxQueryWithDataResults limit still applies per recipient.
+
+        @param parallel: maximum number of recipients to process at once
+        @type parallel: L{int}
+        """
+
+        semaphore = DeferredSemaphore(parallel)
+        queues = [_RecipientResponses() for _ignore in self.recipients]
+
+        # Check access controls - we do not do this right now. But if we ever implement access controls to
+        # determine which users can schedule with other users, here is where we would do that test.
+        results = yield DeferredList([
+            semaphore.run(
+                self.generateFreeBusyResponse,
+                recipient,
+                queue,
+                organizerProp,
+                uid,
+                [] if use_extended_free_busy else None,
+            ) for recipient, queue in zip(self.recipients, queues)
+        ], consumeErrors=True)
+
+        # Fail in the same way as the serial case would
+        for success, result in results:
+            if not success:
+                result.raiseException()
+
+        for queue in queues:
+            queue.replay(self.responses)
+
     @inlineCallbacks
     def generateResponse(self, recipient, responses):
         # Hash the iCalendar data for use as the last path element of the URI path
@@ -193,11 +235,11 @@ class ScheduleViaCalDAV(DeliveryService):
     @inlineCallbacks
     def generateFreeBusyResponse(self, recipient, responses, organizerProp, uid, event_details):
 
-        # Extract the ATTENDEE property matching current recipient from the calendar data
-        cuas = recipient.record.calendarUserAddresses
-        attendeeProp = self.scheduler.calendar.getAttendeeProperty(cuas)
-
         try:
+            # Extract the ATTENDEE property matching current recipient from the calendar data
+            cuas = recipient.record.calendarUserAddresses
+            attendeeProp = self.scheduler.calendar.getAttendeeProperty(cuas)
+
             fbresult = yield FreebusyQuery(
                 organizer=self.scheduler.organizer,
                 organizerProp=organizerProp,
@@ -237,3 +279,21 @@ class ScheduleViaCalDAV(DeliveryService):
                 calendar=fbresult
             )
             returnValue(True)
+
+
+class _RecipientResponses(object):
+    """
+    Stands in for a L{ScheduleResponseQueue} for a single recipient when freebusy is
+    being done in parallel, so that the responses can be added to the real queue in
+    a predictable order.
+    """
+
+    def __init__(self):
+        self.added = []
+
+    def add(self, *args, **kwargs):
+        self.added.append((args, kwargs,))
+
+    def replay(self, responses):
+        for args, kwargs in self.added:
+            responses.add(*args, **kwargs)
@@ -27,7 +27,7 @@ from twistedcaldav.config import config
 from txdav.caldav.datastore.scheduling import addressmapping
 from txdav.caldav.datastore.scheduling.cuaddress import LocalCalendarUser, \
     OtherServerCalendarUser, InvalidCalendarUser, \
-    calendarUserFromCalendarUserAddress
+    calendarUserFromCalendarUserAddress, calendarUsersFromCalendarUserAddresses
 from txdav.caldav.datastore.scheduling.scheduler import Scheduler, ScheduleResponseQueue
 
 
@@ -128,9 +128,10 @@ class CalDAVScheduler(Scheduler):
         """
 
         results = []
+        recipientAddresses = yield calendarUsersFromCalendarUserAddresses(self.recipients, self.txn)
         for recipient in self.recipients:
             # Get the calendar user object for this recipient
-            recipientAddress = yield calendarUserFromCalendarUserAddress(recipient, self.txn)
+            recipientAddress = recipientAddresses[recipient]
 
             # If no principal we may have a remote recipient but we should check whether
             # the address is one that ought to be on our server and treat that as a missing
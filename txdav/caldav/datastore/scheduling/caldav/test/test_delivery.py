@@ -14,11 +14,12 @@
 # limitations under the License.
 ##
 
-from twisted.internet.defer import inlineCallbacks
+from twisted.internet.defer import inlineCallbacks, Deferred, fail
 
 from twistedcaldav.config import config
 
 from txdav.caldav.datastore.scheduling.caldav.delivery import ScheduleViaCalDAV
+from txdav.caldav.datastore.scheduling.itip import iTIPRequestStatus
 
 import twistedcaldav.test.util
 
@@ -44,3 +45,111 @@ class CalDAV (twistedcaldav.test.util.TestCase):
         self.assertFalse(result)
         result = yield ScheduleViaCalDAV.matchCalendarUserAddress("mailto:user")
         self.assertFalse(result)
+
+    @inlineCallbacks
+    def test_freebusyParallel(self):
+        """
+        Make sure freebusy for multiple recipients is done in parallel, with a bound
+        on the number in progress, and that responses are in recipient order.
+        """
+
+        class FakeCalendar(object):
+            def getOrganizerProperty(self):
+                return None
+
+            def resourceUID(self):
+                return "1234"
+
+            def getExtendedFreeBusy(self):
+                return None
+
+        class FakeScheduler(object):
+            calendar = FakeCalendar()
+
+        class FakeResponses(object):
+            def __init__(self):
+                self.added = []
+
+            def add(self, recipient, what, reqstatus=None, calendar=None):
+                self.added.append(recipient)
+
+        self.patch(config.Scheduling.Options, "FreeBusyParallelRecipients", 2)
+        pending = []
+
+        def _generateFreeBusyResponse(recipient, responses, organizerProp, uid, event_details):
+            d = Deferred()
+            d.addCallback(lambda _: responses.add(recipient, 200))
+            pending.append(d)
+            return d
+
+        responses = FakeResponses()
+        recipients = ["mailto:user{:02d}@example.com".format(i) for i in range(1, 6)]
+        delivery = ScheduleViaCalDAV(FakeScheduler(), recipients, responses, True)
+        self.patch(delivery, "generateFreeBusyResponse", _generateFreeBusyResponse)
+
+        d = delivery.generateSchedulingResponses()
+
+        # Only two in progress at once - complete them in reverse order
+        self.assertEqual(len(pending), 2)
+        pending[1].callback(None)
+        self.assertEqual(len(pending), 3)
+        pending[0].callback(None)
+        pending[2].callback(None)
+        self.assertEqual(len(pending), 5)
+        pending[4].callback(None)
+        pending[3].callback(None)
+
+        yield d
+        self.assertEqual(responses.added, recipients)
+
+    @inlineCallbacks
+    def test_freebusyParallelErrors(self):
+        """
+        Make sure a recipient whose freebusy cannot be determined gets an error response
+        when freebusy is done in parallel, and that other failures are not hidden.
+        """
+
+        class FakeCalendar(object):
+            def getOrganizerProperty(self):
+                return None
+
+            def resourceUID(self):
+                return "1234"
+
+            def getExtendedFreeBusy(self):
+                return None
+
+        class FakeScheduler(object):
+            calendar = FakeCalendar()
+
+        class FakeRecipient(object):
+            def __init__(self, cuaddr):
+                self.cuaddr = cuaddr
+
+            @property
+            def record(self):
+                raise ValueError("No record")
+
+        class FakeResponses(object):
+            def __init__(self):
+                self.added = []
+
+            def add(self, recipient, what, reqstatus=None, calendar=None):
+                self.added.append((recipient, reqstatus,))
+
+        self.patch(config.Scheduling.Options, "FreeBusyParallelRecipients", 2)
+
+        responses = FakeResponses()
+        recipients = [FakeRecipient("mailto:user{:02d}@example.com".format(i)) for i in range(1, 4)]
+        delivery = ScheduleViaCalDAV(FakeScheduler(), recipients, responses, True)
+        yield delivery.generateSchedulingResponses()
+        self.assertEqual(responses.added, [(recipient.cuaddr, iTIPRequestStatus.NO_AUTHORITY,) for recipient in recipients])
+
+        # Anything else fails the request, as it does when done serially
+        def _generateFreeBusyResponse(recipient, responses, organizerProp, uid, event_details):
+            return fail(RuntimeError("Failed"))
+
+        responses = FakeResponses()
+        delivery = ScheduleViaCalDAV(FakeScheduler(), recipients, responses, True)
+        self.patch(delivery, "generateFreeBusyResponse", _generateFreeBusyResponse)
+        yield self.assertFailure(delivery.generateSchedulingResponses(), RuntimeError)
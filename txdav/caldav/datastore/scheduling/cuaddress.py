@@ -222,6 +222,27 @@ def calendarUserFromCalendarUserAddress(cuaddr, txn):
     returnValue((yield _fromRecord(cuaddr, record, txn)))
 
 
+@inlineCallbacks
+def calendarUsersFromCalendarUserAddresses(cuaddrs, txn):
+    """
+    Map a set of calendar user addresses into L{CalendarUser}s, using a single
+    batched directory lookup for all of them.
+
+    @param cuaddrs: the calendar user addresses to map
+    @type cuaddrs: iterable of L{str}
+    @param txn: a transaction to use for store operations
+    @type txn: L{ICommonStoreTransaction}
+
+    @return: a L{dict} mapping each address to its L{CalendarUser}
+    """
+
+    records = yield txn.directoryService().recordsWithCalendarUserAddresses(cuaddrs)
+    results = {}
+    for cuaddr in cuaddrs:
+        results[cuaddr] = yield _fromRecord(cuaddr, records.get(cuaddr), txn)
+    returnValue(results)
+
+
 @inlineCallbacks
 def calendarUserFromCalendarUserUID(uid, txn):
     """
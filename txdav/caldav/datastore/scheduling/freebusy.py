@@ -21,7 +21,9 @@ from pycalendar.timezone import Timezone
 
 from twext.python.log import Logger
 
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, succeed, \
+    DeferredList
+from twisted.python.failure import Failure
 
 from twistedcaldav import caldavxml
 from twistedcaldav.caldavxml import TimeRange
@@ -59,11 +61,49 @@ class FBCacheEntry(object):
 
     @classmethod
     @inlineCallbacks
-    def getCacheEntry(cls, calresource, useruid, timerange):
+    def getCacheEntry(cls, calresource, useruid, timerange, lease=False, logItems=None):
+        """
+        Get the cached free-busy results for a calendar.
+
+        @param lease: if C{True} the caller will cache the results it computes on a
+            miss, so only one caller at a time is left to compute them: the others
+            wait for the new entry, or get the previous results if
+            C{config.FreeBusyCacheServeStale} is set.
+        @type lease: C{bool}
+        @param logItems: items to add to logging
+        @type logItems: L{dict}
+
+        @return: a C{tuple} of the cached results, or L{None} if they have to be
+            computed, and the lease token, or L{None} if the caller was not granted
+            the lease. A caller granted the lease passes the token to
+            L{makeCacheEntry}, or to L{releaseLease} if it fails to compute the results.
+        """
 
         key = str(calresource.id()) + "/" + useruid
         token = (yield calresource.syncToken())
         entry = (yield cls.fbcacher.get(key))
+        results = cls._entryResults(entry, token, timerange)
+        if results is not None or not lease or not config.CacheLeases.Enabled:
+            returnValue((results, None,))
+
+        stale = None
+        if config.FreeBusyCacheServeStale:
+            stale = cls._entryResults(entry, None, timerange)
+
+        @inlineCallbacks
+        def _lookup():
+            entry = (yield cls.fbcacher.get(key))
+            returnValue(cls._entryResults(entry, token, timerange))
+
+        results = (yield cls.fbcacher.leaseOrWait(key, _lookup, stale, logItems=logItems))
+        returnValue(results)
+
+    @classmethod
+    def _entryResults(cls, entry, token, timerange):
+        """
+        Get the results from a cache entry if they cover the time range and
+        match the token (any token if C{token} is L{None}).
+        """
 
         if entry:
 
@@ -76,19 +116,31 @@ class FBCacheEntry(object):
             if compareDateTime(timerange.getEnd(), cached_end) <= 0 and compareDateTime(timerange.getStart(), cached_start) >= 0:
 
                 # Verify that cached entry is still valid
-                if token == entry.token:
-                    returnValue(entry.fbresults)
+                if token is None or token == entry.token:
+                    return entry.fbresults
 
-        returnValue(None)
+        return None
 
     @classmethod
     @inlineCallbacks
-    def makeCacheEntry(cls, calresource, useruid, timerange, fbresults):
+    def makeCacheEntry(cls, calresource, useruid, timerange, fbresults, lease=None):
 
         key = str(calresource.id()) + "/" + useruid
         token = (yield calresource.syncToken())
         entry = cls(key, token, timerange, fbresults)
         yield cls.fbcacher.set(key, entry)
+        yield cls.releaseLease(calresource, useruid, lease)
+
+    @classmethod
+    def releaseLease(cls, calresource, useruid, lease):
+        """
+        Release the lease granted by L{getCacheEntry}, if any.
+        """
+
+        if lease is None:
+            return succeed(None)
+        key = str(calresource.id()) + "/" + useruid
+        return cls.fbcacher.releaseLease(key, lease)
 
 
 class FreebusyQuery(object):
@@ -142,6 +194,9 @@ class FreebusyQuery(object):
         self.accountingItems = accountingItems
         self.event_details = event_details
 
+        # Cache leases granted for calendars whose results are to be cached
+        self._cacheLeases = {}
+
         # Check to see if the recipient is the same calendar user as the organizer.
         # Needed for masked UID stuff.
         if isinstance(self.organizer, LocalCalendarUser):
@@ -492,106 +547,247 @@ class FreebusyQuery(object):
     @inlineCallbacks
     def _matchResources(self, fbset):
         """
-        For now iterate over each calendar and collect the results. In the longer term we might want to consider
-        doing a single DB query in the case where multiple calendars need to be searched.
+        Collect the results for each calendar. Calendars with a valid L{FBCacheEntry} are handled
+        via the cache. The rest are grouped by calendar timezone (needed to resolve floating times
+        in the query) and each group is searched with a single DB query, the results of which are
+        then split back out per-calendar.
 
         @param fbset: list of calendars to process
         @type fbset: L{list} of L{Calendar}
         """
 
         results = {}
-        for calresource in fbset:
-            aggregated_resources, tzinfo, filter = yield self._matchCalendarResources(calresource)
-            results[calresource.id()] = (aggregated_resources, tzinfo, filter,)
+        uncached = {}
+        try:
+            # Check the cache for every calendar at once, so any waits on calendars being
+            # rebuilt by other requests overlap. Wait for every check to finish even if
+            # one fails, so all the leases granted are known.
+            cached = (yield DeferredList(
+                [self._cachedCalendarResources(calresource) for calresource in fbset],
+                consumeErrors=True,
+            ))
+            for success, result in cached:
+                if not success:
+                    result.raiseException()
 
+            for calresource, (_ignore_success, result) in zip(fbset, cached):
+                if result is not None:
+                    results[calresource.id()] = result
+                else:
+                    uncached.setdefault(calresource.getTimezoneID(), []).append(calresource)
+
+            for calresources in uncached.values():
+                if len(calresources) == 1:
+                    results[calresources[0].id()] = yield self._matchCalendarResources(calresources[0], checkCache=False)
+                else:
+                    results.update((yield self._matchMultipleCalendarResources(calresources)))
+        except Exception:
+            f = Failure()
+            yield self._releaseCacheLeases(fbset)
+            f.raiseException()
+
+        yield self._releaseCacheLeases(fbset)
         returnValue(results)
 
     @inlineCallbacks
-    def _matchCalendarResources(self, calresource):
+    def _releaseCacheLeases(self, fbset):
+        """
+        Release any cache leases for which no cache entry was made, so other requests
+        are not left waiting on results that will not be cached.
+
+        @param fbset: list of calendars being processed
+        @type fbset: L{list} of L{Calendar}
+        """
+
+        for calresource in fbset:
+            lease = self._cacheLeases.pop(calresource.id(), None)
+            if lease is not None:
+                yield FBCacheEntry.releaseLease(calresource, self.attendee_uid, lease)
 
-        # Get the timezone property from the collection.
+    @inlineCallbacks
+    def _cachedCalendarResources(self, calresource):
+        """
+        Get the cached results for a calendar.
+
+        @param calresource: the calendar to lookup
+        @type calresource: L{Calendar}
+
+        @return: a L{tuple} of aggregated resources, timezone and filter, or L{None} if there
+            is no valid cache entry.
+        """
+
+        if not config.EnableFreeBusyCache:
+            returnValue(None)
+
+        aggregated_resources, lease = (yield FBCacheEntry.getCacheEntry(
+            calresource, self.attendee_uid, self.timerange,
+            lease=self._cacheTimerange() is not None, logItems=self.logItems,
+        ))
+        if lease is not None:
+            self._cacheLeases[calresource.id()] = lease
+        if aggregated_resources is None:
+            returnValue(None)
+
+        if self.accountingItems is not None:
+            self.accountingItems["fb-cached"] = self.accountingItems.get("fb-cached", 0) + 1
+
+        # Log extended item
+        if self.logItems is not None:
+            self.logItems["fb-cached"] = self.logItems.get("fb-cached", 0) + 1
+
+        # Determine appropriate timezone (UTC is the default)
         tz = calresource.getTimezone()
+        tzinfo = tz.gettimezone() if tz is not None else Timezone.UTCTimezone
+
+        returnValue((aggregated_resources, tzinfo, None,))
+
+    @inlineCallbacks
+    def _matchCalendarResources(self, calresource, checkCache=True):
 
         # Try cache
-        aggregated_resources = (yield FBCacheEntry.getCacheEntry(calresource, self.attendee_uid, self.timerange)) if config.EnableFreeBusyCache else None
+        if checkCache:
+            result = yield self._cachedCalendarResources(calresource)
+            if result is not None:
+                returnValue(result)
+
+        filter, tzinfo, cache_timerange = self._uncachedFilter(calresource.getTimezone())
+
+        try:
+            resources = yield calresource.search(filter, useruid=self.attendee_uid, fbtype=True)
+            aggregated_resources = self._aggregateResources(resources)
+            if cache_timerange is not None:
+                yield FBCacheEntry.makeCacheEntry(
+                    calresource, self.attendee_uid, cache_timerange, aggregated_resources,
+                    lease=self._cacheLeases.pop(calresource.id(), None),
+                )
+        except IndexedSearchException:
+            raise InternalDataStoreError("Invalid indexedSearch query")
 
-        if aggregated_resources is None:
+        returnValue((aggregated_resources, tzinfo, filter,))
 
-            if self.accountingItems is not None:
-                self.accountingItems["fb-uncached"] = self.accountingItems.get("fb-uncached", 0) + 1
-
-            caching = False
-            if config.EnableFreeBusyCache:
-                # Log extended item
-                if self.logItems is not None:
-                    self.logItems["fb-uncached"] = self.logItems.get("fb-uncached", 0) + 1
-
-                # We want to cache a large range of time based on the current date
-                cache_start = normalizeToUTC(DateTime.getToday() + Duration(days=0 - config.FreeBusyCacheDaysBack))
-                cache_end = normalizeToUTC(DateTime.getToday() + Duration(days=config.FreeBusyCacheDaysForward))
-
-                # If the requested time range would fit in our allowed cache range, trigger the cache creation
-                if compareDateTime(self.timerange.getStart(), cache_start) >= 0 and compareDateTime(self.timerange.getEnd(), cache_end) <= 0:
-                    cache_timerange = Period(cache_start, cache_end)
-                    caching = True
-
-            #
-            # What we do is a fake calendar-query for VEVENT/VFREEBUSYs in the specified time-range.
-            # We then take those results and merge them into one VFREEBUSY component
-            # with appropriate FREEBUSY properties, and return that single item as iCal data.
-            #
-
-            # Create fake filter element to match time-range
-            tr = TimeRange(
-                start=(cache_timerange if caching else self.timerange).getStart().getText(),
-                end=(cache_timerange if caching else self.timerange).getEnd().getText(),
-            )
-            filter = caldavxml.Filter(
+    @inlineCallbacks
+    def _matchMultipleCalendarResources(self, calresources):
+        """
+        Search a set of calendars, which all have the same timezone, with a single DB query.
+
+        @param calresources: list of calendars to process
+        @type calresources: L{list} of L{Calendar}
+
+        @return: a L{dict} mapping calendar resource-id to a L{tuple} of aggregated resources,
+            timezone and filter.
+        """
+
+        filter, tzinfo, cache_timerange = self._uncachedFilter(calresources[0].getTimezone(), count=len(calresources))
+
+        results = {}
+        try:
+            resources = yield calresources[0].searchMultiple(calresources, filter, useruid=self.attendee_uid, fbtype=True)
+            for calresource in calresources:
+                aggregated_resources = self._aggregateResources(resources[calresource.id()])
+                if cache_timerange is not None:
+                    yield FBCacheEntry.makeCacheEntry(
+                        calresource, self.attendee_uid, cache_timerange, aggregated_resources,
+                        lease=self._cacheLeases.pop(calresource.id(), None),
+                    )
+                results[calresource.id()] = (aggregated_resources, tzinfo, filter,)
+        except IndexedSearchException:
+            raise InternalDataStoreError("Invalid indexedSearch query")
+
+        returnValue(results)
+
+    def _cacheTimerange(self):
+        """
+        The time range to cache the results of an uncached query for.
+
+        @return: the L{Period} to use when caching the results, or L{None} if the
+            results are not to be cached.
+        """
+
+        if not config.EnableFreeBusyCache:
+            return None
+
+        # We want to cache a large range of time based on the current date
+        cache_start = normalizeToUTC(DateTime.getToday() + Duration(days=0 - config.FreeBusyCacheDaysBack))
+        cache_end = normalizeToUTC(DateTime.getToday() + Duration(days=config.FreeBusyCacheDaysForward))
+
+        # If the requested time range would fit in our allowed cache range, trigger the cache creation
+        if compareDateTime(self.timerange.getStart(), cache_start) >= 0 and compareDateTime(self.timerange.getEnd(), cache_end) <= 0:
+            return Period(cache_start, cache_end)
+
+        return None
+
+    def _uncachedFilter(self, tz, count=1):
+        """
+        Build the query filter used to find busy time for calendars that are not cached.
+
+        @param tz: the calendar timezone
+        @type tz: L{Component} or L{None}
+        @param count: the number of calendars being queried
+        @type count: L{int}
+
+        @return: a L{tuple} of the L{Filter}, the timezone to use for floating times and the
+            L{Period} to use when caching the results (L{None} if the results are not to be cached).
+        """
+
+        if self.accountingItems is not None:
+            self.accountingItems["fb-uncached"] = self.accountingItems.get("fb-uncached", 0) + count
+
+        # Log extended item
+        if config.EnableFreeBusyCache and self.logItems is not None:
+            self.logItems["fb-uncached"] = self.logItems.get("fb-uncached", 0) + count
+
+        cache_timerange = self._cacheTimerange()
+
+        #
+        # What we do is a fake calendar-query for VEVENT/VFREEBUSYs in the specified time-range.
+        # We then take those results and merge them into one VFREEBUSY component
+        # with appropriate FREEBUSY properties, and return that single item as iCal data.
+        #
+
+        # Create fake filter element to match time-range
+        tr = TimeRange(
+            start=(cache_timerange if cache_timerange is not None else self.timerange).getStart().getText(),
+            end=(cache_timerange if cache_timerange is not None else self.timerange).getEnd().getText(),
+        )
+        filter = caldavxml.Filter(
+            caldavxml.ComponentFilter(
                 caldavxml.ComponentFilter(
-                    caldavxml.ComponentFilter(
-                        tr,
-                        name=("VEVENT", "VFREEBUSY", "VAVAILABILITY"),
-                    ),
-                    name="VCALENDAR",
-                )
+                    tr,
+                    name=("VEVENT", "VFREEBUSY", "VAVAILABILITY"),
+                ),
+                name="VCALENDAR",
             )
-            filter = Filter(filter)
-            tzinfo = filter.settimezone(tz)
-            if self.accountingItems is not None:
-                self.accountingItems["fb-query-timerange"] = (str(tr.start), str(tr.end),)
-
-            try:
-                resources = yield calresource.search(filter, useruid=self.attendee_uid, fbtype=True)
-
-                aggregated_resources = {}
-                for name, uid, comptype, test_organizer, float, start, end, fbtype, transp in resources:
-                    if transp == 'T' and fbtype != '?':
-                        fbtype = 'F'
-                    aggregated_resources.setdefault((name, uid, comptype, test_organizer,), []).append((
-                        float,
-                        tupleFromDateTime(parseSQLTimestampToPyCalendar(start)),
-                        tupleFromDateTime(parseSQLTimestampToPyCalendar(end)),
-                        fbtype,
-                    ))
-
-                if caching:
-                    yield FBCacheEntry.makeCacheEntry(calresource, self.attendee_uid, cache_timerange, aggregated_resources)
-            except IndexedSearchException:
-                raise InternalDataStoreError("Invalid indexedSearch query")
+        )
+        filter = Filter(filter)
+        tzinfo = filter.settimezone(tz)
+        if self.accountingItems is not None:
+            self.accountingItems["fb-query-timerange"] = (str(tr.start), str(tr.end),)
 
-        else:
-            if self.accountingItems is not None:
-                self.accountingItems["fb-cached"] = self.accountingItems.get("fb-cached", 0) + 1
+        return filter, tzinfo, cache_timerange
 
-            # Log extended item
-            if self.logItems is not None:
-                self.logItems["fb-cached"] = self.logItems.get("fb-cached", 0) + 1
+    def _aggregateResources(self, resources):
+        """
+        Group the instance results from a freebusy search by resource.
 
-            # Determine appropriate timezone (UTC is the default)
-            tzinfo = tz.gettimezone() if tz is not None else Timezone.UTCTimezone
-            filter = None
+        @param resources: the results from L{Calendar.search}
+        @type resources: L{list}
 
-        returnValue((aggregated_resources, tzinfo, filter,))
+        @return: a L{dict} mapping (name, uid, comptype, organizer) to a list of
+            (float, start, end, fbtype) instance details
+        @rtype: L{dict}
+        """
+
+        aggregated_resources = {}
+        for name, uid, comptype, test_organizer, float, start, end, fbtype, transp in resources:
+            if transp == 'T' and fbtype != '?':
+                fbtype = 'F'
+            aggregated_resources.setdefault((name, uid, comptype, test_organizer,), []).append((
+                float,
+                tupleFromDateTime(parseSQLTimestampToPyCalendar(start)),
+                tupleFromDateTime(parseSQLTimestampToPyCalendar(end)),
+                fbtype,
+            ))
+        return aggregated_resources
 
     @inlineCallbacks
     def _testIgnoreExcludeUID(self, uid, test_organizer, recordUIDCache, dirservice):
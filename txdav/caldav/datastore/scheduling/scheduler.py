@@ -35,7 +35,7 @@ from txdav.caldav.datastore.scheduling import addressmapping
 from txdav.caldav.datastore.scheduling.caldav.delivery import ScheduleViaCalDAV
 from txdav.caldav.datastore.scheduling.cuaddress import EmailCalendarUser
 from txdav.caldav.datastore.scheduling.cuaddress import InvalidCalendarUser, \
-    OtherServerCalendarUser, calendarUserFromCalendarUserAddress
+    OtherServerCalendarUser, calendarUsersFromCalendarUserAddresses
 from txdav.caldav.datastore.scheduling.cuaddress import LocalCalendarUser
 from txdav.caldav.datastore.scheduling.cuaddress import RemoteCalendarUser
 from txdav.caldav.datastore.scheduling.imip.delivery import ScheduleViaIMip
@@ -566,9 +566,10 @@ class RemoteScheduler(Scheduler):
         """
 
         results = []
+        recipientAddresses = yield calendarUsersFromCalendarUserAddresses(self.recipients, self.txn)
         for recipient in self.recipients:
             # Get the calendar user object for this recipient
-            recipientAddress = yield calendarUserFromCalendarUserAddress(recipient, self.txn)
+            recipientAddress = recipientAddresses[recipient]
 
             # If no calendar user we may have a remote recipient but we should check whether
             # the address is one that ought to be on our server and treat that as a missing
@@ -22,11 +22,15 @@ from twext.python.clsprop import classproperty
 from twisted.internet.defer import inlineCallbacks
 from twisted.trial.unittest import TestCase
 
+from twistedcaldav.config import config
 from twistedcaldav.ical import Component, Property
+from twistedcaldav.memcacher import Memcacher
 
 from txdav.caldav.datastore.scheduling.cuaddress import calendarUserFromCalendarUserAddress
-from txdav.caldav.datastore.scheduling.freebusy import FreebusyQuery
+from txdav.caldav.datastore.scheduling.freebusy import FreebusyQuery, FBCacheEntry
 from txdav.common.datastore.test.util import CommonCommonTests, populateCalendarsFrom
+from txdav.common.icommondatastore import IndexedSearchException, \
+    InternalDataStoreError
 
 
 def normalizeiCalendarText(data):
@@ -256,6 +260,9 @@ class GenerateFreeBusyInfo(CommonCommonTests, TestCase):
         self.now_13H = self.now.duplicate()
         self.now_13H.offsetHours(13)
 
+        self.now_14H = self.now.duplicate()
+        self.now_14H.offsetHours(14)
+
         self.now_1D = self.now.duplicate()
         self.now_1D.offsetDay(1)
 
@@ -348,6 +355,88 @@ END:VCALENDAR
         self.assertEqual(len(fbinfo.tentative), 0)
         self.assertEqual(len(fbinfo.unavailable), 0)
 
+    @inlineCallbacks
+    def test_multiple_calendars(self):
+        """
+        Test that calendars with the same timezone are searched with one query and
+        the results are split out correctly.
+        """
+
+        data = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:%s
+DTSTAMP:20080601T000000Z
+DTSTART:%s
+DTEND:%s
+END:VEVENT
+END:VCALENDAR
+"""
+
+        home = yield self.homeUnderTest(name="user01")
+        calendar2 = yield home.createCalendarWithName("calendar_2")
+        yield calendar2.createCalendarObjectWithName("test.ics", Component.fromString(data % ("1234-5678", self.now_12H.getText(), self.now_13H.getText(),)))
+        calendar1 = yield home.calendarWithName("calendar_1")
+        yield calendar1.createCalendarObjectWithName("test.ics", Component.fromString(data % ("1234-9012", self.now_13H.getText(), self.now_14H.getText(),)))
+        yield self.commit()
+
+        calendar1 = (yield self.calendarUnderTest(home="user01", name="calendar_1"))
+        calendar2 = (yield self.calendarUnderTest(home="user01", name="calendar_2"))
+
+        searches = []
+        self.patch(calendar1, "search", lambda *args, **kwargs: searches.append(calendar1))
+        self.patch(calendar2, "search", lambda *args, **kwargs: searches.append(calendar2))
+
+        fbinfo = FreebusyQuery.FBInfo([], [], [])
+        timerange = Period(self.now, self.now_1D)
+
+        organizer = recipient = yield calendarUserFromCalendarUserAddress("mailto:user01@example.com", self.transactionUnderTest())
+        freebusy = FreebusyQuery(organizer=organizer, recipient=recipient, timerange=timerange)
+        result = (yield freebusy.generateFreeBusyInfo([calendar1, calendar2, ], fbinfo))
+        self.assertEqual(result, 2)
+        self.assertEqual(searches, [])
+        self.assertEqual(len(fbinfo.busy), 2)
+        self.assertIn(Period.parseText("%s/%s" % (self.now_12H.getText(), self.now_13H.getText(),)), fbinfo.busy)
+        self.assertIn(Period.parseText("%s/%s" % (self.now_13H.getText(), self.now_14H.getText(),)), fbinfo.busy)
+        self.assertEqual(len(fbinfo.tentative), 0)
+        self.assertEqual(len(fbinfo.unavailable), 0)
+
+    @inlineCallbacks
+    def test_cacheLeaseReleased(self):
+        """
+        Test that the free-busy cache lease is released when the cache entry is
+        made, and when searching the calendar fails.
+        """
+
+        self.patch(config, "ProcessType", "Single")
+        self.patch(config, "EnableFreeBusyCache", True)
+        self.patch(config.CacheLeases, "Enabled", True)
+        Memcacher.reset()
+        self.patch(FBCacheEntry, "fbcacher", Memcacher("FBCache", pickle=True))
+
+        calendar = (yield self.calendarUnderTest(home="user01", name="calendar_1"))
+        timerange = Period(self.now, self.now_1D)
+        organizer = recipient = yield calendarUserFromCalendarUserAddress("mailto:user01@example.com", self.transactionUnderTest())
+        key = str(calendar.id()) + "/" + recipient.record.uid
+
+        freebusy = FreebusyQuery(organizer=organizer, recipient=recipient, timerange=timerange)
+        yield freebusy.generateFreeBusyInfo([calendar, ], FreebusyQuery.FBInfo([], [], []))
+        lease = yield FBCacheEntry.fbcacher.acquireLease(key)
+        self.assertNotEqual(lease, None)
+        yield FBCacheEntry.fbcacher.releaseLease(key, lease)
+
+        # Make the cache entry out of date and the search fail
+        yield FBCacheEntry.fbcacher.delete(key)
+
+        def _search(*args, **kwargs):
+            raise IndexedSearchException()
+        self.patch(calendar, "search", _search)
+
+        freebusy = FreebusyQuery(organizer=organizer, recipient=recipient, timerange=timerange)
+        yield self.assertFailure(freebusy.generateFreeBusyInfo([calendar, ], FreebusyQuery.FBInfo([], [], [])), InternalDataStoreError)
+        self.assertNotEqual((yield FBCacheEntry.fbcacher.acquireLease(key)), None)
+
     @inlineCallbacks
     def test_one_event_event_details(self):
         """
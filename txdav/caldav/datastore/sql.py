@@ -70,6 +70,7 @@ from txdav.caldav.datastore.sql_directory import GroupAttendeeRecord, \
 from txdav.caldav.datastore.util import normalizationLookup
 from txdav.caldav.datastore.util import CalendarObjectBase
 from txdav.caldav.datastore.util import dropboxIDFromCalendarObject
+from txdav.caldav.datastore.util import parsedComponentCache
 from txdav.caldav.icalendarstore import ICalendarHome, ICalendar, ICalendarObject, \
     AttachmentStoreFailed, AttachmentStoreValidManagedID, \
     TooManyAttendeesError, InvalidComponentTypeError, InvalidCalendarAccessError, \
@@ -91,6 +92,8 @@ from txdav.common.datastore.sql_tables import _ATTACHMENTS_MODE_NONE, \
     _TRANSP_OPAQUE, _TRANSP_TRANSPARENT, schema, _CHILD_TYPE_TRASH, \
     _HOME_STATUS_NORMAL
 from txdav.common.datastore.sql_sharing import SharingInvitation
+from txdav.common.datastore.sql_util import allocateSequenceValues, bulkInsert, \
+    BULK_INSERT_BATCH_SIZE
 from txdav.common.icommondatastore import IndexedSearchException, \
     InternalDataStoreError, HomeChildNameAlreadyExistsError, \
     HomeChildNameNotAllowedError, ObjectResourceTooBigError, \
@@ -1142,6 +1145,8 @@ class Calendar(CommonHomeChild):
     _revisionsSchema = schema.CALENDAR_OBJECT_REVISIONS
     _objectSchema = schema.CALENDAR_OBJECT
     _timeRangeSchema = schema.TIME_RANGE
+    _propertySchema = schema.CALENDAR_OBJECT_PROPERTY
+    _attendeeSchema = schema.CALENDAR_OBJECT_ATTENDEE
 
     _homeRecordClass = CalendarHomeRecord
     _metadataRecordClass = CalendarMetaDataRecord
@@ -1153,6 +1158,9 @@ class Calendar(CommonHomeChild):
     _queryFields = {
         "UID": _objectSchema.UID,
         "TYPE": _objectSchema.ICALENDAR_TYPE,
+        "PROPERTY": _propertySchema.VALUE,
+        "CUA": _attendeeSchema.CUA,
+        "PARTSTAT": _attendeeSchema.PARTSTAT,
     }
 
     _supportedComponents = None
@@ -1734,36 +1742,7 @@ class Calendar(CommonHomeChild):
 
         # Check for time-range re-expand
         if usedtimerange is not None:
-
-            today = DateTime.getToday()
-
-            # Determine how far we need to extend the current expansion of
-            # events. If we have an open-ended time-range we will expand
-            # one year past the start. That should catch bounded
-            # recurrences - unbounded will have been indexed with an
-            # "infinite" value always included.
-            maxDate, isStartDate = filter.getmaxtimerange()
-            if maxDate:
-                maxDate = maxDate.duplicate()
-                maxDate.offsetDay(1)
-                maxDate.setDateOnly(True)
-                upperLimit = today + Duration(days=config.FreeBusyIndexExpandMaxDays)
-                if maxDate > upperLimit:
-                    raise TimeRangeUpperLimit(upperLimit)
-                if isStartDate:
-                    maxDate += Duration(days=365)
-
-            # Determine if the start date is too early for the restricted range we
-            # are applying. If it is today or later we don't need to worry about truncation
-            # in the past.
-            minDate, _ignore_isEndDate = filter.getmintimerange()
-            if minDate >= today:
-                minDate = None
-            if minDate is not None and config.FreeBusyIndexLowerLimitDays:
-                truncateLowerLimit = today - Duration(days=config.FreeBusyIndexLowerLimitDays)
-                if minDate < truncateLowerLimit:
-                    raise TimeRangeLowerLimit(truncateLowerLimit)
-
+            minDate, maxDate = self._indexExpansionLimits(filter)
             if maxDate is not None or minDate is not None:
                 yield self.testAndUpdateIndex(minDate, maxDate)
 
@@ -1772,34 +1751,142 @@ class Calendar(CommonHomeChild):
         # Check result for missing resources
         results = []
         for row in rowiter:
-            if fbtype:
-                row = list(row)
-                row[4] = 'Y' if row[4] else 'N'
-                row[7] = indexfbtype_to_icalfbtype[row[7]]
-                if row[9] is not None:
-                    row[8] = row[9]
-                row[8] = 'T' if row[8] else 'F'
-                del row[9]
-            results.append(row)
+            results.append(self._searchResultRow(row, fbtype))
 
         returnValue(results)
 
-    def _sqlquery(self, filter, useruid, fbtype):
+    @classmethod
+    @inlineCallbacks
+    def searchMultiple(cls, calendars, filter, useruid=None, fbtype=False):
+        """
+        Finds resources matching the given qualifiers in several calendars using a single
+        query. All the calendars must be using the same transaction. Note that any floating
+        time-range in the filter is resolved using the one timezone set on the filter, so
+        callers must only combine calendars that share a timezone.
+
+        @param calendars: the calendars to search
+        @type calendars: L{list} of L{Calendar}
+        @param filter: the L{Filter} for the calendar-query to execute.
+        @return: a C{dict} mapping each calendar resource-id to a C{list} of result tuples,
+            which are the same as those returned by L{search}.
         """
-        Convert the supplied addressbook-query into a partial SQL statement.
 
-        @param filter: the L{Filter} for the addressbook-query to convert.
+        # We might be passed an L{Filter} or a serialization of one
+        if isinstance(filter, dict):
+            try:
+                filter = Filter.deserialize(filter)
+            except Exception:
+                filter = None
+
+        calendarsByID = dict([(calendar.id(), calendar,) for calendar in calendars])
+        calendarIDs = sorted(calendarsByID.keys())
+        txn = calendars[0]._txn
+
+        # Make sure we have a proper Filter element and get the partial SQL statement to use.
+        sql_stmt = calendars[0]._sqlquery(filter, useruid, fbtype, calendarIDs=calendarIDs)
+
+        # No result means it is too complex for us
+        if sql_stmt is None:
+            raise IndexedSearchException()
+        sql_stmt, args, usedtimerange = sql_stmt
+
+        # Check for time-range re-expand across all the calendars at once
+        if usedtimerange is not None:
+            minDate, maxDate = cls._indexExpansionLimits(filter)
+            if maxDate is not None or minDate is not None:
+                names = yield cls.notExpandedWithinMultiple(txn, calendarIDs, minDate, maxDate)
+                for calendarID, name in names:
+                    log.info("Search falls outside range of index for {name} {min} to {max}", name=name, min=minDate, max=maxDate)
+                    yield calendarsByID[calendarID].reExpandResource(name, minDate, maxDate)
+
+        rowiter = yield sql_stmt.on(txn, **args)
+
+        # The calendar resource-id is the last column - use it to split up the results
+        results = dict([(calendarID, []) for calendarID in calendarIDs])
+        for row in rowiter:
+            row = list(row)
+            calendarID = row.pop()
+            results[calendarID].append(cls._searchResultRow(row, fbtype))
+
+        returnValue(results)
+
+    @staticmethod
+    def _indexExpansionLimits(filter):
+        """
+        Determine the range over which the instance index needs to be expanded
+        in order to satisfy the time-range in a query.
+
+        @param filter: the L{Filter} for the calendar-query being executed.
+        @return: a C{tuple} of (min, max) L{DateTime}s, either of which may be
+            L{None} if no expansion is needed at that end.
+        """
+
+        today = DateTime.getToday()
+
+        # Determine how far we need to extend the current expansion of
+        # events. If we have an open-ended time-range we will expand
+        # one year past the start. That should catch bounded
+        # recurrences - unbounded will have been indexed with an
+        # "infinite" value always included.
+        maxDate, isStartDate = filter.getmaxtimerange()
+        if maxDate:
+            maxDate = maxDate.duplicate()
+            maxDate.offsetDay(1)
+            maxDate.setDateOnly(True)
+            upperLimit = today + Duration(days=config.FreeBusyIndexExpandMaxDays)
+            if maxDate > upperLimit:
+                raise TimeRangeUpperLimit(upperLimit)
+            if isStartDate:
+                maxDate += Duration(days=365)
+
+        # Determine if the start date is too early for the restricted range we
+        # are applying. If it is today or later we don't need to worry about truncation
+        # in the past.
+        minDate, _ignore_isEndDate = filter.getmintimerange()
+        if minDate >= today:
+            minDate = None
+        if minDate is not None and config.FreeBusyIndexLowerLimitDays:
+            truncateLowerLimit = today - Duration(days=config.FreeBusyIndexLowerLimitDays)
+            if minDate < truncateLowerLimit:
+                raise TimeRangeLowerLimit(truncateLowerLimit)
+
+        return minDate, maxDate
+
+    @staticmethod
+    def _searchResultRow(row, fbtype):
+        """
+        Convert the index values in a search result row into their iCalendar
+        equivalents.
+        """
+        if fbtype:
+            row = list(row)
+            row[4] = 'Y' if row[4] else 'N'
+            row[7] = indexfbtype_to_icalfbtype[row[7]]
+            if row[9] is not None:
+                row[8] = row[9]
+            row[8] = 'T' if row[8] else 'F'
+            del row[9]
+        return row
+
+    def _sqlquery(self, filter, useruid, fbtype, calendarIDs=None):
+        """
+        Convert the supplied calendar-query into a partial SQL statement.
+
+        @param filter: the L{Filter} for the calendar-query to convert.
+        @param calendarIDs: if not L{None}, the resource-ids of the calendars to
+            query, instead of just this one.
+        @type calendarIDs: L{list} of C{int}
         @return: a C{tuple} of (C{str}, C{list}), where the C{str} is the partial SQL statement,
                 and the C{list} is the list of argument substitutions to use with the SQL API execute method.
-                Or return C{None} if it is not possible to create an SQL query to fully match the addressbook-query.
+                Or return C{None} if it is not possible to create an SQL query to fully match the calendar-query.
         """
 
         if not isinstance(filter, Filter):
             return None
 
         try:
-            expression = buildExpression(filter, self._queryFields)
-            sql = CalDAVSQLQueryGenerator(expression, self, self.id(), useruid, fbtype)
+            expression = buildExpression(filter, self._queryFields, config.IndexedQueryProperties)
+            sql = CalDAVSQLQueryGenerator(expression, self, calendarIDs if calendarIDs is not None else self.id(), useruid, fbtype)
             return sql.generate()
         except ValueError:
             return None
@@ -1833,6 +1920,38 @@ class Calendar(CommonHomeChild):
                 resourceID=self._resourceID))]
         )
 
+    @classmethod
+    def _notExpandedWithinMultipleQuery(cls, count):
+        """
+        Query to find resources, across several calendars, that need to be re-expanded
+        """
+        co = cls._objectSchema
+        return Select(
+            [co.CALENDAR_RESOURCE_ID, co.RESOURCE_NAME],
+            From=co,
+            Where=(
+                (co.RECURRANCE_MIN > Parameter("minDate"))
+                .Or(co.RECURRANCE_MAX < Parameter("maxDate"))
+            ).And(co.CALENDAR_RESOURCE_ID.In(Parameter("resourceIDs", count)))
+        )
+
+    @classmethod
+    @inlineCallbacks
+    def notExpandedWithinMultiple(cls, txn, calendarIDs, minDate, maxDate):
+        """
+        Gives all resources in a set of calendars which have not been expanded beyond
+        a given date in the database.
+
+        @return: a L{list} of C{tuple} of (calendar resource-id, resource name)
+        """
+        returnValue([tuple(row) for row in (
+            yield cls._notExpandedWithinMultipleQuery(len(calendarIDs)).on(
+                txn,
+                minDate=pyCalendarToSQLTimestamp(normalizeForIndex(minDate)) if minDate is not None else None,
+                maxDate=pyCalendarToSQLTimestamp(normalizeForIndex(maxDate)),
+                resourceIDs=calendarIDs))]
+        )
+
     @inlineCallbacks
     def reExpandResource(self, name, expand_start, expand_end):
         """
@@ -2053,16 +2172,48 @@ class Calendar(CommonHomeChild):
             Where=tr.CALENDAR_OBJECT_RESOURCE_ID == Parameter("resourceID")
         )
 
+    @classproperty
+    def _movePropertyUpdateQuery(cls):  # @NoSelf
+        """
+        DAL query to update a child's indexed properties to be in a new parent.
+        """
+        prop = cls._propertySchema
+        return Update(
+            {prop.CALENDAR_RESOURCE_ID: Parameter("newParentID")},
+            Where=prop.CALENDAR_OBJECT_RESOURCE_ID == Parameter("resourceID")
+        )
+
+    @classproperty
+    def _moveAttendeeUpdateQuery(cls):  # @NoSelf
+        """
+        DAL query to update a child's organizer and attendee entries to be in a new parent.
+        """
+        att = cls._attendeeSchema
+        return Update(
+            {att.CALENDAR_RESOURCE_ID: Parameter("newParentID")},
+            Where=att.CALENDAR_OBJECT_RESOURCE_ID == Parameter("resourceID")
+        )
+
     @inlineCallbacks
     def _movedObjectResource(self, child, newparent):
         """
-        Make sure time range entries have the new parent resource id.
+        Make sure time range, indexed property and attendee entries have the new parent resource id.
         """
         yield self._moveTimeRangeUpdateQuery.on(
             self._txn,
             newParentID=newparent._resourceID,
             resourceID=child._resourceID
         )
+        yield self._movePropertyUpdateQuery.on(
+            self._txn,
+            newParentID=newparent._resourceID,
+            resourceID=child._resourceID
+        )
+        yield self._moveAttendeeUpdateQuery.on(
+            self._txn,
+            newParentID=newparent._resourceID,
+            resourceID=child._resourceID
+        )
 
     # ===============================================================================
     # Group sharing
@@ -2582,6 +2733,12 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
 
     _currentDataVersion = 1
 
+    # The CALENDARSERVER value recording which properties the CALENDAR_OBJECT_PROPERTY index
+    # was last built for, and whether that was for none of them. It only changes when the
+    # index is rebuilt by the upgrader at startup, so it is read once per process.
+    _indexedPropertiesKey = "INDEXED-QUERY-PROPERTIES"
+    _indexedPropertiesEmpty = None
+
     def __init__(self, calendar, name, uid, resourceID=None, options=None):
 
         super(CalendarObject, self).__init__(calendar, name, uid, resourceID)
@@ -3868,6 +4025,7 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
         else:
             instanceIndexingRequired = getattr(self, "tr_change", True) in (None, True)
         instances = None
+        incremental = False
 
         if instanceIndexingRequired:
 
@@ -3946,6 +4104,10 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
                 recurrenceLowerLimit = None
                 recurrenceLimit = DateTime(1900, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
 
+            # When re-indexing an existing resource, only change the rows for instances that
+            # differ from what is already indexed, rather than deleting and rebuilding them all
+            incremental = doInstanceIndexing and not inserting and config.FreeBusyIndexIncrementalUpdate
+
         co = self._objectSchema
         tr = schema.TIME_RANGE
 
@@ -4031,7 +4193,7 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
                 )[0][0])
 
                 # Need to wipe the existing time-range for this and rebuild if required
-                if instanceIndexingRequired:
+                if instanceIndexingRequired and not incremental:
                     yield Delete(
                         From=tr,
                         Where=tr.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID
@@ -4050,20 +4212,139 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
             ).on(txn)
 
             # Need to wipe the existing time-range for this and rebuild
-            yield Delete(
-                From=tr,
-                Where=tr.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID
-            ).on(txn)
+            if not incremental:
+                yield Delete(
+                    From=tr,
+                    Where=tr.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID
+                ).on(txn)
 
         if instanceIndexingRequired and doInstanceIndexing:
-            yield self._addInstances(component, instances, truncateLowerLimit, isInboxItem, txn)
+            yield self._addInstances(component, instances, truncateLowerLimit, isInboxItem, txn, incremental)
+
+        yield self._updateIndexedProperties(component, inserting, txn)
+
+        yield self._updateAttendees(component, inserting, txn)
 
         yield self.removeOldEventGroupLink(component, instances, inserting, txn)
 
     @inlineCallbacks
-    def _addInstances(self, component, instances, truncateLowerLimit, isInboxItem, txn):
+    def _updateIndexedProperties(self, component, inserting, txn):
+        """
+        Rewrite the CALENDAR_OBJECT_PROPERTY rows used to match calendar-query
+        text-match tests in the database. There is one row for each instance of
+        a property listed in C{config.IndexedQueryProperties} in each top-level
+        component, holding the lower-cased property value as it would be
+        compared by L{TextMatch.match}. Existing rows are removed even when no
+        properties are configured, so that none are left stale, unless the index
+        is known to have been built for no properties.
+
+        @param component: the component being stored
+        @type component: L{Component}
+        @param inserting: whether the resource is new
+        @type inserting: C{bool}
+        @param txn: transaction to use
+        @type txn: L{Transaction}
+        """
+
+        prop = schema.CALENDAR_OBJECT_PROPERTY
+        names = set([name.upper() for name in config.IndexedQueryProperties])
+
+        if not inserting and (names or not (yield self._indexedPropertiesAreEmpty(txn))):
+            yield Delete(
+                From=prop,
+                Where=prop.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID
+            ).on(txn)
+
+        if not names:
+            returnValue(None)
+
+        rows = []
+        for subcomponent in component.subcomponents(ignore=True):
+            for property in subcomponent.properties():
+                if property.name().upper() in names:
+                    rows.append({
+                        prop.CALENDAR_RESOURCE_ID: self._calendar._resourceID,
+                        prop.CALENDAR_OBJECT_RESOURCE_ID: self._resourceID,
+                        prop.NAME: property.name().upper(),
+                        prop.VALUE: unicode(property.strvalue(), "utf-8").lower().encode("utf-8"),
+                    })
+
+        if rows:
+            yield bulkInsert(txn, rows)
+
+    @classmethod
+    @inlineCallbacks
+    def _indexedPropertiesAreEmpty(cls, txn):
+        """
+        Determine whether the CALENDAR_OBJECT_PROPERTY index was last built for no
+        properties, in which case it has no rows. That is not known until the upgrader
+        has recorded the properties, and an empty value may read back as NULL.
+
+        @param txn: transaction to use
+        @type txn: L{Transaction}
+
+        @rtype: C{bool}
+        """
+        if cls._indexedPropertiesEmpty is None:
+            cs = schema.CALENDARSERVER
+            rows = yield Select(
+                [cs.VALUE],
+                From=cs,
+                Where=cs.NAME == cls._indexedPropertiesKey,
+            ).on(txn)
+            cls._indexedPropertiesEmpty = len(rows) == 1 and not rows[0][0]
+        returnValue(cls._indexedPropertiesEmpty)
+
+    @inlineCallbacks
+    def _updateAttendees(self, component, inserting, txn):
+        """
+        Rewrite the CALENDAR_OBJECT_ATTENDEE rows that index the ORGANIZER and
+        ATTENDEE properties of each top-level component, so that attendee and
+        PARTSTAT tests can be answered without parsing the calendar data. The
+        calendar user address and PARTSTAT are stored lower-cased.
+
+        @param component: the component being stored
+        @type component: L{Component}
+        @param inserting: whether the resource is new
+        @type inserting: C{bool}
+        @param txn: transaction to use
+        @type txn: L{Transaction}
+        """
+
+        att = schema.CALENDAR_OBJECT_ATTENDEE
+
+        if not inserting:
+            yield Delete(
+                From=att,
+                Where=att.CALENDAR_OBJECT_RESOURCE_ID == self._resourceID
+            ).on(txn)
+
+        rows = []
+        for subcomponent in component.subcomponents(ignore=True):
+            rid = subcomponent.getRecurrenceIDUTC()
+            rid = rid.getText() if rid is not None else None
+            for organizer, name in ((True, "ORGANIZER"), (False, "ATTENDEE")):
+                for property in subcomponent.properties(name):
+                    partstat = property.parameterValue("PARTSTAT") if not organizer else None
+                    rows.append({
+                        att.CALENDAR_RESOURCE_ID: self._calendar._resourceID,
+                        att.CALENDAR_OBJECT_RESOURCE_ID: self._resourceID,
+                        att.RECURRENCE_ID: rid,
+                        att.ORGANIZER: organizer,
+                        att.CUA: unicode(property.value(), "utf-8").lower().encode("utf-8"),
+                        att.PARTSTAT: partstat.lower() if partstat else None,
+                    })
+
+        if rows:
+            yield bulkInsert(txn, rows)
+
+    @inlineCallbacks
+    def _addInstances(self, component, instances, truncateLowerLimit, isInboxItem, txn, incremental=False):
         """
-        Add the set of supplied instances to the store.
+        Add the set of supplied instances to the store. When C{incremental} is C{True} the
+        resource already has instances indexed, and only the ones that differ from the
+        supplied set are removed or added - e.g., extending the expansion of a long running
+        series only adds the rows for the newly expanded instances.
 
         @param component: the component whose instances are being added
         @type component: L{Component}
@@ -4075,9 +4356,13 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
         @type isInboxItem: C{bool}
         @param txn: transaction to use
         @type txn: L{Transaction}
+        @param incremental: whether existing instances are to be updated
+        @type incremental: C{bool}
         """
 
-        # TIME_RANGE table update
+        # TIME_RANGE table update - gather up all the instance details first so that
+        # they can be written out with a few multi-row inserts
+        details = []
         lowerLimitApplied = False
         for key in instances:
             instance = instances[key]
@@ -4094,14 +4379,14 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
                 lowerLimitApplied = True
                 continue
 
-            yield self._addInstanceDetails(component, instance.rid, start, end, floating, transp, fbtype, isInboxItem, txn)
+            details.append((instance.rid, start, end, floating, transp, fbtype,))
 
         # For truncated items we insert a tomb stone lower bound so that a time-range
         # query with just an end bound will match
         if lowerLimitApplied or instances.lowerLimit and len(instances.instances) == 0:
             start = DateTime(1901, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
             end = DateTime(1901, 1, 1, 1, 0, 0, tzid=Timezone.UTCTimezone)
-            yield self._addInstanceDetails(component, None, start, end, False, True, "UNKNOWN", isInboxItem, txn)
+            details.append((None, start, end, False, True, "UNKNOWN",))
 
         # Special - for unbounded recurrence we insert a value for "infinity"
         # that will allow an open-ended time-range to always match it.
@@ -4110,45 +4395,248 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
         if component.isRecurringUnbounded() or instances.limit and len(instances.instances) == 0:
             start = DateTime(2100, 1, 1, 0, 0, 0, tzid=Timezone.UTCTimezone)
             end = DateTime(2100, 1, 1, 1, 0, 0, tzid=Timezone.UTCTimezone)
-            yield self._addInstanceDetails(component, None, start, end, False, True, "UNKNOWN", isInboxItem, txn)
+            details.append((None, start, end, False, True, "UNKNOWN",))
+
+        rows = self._instanceRows(component, details, isInboxItem)
+        if incremental:
+            rows = yield self._removeChangedInstanceRows(rows, txn)
+        yield self._insertInstanceRows(rows, txn)
+
+    def _instanceRows(self, component, details, isInboxItem):
+        """
+        Build the TIME_RANGE row values, and those of any PERUSER rows that refer to
+        them, for a set of instances. The INSTANCE_ID values are not included - they
+        are allocated when the rows are inserted.
+
+        @param component: the component whose instances are being added
+        @type component: L{Component}
+        @param details: tuples of (rid, start, end, floating, transp, fbtype) for
+            each instance
+        @type details: C{list} of C{tuple}
+        @param isInboxItem: indicates if an inbox item
+        @type isInboxItem: C{bool}
+
+        @return: a C{list} of C{tuple} of (TIME_RANGE column map, C{list} of PERUSER
+            column maps)
+        """
+
+        tr = schema.TIME_RANGE
+        tpy = schema.PERUSER
+
+        def _adjustDateTime(dt, adjustment, add_duration):
+            if isinstance(adjustment, Duration):
+                return pyCalendarToSQLTimestamp((dt + adjustment) if add_duration else (dt - adjustment))
+            elif isinstance(adjustment, DateTime):
+                return pyCalendarToSQLTimestamp(normalizeForIndex(adjustment))
+            else:
+                return None
+
+        rows = []
+        for rid, start, end, floating, transp, fbtype in details:
+            timeRangeRow = {
+                tr.CALENDAR_RESOURCE_ID: self._calendar._resourceID,
+                tr.CALENDAR_OBJECT_RESOURCE_ID: self._resourceID,
+                tr.FLOATING: floating,
+                tr.START_DATE: pyCalendarToSQLTimestamp(start),
+                tr.END_DATE: pyCalendarToSQLTimestamp(end),
+                tr.FBTYPE: icalfbtype_to_indexfbtype.get(fbtype, icalfbtype_to_indexfbtype["FREE"]),
+                tr.TRANSPARENT: transp,
+            }
+
+            # Don't do transparency for inbox items - we never do freebusy on inbox
+            perUserRows = []
+            if not isInboxItem:
+                peruserdata = component.perUserData(rid)
+                for useruid, (usertransp, adjusted_start, adjusted_end) in peruserdata:
+                    if usertransp != transp or adjusted_start is not None or adjusted_end is not None:
+                        perUserRows.append({
+                            tpy.USER_ID: useruid if useruid else ".",
+                            tpy.TRANSPARENT: usertransp,
+                            tpy.ADJUSTED_START_DATE: _adjustDateTime(start, adjusted_start, add_duration=False),
+                            tpy.ADJUSTED_END_DATE: _adjustDateTime(end, adjusted_end, add_duration=True),
+                        })
+
+            rows.append((timeRangeRow, perUserRows,))
+
+        return rows
 
     @inlineCallbacks
-    def _addInstanceDetails(self, component, rid, start, end, floating, transp, fbtype, isInboxItem, txn):
+    def _insertInstanceRows(self, rows, txn):
+        """
+        Write the TIME_RANGE rows, and any PERUSER rows that refer to them, for a set
+        of instances. INSTANCE_ID values are allocated from the sequence up front so
+        that each table can be written with multi-row inserts, rather than needing one
+        round trip per instance and per-user override.
+
+        @param rows: the rows to write, as returned by L{_instanceRows}
+        @type rows: C{list} of C{tuple}
+        @param txn: transaction to use
+        @type txn: L{Transaction}
+        """
+
+        if not rows:
+            returnValue(None)
 
         tr = schema.TIME_RANGE
         tpy = schema.PERUSER
 
-        instanceid = (yield Insert({
-            tr.CALENDAR_RESOURCE_ID: self._calendar._resourceID,
-            tr.CALENDAR_OBJECT_RESOURCE_ID: self._resourceID,
-            tr.FLOATING: floating,
-            tr.START_DATE: pyCalendarToSQLTimestamp(start),
-            tr.END_DATE: pyCalendarToSQLTimestamp(end),
-            tr.FBTYPE: icalfbtype_to_indexfbtype.get(fbtype, icalfbtype_to_indexfbtype["FREE"]),
-            tr.TRANSPARENT: transp,
-        }, Return=tr.INSTANCE_ID).on(txn))[0][0]
-
-        # Don't do transparency for inbox items - we never do freebusy on inbox
-        if not isInboxItem:
-            peruserdata = component.perUserData(rid)
-            for useruid, (usertransp, adjusted_start, adjusted_end) in peruserdata:
-
-                def _adjustDateTime(dt, adjustment, add_duration):
-                    if isinstance(adjustment, Duration):
-                        return pyCalendarToSQLTimestamp((dt + adjustment) if add_duration else (dt - adjustment))
-                    elif isinstance(adjustment, DateTime):
-                        return pyCalendarToSQLTimestamp(normalizeForIndex(adjustment))
-                    else:
-                        return None
+        instanceIDs = yield allocateSequenceValues(txn, schema.INSTANCE_ID_SEQ, len(rows))
+
+        timeRangeRows = []
+        perUserRows = []
+        for instanceid, (timeRangeRow, perUserRowsForInstance) in zip(instanceIDs, rows):
+            timeRangeRow = dict(timeRangeRow)
+            timeRangeRow[tr.INSTANCE_ID] = instanceid
+            timeRangeRows.append(timeRangeRow)
+            for perUserRow in perUserRowsForInstance:
+                perUserRow = dict(perUserRow)
+                perUserRow[tpy.TIME_RANGE_INSTANCE_ID] = instanceid
+                perUserRows.append(perUserRow)
+
+        yield bulkInsert(txn, timeRangeRows)
+        if perUserRows:
+            yield bulkInsert(txn, perUserRows)
+
+    @classproperty
+    def _existingTimeRangeRowsQuery(cls):
+        tr = schema.TIME_RANGE
+        return Select(
+            [
+                tr.INSTANCE_ID,
+                tr.CALENDAR_RESOURCE_ID,
+                tr.FLOATING,
+                tr.START_DATE,
+                tr.END_DATE,
+                tr.FBTYPE,
+                tr.TRANSPARENT,
+            ],
+            From=tr,
+            Where=tr.CALENDAR_OBJECT_RESOURCE_ID == Parameter("resourceID"),
+        )
+
+    @classproperty
+    def _existingPerUserRowsQuery(cls):
+        tr = schema.TIME_RANGE
+        tpy = schema.PERUSER
+        return Select(
+            [
+                tpy.TIME_RANGE_INSTANCE_ID,
+                tpy.USER_ID,
+                tpy.TRANSPARENT,
+                tpy.ADJUSTED_START_DATE,
+                tpy.ADJUSTED_END_DATE,
+            ],
+            From=tpy.join(tr, tpy.TIME_RANGE_INSTANCE_ID == tr.INSTANCE_ID),
+            Where=tr.CALENDAR_OBJECT_RESOURCE_ID == Parameter("resourceID"),
+        )
+
+    @classmethod
+    def _removeInstancesQuery(cls, count):
+        tr = schema.TIME_RANGE
+        return Delete(
+            From=tr,
+            Where=tr.INSTANCE_ID.In(Parameter("instanceIDs", count)),
+        )
+
+    @staticmethod
+    def _instanceRowKey(calendarID, floating, start, end, fbtype, transp, perUser):
+        """
+        Generate a key for a TIME_RANGE row and its PERUSER rows, that can be used to compare
+        the rows already in the database with newly generated ones. Timestamps and booleans are
+        normalized as the database may return them in a different form to the one used when
+        writing them.
+
+        @param perUser: C{tuple} of (user id, transparent, adjusted start, adjusted end) for
+            each PERUSER row
+        @type perUser: iterable
+        """
+
+        def _timestamp(value):
+            if value is None:
+                return None
+            elif isinstance(value, datetime.datetime):
+                return value.strftime("%Y-%m-%d %H:%M:%S")
+            elif isinstance(value, datetime.date):
+                return value.strftime("%Y-%m-%d 00:00:00")
+            else:
+                value = str(value)[:19]
+                return value if len(value) != 10 else value + " 00:00:00"
 
-                if usertransp != transp or adjusted_start is not None or adjusted_end is not None:
-                    (yield Insert({
-                        tpy.TIME_RANGE_INSTANCE_ID: instanceid,
-                        tpy.USER_ID: useruid if useruid else ".",
-                        tpy.TRANSPARENT: usertransp,
-                        tpy.ADJUSTED_START_DATE: _adjustDateTime(start, adjusted_start, add_duration=False),
-                        tpy.ADJUSTED_END_DATE: _adjustDateTime(end, adjusted_end, add_duration=True),
-                    }).on(txn))
+        return (
+            calendarID,
+            bool(floating),
+            _timestamp(start),
+            _timestamp(end),
+            fbtype,
+            bool(transp),
+            frozenset([
+                (userID, bool(usertransp), _timestamp(adjustedStart), _timestamp(adjustedEnd),)
+                for userID, usertransp, adjustedStart, adjustedEnd in perUser
+            ]),
+        )
+
+    @inlineCallbacks
+    def _removeChangedInstanceRows(self, rows, txn):
+        """
+        Compare a new set of instance rows with those already in the database for this resource.
+        Existing rows that are not in the new set are removed (the PERUSER rows are removed by
+        cascade), and the new rows that are not already present are returned so they can be
+        inserted. A changed instance is therefore updated by replacing its row.
+
+        @param rows: the rows for the new instances, as returned by L{_instanceRows}
+        @type rows: C{list} of C{tuple}
+        @param txn: transaction to use
+        @type txn: L{Transaction}
+
+        @return: the new rows that need to be inserted
+        @rtype: C{list} of C{tuple}
+        """
+
+        tr = schema.TIME_RANGE
+        tpy = schema.PERUSER
+
+        perUser = collections.defaultdict(list)
+        for instanceID, userID, usertransp, adjustedStart, adjustedEnd in (
+            yield self._existingPerUserRowsQuery.on(txn, resourceID=self._resourceID)
+        ):
+            perUser[instanceID].append((userID, usertransp, adjustedStart, adjustedEnd,))
+
+        # Rows can have identical values (e.g. overridden instances that have been moved to
+        # the same time) so keep a list of instance ids for each key
+        existing = collections.defaultdict(list)
+        for instanceID, calendarID, floating, start, end, fbtype, transp in (
+            yield self._existingTimeRangeRowsQuery.on(txn, resourceID=self._resourceID)
+        ):
+            key = self._instanceRowKey(calendarID, floating, start, end, fbtype, transp, perUser[instanceID])
+            existing[key].append(instanceID)
+
+        newRows = []
+        for timeRangeRow, perUserRows in rows:
+            key = self._instanceRowKey(
+                timeRangeRow[tr.CALENDAR_RESOURCE_ID],
+                timeRangeRow[tr.FLOATING],
+                timeRangeRow[tr.START_DATE],
+                timeRangeRow[tr.END_DATE],
+                timeRangeRow[tr.FBTYPE],
+                timeRangeRow[tr.TRANSPARENT],
+                [(
+                    perUserRow[tpy.USER_ID],
+                    perUserRow[tpy.TRANSPARENT],
+                    perUserRow[tpy.ADJUSTED_START_DATE],
+                    perUserRow[tpy.ADJUSTED_END_DATE],
+                ) for perUserRow in perUserRows],
+            )
+            if existing.get(key):
+                existing[key].pop()
+            else:
+                newRows.append((timeRangeRow, perUserRows,))
+
+        removed = [instanceID for instanceIDs in existing.values() for instanceID in instanceIDs]
+        for offset in range(0, len(removed), BULK_INSERT_BATCH_SIZE):
+            batch = removed[offset:offset + BULK_INSERT_BATCH_SIZE]
+            yield self._removeInstancesQuery(len(batch)).on(txn, instanceIDs=batch)
+
+        returnValue(newRows)
 
     @inlineCallbacks
     def copyMetadata(self, other):
@@ -4172,6 +4660,19 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
             Where=co.RESOURCE_ID == self._resourceID
         ).on(self._txn)
 
+    def _textNeeded(self):
+        """
+        The text does not need to be read if the parsed data is already cached (see
+        L{component}).
+        """
+        if self._cachedComponent is not None:
+            return False
+        return not (
+            self._md5 and
+            self._dataversion >= self._currentDataVersion and
+            parsedComponentCache.contains(self._resourceID, self._md5)
+        )
+
     @inlineCallbacks
     def component(self, doUpdate=False):
         """
@@ -4184,6 +4685,15 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
 
         if self._cachedComponent is None:
 
+            # Data already parsed by an earlier transaction can be re-used without
+            # even reading the text, as long as it has not changed since
+            if self._md5 and self._dataversion >= self._currentDataVersion:
+                component = parsedComponentCache.get(self._resourceID, self._md5)
+                if component is not None:
+                    self._cachedComponent = component
+                    self._cachedCommponentPerUser = {}
+                    returnValue(self._cachedComponent)
+
             text = yield self._text()
 
             try:
@@ -4214,6 +4724,9 @@ class CalendarObject(CommonObjectResource, CalendarObjectBase):
             # Check for on-demand data upgrade
             if self._dataversion < self._currentDataVersion:
                 yield self.upgradeData(component, doUpdate)
+            elif self._md5:
+                component.setStoredMD5(self._md5)
+                parsedComponentCache.set(self._resourceID, self._md5, component, len(text))
 
             self._cachedComponent = component
             self._cachedCommponentPerUser = {}
@@ -18,7 +18,7 @@
 from pycalendar.value import Value
 
 from twext.enterprise.dal.syntax import Select, Insert, Delete, Parameter, \
-    Update, utcNowSQL
+    Update, Count, utcNowSQL
 from twext.enterprise.util import parseSQLTimestamp
 from twext.python.filepath import CachingFilePath
 
@@ -43,6 +43,7 @@ import hashlib
 import itertools
 import os
 import tempfile
+import time
 import urllib
 import uuid
 
@@ -119,6 +120,19 @@ class AttachmentStorageTransport(StorageTransportBase):
         oldSize = self._attachment.size()
         newSize = self._file.tell()
         self._file.close()
+        newMD5 = self._hash.hexdigest()
+
+        # When data is de-duplicated, identical attachments in the same home only count
+        # towards quota once
+        deduplicate = config.AttachmentDeduplication.Enabled
+        oldQuota = oldSize
+        newQuota = newSize
+        if deduplicate and not self._migrating and home:
+            oldMD5 = self._attachment.md5()
+            if oldMD5 and (yield self._attachment._otherReferences(oldMD5, home.id())):
+                oldQuota = 0
+            if (yield self._attachment._otherReferences(newMD5, home.id())):
+                newQuota = 0
 
         # Check max size for attachment
         if not self._migrating and newSize > config.MaximumAttachmentSize:
@@ -130,24 +144,27 @@ class AttachmentStorageTransport(StorageTransportBase):
         # Check overall user quota
         if not self._migrating:
             allowed = home.quotaAllowedBytes()
-            if allowed is not None and allowed < ((yield home.quotaUsedBytes()) + (newSize - oldSize)):
+            if allowed is not None and allowed < ((yield home.quotaUsedBytes()) + (newQuota - oldQuota)):
                 self._path.remove()
                 if self._creating:
                     yield self._attachment._internalRemove()
                 raise QuotaExceeded()
 
-        self._path.moveTo(self._attachment._path)
+        if deduplicate:
+            self._attachment._storeContent(self._path, newMD5)
+        else:
+            self._path.moveTo(self._attachment._attachmentPath)
 
         yield self._attachment.changed(
             self._contentType,
             self._dispositionName,
-            self._hash.hexdigest(),
+            newMD5,
             newSize
         )
 
         if not self._migrating and home:
             # Adjust quota
-            yield home.adjustQuotaUsedBytes(self._attachment.size() - oldSize)
+            yield home.adjustQuotaUsedBytes(newQuota - oldQuota)
 
             # Send change notification to home
             yield home.notifyChanged()
@@ -416,9 +433,85 @@ class Attachment(object):
             .format(self=self)
         )
 
+    _CONTENT_DIRECTORY = "Content"
+
     def _attachmentPathRoot(self):
         return self._txn._store.attachmentsPath
 
+    @property
+    def _path(self):
+        """
+        The file holding the attachment data: the shared copy in the content store
+        if there is one, otherwise the file belonging to this attachment.
+        """
+        if self._md5:
+            contentPath = self._contentPath(self._md5)
+            if contentPath.exists():
+                return contentPath
+        return self._attachmentPath
+
+    def _contentPath(self, md5):
+        """
+        The file in the content store for data with the specified MD5.
+
+        @param md5: the MD5 of the attachment data
+        @type md5: C{str}
+        @rtype: L{CachingFilePath}
+        """
+        return self._attachmentPathRoot().child(self._CONTENT_DIRECTORY).child(md5[0:2]).child(md5[2:4]).child(md5)
+
+    def _storeContent(self, path, md5):
+        """
+        Use the file at C{path} as the data for this attachment, sharing any existing
+        copy of the same data in the content store.
+
+        @param path: the file with the new data, which is moved or removed
+        @type path: L{CachingFilePath}
+        @param md5: the MD5 of the data
+        @type md5: C{str}
+        """
+        contentPath = self._contentPath(md5)
+        try:
+            # Touching the existing copy restarts its garbage collection grace period,
+            # so it cannot be removed before this transaction commits
+            os.utime(contentPath.path, None)
+        except OSError:
+            try:
+                contentPath.parent().makedirs()
+            except Exception:
+                # OK to fail if it already exists, otherwise must raise
+                if not contentPath.parent().exists():
+                    raise
+            path.moveTo(contentPath)
+        else:
+            path.remove()
+
+        # Any data stored before de-duplication was enabled is no longer needed
+        if self._attachmentPath.exists():
+            self._txn.postCommit(self.removePaths)
+
+    @inlineCallbacks
+    def _otherReferences(self, md5, homeID=None):
+        """
+        The number of other attachments with the same data.
+
+        @param md5: the MD5 of the attachment data
+        @type md5: C{str}
+        @param homeID: if not C{None}, only count attachments in this home
+        @type homeID: C{int}
+        @rtype: C{int}
+        """
+        att = self._attachmentSchema
+        where = (att.MD5 == md5).And(att.ATTACHMENT_ID != self._attachmentID)
+        if homeID is not None:
+            where = where.And(att.CALENDAR_HOME_RESOURCE_ID == homeID)
+        rows = (yield Select(
+            [Count(att.ATTACHMENT_ID)],
+            From=att,
+            Where=where,
+        ).on(self._txn))
+        returnValue(rows[0][0])
+
     @inlineCallbacks
     def initFromStore(self):
         """
@@ -481,6 +574,9 @@ class Attachment(object):
     def retrieve(self, protocol):
         return AttachmentRetrievalTransport(self._path).start(protocol)
 
+    def retrieveFile(self):
+        return self._path.open()
+
     def changed(self, contentType, dispositionName, md5, size):
         raise NotImplementedError
 
@@ -499,6 +595,8 @@ class Attachment(object):
         if adjustQuota:
             home = (yield self._txn.calendarHomeWithResourceID(self._ownerHomeID))
             if home:
+                if config.AttachmentDeduplication.Enabled and self._md5 and (yield self._otherReferences(self._md5, home.id())):
+                    oldSize = 0
                 yield home.adjustQuotaUsedBytes(-oldSize)
 
                 # Send change notification to home
@@ -506,17 +604,18 @@ class Attachment(object):
 
     def removePaths(self):
         """
-        Remove the actual file and up to attachment parent directory if empty.
+        Remove the actual file and up to attachment parent directory if empty. Data
+        in the content store is left for L{removeUnreferencedContent}.
         """
-        if self._path.exists():
-            self._path.remove()
+        if self._attachmentPath.exists():
+            self._attachmentPath.remove()
         self.removeParentPaths()
 
     def removeParentPaths(self):
         """
         Remove up to attachment parent directory if empty.
         """
-        parent = self._path.parent()
+        parent = self._attachmentPath.parent()
         toppath = self._attachmentPathRoot().path
         while parent.path != toppath:
             if len(parent.listdir()) == 0:
@@ -559,7 +658,7 @@ class Attachment(object):
             else:
                 attachment = ManagedAttachment(txn, attachmentID, None, None)
             attachment = (yield attachment.initFromStore())
-            if attachment._path.exists():
+            if attachment._attachmentPath.exists():
                 attachment.removePaths()
 
         yield Delete(
@@ -582,6 +681,58 @@ class Attachment(object):
             ),
         ).on(txn)
 
+    @classmethod
+    @inlineCallbacks
+    def removeUnreferencedContent(cls, txn, gracePeriod, batchSize=100):
+        """
+        Garbage collect the content store: remove data that no attachment refers to and
+        that has not been stored or re-used within the grace period.
+
+        @param txn: the transaction to use
+        @type txn: L{CommonStoreTransaction}
+        @param gracePeriod: minimum age in seconds of data to remove
+        @type gracePeriod: C{int}
+        @param batchSize: number of MD5s to look up at a time
+        @type batchSize: C{int}
+
+        @return: the number of files removed
+        @rtype: C{int}
+        """
+        contentRoot = txn._store.attachmentsPath.child(cls._CONTENT_DIRECTORY)
+        if not contentRoot.exists():
+            returnValue(0)
+
+        cutoff = time.time() - gracePeriod
+        candidates = []
+        for dirpath, _ignore_dirnames, filenames in os.walk(contentRoot.path):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if len(filename) == 32 and os.stat(path).st_mtime < cutoff:
+                    candidates.append((filename, path,))
+
+        att = cls._attachmentSchema
+        count = 0
+        for offset in range(0, len(candidates), batchSize):
+            batch = dict(candidates[offset:offset + batchSize])
+            rows = (yield Select(
+                [att.MD5],
+                From=att,
+                Where=att.MD5.In(Parameter("md5s", len(batch))),
+            ).on(txn, md5s=batch.keys()))
+            for md5 in set(batch.keys()) - set([row[0] for row in rows]):
+                # Move the file aside before checking whether it was re-used (touched) in the
+                # meantime, so that a concurrent store either sees it missing or has touched it
+                path = batch[md5]
+                removing = path + ".removing"
+                os.rename(path, removing)
+                if os.stat(removing).st_mtime >= cutoff:
+                    os.rename(removing, path)
+                else:
+                    os.remove(removing)
+                    count += 1
+
+        returnValue(count)
+
     # IDataStoreObject
     def contentType(self):
         return self._contentType
@@ -644,7 +795,7 @@ class DropBoxAttachment(Attachment):
 
         # File system paths need to exist
         try:
-            attachment._path.parent().makedirs()
+            attachment._attachmentPath.parent().makedirs()
         except:
             pass
 
@@ -658,7 +809,7 @@ class DropBoxAttachment(Attachment):
         returnValue(attachment)
 
     @property
-    def _path(self):
+    def _attachmentPath(self):
         # Use directory hashing scheme based on MD5 of dropboxID
         hasheduid = hashlib.md5(self._dropboxID).hexdigest()
         attachmentRoot = self._attachmentPathRoot().child(hasheduid[0:2]).child(hasheduid[2:4]).child(hasheduid)
@@ -742,17 +893,19 @@ class DropBoxAttachment(Attachment):
         if mattach is None:
             raise AttachmentMigrationFailed
 
-        # Then move the file on disk from the old path to the new one
-        try:
-            mattach._path.parent().makedirs()
-        except Exception:
-            # OK to fail if it already exists, otherwise must raise
-            if not mattach._path.parent().exists():
-                raise
-        oldpath = self._path
-        newpath = mattach._path
-        oldpath.moveTo(newpath)
-        self.removeParentPaths()
+        # Then move the file on disk from the old path to the new one (data in the
+        # content store does not need to move)
+        oldpath = self._attachmentPath
+        if oldpath.exists():
+            try:
+                mattach._attachmentPath.parent().makedirs()
+            except Exception:
+                # OK to fail if it already exists, otherwise must raise
+                if not mattach._attachmentPath.parent().exists():
+                    raise
+            newpath = mattach._attachmentPath
+            oldpath.moveTo(newpath)
+            self.removeParentPaths()
 
         returnValue(mattach)
 
@@ -804,7 +957,7 @@ class ManagedAttachment(Attachment):
 
         # File system paths need to exist
         try:
-            attachment._path.parent().makedirs()
+            attachment._attachmentPath.parent().makedirs()
         except:
             pass
 
@@ -1010,7 +1163,7 @@ class ManagedAttachment(Attachment):
         returnValue(obj)
 
     @property
-    def _path(self):
+    def _attachmentPath(self):
         # Use directory hashing scheme based on MD5 of attachmentID
         hasheduid = hashlib.md5(str(self._attachmentID)).hexdigest()
         return self._attachmentPathRoot().child(hasheduid[0:2]).child(hasheduid[2:4]).child(hasheduid)
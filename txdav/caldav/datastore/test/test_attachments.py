@@ -41,6 +41,7 @@ from txdav.common.datastore.test.util import CommonCommonTests, \
 
 import hashlib
 import os
+import time
 
 """
 Tests for txdav.caldav.datastore.sql attachment handling.
@@ -204,6 +205,8 @@ END:VCALENDAR
         self.assertProvides(IAttachment, attachment)
         data = yield self.attachmentToString(attachment)
         self.assertEquals(data, "new attachment text")
+        with attachment.retrieveFile() as f:
+            self.assertEquals(f.read(), "new attachment text")
         contentType = attachment.contentType()
         self.assertIsInstance(contentType, MimeType)
         self.assertEquals(contentType, MimeType("text", "x-fixture"))
@@ -1386,6 +1389,76 @@ class ManagedAttachmentTests(AttachmentTests):
         yield self.commit()
         self.assertEqual(quota, 0)
 
+    @inlineCallbacks
+    def test_deduplicatedAttachments(self):
+        """
+        With de-duplication enabled, attachments with the same data share one file in
+        the content store and only count towards quota once per home. The file is
+        garbage collected once no attachment refers to it.
+        """
+        self.patch(config.AttachmentDeduplication, "Enabled", True)
+        self.patch(config.AttachmentDeduplication, "GracePeriodSeconds", 60)
+
+        def backdate(path):
+            old = time.time() - 120
+            os.utime(path, (old, old,))
+
+        obj = yield self.calendarObjectUnderTest()
+        obj2 = yield self.calendarObjectUnderTest(name="2.ics")
+        att1 = yield self.stringToAttachment(obj, "sample1.attachment", "shared data")
+        att2 = yield self.stringToAttachment(obj2, "sample2.attachment", "shared data")
+        mid1 = att1.managedID()
+        mid2 = att2.managedID()
+        self.assertEqual(att1._path, att2._path)
+        self.assertEqual(att1._path, att1._contentPath(hashlib.md5("shared data").hexdigest()))
+        self.assertFalse(att1._attachmentPath.exists())
+        self.assertFalse(att2._attachmentPath.exists())
+        self.assertEqual((yield self.attachmentToString(att2)), "shared data")
+        contentPath = att1._path.path
+        yield self.commit()
+
+        home = yield self.homeUnderTest()
+        self.assertEqual((yield home.quotaUsedBytes()), len("shared data"))
+        yield self.commit()
+
+        # Removing one attachment leaves the data and quota for the other
+        obj = yield self.calendarObjectUnderTest()
+        yield obj.removeManagedAttachmentWithID(mid1)
+        yield self.commit()
+
+        home = yield self.homeUnderTest()
+        self.assertEqual((yield home.quotaUsedBytes()), len("shared data"))
+        yield self.commit()
+
+        backdate(contentPath)
+        count = yield self.transactionUnderTest().removeOrphanedAttachments()
+        yield self.commit()
+        self.assertEqual(count, 0)
+        self.assertTrue(os.path.exists(contentPath))
+
+        # Removing the last one leaves the data for garbage collection
+        obj = yield self.calendarObjectUnderTest(name="2.ics")
+        yield obj.removeManagedAttachmentWithID(mid2)
+        yield self.commit()
+
+        home = yield self.homeUnderTest()
+        self.assertEqual((yield home.quotaUsedBytes()), 0)
+        yield self.commit()
+        self.assertTrue(os.path.exists(contentPath))
+
+        # Recently used data is not removed
+        os.utime(contentPath, None)
+        count = yield self.transactionUnderTest().removeOrphanedAttachments()
+        yield self.commit()
+        self.assertEqual(count, 0)
+        self.assertTrue(os.path.exists(contentPath))
+
+        backdate(contentPath)
+        count = yield self.transactionUnderTest().removeOrphanedAttachments()
+        yield self.commit()
+        self.assertEqual(count, 1)
+        self.assertFalse(os.path.exists(contentPath))
+
     @inlineCallbacks
     def test_resourceCheckAttachments_clientRemovesParameters(self):
         """
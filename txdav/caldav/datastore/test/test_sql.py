@@ -20,6 +20,7 @@ L{txdav.caldav.datastore.test.common}.
 """
 
 from pycalendar.datetime import DateTime
+from pycalendar.duration import Duration
 from pycalendar.timezone import Timezone
 from pycalendar.value import Value
 
@@ -52,6 +53,7 @@ from txdav.caldav.datastore.scheduling.implicit import ImplicitScheduler
 from txdav.caldav.datastore.scheduling.itip import iTIPRequestStatus
 from txdav.caldav.datastore.scheduling.processing import ImplicitProcessor
 from txdav.caldav.datastore.scheduling.scheduler import ScheduleResponseQueue
+from txdav.caldav.datastore import sql as caldav_sql
 from txdav.caldav.datastore.sql import CalendarStoreFeatures, CalendarObject
 from txdav.common.datastore.sql import ECALENDARTYPE, CommonObjectResource, \
     CommonStoreTransactionMonitor
@@ -63,7 +65,8 @@ from txdav.caldav.datastore.test.test_file import setUpCalendarStore
 from txdav.caldav.datastore.test.util import DateTimeSubstitutionsMixin
 from txdav.common.datastore.test.util import populateCalendarsFrom, \
     CommonCommonTests, updateToCurrentYear
-from txdav.caldav.datastore.util import _migrateCalendar, migrateHome
+from txdav.caldav.datastore.util import _migrateCalendar, migrateHome, \
+    parsedComponentCache
 from txdav.caldav.icalendarstore import ComponentUpdateState, InvalidDefaultCalendar, \
     InvalidSplit, UnknownTimezone
 from txdav.common.icommondatastore import NoSuchObjectResourceError, \
@@ -1468,6 +1471,387 @@ END:VCALENDAR
         result = yield newcalendar.notExpandedWithin(testMin, testMax)
         self.assertEqual(result, ["indexing.ics"])
 
+    @inlineCallbacks
+    def test_addInstances_bulk(self):
+        """
+        Test that L{CalendarObject._addInstances} writes one TIME_RANGE row per instance, plus
+        the matching PERUSER rows, using multi-row inserts rather than one statement per row.
+        """
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:instance
+DTSTART:%(now)s0102T140000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+RRULE:FREQ=DAILY;COUNT=20
+SUMMARY:instance
+END:VEVENT
+BEGIN:X-CALENDARSERVER-PERUSER
+UID:instance
+X-CALENDARSERVER-PERUSER-UID:user01
+BEGIN:X-CALENDARSERVER-PERINSTANCE
+TRANSP:TRANSPARENT
+END:X-CALENDARSERVER-PERINSTANCE
+END:X-CALENDARSERVER-PERUSER
+END:VCALENDAR
+""".replace("\n", "\r\n") % self.nowYear
+
+        self.patch(config, "FreeBusyIndexDelayedExpand", False)
+
+        inserts = []
+        original_bulkInsert = caldav_sql.bulkInsert
+
+        def _bulkInsert(txn, rows, *args, **kwargs):
+            inserts.append(len(rows))
+            return original_bulkInsert(txn, rows, *args, **kwargs)
+        self.patch(caldav_sql, "bulkInsert", _bulkInsert)
+
+        calendar = yield self.calendarUnderTest()
+        component = Component.fromString(caldata)
+        calendarObject = yield calendar.createCalendarObjectWithName("indexing.ics", component)
+        resourceID = calendarObject._resourceID
+        yield self.commit()
+
+        self.assertEqual(inserts, [20, 20])
+
+        tr = schema.TIME_RANGE
+        tpy = schema.PERUSER
+        rows = yield Select(
+            [tr.INSTANCE_ID, ],
+            From=tr,
+            Where=tr.CALENDAR_OBJECT_RESOURCE_ID == resourceID,
+        ).on(self.transactionUnderTest())
+        self.assertEqual(len(rows), 20)
+
+        peruser = yield Select(
+            [tpy.TIME_RANGE_INSTANCE_ID, tpy.TRANSPARENT, ],
+            From=tpy,
+            Where=tpy.TIME_RANGE_INSTANCE_ID.In(Parameter("ids", len(rows))),
+        ).on(self.transactionUnderTest(), ids=[row[0] for row in rows])
+        self.assertEqual(
+            sorted([row[0] for row in peruser]),
+            sorted([row[0] for row in rows]),
+        )
+        self.assertTrue(all([row[1] for row in peruser]))
+        yield self.commit()
+
+    @inlineCallbacks
+    def test_addInstances_incremental(self):
+        """
+        Test that re-indexing an existing resource only replaces the TIME_RANGE rows for
+        instances that changed, and that re-expanding over a longer range keeps the
+        existing rows and only adds the new ones.
+        """
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:instance
+DTSTART:%(now)s0102T140000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+RRULE:FREQ=DAILY;COUNT=20
+%(exdate)sSUMMARY:instance
+END:VEVENT
+END:VCALENDAR
+"""
+
+        self.patch(config, "FreeBusyIndexDelayedExpand", False)
+        self.patch(config, "FreeBusyIndexIncrementalUpdate", True)
+
+        tr = schema.TIME_RANGE
+
+        @inlineCallbacks
+        def _instanceIDs(resourceID, txn):
+            rows = yield Select(
+                [tr.INSTANCE_ID, ],
+                From=tr,
+                Where=tr.CALENDAR_OBJECT_RESOURCE_ID == resourceID,
+            ).on(txn)
+            returnValue(set([row[0] for row in rows]))
+
+        calendar = yield self.calendarUnderTest()
+        component = Component.fromString((caldata % {"now": self.nowYear["now"], "exdate": ""}).replace("\n", "\r\n"))
+        calendarObject = yield calendar.createCalendarObjectWithName("indexing.ics", component)
+        resourceID = calendarObject._resourceID
+        yield self.commit()
+
+        ids1 = yield _instanceIDs(resourceID, self.transactionUnderTest())
+        self.assertEqual(len(ids1), 20)
+        yield self.commit()
+
+        # Remove one instance - all the other rows are left as-is
+        calendarObject = yield self.calendarObjectUnderTest(name="indexing.ics")
+        calendarObject.tr_change = True
+        component = Component.fromString((caldata % {
+            "now": self.nowYear["now"],
+            "exdate": "EXDATE:%(now)s0105T140000Z\n" % self.nowYear,
+        }).replace("\n", "\r\n"))
+        yield calendarObject.setComponent(component)
+        yield self.commit()
+
+        ids2 = yield _instanceIDs(resourceID, self.transactionUnderTest())
+        self.assertEqual(len(ids2), 19)
+        self.assertTrue(ids2.issubset(ids1))
+        yield self.commit()
+
+        # Re-index with no change - no rows are replaced
+        calendarObject = yield self.calendarObjectUnderTest(name="indexing.ics")
+        yield calendarObject.updateDatabase((yield calendarObject.component()), reCreate=True)
+        ids3 = yield _instanceIDs(resourceID, self.transactionUnderTest())
+        self.assertEqual(ids3, ids2)
+        yield self.commit()
+
+    @inlineCallbacks
+    def test_reExpandResource_incremental(self):
+        """
+        Test that L{Calendar.reExpandResource} keeps the existing TIME_RANGE rows when
+        extending the expansion of an unbounded recurrence.
+        """
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:instance
+DTSTART:%(now)s0102T140000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+RRULE:FREQ=WEEKLY
+SUMMARY:instance
+END:VEVENT
+END:VCALENDAR
+""".replace("\n", "\r\n") % self.nowYear
+
+        self.patch(config, "FreeBusyIndexDelayedExpand", False)
+        self.patch(config, "FreeBusyIndexIncrementalUpdate", True)
+
+        tr = schema.TIME_RANGE
+
+        calendar = yield self.calendarUnderTest()
+        calendarObject = yield calendar.createCalendarObjectWithName("indexing.ics", Component.fromString(caldata))
+        resourceID = calendarObject._resourceID
+        yield self.commit()
+
+        query = Select(
+            [tr.INSTANCE_ID, ],
+            From=tr,
+            Where=tr.CALENDAR_OBJECT_RESOURCE_ID == resourceID,
+        )
+        ids1 = set([row[0] for row in (yield query.on(self.transactionUnderTest()))])
+        yield self.commit()
+
+        calendar = yield self.calendarUnderTest()
+        expand_end = DateTime.getToday() + Duration(days=2 * 365)
+        yield calendar.reExpandResource("indexing.ics", None, expand_end)
+        yield self.commit()
+
+        ids2 = set([row[0] for row in (yield query.on(self.transactionUnderTest()))])
+        self.assertTrue(ids1.issubset(ids2))
+        self.assertTrue(len(ids2) > len(ids1) + 50)
+        yield self.commit()
+
+    @inlineCallbacks
+    def test_component_parsedCache(self):
+        """
+        Test that L{CalendarObject.component} re-uses calendar data parsed by an earlier
+        transaction, hands out a separate copy each time, and parses again once the data
+        has changed.
+        """
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:instance
+DTSTART:%(now)s0102T140000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+SUMMARY:%(summary)s
+END:VEVENT
+END:VCALENDAR
+""".replace("\n", "\r\n")
+
+        self.patch(config, "ParsedComponentCacheSize", 1000000)
+        parsedComponentCache.clear()
+
+        calendar = yield self.calendarUnderTest()
+        yield calendar.createCalendarObjectWithName("cached.ics", Component.fromString(caldata % {"now": self.nowYear["now"], "summary": "1"}))
+        yield self.commit()
+
+        calendarObject = yield self.calendarObjectUnderTest(name="cached.ics")
+        component1 = yield calendarObject.component()
+        yield self.commit()
+        self.assertEqual(parsedComponentCache.stats()["misses"], 1)
+        self.assertEqual(len(parsedComponentCache), 1)
+
+        # Changes to a component handed out are not seen by later transactions
+        component1.mainComponent().replaceProperty(Property("SUMMARY", "changed"))
+
+        calendarObject = yield self.calendarObjectUnderTest(name="cached.ics")
+        component2 = yield calendarObject.component()
+        self.assertEqual(parsedComponentCache.stats()["hits"], 1)
+        self.assertEqual(component2.mainComponent().propertyValue("SUMMARY"), "1")
+        self.assertTrue(calendarObject._textData is None)
+        yield calendarObject.setComponent(Component.fromString(caldata % {"now": self.nowYear["now"], "summary": "2"}))
+        yield self.commit()
+
+        calendarObject = yield self.calendarObjectUnderTest(name="cached.ics")
+        component3 = yield calendarObject.component()
+        self.assertEqual(parsedComponentCache.stats()["hits"], 1)
+        self.assertEqual(parsedComponentCache.stats()["misses"], 2)
+        self.assertEqual(component3.mainComponent().propertyValue("SUMMARY"), "2")
+        yield self.commit()
+
+    @inlineCallbacks
+    def test_search_indexedProperty(self):
+        """
+        Test that L{Calendar.search} matches text on properties in
+        C{config.IndexedQueryProperties} via the property index, and that the index
+        follows changes to the resource.
+        """
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:%(uid)s
+DTSTART:%(now)s0102T140000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+SUMMARY:%(summary)s
+END:VEVENT
+END:VCALENDAR
+""".replace("\n", "\r\n")
+
+        self.patch(config, "IndexedQueryProperties", ["SUMMARY", "LOCATION"])
+
+        def _filter(text, negate=False):
+            textmatch = caldavxml.TextMatch.fromString(text, True)
+            if negate:
+                textmatch.attributes["negate-condition"] = "yes"
+            filter = Filter(caldavxml.Filter(
+                caldavxml.ComponentFilter(
+                    caldavxml.ComponentFilter(
+                        caldavxml.PropertyFilter(textmatch, name="SUMMARY"),
+                        name="VEVENT",
+                    ),
+                    name="VCALENDAR",
+                )
+            ))
+            filter.settimezone(None)
+            return filter
+
+        @inlineCallbacks
+        def _search(text, negate=False):
+            calendar = yield self.calendarUnderTest()
+            results = yield calendar.search(_filter(text, negate))
+            yield self.commit()
+            returnValue(sorted([row[0] for row in results]))
+
+        calendar = yield self.calendarUnderTest()
+        for name, summary in (("meeting.ics", "Team Meeting"), ("lunch.ics", "Lunch")):
+            yield calendar.createCalendarObjectWithName(name, Component.fromString(caldata % {
+                "uid": name, "now": self.nowYear["now"], "summary": summary,
+            }))
+        yield self.commit()
+
+        self.assertEqual((yield _search("MEETING")), ["meeting.ics"])
+        self.assertEqual((yield _search("meeting", negate=True)), ["lunch.ics"])
+
+        calendarObject = yield self.calendarObjectUnderTest(name="meeting.ics")
+        yield calendarObject.setComponent(Component.fromString(caldata % {
+            "uid": "meeting.ics", "now": self.nowYear["now"], "summary": "Team Lunch",
+        }))
+        yield self.commit()
+
+        self.assertEqual((yield _search("meeting")), [])
+        self.assertEqual((yield _search("lunch")), ["lunch.ics", "meeting.ics"])
+
+    @inlineCallbacks
+    def test_search_attendee(self):
+        """
+        Test that L{Calendar.search} matches ATTENDEE PARTSTAT via the attendee index,
+        and that the index follows changes to the resource.
+        """
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:%(uid)s
+DTSTART:%(now)s0102T140000Z
+DURATION:PT1H
+CREATED:20060102T190000Z
+DTSTAMP:20051222T210507Z
+ORGANIZER:mailto:organizer@example.com
+ATTENDEE:mailto:organizer@example.com
+ATTENDEE;PARTSTAT=%(partstat)s:mailto:User01@example.com
+END:VEVENT
+END:VCALENDAR
+""".replace("\n", "\r\n")
+
+        def _filter(partstat):
+            filter = Filter(caldavxml.Filter(
+                caldavxml.ComponentFilter(
+                    caldavxml.ComponentFilter(
+                        caldavxml.PropertyFilter(
+                            caldavxml.TextMatch.fromString("mailto:user01@example.com", True),
+                            caldavxml.ParameterFilter(
+                                caldavxml.TextMatch.fromString(partstat, True),
+                                name="PARTSTAT",
+                            ),
+                            name="ATTENDEE",
+                        ),
+                        name="VEVENT",
+                    ),
+                    name="VCALENDAR",
+                )
+            ))
+            filter.settimezone(None)
+            return filter
+
+        @inlineCallbacks
+        def _search(partstat):
+            calendar = yield self.calendarUnderTest()
+            results = yield calendar.search(_filter(partstat))
+            yield self.commit()
+            returnValue(sorted([row[0] for row in results]))
+
+        calendar = yield self.calendarUnderTest()
+        for name, partstat in (("invite.ics", "NEEDS-ACTION"), ("accepted.ics", "ACCEPTED")):
+            yield calendar._createCalendarObjectWithNameInternal(name, Component.fromString(caldata % {
+                "uid": name, "now": self.nowYear["now"], "partstat": partstat,
+            }), internal_state=ComponentUpdateState.RAW)
+        yield self.commit()
+
+        self.assertEqual((yield _search("needs-action")), ["invite.ics"])
+        self.assertEqual((yield _search("ACCEPTED")), ["accepted.ics"])
+
+        calendarObject = yield self.calendarObjectUnderTest(name="invite.ics")
+        yield calendarObject._setComponentInternal(Component.fromString(caldata % {
+            "uid": "invite.ics", "now": self.nowYear["now"], "partstat": "ACCEPTED",
+        }), internal_state=ComponentUpdateState.RAW)
+        yield self.commit()
+
+        self.assertEqual((yield _search("needs-action")), [])
+        self.assertEqual((yield _search("accepted")), ["accepted.ics", "invite.ics"])
+
     @inlineCallbacks
     def test_setComponent_no_instance_indexing(self):
         """
@@ -1621,6 +2005,35 @@ END:VCALENDAR
         prop = caldavxml.CalendarDescription.fromString("p2")
         self.assertEqual(resources[0].properties()[PropertyName.fromElement(prop)], prop)
 
+    @inlineCallbacks
+    def test_loadObjectResourcesWithName_withText(self):
+        """
+        L{CommonHomeChild.objectResourcesWithNames} with C{withText} loads the data for
+        the object resources, except for those whose parsed data is already cached.
+        """
+
+        self.patch(config, "ParsedComponentCacheSize", 1000000)
+        parsedComponentCache.clear()
+
+        # Cache the parsed data for one resource
+        obj = yield self.calendarObjectUnderTest(name="1.ics")
+        yield obj.component()
+        yield self.commit()
+
+        cal = yield self.calendarUnderTest()
+        resources = yield cal.objectResourcesWithNames(("1.ics", "2.ics", "3.ics",))
+        self.assertEqual(set([resource._textData is None for resource in resources]), set((True,)))
+
+        self.patch(CommonObjectResource, "BATCH_LOAD_SIZE", 2)
+        resources = yield cal.objectResourcesWithNames(("1.ics", "2.ics", "3.ics",), withText=True)
+        texts = dict([(resource.name(), resource._textData,) for resource in resources])
+        self.assertEqual(texts["1.ics"], None)
+        for name in ("2.ics", "3.ics",):
+            self.assertNotEqual(texts[name], None)
+            obj = yield cal.calendarObjectWithName(name)
+            component = yield obj.component()
+            self.assertEqual(component.resourceUID(), obj.uid())
+
     @inlineCallbacks
     def test_objectResourceWithID(self):
         """
@@ -2225,6 +2638,109 @@ END:VCALENDAR
 """))
         yield self.commit()
 
+    @inlineCallbacks
+    def test_resourceNamesSinceTokenLimit(self):
+        """
+        Test that L{Calendar.resourceNamesSinceToken} truncates its results when a limit is
+        given, and returns the point to resume from so that all the changes can be paged through.
+        """
+
+        caldata = """BEGIN:VCALENDAR
+VERSION:2.0
+CALSCALE:GREGORIAN
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:paging-%(uid)s
+DTSTART:20080601T120000Z
+DTEND:20080601T130000Z
+DTSTAMP:20080601T120000Z
+SUMMARY:paging
+END:VEVENT
+END:VCALENDAR
+"""
+
+        # Initial sync is paged by name
+        calendar = yield self.calendarUnderTest()
+        st = yield calendar.syncToken()
+        names = []
+        startAfter = None
+        while True:
+            changed, deleted, invalid, truncatedAt = yield calendar.resourceNamesSinceToken(None, limit=2, startAfter=startAfter)
+            self.assertTrue(len(changed) <= 2)
+            self.assertEqual(deleted, [])
+            names.extend(changed)
+            if truncatedAt is None:
+                break
+            self.assertEqual(truncatedAt, changed[-1])
+            startAfter = truncatedAt
+        self.assertEqual(names, ["1.ics", "2.ics", "3.ics", "4.ics", "5.ics", ])
+        yield self.commit()
+
+        # Incremental sync is paged by revision
+        calendar = yield self.calendarUnderTest()
+        for ctr in range(5):
+            yield calendar.createCalendarObjectWithName("new%d.ics" % (ctr,), Component.fromString(caldata % {"uid": ctr}))
+        obj = yield calendar.calendarObjectWithName("1.ics")
+        yield obj.remove()
+        yield self.commit()
+
+        calendar = yield self.calendarUnderTest()
+        allChanged = []
+        allDeleted = []
+        revision = self.token2revision(st)
+        pages = 0
+        while True:
+            changed, deleted, invalid, truncatedAt = yield calendar.resourceNamesSinceToken(revision, limit=2)
+            self.assertTrue(len(changed) + len(deleted) <= 2)
+            allChanged.extend(changed)
+            allDeleted.extend(deleted)
+            pages += 1
+            if truncatedAt is None:
+                break
+            self.assertTrue(truncatedAt > revision)
+            revision = truncatedAt
+        self.assertEqual(pages, 3)
+        self.assertEqual(allChanged, ["new%d.ics" % (ctr,) for ctr in range(5)])
+        self.assertEqual(allDeleted, ["1.ics"])
+
+        # No limit returns everything in one go
+        changed, deleted, invalid = yield calendar.resourceNamesSinceToken(self.token2revision(st))
+        self.assertEqual(set(changed), set(allChanged))
+        self.assertEqual(set(deleted), set(allDeleted))
+        yield self.commit()
+
+        # A revision with more changes than the limit is returned whole, with a token
+        # that moves past it
+        rev = schema.CALENDAR_OBJECT_REVISIONS
+        calendar = yield self.calendarUnderTest()
+        revisions = yield Select(
+            [rev.REVISION],
+            From=rev,
+            Where=(rev.RESOURCE_ID == calendar._resourceID).And(
+                rev.RESOURCE_NAME.In(Parameter("names", 3))),
+        ).on(self.transactionUnderTest(), names=["new0.ics", "new1.ics", "new2.ics"])
+        shared = max([row[0] for row in revisions])
+        yield Update(
+            {rev.REVISION: shared},
+            Where=(rev.RESOURCE_ID == calendar._resourceID).And(
+                rev.RESOURCE_NAME.In(Parameter("names", 3))),
+        ).on(self.transactionUnderTest(), names=["new0.ics", "new1.ics", "new2.ics"])
+        yield self.commit()
+
+        calendar = yield self.calendarUnderTest()
+        changed, deleted, invalid, truncatedAt = yield calendar.resourceNamesSinceToken(self.token2revision(st), limit=2)
+        self.assertEqual(sorted(changed), ["new0.ics", "new1.ics", "new2.ics"])
+        self.assertEqual(truncatedAt, shared)
+        allChanged = []
+        allDeleted = []
+        revision = truncatedAt
+        while revision is not None:
+            changed, deleted, invalid, revision = yield calendar.resourceNamesSinceToken(revision, limit=2)
+            allChanged.extend(changed)
+            allDeleted.extend(deleted)
+        self.assertEqual(allChanged, ["new3.ics", "new4.ics"])
+        self.assertEqual(allDeleted, ["1.ics"])
+
 
 class SyncTests(CommonCommonTests, unittest.TestCase):
     """
@@ -2715,6 +3231,9 @@ END:VCALENDAR
         ).on(self.transactionUnderTest())
         yield self.commit()
 
+        # The MD5 is unchanged, so make sure the broken data is what gets parsed
+        parsedComponentCache.clear()
+
         # Write user01 data - will trigger fix
         cobj = yield self.calendarObjectUnderTest(name="data1.ics", calendar_name="calendar", home="user01")
         yield cobj.setComponent(Component.fromString(data_update1))
@@ -21,6 +21,8 @@ Utility logic common to multiple backend implementations.
 
 import os
 
+from collections import OrderedDict
+
 from zope.interface.declarations import implements
 
 from txdav.caldav.icalendarstore import IAttachmentStorageTransport, \
@@ -38,6 +40,7 @@ from twistedcaldav.ical import InvalidICalendarDataError
 from twistedcaldav.ical import Component as VComponent
 
 from twistedcaldav import ical
+from twistedcaldav.config import config
 from twistedcaldav.datafilters.hiddeninstance import HiddenInstanceFilter
 from twistedcaldav.datafilters.privateevents import PrivateEventFilter
 from twistedcaldav.ical import PERUSER_UID
@@ -460,6 +463,117 @@ class CalendarObjectBase(object):
         returnValue(component)
 
 
+class ParsedComponentCache(object):
+    """
+    A cache of parsed and validated calendar data shared by all the transactions
+    in the process, so that a resource read again by a later request (e.g., by a
+    multiget, a scheduling operation or a free-busy lookup) does not need to be
+    fetched and re-parsed when its data has not changed. Entries are keyed by
+    (resource id, MD5) and kept in least-recently-used order; the oldest entries
+    are discarded once the total size of their calendar data exceeds
+    C{config.ParsedComponentCacheSize} bytes.
+
+    Callers always get their own duplicate of a cached component, so they are
+    free to modify it.
+    """
+
+    def __init__(self):
+        self._entries = OrderedDict()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, resourceID, md5):
+        """
+        Return a duplicate of the component cached for a resource, or L{None}.
+
+        @param resourceID: the resource id of the calendar object
+        @type resourceID: L{int}
+        @param md5: the MD5 of the calendar object's data
+        @type md5: L{str}
+        @rtype: L{VComponent} or L{None}
+        """
+        key = (resourceID, md5,)
+        try:
+            component, size = self._entries.pop(key)
+        except KeyError:
+            self.misses += 1
+            return None
+        self._entries[key] = (component, size,)
+        self.hits += 1
+        return component.duplicate()
+
+    def contains(self, resourceID, md5):
+        """
+        Whether a component is cached for a resource. This does not count as a use
+        of the entry.
+
+        @param resourceID: the resource id of the calendar object
+        @type resourceID: L{int}
+        @param md5: the MD5 of the calendar object's data
+        @type md5: L{str}
+        @rtype: L{bool}
+        """
+        return (resourceID, md5,) in self._entries
+
+    def set(self, resourceID, md5, component, size):
+        """
+        Cache a duplicate of a component for a resource.
+
+        @param resourceID: the resource id of the calendar object
+        @type resourceID: L{int}
+        @param md5: the MD5 of the calendar object's data
+        @type md5: L{str}
+        @param component: the parsed calendar data
+        @type component: L{VComponent}
+        @param size: the size of the calendar data in bytes
+        @type size: L{int}
+        """
+        maxSize = config.ParsedComponentCacheSize
+        if maxSize <= 0 or size > maxSize:
+            return
+        self._remove((resourceID, md5,))
+        self._entries[(resourceID, md5,)] = (component.duplicate(), size,)
+        self._size += size
+        while self._size > maxSize:
+            _ignore_key, (_ignore_component, oldSize) = self._entries.popitem(last=False)
+            self._size -= oldSize
+            self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._size -= entry[1]
+
+    def clear(self):
+        self._entries.clear()
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def stats(self):
+        """
+        Return the cache counters. C{hits} is the number of parses avoided.
+
+        @rtype: L{dict}
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "size": self._size,
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+
+parsedComponentCache = ParsedComponentCache()
+
+
 class StorageTransportAddress(object):
     """
     Peer / host address for L{IAttachmentStorageTransport} implementations.
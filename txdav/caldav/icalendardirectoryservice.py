@@ -42,6 +42,16 @@ class ICalendarStoreDirectoryService(IStoreDirectoryService):
         @rtype: L{Deferred} resulting in L{ICalendarStoreDirectoryRecord}
         """
 
+    def recordsWithCalendarUserAddresses(cuaddrs):  # @NoSelf
+        """
+        Return the records for a set of calendar user addresses, looking them
+        up together where possible.
+
+        @return: Deferred resulting in a L{dict} mapping each address to its
+            record (or L{None}).
+        @rtype: L{Deferred} resulting in L{dict}
+        """
+
 
 class ICalendarStoreDirectoryRecord(IStoreDirectoryRecord):
     """
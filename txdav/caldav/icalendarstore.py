@@ -376,9 +376,11 @@ class ICalendar(INotifier, IShareableCollection, IDataStoreObject):
             that have been removed, and the current sync token.
         """
 
-    def resourceNamesSinceToken(revision):  # @NoSelf
+    def resourceNamesSinceToken(revision, limit=None, startAfter=None):  # @NoSelf
         """
-        Low-level query to gather names for calendarObjectsSinceToken.
+        Low-level query to gather names for calendarObjectsSinceToken. If C{limit}
+        is given, the results may be truncated and a fourth item is returned
+        indicating where to resume from.
         """
 
     def sharingInvites():  # @NoSelf
@@ -684,6 +686,17 @@ class IAttachment(IDataStoreObject):
         @type protocol: L{IProtocol}
         """
 
+    def retrieveFile():  # @NoSelf
+        """
+        Open the content of this attachment for reading, so that it can be
+        served straight from the file.
+
+        @return: a file opened for reading at the start of the content.
+        @rtype: C{file}
+
+        @raise IOError: if the content cannot be opened.
+        """
+
 
 #
 # Exceptions
@@ -611,18 +611,19 @@ class AddressBook(AddressBookSharingMixIn, CommonHomeChild):
         return self._changeRevision("delete", name, id)
 
     @inlineCallbacks
-    def resourceNamesSinceRevision(self, revision):
+    def resourceNamesSinceRevision(self, revision, limit=None, startAfter=None):
         """
         Return the changed and deleted resources since a particular revision. This implementation takes
         into account sharing by making use of the bindRevision attribute to determine if the requested
         revision is earlier than the share acceptance. If so, then we need to return all resources in
-        the results since the collection is in effect "new".
+        the results since the collection is in effect "new". Results for a shared address book are never
+        truncated when a C{limit} is given.
 
         @param revision: the revision to determine changes since
         @type revision: C{int}
         """
         if self.owned():
-            returnValue((yield super(AddressBook, self).resourceNamesSinceRevision(revision)))
+            returnValue((yield super(AddressBook, self).resourceNamesSinceRevision(revision, limit=limit, startAfter=startAfter)))
 
         if revision:
             minValidRevision = yield self._txn.calendarserverValue("MIN-VALID-REVISION")
@@ -637,7 +638,10 @@ class AddressBook(AddressBookSharingMixIn, CommonHomeChild):
         changed = [item[lenpath:] for item in sharedChildChanged if item.startswith(selfPath) and item != selfPath]
         deleted = [item[lenpath:] for item in sharedChildDeleted if item.startswith(selfPath) and item != selfPath]
         invalid = [item[lenpath:] for item in sharedChildInvalid if item.startswith(selfPath) and item != selfPath]
-        returnValue((changed, deleted, invalid))
+        if limit is not None:
+            returnValue((changed, deleted, invalid, None))
+        else:
+            returnValue((changed, deleted, invalid))
 
     @inlineCallbacks
     def sharedChildResourceNamesSinceRevision(self, revision, depth):
@@ -1074,9 +1074,10 @@ class CommonHomeChild(FileMetaDataMixin, FancyEqMixin, HomeChildBase):
         return [self.objectResourceWithName(name)
                 for name in self.listObjectResources()]
 
-    def objectResourcesWithNames(self, names):
+    def objectResourcesWithNames(self, names, withText=False):
         """
-        Return a list of the specified object resource objects.
+        Return a list of the specified object resource objects. C{withText} is
+        ignored as data is always read from the file when needed.
         """
         results = []
         for name in names:
@@ -1170,8 +1171,12 @@ class CommonHomeChild(FileMetaDataMixin, FancyEqMixin, HomeChildBase):
     def objectResourcesSinceToken(self, token):
         raise NotImplementedError()
 
-    def resourceNamesSinceToken(self, token):
-        return succeed(self.retrieveOldIndex().whatchanged(token))
+    def resourceNamesSinceToken(self, token, limit=None, startAfter=None):
+        # Results are never truncated
+        names = self.retrieveOldIndex().whatchanged(token)
+        if limit is not None:
+            names = tuple(names) + (None,)
+        return succeed(names)
 
     def objectResourcesHaveProperties(self):
         """
@@ -27,6 +27,8 @@ __all__ = [
     "andExpression",
     "orExpression",
     "timerangeExpression",
+    "propertyExpression",
+    "attendeeExpression",
     "textcompareExpression",
     "containsExpression",
     "notcontainsExpression",
@@ -198,6 +200,34 @@ class timerangeExpression(baseExpression):
         return "timerange(" + str(self.start) + ", " + str(self.end) + ")"
 
 
+class propertyExpression(baseExpression):
+    """
+    Indexed property expression - matches when the resource has a property with
+    the given name whose value also matches the (optional) text comparison.
+    """
+
+    def __init__(self, name, test):
+        self.name = name
+        self.test = test
+
+    def __str__(self):
+        return "property(" + self.name + ", " + str(self.test) + ")"
+
+
+class attendeeExpression(baseExpression):
+    """
+    Organizer/attendee index expression - matches when the resource has an
+    ORGANIZER (or ATTENDEE) property that also matches the (optional) test.
+    """
+
+    def __init__(self, organizer, test):
+        self.organizer = organizer
+        self.test = test
+
+    def __str__(self):
+        return "attendee(" + ("ORGANIZER" if self.organizer else "ATTENDEE") + ", " + str(self.test) + ")"
+
+
 class textcompareExpression(baseExpression):
     """
     Base class for text comparison expressions.
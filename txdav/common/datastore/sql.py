@@ -51,7 +51,7 @@ from twisted.python.util import FancyEqMixin
 from twistedcaldav.config import config
 from twistedcaldav.dateops import datetimeMktime, pyCalendarToSQLTimestamp
 
-from txdav.base.datastore.util import QueryCacher
+from txdav.base.datastore.util import QueryCacher, StatementArgs
 from txdav.base.propertystore.none import PropertyStore as NonePropertyStore
 from txdav.base.propertystore.sql import PropertyStore
 from txdav.caldav.icalendarstore import ICalendarTransaction, ICalendarStore
@@ -91,6 +91,7 @@ import datetime
 import inspect
 import itertools
 import os
+import re
 import sys
 import time
 from uuid import uuid4
@@ -152,6 +153,8 @@ class CommonDataStore(Service, object):
         logLabels=False,
         logStats=False,
         logStatsLogFile=None,
+        logStatsOnline=False,
+        logStatsRepeatThreshold=0,
         logSQL=False,
         logTransactionWaits=0,
         timeoutTransactions=0,
@@ -174,6 +177,8 @@ class CommonDataStore(Service, object):
         self.logLabels = logLabels
         self.logStats = logStats
         self.logStatsLogFile = logStatsLogFile
+        self.logStatsOnline = logStatsOnline
+        self.logStatsRepeatThreshold = logStatsRepeatThreshold
         self.logSQL = logSQL
         self.logTransactionWaits = logTransactionWaits
         self.timeoutTransactions = timeoutTransactions
@@ -406,14 +411,60 @@ class TransactionStatsCollector(object):
     """
     Used to log each SQL query and statistics about that query during the course of a single transaction.
     Results can be printed out where ever needed at the end of the transaction.
+
+    In online mode the statements themselves are not kept. Instead each one is reduced to a
+    fingerprint of its normalized SQL, so that the same statement being run many times in one
+    transaction (typically an N+1 query pattern) can be reported in production.
     """
 
-    def __init__(self, label, logFileName=None):
+    # Rules applied in order to normalize SQL into a fingerprint: literals become "?", and lists
+    # of parameters or rows of parameters collapse to a single "(...)"
+    _fingerprintRules = (
+        (re.compile(r"'(?:[^']|'')*'"), "?"),
+        (re.compile(r"\s+"), " "),
+        (re.compile(r"\(\s*(?:(?:%s|\?|:\d+)\s*,\s*)*(?:%s|\?|:\d+)\s*\)"), "(...)"),
+        (re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+"), "(...)"),
+        (re.compile(r"\b\d+\b"), "?"),
+    )
+
+    def __init__(self, label, logFileName=None, online=False, repeatThreshold=0):
+        """
+        @param label: the label of the transaction
+        @type label: C{str}
+        @param logFileName: the file to write the report to, or C{None} to log it
+        @type logFileName: C{str}
+        @param online: whether to only keep statement fingerprints rather than full statements
+        @type online: C{bool}
+        @param repeatThreshold: the number of times a statement fingerprint can be run before
+            the transaction is reported as repeating it, 0 for no reporting
+        @type repeatThreshold: C{int}
+        """
         self.label = label
         self.logFileName = logFileName
+        self.online = online
+        self.repeatThreshold = repeatThreshold
         self.statements = []
+        self.fingerprints = defaultdict(int)
+        self.reused = 0
+        self.reusedTime = 0.0
+        self.prepared = 0
+        self.preparedTime = 0.0
         self.startTime = time.time()
 
+    @classmethod
+    def fingerprint(cls, sql):
+        """
+        Normalize SQL so that statements differing only in literal values or in the
+        number of parameters in a list have the same fingerprint.
+
+        @param sql: the SQL statement
+        @type sql: C{str}
+        @rtype: C{str}
+        """
+        for pattern, replacement in cls._fingerprintRules:
+            sql = pattern.sub(replacement, sql)
+        return sql.strip()
+
     def startStatement(self, sql, args):
         """
         Called prior to an SQL query being run.
@@ -425,11 +476,31 @@ class TransactionStatsCollector(object):
 
         @return: C{tuple} containing the index in the statement list for this statement, and the start time
         """
-        args = ["%s" % (arg,) for arg in args]
-        args = [((arg[:10] + "...") if len(arg) > 40 else arg) for arg in args]
-        self.statements.append(["%s %s" % (sql, args,), 0, 0, 0])
+        if self.online:
+            self.fingerprints[self.fingerprint(sql)] += 1
+            self.statements.append([None, 0, 0, 0])
+        else:
+            if self.repeatThreshold:
+                self.fingerprints[self.fingerprint(sql)] += 1
+            args = ["%s" % (arg,) for arg in args]
+            args = [((arg[:10] + "...") if len(arg) > 40 else arg) for arg in args]
+            self.statements.append(["%s %s" % (sql, args,), 0, 0, 0])
         return len(self.statements) - 1, time.time()
 
+    def repeatedStatements(self):
+        """
+        The statement fingerprints run more than C{repeatThreshold} times.
+
+        @return: C{list} of C{tuple} of fingerprint and count, most repeated first
+        @rtype: C{list}
+        """
+        if not self.repeatThreshold:
+            return []
+        return sorted(
+            [(fingerprint, count,) for fingerprint, count in self.fingerprints.items() if count > self.repeatThreshold],
+            key=lambda x: (-x[1], x[0]),
+        )
+
     def endStatement(self, context, rows):
         """
         Called after an SQL query has executed.
@@ -445,14 +516,62 @@ class TransactionStatsCollector(object):
         self.statements[index][2] = t - tstamp
         self.statements[index][3] = t
 
+    def recordPrepared(self, prepared, elapsed):
+        """
+        Called by the database connection after an SQL query has executed, for drivers
+        that prepare every statement themselves.
+
+        @param prepared: whether the statement was already prepared on its connection
+        @type prepared: C{bool}
+        @param elapsed: the time taken in seconds
+        @type elapsed: C{float}
+        """
+        if prepared:
+            self.reused += 1
+            self.reusedTime += elapsed
+        else:
+            self.prepared += 1
+            self.preparedTime += elapsed
+
+    def totals(self):
+        """
+        Totals for the SQL statements executed to date.
+
+        @return: C{tuple} of the number of statements, rows, and time in ms
+        @rtype: C{tuple}
+        """
+        return (
+            len(self.statements),
+            sum([statement[1] for statement in self.statements]),
+            sum([statement[2] for statement in self.statements]) * 1000.0,
+        )
+
+    def onlineReport(self):
+        """
+        Log any statements that were repeated too many times. Unlike L{printReport} this is
+        cheap enough to run at the end of every transaction.
+
+        @return: C{tuple} of the number of statements, rows, time in ms, and the highest
+            number of times one statement fingerprint was run
+        @rtype: C{tuple}
+        """
+        total_statements, total_rows, total_time = self.totals()
+        repeated = self.repeatedStatements()
+        if repeated:
+            log.warn(
+                "Transaction {label} repeated SQL statements: {repeated}",
+                label=self.label,
+                repeated=", ".join(["{} x {}".format(count, fingerprint) for fingerprint, count in repeated]),
+            )
+        max_repeat = max(self.fingerprints.values()) if self.fingerprints else 0
+        return (total_statements, total_rows, total_time, max_repeat,)
+
     def printReport(self):
         """
         Print a report of all the SQL statements executed to date.
         """
 
-        total_statements = len(self.statements)
-        total_rows = sum([statement[1] for statement in self.statements])
-        total_time = sum([statement[2] for statement in self.statements]) * 1000.0
+        total_statements, total_rows, total_time = self.totals()
 
         toFile = StringIO()
         toFile.write("*** SQL Stats ***\n")
@@ -462,6 +581,8 @@ class TransactionStatsCollector(object):
         toFile.write("Total statements: %d\n" % (total_statements,))
         toFile.write("Total rows: %d\n" % (total_rows,))
         toFile.write("Total time (ms): %.3f\n" % (total_time,))
+        toFile.write("Prepared statement reuses: %d (%.3f ms)\n" % (self.reused, self.reusedTime * 1000.0,))
+        toFile.write("Statements prepared: %d (%.3f ms)\n" % (self.prepared, self.preparedTime * 1000.0,))
         t_last_end = self.startTime
         for sql, rows, t_taken, t_end in self.statements:
             toFile.write("\n")
@@ -472,6 +593,8 @@ class TransactionStatsCollector(object):
             toFile.write("Elapsed (ms): %.3f\n" % ((t_end - self.startTime) * 1000.0,))
             t_last_end = t_end
         toFile.write("Commit (ms): %.3f\n" % ((time.time() - t_last_end) * 1000.0,))
+        for fingerprint, count in self.repeatedStatements():
+            toFile.write("Repeated %d times: %s\n" % (count, fingerprint,))
         toFile.write("***\n\n")
 
         if self.logFileName:
@@ -622,10 +745,18 @@ class CommonStoreTransaction(
         self._sqlTxn = sqlTxn
         self.dbtype = sqlTxn.dbtype
 
-        self._stats = (
-            TransactionStatsCollector(self._label, self._store.logStatsLogFile)
-            if self._store.logStats else None
-        )
+        if self._store.logStats:
+            self._stats = TransactionStatsCollector(
+                self._label, self._store.logStatsLogFile,
+                repeatThreshold=self._store.logStatsRepeatThreshold,
+            )
+        elif self._store.logStatsOnline:
+            self._stats = TransactionStatsCollector(
+                self._label, online=True,
+                repeatThreshold=self._store.logStatsRepeatThreshold,
+            )
+        else:
+            self._stats = None
         self.statementCount = 0
         self.iudCount = 0
         self.currentStatement = None
@@ -978,7 +1109,9 @@ class CommonStoreTransaction(
         Execute some SQL (delegate to L{IAsyncTransaction}).
         """
         if self._stats:
-            statsContext = self._stats.startStatement(a[0], a[1] if len(a) > 1 else ())
+            args = (a[1] or ()) if len(a) > 1 else ()
+            statsContext = self._stats.startStatement(a[0], args)
+            a = (a[0], StatementArgs(args, self._stats.recordPrepared),) + a[2:]
         self.currentStatement = a[0]
         if self._store.logTransactionWaits and a[0].split(" ", 1)[0].lower() in ("insert", "update", "delete",):
             self.iudCount += 1
@@ -1038,7 +1171,11 @@ class CommonStoreTransaction(
         """
         Print the stats report and record log items
         """
-        sql_statements, sql_rows, sql_time = self._stats.printReport()
+        if self._stats.online:
+            sql_statements, sql_rows, sql_time, sql_repeat = self._stats.onlineReport()
+            self.logItems["sql-rep"] = str(sql_repeat)
+        else:
+            sql_statements, sql_rows, sql_time = self._stats.printReport()
         self.logItems["sql-s"] = str(sql_statements)
         self.logItems["sql-r"] = str(sql_rows)
         self.logItems["sql-t"] = "%.1f" % (sql_time,)
@@ -1158,11 +1295,13 @@ class CommonStoreTransaction(
     @inlineCallbacks
     def removeOrphanedAttachments(self, uuid=None, batchSize=None):
         """
-        Remove attachments that no longer have any references to them
+        Remove attachments that no longer have any references to them. Once there are no
+        more of those, attachment data in the content store that is not referenced by any
+        attachment is removed too (unless limited to one C{uuid}).
         """
 
         # TODO: see if there is a better way to import Attachment
-        from txdav.caldav.datastore.sql import DropBoxAttachment
+        from txdav.caldav.datastore.sql import Attachment, DropBoxAttachment
 
         kwds = {}
         if uuid:
@@ -1194,6 +1333,11 @@ class CommonStoreTransaction(
             attachment = (yield DropBoxAttachment.load(self, dropboxID, path))
             yield attachment.remove()
             count += 1
+
+        if not count and not uuid:
+            count = (yield Attachment.removeUnreferencedContent(
+                self, config.AttachmentDeduplication.GracePeriodSeconds
+            ))
         returnValue(count)
 
     def oldDropboxAttachments(self, cutoff, uuid):
@@ -3665,11 +3809,17 @@ class CommonHomeChild(FancyEqMixin, Memoizable, _SharedSyncLogic, HomeChildBase,
         returnValue(results)
 
     @inlineCallbacks
-    def objectResourcesWithNames(self, names):
+    def objectResourcesWithNames(self, names, withText=False):
         """
         Load and cache all named children - set of names optimization
+
+        @param names: the names of the children to load
+        @type names: L{list} of L{str}
+        @param withText: whether to also load the data of the children, when
+            the caller is going to need it for all of them
+        @type withText: L{bool}
         """
-        results = (yield self._objectResourceClass.loadAllObjectsWithNames(self, names))
+        results = (yield self._objectResourceClass.loadAllObjectsWithNames(self, names, withText=withText))
         for result in results:
             self._objects[result.name()] = result
             self._objects[result.uid()] = result
@@ -4440,21 +4590,62 @@ class CommonObjectResource(FancyEqMixin, object):
 
     @classmethod
     @inlineCallbacks
-    def loadAllObjectsWithNames(cls, parent, names):
+    def loadAllObjectsWithNames(cls, parent, names, withText=False):
         """
         Load all child objects with the specified names, doing so in batches (because we need to match
         using SQL "resource_name in (...)" where there might be a character length limit on the number
-        of items in the set).
+        of items in the set). If C{withText} is C{True} the data of the objects is loaded as well, one
+        query per batch.
         """
         names = tuple(names)
         results = []
         while(len(names)):
             result_batch = (yield cls._loadAllObjectsWithNames(parent, names[:cls.BATCH_LOAD_SIZE]))
+            if withText:
+                yield cls._loadTextForObjects(parent, result_batch)
             results.extend(result_batch)
             names = names[cls.BATCH_LOAD_SIZE:]
 
         returnValue(results)
 
+    @classmethod
+    def _textForIDsQuery(cls, resourceIDs):
+        obj = cls._objectSchema
+        return Select([obj.RESOURCE_ID, obj.TEXT], From=obj,
+                      Where=obj.RESOURCE_ID.In(Parameter("resourceIDs", len(resourceIDs))))
+
+    @classmethod
+    @inlineCallbacks
+    def _loadTextForObjects(cls, parent, objects):
+        """
+        Load the text of each of the supplied child objects with one query, skipping any
+        that already have it or will not need it (see L{_textNeeded}).
+
+        @param parent: the parent collection object
+        @type parent: L{CommonHomeChild}
+        @param objects: the child objects
+        @type objects: L{list} of L{CommonObjectResource}
+        """
+        objects = dict([
+            (child._resourceID, child,)
+            for child in objects if child._textData is None and child._textNeeded()
+        ])
+        if objects:
+            resourceIDs = tuple(objects.keys())
+            rows = yield cls._textForIDsQuery(resourceIDs).on(
+                parent._txn, resourceIDs=resourceIDs)
+            for resourceID, text in rows:
+                objects[resourceID]._textData = text
+
+    def _textNeeded(self):
+        """
+        Whether the text of this object will need to be read from the store when its data
+        is used. Sub-classes that keep their data elsewhere can override this.
+
+        @rtype: L{bool}
+        """
+        return True
+
     @classmethod
     @inlineCallbacks
     def listObjects(cls, parent):
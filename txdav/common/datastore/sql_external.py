@@ -346,13 +346,16 @@ class CommonHomeChildExternal(CommonHomeChild):
         returnValue(revision)
 
     @inlineCallbacks
-    def resourceNamesSinceRevision(self, revision):
+    def resourceNamesSinceRevision(self, revision, limit=None, startAfter=None):
         try:
             names = yield self._txn.store().conduit.send_homechild_resourcenamessincerevision(self, revision)
         except NonExistentExternalShare:
             yield self.fixNonExistentExternalShare()
             raise ExternalShareFailed("External share does not exist")
 
+        # Results from another pod are never truncated
+        if limit is not None:
+            names = tuple(names) + (None,)
         returnValue(names)
 
     @inlineCallbacks
@@ -394,7 +397,9 @@ class CommonObjectResourceExternal(CommonObjectResource):
 
     @classmethod
     @inlineCallbacks
-    def loadAllObjectsWithNames(cls, parent, names):
+    def loadAllObjectsWithNames(cls, parent, names, withText=False):
+        # The data of remote objects is not prefetched - it is sent over the conduit as
+        # each object needs it
         mapping_list = yield parent._txn.store().conduit.send_objectresource_loadallobjectswithnames(parent, names)
 
         results = []
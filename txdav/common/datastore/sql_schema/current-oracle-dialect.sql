@@ -259,6 +259,24 @@ create table PERUSER (
 );
 
 
+create table CALENDAR_OBJECT_PROPERTY (
+    "CALENDAR_RESOURCE_ID" integer not null references CALENDAR on delete cascade,
+    "CALENDAR_OBJECT_RESOURCE_ID" integer not null references CALENDAR_OBJECT on delete cascade,
+    "NAME" nvarchar2(255),
+    "VALUE" nclob
+);
+
+
+create table CALENDAR_OBJECT_ATTENDEE (
+    "CALENDAR_RESOURCE_ID" integer not null references CALENDAR on delete cascade,
+    "CALENDAR_OBJECT_RESOURCE_ID" integer not null references CALENDAR_OBJECT on delete cascade,
+    "RECURRENCE_ID" nvarchar2(255) default null,
+    "ORGANIZER" integer not null,
+    "CUA" nvarchar2(255),
+    "PARTSTAT" nvarchar2(255) default null
+);
+
+
 create table CALENDAR_OBJECT_MIGRATION (
     "CALENDAR_HOME_RESOURCE_ID" integer references CALENDAR_HOME on delete cascade,
     "REMOTE_RESOURCE_ID" integer not null,
@@ -772,8 +790,8 @@ create table CALENDARSERVER (
     "VALUE" nvarchar2(255)
 );
 
-insert into CALENDARSERVER (NAME, VALUE) values ('VERSION', '66');
-insert into CALENDARSERVER (NAME, VALUE) values ('CALENDAR-DATAVERSION', '6');
+insert into CALENDARSERVER (NAME, VALUE) values ('VERSION', '69');
+insert into CALENDARSERVER (NAME, VALUE) values ('CALENDAR-DATAVERSION', '7');
 insert into CALENDARSERVER (NAME, VALUE) values ('ADDRESSBOOK-DATAVERSION', '2');
 insert into CALENDARSERVER (NAME, VALUE) values ('NOTIFICATION-DATAVERSION', '1');
 insert into CALENDARSERVER (NAME, VALUE) values ('MIN-VALID-REVISION', '1');
@@ -860,6 +878,27 @@ create index TIME_RANGE_CALENDAR_O_acf37bd1 on TIME_RANGE (
     "CALENDAR_OBJECT_RESOURCE_ID"
 );
 
+create index CALENDAR_OBJECT_PROPE_60fc608c on CALENDAR_OBJECT_PROPERTY (
+    "CALENDAR_RESOURCE_ID",
+    "NAME"
+);
+
+create index CALENDAR_OBJECT_PROPE_6fa967e6 on CALENDAR_OBJECT_PROPERTY (
+    "CALENDAR_OBJECT_RESOURCE_ID"
+);
+
+create index CALENDAR_OBJECT_ATTEN_295a4fbc on CALENDAR_OBJECT_ATTENDEE (
+    "CALENDAR_RESOURCE_ID"
+);
+
+create index CALENDAR_OBJECT_ATTEN_b0cf8e60 on CALENDAR_OBJECT_ATTENDEE (
+    "CALENDAR_OBJECT_RESOURCE_ID"
+);
+
+create index CALENDAR_OBJECT_ATTEN_f04a25e5 on CALENDAR_OBJECT_ATTENDEE (
+    "CUA"
+);
+
 create index CALENDAR_OBJECT_MIGRA_0502cbef on CALENDAR_OBJECT_MIGRATION (
     "CALENDAR_HOME_RESOURCE_ID",
     "LOCAL_RESOURCE_ID"
@@ -877,6 +916,10 @@ create index ATTACHMENT_DROPBOX_ID_5073cf23 on ATTACHMENT (
     "DROPBOX_ID"
 );
 
+create index ATTACHMENT_MD5_55771cbf on ATTACHMENT (
+    "MD5"
+);
+
 create index ATTACHMENT_CALENDAR_O_81508484 on ATTACHMENT_CALENDAR_OBJECT (
     "CALENDAR_OBJECT_RESOURCE_ID"
 );
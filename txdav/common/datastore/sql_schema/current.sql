@@ -403,6 +403,50 @@ create table PERUSER (
 );
 
 
+------------------------------------
+-- Searchable calendar properties --
+------------------------------------
+
+-- Lower-cased values of the properties listed in the IndexedQueryProperties
+-- config option, one row per property in each top-level component
+
+create table CALENDAR_OBJECT_PROPERTY (
+  CALENDAR_RESOURCE_ID        bigint       not null references CALENDAR on delete cascade,
+  CALENDAR_OBJECT_RESOURCE_ID bigint       not null references CALENDAR_OBJECT on delete cascade,
+  NAME                        varchar(255) not null,
+  VALUE                       text         not null
+);
+
+create index CALENDAR_OBJECT_PROPERTY_CALENDAR_RESOURCE_ID_NAME on
+  CALENDAR_OBJECT_PROPERTY(CALENDAR_RESOURCE_ID, NAME);
+create index CALENDAR_OBJECT_PROPERTY_CALENDAR_OBJECT_RESOURCE_ID on
+  CALENDAR_OBJECT_PROPERTY(CALENDAR_OBJECT_RESOURCE_ID);
+
+
+------------------------------
+-- Organizers and attendees --
+------------------------------
+
+-- Lower-cased ORGANIZER and ATTENDEE values, and the ATTENDEE PARTSTAT, one
+-- row per property in each top-level component
+
+create table CALENDAR_OBJECT_ATTENDEE (
+  CALENDAR_RESOURCE_ID        bigint       not null references CALENDAR on delete cascade,
+  CALENDAR_OBJECT_RESOURCE_ID bigint       not null references CALENDAR_OBJECT on delete cascade,
+  RECURRENCE_ID               varchar(255) default null, -- null for the master component
+  ORGANIZER                   boolean      not null,     -- ORGANIZER rather than ATTENDEE property
+  CUA                         varchar(255) not null,
+  PARTSTAT                    varchar(255) default null
+);
+
+create index CALENDAR_OBJECT_ATTENDEE_CALENDAR_RESOURCE_ID on
+  CALENDAR_OBJECT_ATTENDEE(CALENDAR_RESOURCE_ID);
+create index CALENDAR_OBJECT_ATTENDEE_CALENDAR_OBJECT_RESOURCE_ID on
+  CALENDAR_OBJECT_ATTENDEE(CALENDAR_OBJECT_RESOURCE_ID);
+create index CALENDAR_OBJECT_ATTENDEE_CUA on
+  CALENDAR_OBJECT_ATTENDEE(CUA);
+
+
 -------------------------------
 -- Calendar Object Migration --
 -------------------------------
@@ -445,6 +489,9 @@ create index ATTACHMENT_CALENDAR_HOME_RESOURCE_ID on
 create index ATTACHMENT_DROPBOX_ID on
   ATTACHMENT(DROPBOX_ID);
 
+create index ATTACHMENT_MD5 on
+  ATTACHMENT(MD5);
+
 -- Many-to-many relationship between attachments and calendar objects
 create table ATTACHMENT_CALENDAR_OBJECT (
   ATTACHMENT_ID                  bigint       not null references ATTACHMENT on delete cascade,
@@ -1314,8 +1361,8 @@ create table CALENDARSERVER (
   VALUE                         varchar(255)
 );
 
-insert into CALENDARSERVER values ('VERSION', '66');
-insert into CALENDARSERVER values ('CALENDAR-DATAVERSION', '6');
+insert into CALENDARSERVER values ('VERSION', '69');
+insert into CALENDARSERVER values ('CALENDAR-DATAVERSION', '7');
 insert into CALENDARSERVER values ('ADDRESSBOOK-DATAVERSION', '2');
 insert into CALENDARSERVER values ('NOTIFICATION-DATAVERSION', '1');
 insert into CALENDARSERVER values ('MIN-VALID-REVISION', '1');
@@ -0,0 +1,29 @@
+----
+-- Copyright (c) 2012-2018 Apple Inc. All rights reserved.
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+-- http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+----
+
+---------------------------------------------------
+-- Optional trigram index at VERSION 68 or later --
+---------------------------------------------------
+
+-- Lets the IndexedQueryProperties text-match queries use an index for
+-- contains, starts-with and ends-with tests rather than scanning every
+-- property row of the calendar. Requires the pg_trgm extension, which needs
+-- superuser (or, from PostgreSQL 13, database owner) privileges to install.
+
+create extension if not exists pg_trgm;
+
+create index CALENDAR_OBJECT_PROPERTY_VALUE_TRGM on
+  CALENDAR_OBJECT_PROPERTY using gin (VALUE gin_trgm_ops);
@@ -0,0 +1,43 @@
+----
+-- Copyright (c) 2012-2018 Apple Inc. All rights reserved.
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+-- http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+----
+
+---------------------------------------------------
+-- Upgrade database schema from VERSION 68 to 69 --
+---------------------------------------------------
+
+create table CALENDAR_OBJECT_ATTENDEE (
+    "CALENDAR_RESOURCE_ID" integer not null references CALENDAR on delete cascade,
+    "CALENDAR_OBJECT_RESOURCE_ID" integer not null references CALENDAR_OBJECT on delete cascade,
+    "RECURRENCE_ID" nvarchar2(255) default null,
+    "ORGANIZER" integer not null,
+    "CUA" nvarchar2(255),
+    "PARTSTAT" nvarchar2(255) default null
+);
+
+create index CALENDAR_OBJECT_ATTEN_295a4fbc on CALENDAR_OBJECT_ATTENDEE (
+    "CALENDAR_RESOURCE_ID"
+);
+
+create index CALENDAR_OBJECT_ATTEN_b0cf8e60 on CALENDAR_OBJECT_ATTENDEE (
+    "CALENDAR_OBJECT_RESOURCE_ID"
+);
+
+create index CALENDAR_OBJECT_ATTEN_f04a25e5 on CALENDAR_OBJECT_ATTENDEE (
+    "CUA"
+);
+
+-- update the version
+update CALENDARSERVER set VALUE = '69' where NAME = 'VERSION';
@@ -0,0 +1,34 @@
+----
+-- Copyright (c) 2012-2018 Apple Inc. All rights reserved.
+--
+-- Licensed under the Apache License, Version 2.0 (the "License");
+-- you may not use this file except in compliance with the License.
+-- You may obtain a copy of the License at
+--
+-- http://www.apache.org/licenses/LICENSE-2.0
+--
+-- Unless required by applicable law or agreed to in writing, software
+-- distributed under the License is distributed on an "AS IS" BASIS,
+-- WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+-- See the License for the specific language governing permissions and
+-- limitations under the License.
+----
+
+---------------------------------------------------
+-- Upgrade database schema from VERSION 67 to 68 --
+---------------------------------------------------
+
+create table CALENDAR_OBJECT_PROPERTY (
+  CALENDAR_RESOURCE_ID        bigint       not null references CALENDAR on delete cascade,
+  CALENDAR_OBJECT_RESOURCE_ID bigint       not null references CALENDAR_OBJECT on delete cascade,
+  NAME                        varchar(255) not null,
+  VALUE                       text         not null
+);
+
+create index CALENDAR_OBJECT_PROPERTY_CALENDAR_RESOURCE_ID_NAME on
+  CALENDAR_OBJECT_PROPERTY(CALENDAR_RESOURCE_ID, NAME);
+create index CALENDAR_OBJECT_PROPERTY_CALENDAR_OBJECT_RESOURCE_ID on
+  CALENDAR_OBJECT_PROPERTY(CALENDAR_OBJECT_RESOURCE_ID);
+
+-- update the version
+update CALENDARSERVER set VALUE = '68' where NAME = 'VERSION';
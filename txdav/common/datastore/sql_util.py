@@ -16,7 +16,8 @@
 ##
 
 from twext.enterprise.dal.syntax import Max, Select, Parameter, Delete, Insert, \
-    Update, ColumnSyntax, TableSyntax, Upper, utcNowSQL
+    Update, ColumnSyntax, TableSyntax, Upper, utcNowSQL, Constant, SQLFragment
+from twext.enterprise.ienterprise import ORACLE_DIALECT
 from twext.python.clsprop import classproperty
 from twext.python.log import Logger
 from twisted.internet.defer import succeed, inlineCallbacks, returnValue
@@ -24,6 +25,7 @@ from txdav.base.datastore.util import normalizeUUIDOrNot
 from txdav.common.datastore.sql_tables import schema
 from txdav.common.icommondatastore import SyncTokenValidException, \
     ENOTIFICATIONTYPE, ECALENDARTYPE, EADDRESSBOOKTYPE
+from bisect import bisect_right
 import time
 from uuid import UUID
 
@@ -128,7 +130,38 @@ class _SharedSyncLogic(object):
             Where=where,
         )
 
-    def resourceNamesSinceToken(self, token):
+    @classmethod
+    def _objectNamesSinceRevisionPageQuery(cls, limit):
+        """
+        DAL query for (resource, deleted-flag, revision) ordered by revision, returning at most
+        C{limit} rows.
+        """
+        rev = cls._revisionsSchema
+        return Select(
+            [rev.RESOURCE_NAME, rev.DELETED, rev.REVISION],
+            From=rev,
+            Where=(rev.REVISION > Parameter("revision")).And(
+                rev.RESOURCE_ID == Parameter("resourceID")).And(
+                rev.RESOURCE_NAME != None),
+            OrderBy=rev.REVISION,
+            Limit=limit,
+        )
+
+    @classproperty
+    def _objectNamesAtRevisionQuery(cls):
+        """
+        DAL query for (resource, deleted-flag, revision) of the changes made at one revision.
+        """
+        rev = cls._revisionsSchema
+        return Select(
+            [rev.RESOURCE_NAME, rev.DELETED, rev.REVISION],
+            From=rev,
+            Where=(rev.REVISION == Parameter("revision")).And(
+                rev.RESOURCE_ID == Parameter("resourceID")).And(
+                rev.RESOURCE_NAME != None),
+        )
+
+    def resourceNamesSinceToken(self, token, limit=None, startAfter=None):
         """
         Return the changed and deleted resources since a particular sync-token. This simply extracts
         the revision from from the token then calls L{resourceNamesSinceRevision}.
@@ -137,30 +170,44 @@ class _SharedSyncLogic(object):
         @type revision: C{int}
         """
 
-        return self.resourceNamesSinceRevision(self.revisionFromToken(token))
+        return self.resourceNamesSinceRevision(self.revisionFromToken(token), limit=limit, startAfter=startAfter)
 
     @inlineCallbacks
-    def resourceNamesSinceRevision(self, revision):
+    def resourceNamesSinceRevision(self, revision, limit=None, startAfter=None):
         """
-        Return the changed and deleted resources since a particular revision.
+        Return the changed and deleted resources since a particular revision. When C{limit} is
+        given the results are truncated to roughly that many names so that callers can page through
+        a large set of changes (RFC 6578 truncation). In that case the returned C{tuple} has a
+        fourth item which is L{None} when all the changes were returned, or otherwise the point
+        to resume from: for an initial sync (revision 0) the name of the last resource returned
+        (pass it back as C{startAfter}), and for an incremental sync the revision up to which changes
+        have been returned (pass it back as C{revision}).
 
         @param revision: the revision to determine changes since
         @type revision: C{int}
+        @param limit: the maximum number of names to return, or L{None} for no limit
+        @type limit: C{int}
+        @param startAfter: for an initial sync, only return names that sort after this one
+        @type startAfter: C{str}
         """
         changed = []
         deleted = []
         invalid = []
+        truncatedAt = None
         if revision:
             minValidRevision = yield self._txn.calendarserverValue("MIN-VALID-REVISION")
             if revision < int(minValidRevision):
                 raise SyncTokenValidException
 
-            results = [
-                (name if name else "", removed) for name, removed in (
-                    yield self._objectNamesSinceRevisionQuery().on(
-                        self._txn, revision=revision, resourceID=self._resourceID)
-                )
-            ]
+            if limit is not None:
+                results, truncatedAt = yield self._objectNamesSinceRevisionPage(revision, limit)
+            else:
+                results = [
+                    (name if name else "", removed) for name, removed in (
+                        yield self._objectNamesSinceRevisionQuery().on(
+                            self._txn, revision=revision, resourceID=self._resourceID)
+                    )
+                ]
             results.sort(key=lambda x: x[1])
 
             for name, wasdeleted in results:
@@ -171,8 +218,47 @@ class _SharedSyncLogic(object):
                         changed.append(name)
         else:
             changed = yield self.listObjectResources()
+            if limit is not None:
+                changed = sorted(changed)
+                if startAfter is not None:
+                    changed = changed[bisect_right(changed, startAfter):]
+                if len(changed) > limit:
+                    changed = changed[:limit]
+                    truncatedAt = changed[-1]
+
+        if limit is not None:
+            returnValue((changed, deleted, invalid, truncatedAt))
+        else:
+            returnValue((changed, deleted, invalid))
+
+    @inlineCallbacks
+    def _objectNamesSinceRevisionPage(self, revision, limit):
+        """
+        Get up to C{limit} changes since C{revision}, in revision order. Changes that share a
+        revision are never split across pages, since the page boundary has to be expressed
+        as a revision. If the first revision alone has more changes than C{limit}, all of
+        them are returned as the page, so that the caller can always move past it.
+
+        @return: a C{tuple} of a C{list} of (name, deleted-flag) and the last revision
+            included if the results were truncated, or L{None} if they were not.
+        """
+        rows = yield self._objectNamesSinceRevisionPageQuery(limit + 1).on(
+            self._txn, revision=revision, resourceID=self._resourceID)
+        truncatedAt = None
+        if len(rows) > limit:
+            # Back off to the last revision that is completely within the page
+            boundary = rows[-1][2]
+            rows = [row for row in rows if row[2] != boundary]
+            if rows:
+                truncatedAt = rows[-1][2]
+            else:
+                # A single revision has more changes than the limit - return the whole
+                # revision, flagged as truncated so the caller resumes after it
+                rows = yield self._objectNamesAtRevisionQuery.on(
+                    self._txn, revision=boundary, resourceID=self._resourceID)
+                truncatedAt = boundary
 
-        returnValue((changed, deleted, invalid))
+        returnValue(([(name, removed) for name, removed, _ignore_revision in rows], truncatedAt,))
 
     @classproperty
     def _removeDeletedRevision(cls):
@@ -764,6 +850,112 @@ def _normalizeColumnUUIDs(txn, column):
             yield Update({column: after}, Where=where).on(txn)
 
 
+# Maximum number of rows written by a single L{MultiRowInsert} statement
+BULK_INSERT_BATCH_SIZE = 500
+
+
+class MultiRowInsert(Insert):
+    """
+    An L{Insert} that writes several rows with one statement. Every row is a
+    column map specifying the same set of columns. C{Return} is not supported -
+    callers that need generated keys should allocate them up front with
+    L{allocateSequenceValues} and specify them explicitly.
+    """
+
+    def __init__(self, rows):
+        if not rows:
+            raise ValueError("MultiRowInsert requires at least one row")
+        columns = set(rows[0].keys())
+        for row in rows[1:]:
+            if set(row.keys()) != columns:
+                raise ValueError("MultiRowInsert rows must all specify the same columns")
+        super(MultiRowInsert, self).__init__(rows[0])
+        self.rows = rows
+
+    def _toSQL(self, queryGenerator):
+        columns = sorted(self.rows[0].keys(), key=lambda c: c.model.name)
+        allTables = []
+
+        def _parenthesized(fragments):
+            result = SQLFragment("(")
+            for ctr, fragment in enumerate(fragments):
+                if ctr:
+                    result.append(SQLFragment(", "))
+                result.append(fragment)
+            result.append(SQLFragment(")"))
+            return result
+
+        def _value(value):
+            if not hasattr(value, "subSQL"):
+                value = Constant(value)
+            return value.subSQL(queryGenerator, allTables)
+
+        into = SQLFragment()
+        into.append(TableSyntax(columns[0].model.table).subSQL(queryGenerator, allTables))
+        into.append(SQLFragment(" "))
+        into.append(_parenthesized([column.subSQL(queryGenerator, allTables) for column in columns]))
+        into.append(SQLFragment(" values "))
+
+        if queryGenerator.dialect == ORACLE_DIALECT:
+            # Oracle has no multi-row VALUES list, but does support INSERT ALL
+            stmt = SQLFragment("insert all")
+            for row in self.rows:
+                stmt.append(SQLFragment(" into "))
+                stmt.append(into)
+                stmt.append(_parenthesized([_value(row[column]) for column in columns]))
+            stmt.append(SQLFragment(" select * from dual"))
+        else:
+            stmt = SQLFragment("insert into ")
+            stmt.append(into)
+            for ctr, row in enumerate(self.rows):
+                if ctr:
+                    stmt.append(SQLFragment(", "))
+                stmt.append(_parenthesized([_value(row[column]) for column in columns]))
+        return stmt
+
+
+@inlineCallbacks
+def bulkInsert(txn, rows, batchSize=BULK_INSERT_BATCH_SIZE):
+    """
+    Insert a set of rows into a single table using as few statements as
+    possible.
+
+    @param txn: the transaction to use
+    @type txn: L{CommonStoreTransaction}
+    @param rows: column maps (all with the same columns) for each row
+    @type rows: C{list} of C{dict}
+    @param batchSize: maximum number of rows per statement
+    @type batchSize: C{int}
+    """
+    for offset in range(0, len(rows), batchSize):
+        yield MultiRowInsert(rows[offset:offset + batchSize]).on(txn)
+
+
+@inlineCallbacks
+def allocateSequenceValues(txn, sequence, count):
+    """
+    Allocate a number of values from a sequence in one query.
+
+    @param txn: the transaction to use
+    @type txn: L{CommonStoreTransaction}
+    @param sequence: the sequence to use, e.g. C{schema.INSTANCE_ID_SEQ}
+    @type sequence: L{SequenceSyntax}
+    @param count: number of values needed
+    @type count: C{int}
+
+    @return: a L{Deferred} that fires with a C{list} of C{int}
+    """
+    if count <= 0:
+        returnValue([])
+    name = sequence.model.name
+    if txn.dbtype.dialect == ORACLE_DIALECT:
+        sql = "select {}.nextval from dual connect by level <= {}".format(name, int(count))
+    else:
+        sql = "select nextval('{}') from generate_series(1, {})".format(name, int(count))
+    rows = yield txn.execSQL(sql, [])
+    returnValue([row[0] for row in rows])
+
+
 class _AndNothing(object):
     """
     Simple placeholder for iteratively generating a 'Where' clause; the 'And'
@@ -22,6 +22,7 @@ from uuid import UUID
 
 from twext.enterprise.dal.syntax import Insert
 from twext.enterprise.dal.syntax import Select
+from twext.enterprise.dal.syntax import SQLFragment
 from twisted.internet.defer import Deferred
 from twisted.internet.defer import inlineCallbacks, returnValue, succeed
 from twisted.internet.task import Clock
@@ -29,11 +30,12 @@ from twisted.trial.unittest import TestCase
 # from twistedcaldav.vcard import Component as VCard
 from txdav.common.datastore.sql import (
     log, CommonStoreTransactionMonitor,
-    CommonHome, CommonHomeChild, ECALENDARTYPE
+    CommonHome, CommonHomeChild, ECALENDARTYPE,
+    TransactionStatsCollector
 )
 from txdav.common.datastore.sql_tables import schema
 from txdav.common.datastore.sql_util import _normalizeColumnUUIDs, \
-    fixUUIDNormalization
+    fixUUIDNormalization, MultiRowInsert
 from txdav.common.datastore.test.util import CommonCommonTests
 from txdav.common.icommondatastore import AllRetriesFailed
 from txdav.xml import element as davxml
@@ -475,6 +477,101 @@ class CommonSQLStoreTests(CommonCommonTests, TestCase):
         self.assertEquals(self.txn.label, "bad")
 
 
+class MultiRowInsertTests(TestCase):
+    """
+    Tests for L{txdav.common.datastore.sql_util.MultiRowInsert}.
+    """
+
+    def test_toSQL(self):
+        """
+        All rows are written by a single statement with one VALUES list per row.
+        """
+        tpy = schema.PERUSER
+        stmt = MultiRowInsert([
+            {tpy.TIME_RANGE_INSTANCE_ID: 1, tpy.USER_ID: "user01", tpy.TRANSPARENT: True},
+            {tpy.TIME_RANGE_INSTANCE_ID: 2, tpy.USER_ID: "user02", tpy.TRANSPARENT: False},
+        ])
+        self.assertEqual(
+            stmt.toSQL(),
+            SQLFragment(
+                "insert into PERUSER (TIME_RANGE_INSTANCE_ID, TRANSPARENT, USER_ID) values (?, ?, ?), (?, ?, ?)",
+                [1, True, "user01", 2, False, "user02"],
+            )
+        )
+
+    def test_mismatchedColumns(self):
+        """
+        Rows must all specify the same columns.
+        """
+        tpy = schema.PERUSER
+        self.assertRaises(
+            ValueError,
+            MultiRowInsert,
+            [
+                {tpy.TIME_RANGE_INSTANCE_ID: 1, tpy.USER_ID: "user01", tpy.TRANSPARENT: True},
+                {tpy.TIME_RANGE_INSTANCE_ID: 2, tpy.USER_ID: "user02", tpy.TRANSPARENT: False, tpy.ADJUSTED_START_DATE: None},
+            ]
+        )
+        self.assertRaises(ValueError, MultiRowInsert, [])
+
+
+class TransactionStatsCollectorTests(TestCase):
+    """
+    Tests for L{txdav.common.datastore.sql.TransactionStatsCollector}.
+    """
+
+    def test_fingerprint(self):
+        """
+        Statements differing only in literals or parameter list lengths have the same
+        fingerprint.
+        """
+        self.assertEqual(
+            TransactionStatsCollector.fingerprint("select A from B where C = 'x''y' and D = 10"),
+            "select A from B where C = ? and D = ?",
+        )
+        self.assertEqual(
+            TransactionStatsCollector.fingerprint("select A from B where C in (%s, %s)"),
+            TransactionStatsCollector.fingerprint("select A from B where C in (%s,\n %s, %s)"),
+        )
+        self.assertEqual(
+            TransactionStatsCollector.fingerprint("insert into B values (%s, %s), (%s, %s)"),
+            "insert into B values (...)",
+        )
+
+    def test_onlineReport(self):
+        """
+        In online mode only totals and fingerprint counts are kept, and the highest
+        repeat count is reported.
+        """
+        stats = TransactionStatsCollector("test", online=True, repeatThreshold=2)
+        for ctr in range(3):
+            stats.endStatement(stats.startStatement("select A from B where C = %s", [ctr]), [(1,)])
+        stats.endStatement(stats.startStatement("select C from D", []), [])
+        self.assertEqual(stats.statements[0][0], None)
+        self.assertEqual(stats.repeatedStatements(), [("select A from B where C = %s", 3,)])
+        self.assertEqual(stats.onlineReport()[:2], (4, 3,))
+        self.assertEqual(stats.onlineReport()[3], 3)
+
+    def test_recordPrepared(self):
+        """
+        Prepared statement reuse reported by the database connection is counted on the
+        transaction's own statistics and included in its report.
+        """
+        stats = TransactionStatsCollector("test")
+        stats.recordPrepared(False, 0.002)
+        stats.recordPrepared(True, 0.001)
+        stats.recordPrepared(True, 0.001)
+        self.assertEqual((stats.prepared, stats.reused,), (1, 2,))
+
+        logFileName = self.mktemp()
+        stats.logFileName = logFileName
+        stats.printReport()
+        with open(logFileName) as f:
+            report = f.read()
+        self.assertIn("Prepared statement reuses: 2 (2.000 ms)\n", report)
+        self.assertIn("Statements prepared: 1 (2.000 ms)\n", report)
+
+
 class StubTransaction(object):
 
     def __init__(self, label):
@@ -348,6 +348,8 @@ class SQLStoreBuilder(object):
         storeToClean.queryCacher.flushAll()
         from txdav.base.propertystore.sql import PropertyStore
         PropertyStore._cacher.flushAll()
+        from txdav.caldav.datastore.util import parsedComponentCache
+        parsedComponentCache.clear()
 
 theStoreBuilder = SQLStoreBuilder()
 buildStore = theStoreBuilder.buildStore
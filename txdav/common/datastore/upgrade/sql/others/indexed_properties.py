@@ -0,0 +1,126 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from twext.enterprise.dal.syntax import Delete, Select
+from twext.python.log import Logger
+
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+from twistedcaldav.config import config
+
+from txdav.caldav.datastore.sql import CalendarObject
+from txdav.common.datastore.sql_tables import schema, _HOME_STATUS_EXTERNAL
+from txdav.common.datastore.upgrade.sql.upgrades.util import logUpgradeStatus
+from txdav.common.icommondatastore import InternalDataStoreError
+
+"""
+Upgrader that rebuilds the CALENDAR_OBJECT_PROPERTY index whenever the set of properties in
+config.IndexedQueryProperties changes. Calendar-query text-match tests on those properties are
+answered from the index alone, so it has to cover every existing resource, not just the ones
+written since a property was added.
+
+This makes use of an INDEXED-QUERY-PROPERTIES value in the CALENDARSERVER table to record which
+properties the index was last built for.
+"""
+
+statusKey = CalendarObject._indexedPropertiesKey
+
+log = Logger()
+
+
+@inlineCallbacks
+def doUpgrade(upgrader):
+    """
+    Rebuild the index if the configured properties are not the ones it was built for.
+    """
+
+    names = ",".join(sorted(set([name.upper() for name in config.IndexedQueryProperties])))
+
+    txn = upgrader.sqlStore.newTransaction("indexed_properties.doUpgrade")
+    try:
+        indexed = (yield txn.calendarserverValue(statusKey, raiseIfMissing=False))
+        if (indexed or "") == names:
+            yield txn.commit()
+            returnValue(None)
+
+        upgrader.log.warn("Rebuilding indexed query properties: {names}", names=names or "none")
+        prop = schema.CALENDAR_OBJECT_PROPERTY
+        yield Delete(From=prop, Where=prop.NAME != None).on(txn)
+
+        ch = schema.CALENDAR_HOME
+        rows = (yield Select(
+            [ch.RESOURCE_ID, ch.STATUS, ],
+            From=ch,
+            OrderBy=ch.RESOURCE_ID,
+        ).on(txn))
+    except RuntimeError:
+        yield txn.abort()
+        raise
+    else:
+        yield txn.commit()
+
+    if names:
+        homeIDs = [homeResourceID for homeResourceID, homeStatus in rows if homeStatus != _HOME_STATUS_EXTERNAL]
+        logStr = "Index Calendar Home Properties"
+        for count, homeResourceID in enumerate(homeIDs):
+            logUpgradeStatus(logStr, count, len(homeIDs))
+            txn = upgrader.sqlStore.newTransaction("indexed_properties.doUpgrade")
+            try:
+                yield indexCalendarHome(txn, homeResourceID)
+            except RuntimeError:
+                yield txn.abort()
+                raise
+            else:
+                yield txn.commit()
+        logUpgradeStatus("End {}".format(logStr), len(homeIDs), len(homeIDs))
+
+    # Only record the new properties once every home has been indexed, so an interrupted
+    # rebuild is started again
+    txn = upgrader.sqlStore.newTransaction("indexed_properties.doUpgrade")
+    try:
+        # An empty value may read back as NULL, so replace the row rather than update it
+        cs = schema.CALENDARSERVER
+        yield Delete(From=cs, Where=cs.NAME == statusKey).on(txn)
+        yield txn.setCalendarserverValue(statusKey, names)
+    except RuntimeError:
+        yield txn.abort()
+        raise
+    else:
+        yield txn.commit()
+
+    # Calendar object writes in this process check again whether the index is empty
+    CalendarObject._indexedPropertiesEmpty = None
+
+
+@inlineCallbacks
+def indexCalendarHome(txn, homeResourceID):
+    """
+    For this calendar home, populate the CALENDAR_OBJECT_PROPERTY rows for each
+    resource in its owned calendars.
+    """
+
+    home = yield txn.calendarHomeWithResourceID(homeResourceID)
+    calendars = yield home.loadChildren()
+    for calendar in calendars:
+        if not calendar.owned():
+            continue
+        for calendarObject in (yield calendar.objectResources()):
+            try:
+                component = yield calendarObject.component()
+            except InternalDataStoreError as e:
+                log.error("Could not index properties for id={id}: {ex}", id=calendarObject._resourceID, ex=e)
+                continue
+            yield calendarObject._updateIndexedProperties(component, True, txn)
@@ -0,0 +1,173 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from twext.enterprise.dal.syntax import Delete, Insert, Select
+
+from twisted.internet.defer import inlineCallbacks, returnValue
+
+from twistedcaldav.config import config
+from twistedcaldav.ical import Component
+
+from txdav.caldav.datastore.sql import CalendarObject
+from txdav.caldav.datastore.test.util import CommonStoreTests
+from txdav.common.datastore.sql_tables import schema
+from txdav.common.datastore.upgrade.sql.others import indexed_properties
+from txdav.common.datastore.upgrade.sql.upgrade import UpgradeDatabaseOtherStep
+
+"""
+Tests for L{txdav.common.datastore.upgrade.sql.others.indexed_properties}.
+"""
+
+
+class IndexedPropertiesTests(CommonStoreTests):
+    """
+    Tests for L{indexed_properties.doUpgrade}.
+    """
+
+    data = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:%(uid)s
+DTSTART:20160102T140000Z
+DURATION:PT1H
+DTSTAMP:20160101T000000Z
+SUMMARY:%(summary)s
+LOCATION:Room 1
+END:VEVENT
+END:VCALENDAR
+""".replace("\n", "\r\n")
+
+    @inlineCallbacks
+    def setUp(self):
+        yield super(IndexedPropertiesTests, self).setUp()
+
+        cs = schema.CALENDARSERVER
+        yield Delete(
+            From=cs,
+            Where=cs.NAME == indexed_properties.statusKey
+        ).on(self.transactionUnderTest())
+        yield self.commit()
+        self.patch(CalendarObject, "_indexedPropertiesEmpty", None)
+
+    @inlineCallbacks
+    def _indexed(self):
+        prop = schema.CALENDAR_OBJECT_PROPERTY
+        rows = yield Select(
+            [prop.NAME, prop.VALUE],
+            From=prop,
+        ).on(self.transactionUnderTest())
+        status = yield self.transactionUnderTest().calendarserverValue(indexed_properties.statusKey, raiseIfMissing=False)
+        yield self.commit()
+        returnValue((sorted(rows), status,))
+
+    @inlineCallbacks
+    def _upgrade(self):
+        yield indexed_properties.doUpgrade(UpgradeDatabaseOtherStep(self._sqlCalendarStore))
+
+    @inlineCallbacks
+    def test_rebuild(self):
+        """
+        Existing resources are indexed when a property is added to
+        C{config.IndexedQueryProperties}, and the index is only rebuilt when the
+        properties change.
+        """
+
+        self.patch(config, "IndexedQueryProperties", [])
+        for home, summary in (("user01", "Team Meeting"), ("user02", "Lunch")):
+            calendar = yield self.calendarUnderTest(name="calendar_1", home=home)
+            yield calendar.createCalendarObjectWithName("%s.ics" % (home,), Component.fromString(self.data % {
+                "uid": home, "summary": summary,
+            }))
+        yield self.commit()
+        yield self._upgrade()
+        self.assertEqual((yield self._indexed()), ([], None))
+
+        self.patch(config, "IndexedQueryProperties", ["summary"])
+        yield self._upgrade()
+        self.assertEqual((yield self._indexed()), ([("SUMMARY", "lunch"), ("SUMMARY", "team meeting")], "SUMMARY"))
+
+        # Nothing is rebuilt while the properties stay the same
+        prop = schema.CALENDAR_OBJECT_PROPERTY
+        yield Delete(From=prop, Where=prop.VALUE == "lunch").on(self.transactionUnderTest())
+        yield self.commit()
+        yield self._upgrade()
+        self.assertEqual((yield self._indexed()), ([("SUMMARY", "team meeting")], "SUMMARY"))
+
+        self.patch(config, "IndexedQueryProperties", ["SUMMARY", "LOCATION"])
+        yield self._upgrade()
+        self.assertEqual((yield self._indexed()), ([
+            ("LOCATION", "room 1"), ("LOCATION", "room 1"),
+            ("SUMMARY", "lunch"), ("SUMMARY", "team meeting"),
+        ], "LOCATION,SUMMARY"))
+
+        self.patch(config, "IndexedQueryProperties", [])
+        yield self._upgrade()
+        self.assertEqual((yield self._indexed())[0], [])
+
+    @inlineCallbacks
+    def test_updateWithoutProperties(self):
+        """
+        Updating a resource removes its index rows even when no properties are
+        configured, so that none are left stale.
+        """
+
+        self.patch(config, "IndexedQueryProperties", ["SUMMARY"])
+        calendar = yield self.calendarUnderTest(name="calendar_1", home="user01")
+        yield calendar.createCalendarObjectWithName("user01.ics", Component.fromString(self.data % {
+            "uid": "user01", "summary": "Team Meeting",
+        }))
+        yield self.commit()
+        self.assertEqual((yield self._indexed())[0], [("SUMMARY", "team meeting")])
+
+        self.patch(config, "IndexedQueryProperties", [])
+        calendarObject = yield self.calendarObjectUnderTest(name="user01.ics", calendar_name="calendar_1", home="user01")
+        yield calendarObject.setComponent(Component.fromString(self.data % {
+            "uid": "user01", "summary": "Lunch",
+        }))
+        yield self.commit()
+        self.assertEqual((yield self._indexed())[0], [])
+
+    @inlineCallbacks
+    def test_updateWithEmptyIndex(self):
+        """
+        Updating a resource does not try to remove its index rows when no properties
+        are configured and the index was built for none.
+        """
+
+        self.patch(config, "IndexedQueryProperties", [])
+        calendar = yield self.calendarUnderTest(name="calendar_1", home="user01")
+        yield calendar.createCalendarObjectWithName("user01.ics", Component.fromString(self.data % {
+            "uid": "user01", "summary": "Team Meeting",
+        }))
+        yield self.commit()
+        yield self._upgrade()
+
+        # A row the index could not have had is left alone, showing it was not deleted
+        calendarObject = yield self.calendarObjectUnderTest(name="user01.ics", calendar_name="calendar_1", home="user01")
+        prop = schema.CALENDAR_OBJECT_PROPERTY
+        yield Insert({
+            prop.CALENDAR_RESOURCE_ID: calendarObject._calendar._resourceID,
+            prop.CALENDAR_OBJECT_RESOURCE_ID: calendarObject._resourceID,
+            prop.NAME: "SUMMARY",
+            prop.VALUE: "team meeting",
+        }).on(self.transactionUnderTest())
+        yield calendarObject.setComponent(Component.fromString(self.data % {
+            "uid": "user01", "summary": "Lunch",
+        }))
+        yield self.commit()
+        self.assertTrue(CalendarObject._indexedPropertiesEmpty)
+        self.assertEqual((yield self._indexed())[0], [("SUMMARY", "team meeting")])
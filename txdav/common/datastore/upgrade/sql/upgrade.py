@@ -33,6 +33,7 @@ from twisted.python.reflect import namedObject
 from twistedcaldav.config import config
 
 from txdav.common.datastore.upgrade.sql.others import attachment_migration
+from txdav.common.datastore.upgrade.sql.others import indexed_properties
 
 
 class UpgradeAcquireLockStep(object):
@@ -477,6 +478,9 @@ class UpgradeDatabaseOtherStep(UpgradeDatabaseCoreStep):
         # Migration from dropbox to managed attachments
         yield attachment_migration.doUpgrade(self)
 
+        # Rebuild the calendar-query property index if its properties changed
+        yield indexed_properties.doUpgrade(self)
+
         self.sqlStore.setUpgrading(False)
 
         self.log.warn("Database {vers} check complete.", vers=self.versionDescriptor)
@@ -0,0 +1,78 @@
+# -*- test-case-name: txdav.common.datastore.upgrade.sql.test -*-
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+from twext.python.log import Logger
+
+from twisted.internet.defer import inlineCallbacks
+
+from twistedcaldav.config import config
+
+from txdav.common.datastore.sql_tables import schema
+from txdav.common.datastore.upgrade.sql.upgrades.util import updateCalendarDataVersion, \
+    doToEachHomeNotAtVersion
+from txdav.common.icommondatastore import InternalDataStoreError
+
+"""
+Data upgrade from database version 6 to 7
+"""
+
+UPGRADE_TO_VERSION = 7
+
+log = Logger()
+
+
+@inlineCallbacks
+def doUpgrade(sqlStore):
+    """
+    Do the required upgrade steps.
+    """
+    yield updateCalendarHomes(sqlStore, config.UpgradeHomePrefix)
+
+    # Don't do remaining upgrade if we are only process a subset of the homes
+    if not config.UpgradeHomePrefix:
+        # Always bump the DB value
+        yield updateCalendarDataVersion(sqlStore, UPGRADE_TO_VERSION)
+
+
+@inlineCallbacks
+def updateCalendarHomes(sqlStore, prefix=None):
+    """
+    For each calendar home, index the organizers and attendees of the resources in its owned calendars.
+    """
+
+    yield doToEachHomeNotAtVersion(sqlStore, schema.CALENDAR_HOME, UPGRADE_TO_VERSION, indexCalendarHome, "Index Calendar Home Attendees", filterOwnerUID=prefix)
+
+
+@inlineCallbacks
+def indexCalendarHome(txn, homeResourceID):
+    """
+    For this calendar home, populate the CALENDAR_OBJECT_ATTENDEE rows for each
+    resource in its owned calendars.
+    """
+
+    home = yield txn.calendarHomeWithResourceID(homeResourceID)
+    calendars = yield home.loadChildren()
+    for calendar in calendars:
+        if not calendar.owned():
+            continue
+        for calendarObject in (yield calendar.objectResources()):
+            try:
+                component = yield calendarObject.component()
+            except InternalDataStoreError as e:
+                log.error("Could not index attendees for id={id}: {ex}", id=calendarObject._resourceID, ex=e)
+                continue
+            yield calendarObject._updateAttendees(component, False, txn)
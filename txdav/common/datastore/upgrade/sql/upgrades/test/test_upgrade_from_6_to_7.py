@@ -0,0 +1,84 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+"""
+Tests for L{txdav.common.datastore.upgrade.sql.upgrade}.
+"""
+
+from twext.enterprise.dal.syntax import Delete, Select, Update
+
+from twisted.internet.defer import inlineCallbacks
+
+from twistedcaldav.ical import Component
+
+from txdav.caldav.datastore.test.util import CommonStoreTests
+from txdav.caldav.icalendarstore import ComponentUpdateState
+from txdav.common.datastore.sql_tables import schema
+from txdav.common.datastore.upgrade.sql.upgrades.calendar_upgrade_from_6_to_7 import doUpgrade
+
+
+class Upgrade_from_6_to_7(CommonStoreTests):
+    """
+    Tests for the attendee index data upgrade.
+    """
+
+    @inlineCallbacks
+    def test_attendeeIndexUpgrade(self):
+
+        data = """BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//CALENDARSERVER.ORG//NONSGML Version 1//EN
+BEGIN:VEVENT
+UID:upgrade
+DTSTART:20160102T140000Z
+DURATION:PT1H
+DTSTAMP:20160101T000000Z
+ORGANIZER:mailto:organizer@example.com
+ATTENDEE:mailto:organizer@example.com
+ATTENDEE;PARTSTAT=ACCEPTED:mailto:User01@example.com
+END:VEVENT
+END:VCALENDAR
+""".replace("\n", "\r\n")
+
+        calendar = yield self.calendarUnderTest(name="calendar_1", home="user01")
+        yield calendar._createCalendarObjectWithNameInternal("upgrade.ics", Component.fromString(data), internal_state=ComponentUpdateState.RAW)
+
+        # Remove the index entries and force data version to previous
+        att = schema.CALENDAR_OBJECT_ATTENDEE
+        yield Delete(From=att, Where=att.CUA != None).on(self.transactionUnderTest())
+        ch = schema.CALENDAR_HOME
+        yield Update(
+            {ch.DATAVERSION: 6},
+            Where=None,
+        ).on(self.transactionUnderTest())
+        yield self.commit()
+
+        yield doUpgrade(self._sqlCalendarStore)
+
+        rows = yield Select(
+            [att.ORGANIZER, att.CUA, att.PARTSTAT],
+            From=att,
+        ).on(self.transactionUnderTest())
+        self.assertEqual(sorted([(bool(organizer), cuaddr, partstat) for organizer, cuaddr, partstat in rows]), [
+            (False, "mailto:organizer@example.com", None),
+            (False, "mailto:user01@example.com", "accepted"),
+            (True, "mailto:organizer@example.com", None),
+        ])
+
+        home = yield self.homeUnderTest(name="user01")
+        version = (yield home.dataVersion())
+        self.assertEqual(version, 7)
+        version = yield self.transactionUnderTest().calendarserverValue("CALENDAR-DATAVERSION")
+        self.assertEqual(int(version), 7)
@@ -37,6 +37,7 @@ from txdav.caldav.icalendardirectoryservice import (
 from txdav.common.idirectoryservice import IStoreDirectoryService
 from txdav.dps.commands import (
     RecordWithShortNameCommand, RecordWithUIDCommand, RecordWithGUIDCommand,
+    RecordsWithUIDsCommand, RecordsWithCalendarUserAddressesCommand,
     RecordsWithRecordTypeCommand, RecordsWithEmailAddressCommand,
     RecordsMatchingTokensCommand, RecordsMatchingFieldsCommand,
     MembersCommand, GroupsCommand, SetMembersCommand,
@@ -76,6 +77,9 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
     Client side of directory proxy
     """
 
+    # Maximum number of keys to send in one batched lookup
+    BATCH_SIZE = 250
+
     # FIXME: somehow these should come from the actual directory:
 
     recordType = ConstantsContainer(
@@ -151,6 +155,18 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
                 results.append(record)
         return results
 
+    def _processKeyedRecords(self, result):
+        """
+        Takes a dictionary with a "items" key whose value is an iterable
+        of pickled (key, fields) tuples, and returns a dictionary mapping
+        each key to a record (or L{None}).
+        """
+        results = {}
+        for item in result["items"]:
+            key, serializedFields = pickle.loads(item)
+            results[key] = self._dictToRecord(serializedFields)
+        return results
+
     @inlineCallbacks
     def _getConnection(self):
 
@@ -278,6 +294,62 @@ class DirectoryService(BaseDirectoryService, CalendarDirectoryServiceMixin):
             **kwds
         )
 
+    @inlineCallbacks
+    def _batchedCall(self, command, argName, keys, timeoutSeconds=None):
+        """
+        Execute a batched lookup command, splitting the keys up so that each
+        request stays well within the AMP size limit.
+
+        @return: a C{dict} mapping each key to a record (or L{None})
+        """
+        encoded = {}
+        for key in keys:
+            encoded[key.encode("utf-8") if isinstance(key, unicode) else key] = key
+
+        results = dict([(key, None,) for key in encoded.values()])
+        batch = encoded.keys()
+        while batch:
+            kwds = {argName: batch[:self.BATCH_SIZE]}
+            batch = batch[self.BATCH_SIZE:]
+            if timeoutSeconds is not None:
+                kwds["timeoutSeconds"] = timeoutSeconds
+            records = yield self._call(
+                command,
+                self._processKeyedRecords,
+                **kwds
+            )
+            for key, record in records.iteritems():
+                if key in encoded:
+                    results[encoded[key]] = record
+
+        returnValue(results)
+
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+        return self._batchedCall(
+            RecordsWithUIDsCommand, "uids", uids,
+            timeoutSeconds=timeoutSeconds
+        )
+
+    def _recordsWithCalendarUserAddressesUnchecked(self, addresses, timeoutSeconds=None):
+        """
+        Lookup the records for a set of calendar user addresses, without
+        checking they are valid calendar users.
+        """
+        return self._batchedCall(
+            RecordsWithCalendarUserAddressesCommand, "addresses", addresses,
+            timeoutSeconds=timeoutSeconds
+        )
+
+    @inlineCallbacks
+    def recordsWithCalendarUserAddresses(self, addresses, timeoutSeconds=None):
+        records = yield self._recordsWithCalendarUserAddressesUnchecked(
+            addresses, timeoutSeconds=timeoutSeconds
+        )
+        returnValue(dict([
+            (address, self._calendarUserAddressRecord(record),)
+            for address, record in records.items()
+        ]))
+
     def recordWithGUID(self, guid, timeoutSeconds=None):
         kwds = {
             "guid": str(guid),
@@ -48,6 +48,28 @@ class RecordWithGUIDCommand(amp.Command):
     ]
 
 
+class RecordsWithUIDsCommand(amp.Command):
+    arguments = [
+        ('uids', amp.ListOf(amp.String())),
+        ('timeoutSeconds', amp.Integer(optional=True)),
+    ]
+    response = [
+        ('items', amp.ListOf(amp.String())),
+        ('continuation', amp.String(optional=True)),
+    ]
+
+
+class RecordsWithCalendarUserAddressesCommand(amp.Command):
+    arguments = [
+        ('addresses', amp.ListOf(amp.String())),
+        ('timeoutSeconds', amp.Integer(optional=True)),
+    ]
+    response = [
+        ('items', amp.ListOf(amp.String())),
+        ('continuation', amp.String(optional=True)),
+    ]
+
+
 class RecordsWithRecordTypeCommand(amp.Command):
     arguments = [
         ('recordType', amp.String()),
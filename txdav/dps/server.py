@@ -26,7 +26,8 @@ from twext.who.expression import MatchType, MatchFlags, Operand
 
 from twisted.application import service
 from twisted.application.strports import service as strPortsService
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults, \
+    succeed
 from twisted.internet.protocol import Factory
 from twisted.plugin import IPlugin
 from twisted.protocols import amp
@@ -38,6 +39,7 @@ from twistedcaldav.stdconfig import DEFAULT_CONFIG, DEFAULT_CONFIG_FILE
 
 from txdav.dps.commands import (
     RecordWithShortNameCommand, RecordWithUIDCommand, RecordWithGUIDCommand,
+    RecordsWithUIDsCommand, RecordsWithCalendarUserAddressesCommand,
     RecordsWithRecordTypeCommand, RecordsWithEmailAddressCommand,
     RecordsMatchingTokensCommand, RecordsMatchingFieldsCommand,
     MembersCommand, ExpandedMembersCommand, GroupsCommand, SetMembersCommand,
@@ -285,6 +287,71 @@ class DirectoryProxyAMPProtocol(amp.AMP):
         # log.debug("Responding with: {response}", response=response)
         returnValue(response)
 
+    def _keyedRecordsToResponse(self, records):
+        """
+        Craft an AMP response for a batched lookup. Each item is a pickled
+        tuple of the key that was looked up and the fields of the record found
+        for it (empty if there was no record). The existing continuation
+        mechanism is used if the response is too large.
+
+        @param records: a C{dict} mapping each key to a record or L{None}
+        """
+        items = [
+            pickle.dumps((key.encode("utf-8"), self.recordToDict(record),))
+            for key, record in records.iteritems()
+        ]
+        return self._itemsToResponse(items)
+
+    @RecordsWithUIDsCommand.responder
+    @inlineCallbacks
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+        uids = [uid.decode("utf-8") for uid in uids]
+        log.debug("RecordsWithUIDs: {count} uids", count=len(uids))
+        try:
+            records = (yield self._directory.recordsWithUIDs(
+                uids, timeoutSeconds=timeoutSeconds
+            ))
+        except Exception as e:
+            log.error("Failed in recordsWithUIDs", error=e)
+            records = {}
+        response = self._keyedRecordsToResponse(records)
+        # log.debug("Responding with: {response}", response=response)
+        returnValue(response)
+
+    @RecordsWithCalendarUserAddressesCommand.responder
+    @inlineCallbacks
+    def recordsWithCalendarUserAddresses(self, addresses, timeoutSeconds=None):
+        """
+        The records returned here are not checked for being valid calendar
+        users - the client does that, so that it can also cache the records.
+        """
+        addresses = [address.decode("utf-8") for address in set(addresses)]
+        log.debug("RecordsWithCalendarUserAddresses: {count} addresses", count=len(addresses))
+
+        def _failed(failure, address):
+            log.error(
+                "Failed in recordsWithCalendarUserAddresses for {address}: {ex}",
+                address=address, ex=failure.value
+            )
+            return None
+
+        ds = []
+        for address in addresses:
+            lookup = self._directory._calendarUserAddressLookup(address)
+            if lookup is None:
+                ds.append(succeed(None))
+            else:
+                d = self._directory._recordForCalendarUserAddressLookup(
+                    lookup, timeoutSeconds=timeoutSeconds
+                )
+                d.addErrback(_failed, address)
+                ds.append(d)
+        records = yield gatherResults(ds)
+        records = dict(zip(addresses, records))
+        response = self._keyedRecordsToResponse(records)
+        # log.debug("Responding with: {response}", response=response)
+        returnValue(response)
+
     @RecordsWithRecordTypeCommand.responder
     @inlineCallbacks
     def recordsWithRecordType(
@@ -128,6 +128,32 @@ class DPSClientSingleDirectoryTest(unittest.TestCase):
             record = (yield self.directory.recordWithGUID(testUID))
             self.assertTrue(testShortName in record.shortNames)
 
+    @inlineCallbacks
+    def test_recordsWithUIDs(self):
+        records = (yield self.directory.recordsWithUIDs(
+            [testUID, u"__no_such_uid__"]
+        ))
+        self.assertEquals(len(records), 2)
+        self.assertTrue(testShortName in records[testUID].shortNames)
+        self.assertTrue(records[u"__no_such_uid__"] is None)
+
+    @inlineCallbacks
+    def test_recordsWithCalendarUserAddresses(self):
+        addresses = [
+            "urn:x-uid:{}".format(testUID.encode("utf-8")),
+            "/principals/users/{}".format(testShortName.encode("utf-8")),
+            "urn:x-uid:__no_such_uid__",
+            "http://example.com/not-a-cuaddr",
+        ]
+        records = (yield self.directory._recordsWithCalendarUserAddressesUnchecked(
+            addresses
+        ))
+        self.assertEquals(len(records), 4)
+        self.assertEquals(records[addresses[0]].uid, testUID)
+        self.assertEquals(records[addresses[1]].uid, testUID)
+        self.assertTrue(records[addresses[2]] is None)
+        self.assertTrue(records[addresses[3]] is None)
+
     @inlineCallbacks
     def test_recordType(self):
         if testMode != "od":
@@ -858,6 +884,14 @@ class DPSClientLargeResultsTest(unittest.TestCase):
         members = yield group.members()
         self.assertEquals(len(members), self.numUsers)
 
+        # recordsWithUIDs
+        uids = [u"foo{ctr:05d}".format(ctr=i) for i in xrange(self.numUsers)]
+        records = yield self.directory.recordsWithUIDs(uids)
+        self.assertEquals(len(records), self.numUsers)
+        self.assertEquals(
+            set([record.uid for record in records.values()]), set(uids)
+        )
+
         # force the limit small so continuations happen
         self.server._maxSize = 500
         # expandedMemberUIDs
@@ -247,6 +247,18 @@ class AugmentedDirectoryService(
             self, *args, **kwds
         )
 
+    @timed
+    def recordsWithUIDs(self, *args, **kwds):
+        return CalendarDirectoryServiceMixin.recordsWithUIDs(
+            self, *args, **kwds
+        )
+
+    @timed
+    def recordsWithCalendarUserAddresses(self, *args, **kwds):
+        return CalendarDirectoryServiceMixin.recordsWithCalendarUserAddresses(
+            self, *args, **kwds
+        )
+
     @timed
     def recordsMatchingTokens(self, *args, **kwds):
         return CalendarDirectoryServiceMixin.recordsMatchingTokens(
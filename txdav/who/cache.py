@@ -27,12 +27,14 @@ import base64
 import time
 import uuid
 
+from collections import OrderedDict
+
 from zope.interface import implementer
 
 from twistedcaldav.memcacheclient import ClientFactory, MemcacheError
 from twistedcaldav.config import config
 
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults
 from twext.python.log import Logger
 from twext.who.directory import DirectoryService as BaseDirectoryService
 from twext.who.idirectory import (
@@ -63,6 +65,63 @@ class IndexType(Values):
     emailAddress = ValueConstant("emailAddress")
 
 
+class LRUIndex(object):
+    """
+    One index of the in-process record cache. Entries are kept in
+    least-recently-used order, and once the index holds C{maxEntries} entries
+    the least recently used one is evicted to make room for a new one.
+    Hit, miss and eviction counts are kept for L{CachingDirectoryService.stats}.
+    """
+
+    def __init__(self, maxEntries=0):
+        """
+        @param maxEntries: the maximum number of entries, 0 for no limit
+        @type maxEntries: L{int}
+        """
+        self._entries = OrderedDict()
+        self._maxEntries = maxEntries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """
+        Return the entry for C{key} and mark it as the most recently used.
+        """
+        try:
+            value = self._entries.pop(key)
+        except KeyError:
+            return default
+        self._entries[key] = value
+        return value
+
+    def __getitem__(self, key):
+        return self._entries[key]
+
+    def __setitem__(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = value
+        if self._maxEntries:
+            while len(self._entries) > self._maxEntries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def __delitem__(self, key):
+        del self._entries[key]
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def __len__(self):
+        return len(self._entries)
+
+    def keys(self):
+        return self._entries.keys()
+
+    def items(self):
+        return self._entries.items()
+
+
 class DirectoryMemcacheError(DirectoryServiceError):
     """
     Error communicating with memcached.
@@ -290,7 +349,10 @@ class CachingDirectoryService(
         FieldName,
     ))
 
-    def __init__(self, directory, expireSeconds=30, lookupsBetweenPurges=0, negativeCaching=True):
+    def __init__(
+        self, directory, expireSeconds=30, lookupsBetweenPurges=0,
+        negativeCaching=True, maxRecordsPerIndex=0,
+    ):
         BaseDirectoryService.__init__(self, directory.realmName)
         self._directory = directory
 
@@ -318,6 +380,7 @@ class CachingDirectoryService(
             self._lookupsBetweenPurges = lookupsBetweenPurges
 
         self.negativeCaching = negativeCaching
+        self._maxRecordsPerIndex = maxRecordsPerIndex
 
         self.resetCache()
 
@@ -340,18 +403,17 @@ class CachingDirectoryService(
         """
 
         log.debug("Resetting cache")
-        self._cache = {
-            IndexType.uid: {},
-            IndexType.guid: {},
-            IndexType.shortName: {},  # key is (recordType.name, shortName)
-            IndexType.emailAddress: {},
-        }
-        self._negativeCache = {
-            IndexType.uid: {},
-            IndexType.guid: {},
-            IndexType.shortName: {},  # key is (recordType.name, shortName)
-            IndexType.emailAddress: {},
-        }
+
+        # Each index is bounded separately; for IndexType.shortName the key is
+        # (recordType.name, shortName)
+        self._cache = dict([
+            (indexType, LRUIndex(self._maxRecordsPerIndex),)
+            for indexType in IndexType.iterconstants()
+        ])
+        self._negativeCache = dict([
+            (indexType, LRUIndex(self._maxRecordsPerIndex),)
+            for indexType in IndexType.iterconstants()
+        ])
         self._hitCount = 0
         self._requestCount = 0
         if self._purgingEnabled:
@@ -540,9 +602,10 @@ class CachingDirectoryService(
             now = time.time()
 
         self._requestCount += 1
-        if key in self._cache[indexType]:
+        cached = self._cache[indexType].get(key)
+        if cached is not None:
 
-            cachedTime, record = self._cache[indexType].get(key, (0.0, None))
+            cachedTime, record = cached
             if now - self._expireSeconds > cachedTime:
                 log.debug(
                     "Directory cache miss (expired): {index} {key}",
@@ -563,9 +626,12 @@ class CachingDirectoryService(
                     key=key
                 )
                 self._hitCount += 1
+                self._cache[indexType].hits += 1
                 self._addTiming("{}-hit".format(name), 0)
                 return (record, False,)
 
+        self._cache[indexType].misses += 1
+
         # Check negative cache (take cache entry timeout into account)
         if self.negativeCaching:
             try:
@@ -733,6 +799,111 @@ class CachingDirectoryService(
 
         returnValue(records)
 
+    @inlineCallbacks
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+        """
+        Records that are cached are returned directly, and the rest are looked
+        up together - with a single request if the wrapped directory is the DPS
+        client.
+        """
+
+        results = {}
+        misses = []
+        for uid in set(uids):
+            record, doQuery = self.lookupRecord(IndexType.uid, uid, "recordsWithUIDs")
+            if record is None and doQuery:
+                misses.append(uid)
+            else:
+                results[uid] = record
+
+        if misses:
+            if isinstance(self._directory, DPSClientDirectoryService):
+                records = yield self._directory.recordsWithUIDs(
+                    misses, timeoutSeconds=timeoutSeconds
+                )
+            else:
+                records = yield gatherResults([
+                    self._directory._wrapped_recordWithUID(uid, timeoutSeconds=timeoutSeconds)
+                    for uid in misses
+                ])
+                records = dict(zip(misses, records))
+
+            for uid in misses:
+                record = records.get(uid)
+                if record is not None:
+                    # Note we do not index on email address; see recordsWithEmailAddress.
+                    self.cacheRecord(
+                        record,
+                        (IndexType.uid, IndexType.guid, IndexType.shortName)
+                    )
+                else:
+                    self.negativeCacheRecord(IndexType.uid, uid)
+                results[uid] = record
+
+        returnValue(results)
+
+    @inlineCallbacks
+    def recordsWithCalendarUserAddresses(self, addresses, timeoutSeconds=None):
+        """
+        Records that are cached are returned directly. If the wrapped directory
+        is the DPS client the rest are looked up with a single request,
+        otherwise they are looked up one at a time.
+        """
+
+        results = {}
+        misses = {}
+        for address in set(addresses):
+            lookup = self._calendarUserAddressLookup(address)
+            if lookup is None:
+                results[address] = None
+                continue
+
+            kind, value = lookup
+            if kind == "shortName":
+                if value[0] is None:
+                    results[address] = None
+                    continue
+                indexType, key = IndexType.shortName, (value[0].name, value[1])
+            else:
+                indexType, key = IndexType.lookupByValue(kind), value
+
+            record, doQuery = self.lookupRecord(indexType, key, "recordsWithCalendarUserAddresses")
+            if record is None and doQuery:
+                misses[address] = (lookup, indexType, key,)
+            else:
+                results[address] = self._calendarUserAddressRecord(record)
+
+        if misses:
+            if isinstance(self._directory, DPSClientDirectoryService):
+                records = yield self._directory._recordsWithCalendarUserAddressesUnchecked(
+                    misses.keys(), timeoutSeconds=timeoutSeconds
+                )
+                for address, (_ignore_lookup, indexType, key) in misses.items():
+                    record = records.get(address)
+                    if record is not None:
+                        # As with recordsWithEmailAddress, only index on email
+                        # address when that is what was looked up
+                        indexTypes = [IndexType.uid, IndexType.guid, IndexType.shortName]
+                        if indexType == IndexType.emailAddress:
+                            indexTypes.append(IndexType.emailAddress)
+                        self.cacheRecord(record, indexTypes)
+                    else:
+                        self.negativeCacheRecord(indexType, key)
+                    results[address] = self._calendarUserAddressRecord(record)
+            else:
+                # These will get cached by the underlying recordWith... calls
+                addresses = misses.keys()
+                records = yield gatherResults([
+                    self._recordForCalendarUserAddressLookup(
+                        misses[address][0], timeoutSeconds=timeoutSeconds
+                    )
+                    for address in addresses
+                ])
+                for address, record in zip(addresses, records):
+                    results[address] = self._calendarUserAddressRecord(record)
+
+        returnValue(results)
+
     # Uncached methods:
 
     @property
@@ -816,5 +987,28 @@ class CachingDirectoryService(
         self.resetCache()
         yield self._directory.flush()
 
+    def cacheStats(self):
+        """
+        Return the in-process cache counters for each index.
+
+        @return: a L{dict} mapping a name to a count
+        @rtype: L{dict}
+        """
+        results = {}
+        for indexType, index in self._cache.items():
+            prefix = "cache-{}".format(indexType.value)
+            results["{}-hits".format(prefix)] = index.hits
+            results["{}-misses".format(prefix)] = index.misses
+            results["{}-evictions".format(prefix)] = index.evictions
+            results["{}-size".format(prefix)] = len(index)
+        return results
+
+    @inlineCallbacks
     def stats(self):
-        return self._directory.stats()
+        results = yield self._directory.stats()
+        results = dict(results)
+
+        # The cache counters and sizes are not calls, so keep them apart from the
+        # per-method call stats
+        results["cache"] = self.cacheStats()
+        returnValue(results)
@@ -27,7 +27,7 @@ from twext.who.expression import (
 )
 from twext.who.idirectory import RecordType as BaseRecordType, FieldName as BaseFieldName
 from twisted.cred.credentials import UsernamePassword
-from twisted.internet.defer import inlineCallbacks, returnValue
+from twisted.internet.defer import inlineCallbacks, returnValue, gatherResults
 from twistedcaldav.config import config
 from twistedcaldav.ical import Property
 from txdav.caldav.datastore.scheduling.utils import normalizeCUAddr
@@ -74,8 +74,27 @@ class CalendarDirectoryServiceMixin(object):
     def recordWithCalendarUserAddress(
         self, address, timeoutSeconds=None
     ):
+        lookup = self._calendarUserAddressLookup(address)
+        if lookup is None:
+            returnValue(None)
+        record = yield self._recordForCalendarUserAddressLookup(
+            lookup, timeoutSeconds=timeoutSeconds
+        )
+        returnValue(self._calendarUserAddressRecord(record))
+
+    def _calendarUserAddressLookup(self, address):
+        """
+        Determine how to find the record for a calendar user address.
+
+        @param address: the calendar user address
+        @type address: L{str}
+
+        @return: a L{tuple} of the lookup kind ("uid", "guid", "emailAddress" or
+            "shortName") and the value to lookup, or L{None} if the address
+            cannot be mapped to a record lookup.
+        @rtype: L{tuple} or L{None}
+        """
         address = normalizeCUAddr(address)
-        record = None
 
         if config.Scheduling.Options.FakeResourceLocationEmail:
             if address.startswith("mailto:") and address.endswith("@do_not_reply"):
@@ -89,49 +108,105 @@ class CalendarDirectoryServiceMixin(object):
                         address = ""
 
         if address.startswith("urn:x-uid:"):
-            uid = address[10:]
-            record = yield self.recordWithUID(
-                uid, timeoutSeconds=timeoutSeconds
-            )
+            return ("uid", address[10:],)
 
         elif address.startswith("urn:uuid:"):
             try:
                 guid = uuid.UUID(address[9:])
             except ValueError:
                 log.info("Invalid GUID: {guid}", guid=address[9:])
-                returnValue(None)
-            record = yield self.recordWithGUID(
-                guid, timeoutSeconds=timeoutSeconds
-            )
+                return None
+            return ("guid", guid,)
 
         elif address.startswith("mailto:"):
-            records = yield self.recordsWithEmailAddress(
-                address[7:], limitResults=1, timeoutSeconds=timeoutSeconds
-            )
-            record = records[0] if records else None
+            return ("emailAddress", address[7:],)
 
         elif address.startswith("/principals/"):
             parts = address.split("/")
             if len(parts) == 4:
                 if parts[2] == "__uids__":
-                    uid = parts[3]
-                    record = yield self.recordWithUID(
-                        uid, timeoutSeconds=timeoutSeconds
-                    )
+                    return ("uid", parts[3],)
                 else:
                     recordType = self.oldNameToRecordType(parts[2])
-                    record = yield self.recordWithShortName(
-                        recordType, parts[3], timeoutSeconds=timeoutSeconds
-                    )
+                    return ("shortName", (recordType, parts[3],),)
 
+        return None
+
+    @inlineCallbacks
+    def _recordForCalendarUserAddressLookup(self, lookup, timeoutSeconds=None):
+        """
+        Find the record for a lookup returned by L{_calendarUserAddressLookup}.
+        Note that the record is not checked for being a valid calendar user.
+        """
+        kind, value = lookup
+        if kind == "uid":
+            record = yield self.recordWithUID(
+                value, timeoutSeconds=timeoutSeconds
+            )
+        elif kind == "guid":
+            record = yield self.recordWithGUID(
+                value, timeoutSeconds=timeoutSeconds
+            )
+        elif kind == "emailAddress":
+            records = yield self.recordsWithEmailAddress(
+                value, limitResults=1, timeoutSeconds=timeoutSeconds
+            )
+            record = records[0] if records else None
+        else:
+            record = yield self.recordWithShortName(
+                value[0], value[1], timeoutSeconds=timeoutSeconds
+            )
+        returnValue(record)
+
+    def _calendarUserAddressRecord(self, record):
+        """
+        Only records that can be calendar users are returned for a calendar
+        user address.
+        """
         if record:
             if record.hasCalendars or (
                 config.GroupAttendees.Enabled and
                 record.recordType == BaseRecordType.group
             ):
-                returnValue(record)
+                return record
+
+        return None
 
-        returnValue(None)
+    @inlineCallbacks
+    def recordsWithUIDs(self, uids, timeoutSeconds=None):
+        """
+        Find the records for a set of UIDs. Services that can do this in one
+        request to the underlying directory override this.
+
+        @param uids: the UIDs to lookup
+        @type uids: iterable of L{unicode}
+
+        @return: a L{dict} mapping each UID to its record, or L{None}
+        """
+        uids = list(set(uids))
+        records = yield gatherResults([
+            self.recordWithUID(uid, timeoutSeconds=timeoutSeconds)
+            for uid in uids
+        ])
+        returnValue(dict(zip(uids, records)))
+
+    @inlineCallbacks
+    def recordsWithCalendarUserAddresses(self, addresses, timeoutSeconds=None):
+        """
+        Find the records for a set of calendar user addresses. Services that
+        can do this in one request to the underlying directory override this.
+
+        @param addresses: the calendar user addresses to lookup
+        @type addresses: iterable of L{str}
+
+        @return: a L{dict} mapping each address to its record, or L{None}
+        """
+        addresses = list(set(addresses))
+        records = yield gatherResults([
+            self.recordWithCalendarUserAddress(address, timeoutSeconds=timeoutSeconds)
+            for address in addresses
+        ])
+        returnValue(dict(zip(addresses, records)))
 
     searchContext_location = "location"
     searchContext_resource = "resource"
@@ -198,6 +198,66 @@ class CacheTest(StoreTestCase):
         self.assertEquals(dir._hitCount, 1)
         self.assertEquals(dir._requestCount, 2)
 
+    @inlineCallbacks
+    def test_recordsWithUIDs(self):
+        """
+        Verify cached records are returned directly by recordsWithUIDs and
+        that the misses are cached (including negatively).
+        """
+
+        dir = self.cachingDirectory
+
+        yield dir.recordWithUID(u"cache-uid-1")
+        self.assertEquals(dir._hitCount, 0)
+        self.assertEquals(dir._requestCount, 1)
+
+        records = yield dir.recordsWithUIDs(
+            [u"cache-uid-1", u"cache-uid-2", u"cache-uid-missing"]
+        )
+        self.assertEquals(records[u"cache-uid-1"].uid, u"cache-uid-1")
+        self.assertEquals(records[u"cache-uid-2"].uid, u"cache-uid-2")
+        self.assertTrue(records[u"cache-uid-missing"] is None)
+        self.assertEquals(dir._hitCount, 1)
+        self.assertEquals(dir._requestCount, 4)
+
+        records = yield dir.recordsWithUIDs(
+            [u"cache-uid-2", u"cache-uid-missing"]
+        )
+        self.assertEquals(records[u"cache-uid-2"].uid, u"cache-uid-2")
+        self.assertTrue(records[u"cache-uid-missing"] is None)
+        self.assertEquals(dir._hitCount, 2)
+        self.assertEquals(dir._requestCount, 6)
+        self.assertEquals(dir._negativeCache[IndexType.uid].keys(), [u"cache-uid-missing"])
+
+    @inlineCallbacks
+    def test_recordsWithCalendarUserAddresses(self):
+        """
+        Verify recordsWithCalendarUserAddresses uses the cache for addresses
+        it can map to a cache index.
+        """
+
+        dir = self.cachingDirectory
+
+        yield dir.recordWithUID(u"cache-uid-1")
+        self.assertEquals(dir._hitCount, 0)
+        self.assertEquals(dir._requestCount, 1)
+
+        records = yield dir.recordsWithCalendarUserAddresses([
+            u"urn:x-uid:cache-uid-1",
+            u"mailto:cache-user-2@example.com",
+            u"http://example.com/not-a-cuaddr",
+        ])
+        self.assertEquals(records[u"urn:x-uid:cache-uid-1"].uid, u"cache-uid-1")
+        self.assertEquals(records[u"mailto:cache-user-2@example.com"].uid, u"cache-uid-2")
+        self.assertTrue(records[u"http://example.com/not-a-cuaddr"] is None)
+        self.assertEquals(dir._hitCount, 1)
+
+        records = yield dir.recordsWithCalendarUserAddresses([
+            u"mailto:cache-user-2@example.com",
+        ])
+        self.assertEquals(records[u"mailto:cache-user-2@example.com"].uid, u"cache-uid-2")
+        self.assertEquals(dir._hitCount, 2)
+
     @inlineCallbacks
     def test_cachingExpiration(self):
         """
@@ -265,6 +325,49 @@ class CacheTest(StoreTestCase):
         # cache-uid-2 still in cache
         self.assertTrue(u"cache-uid-2" in dir._cache[IndexType.uid])
 
+    @inlineCallbacks
+    def test_maxRecordsPerIndex(self):
+        """
+        Verify each index evicts its least recently used entry once it is full.
+        """
+
+        dir = CachingDirectoryService(
+            self.directory,
+            expireSeconds=10,
+            negativeCaching=True,
+            maxRecordsPerIndex=2,
+        )
+        dir.setTestTime(1.0)
+
+        yield dir.recordWithUID(u"cache-uid-1")
+        yield dir.recordWithUID(u"cache-uid-2")
+
+        # Use cache-uid-1 so that cache-uid-2 is the least recently used
+        record = yield dir.recordWithUID(u"cache-uid-1")
+        self.assertEquals(record.uid, u"cache-uid-1")
+        self.assertEquals(dir._hitCount, 1)
+
+        yield dir.recordWithUID(u"6423F94A-6B76-4A3A-815B-D52CFD77935D")
+        self.assertEquals(len(dir._cache[IndexType.uid]), 2)
+        self.assertTrue(u"cache-uid-1" in dir._cache[IndexType.uid])
+        self.assertFalse(u"cache-uid-2" in dir._cache[IndexType.uid])
+        self.assertTrue(u"6423F94A-6B76-4A3A-815B-D52CFD77935D" in dir._cache[IndexType.uid])
+
+        stats = dir.cacheStats()
+        self.assertEquals(stats["cache-uid-hits"], 1)
+        self.assertEquals(stats["cache-uid-misses"], 3)
+        self.assertEquals(stats["cache-uid-evictions"], 1)
+        self.assertEquals(stats["cache-uid-size"], 2)
+
+        # They are kept apart from the per-method call stats
+        allStats = yield dir.stats()
+        self.assertEquals(allStats["cache"], stats)
+        self.assertFalse([name for name in allStats if name.startswith("cache-")])
+
+        # Other indexes are bounded independently
+        self.assertTrue(len(dir._cache[IndexType.shortName]) <= 2)
+        self.assertTrue(stats["cache-shortName-evictions"] >= 1)
+
     @inlineCallbacks
     def test_negativeCaching(self):
         """
@@ -114,6 +114,7 @@ class UtilTest(TestCase):
                     "CachingSeconds": 60,
                     "NegativeCachingEnabled": True,
                     "LookupsBetweenPurges": 0,
+                    "MaxRecordsPerIndex": 0,
                 },
                 "DirectoryFilterStartsWith": False,
             }
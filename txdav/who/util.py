@@ -73,14 +73,15 @@ def directoryFromConfig(config, store):
         cachingSeconds=config.DirectoryCaching.CachingSeconds,
         filterStartsWith=config.DirectoryFilterStartsWith,
         lookupsBetweenPurges=config.DirectoryCaching.LookupsBetweenPurges,
-        negativeCaching=config.DirectoryCaching.NegativeCachingEnabled
+        negativeCaching=config.DirectoryCaching.NegativeCachingEnabled,
+        maxRecordsPerIndex=config.DirectoryCaching.MaxRecordsPerIndex,
     )
 
 
 def buildDirectory(
     store, dataRoot, servicesInfo, augmentServiceInfo, wikiServiceInfo,
     serversDB=None, cachingSeconds=0, filterStartsWith=False,
-    lookupsBetweenPurges=0, negativeCaching=True,
+    lookupsBetweenPurges=0, negativeCaching=True, maxRecordsPerIndex=0,
 ):
     """
     Return a directory without using a config object; suitable for tests
@@ -244,6 +245,7 @@ def buildDirectory(
                 expireSeconds=cachingSeconds,
                 lookupsBetweenPurges=lookupsBetweenPurges,
                 negativeCaching=negativeCaching,
+                maxRecordsPerIndex=maxRecordsPerIndex,
             )
             cachingServices.append(directory)
 
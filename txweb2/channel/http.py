@@ -23,6 +23,7 @@
 #
 ##
 
+import errno
 import time
 import warnings
 import socket
@@ -31,9 +32,11 @@ from cStringIO import StringIO
 
 from zope.interface import implements
 
-from twisted.internet import interfaces, protocol, reactor
+from twisted.internet import interfaces, protocol, reactor, main
 from twisted.internet.defer import succeed, Deferred
+from twisted.internet.error import ConnectionLost
 from twisted.protocols import policies, basic
+from twisted.python.failure import Failure
 
 from twext.python.log import Logger
 from txweb2 import responsecode
@@ -141,6 +144,88 @@ class StringTransport(object):
         return getattr(self.__dict__['s'], attr)
 
 
+def _bufferedLength(transport):
+    """
+    The number of bytes a socket transport has been given but not yet sent.
+    """
+    return len(transport.dataBuffer) - transport.offset + transport._tempDataLen
+
+
+class _FileSender(object):
+    """
+    Copy a L{txweb2.stream.SendfileBuffer} to a plain socket transport with
+    sendfile(2), so the data never passes through Python.
+
+    The reactor must only ever see one writer for the socket, so the
+    transport's C{doWrite} is replaced for the duration of the copy. Anything
+    the transport already had buffered (e.g. the response headers) is sent
+    before the file data.
+    """
+
+    def __init__(self, transport, data):
+        self.transport = transport
+        self.data = data
+        self.deferred = None
+
+    def start(self):
+        """
+        @return: a L{Deferred} that fires once all of the data has been sent.
+        """
+        self.deferred = Deferred()
+        self.transport.doWrite = self.doWrite
+        self.transport.startWriting()
+        return self.deferred
+
+    def stop(self):
+        """
+        Abandon the copy, e.g. because the connection went away.
+        """
+        if self.deferred is not None:
+            self._finished(Failure(ConnectionLost()))
+
+    def doWrite(self):
+        transport = self.transport
+        if _bufferedLength(transport):
+            result = type(transport).doWrite(transport)
+            if result is not None:
+                self._finished(Failure(ConnectionLost()))
+                return result
+            if _bufferedLength(transport):
+                return None
+
+        try:
+            self.data.sendTo(transport.fileno())
+        except (IOError, OSError), e:
+            if e.errno in (errno.EAGAIN, errno.EINTR):
+                # The transport's doWrite may have stopped writing once it
+                # flushed its own buffer
+                transport.startWriting()
+                return None
+            self._finished(Failure(ConnectionLost(str(e))))
+            return main.CONNECTION_LOST
+        except Exception:
+            # The file was shorter than promised: the response is broken
+            self._finished(Failure())
+            return main.CONNECTION_LOST
+
+        if self.data.length:
+            # The transport's doWrite may have stopped writing once its own
+            # buffer drained
+            transport.startWriting()
+        else:
+            self._finished(None)
+        return None
+
+    def _finished(self, failure):
+        if "doWrite" in self.transport.__dict__:
+            del self.transport.doWrite
+        d, self.deferred = self.deferred, None
+        if failure is None:
+            d.callback(None)
+        else:
+            d.errback(failure)
+
+
 class AbortedException(Exception):
     pass
 
@@ -530,6 +615,7 @@ class HTTPChannelRequest(HTTPParser):
     producer = None
     chunkedOut = False
     finished = False
+    _fileSender = None
 
     # Request Callbacks #
     def writeIntermediateResponse(self, code, headers=None):
@@ -584,6 +670,40 @@ class HTTPChannelRequest(HTTPParser):
         else:
             self.transport.write(data)
 
+    def canSendfile(self):
+        """
+        Can L{writeFile} be used? Only when we write straight to a plain
+        (non-TLS) socket: TLS has to encrypt the data in process, and a
+        queued or logged response is written to a wrapper.
+        """
+        return (
+            not self.queued and
+            not self.channel._secure and
+            self.transport is self.channel.transport and
+            all(
+                hasattr(self.transport, name)
+                for name in ("fileno", "dataBuffer", "offset", "_tempDataLen")
+            )
+        )
+
+    def writeFile(self, data):
+        """
+        Write a L{txweb2.stream.SendfileBuffer} using sendfile(2).
+
+        @return: a L{Deferred} that fires once the data has been sent.
+        """
+        if self.chunkedOut:
+            self.transport.write("%X\r\n" % len(data))
+
+        def _sent(result):
+            self._fileSender = None
+            if self.chunkedOut and not isinstance(result, Failure):
+                self.transport.write("\r\n")
+            return result
+
+        self._fileSender = _FileSender(self.transport, data)
+        return self._fileSender.start().addBoth(_sent)
+
     def finish(self):
         """We are finished writing data."""
         if self.finished:
@@ -609,6 +729,8 @@ class HTTPChannelRequest(HTTPParser):
         """
         self.abortParse()
         if closeWrite:
+            if self._fileSender is not None:
+                self._fileSender.stop()
             if self.producer:
                 self.producer.stopProducing()
                 self.unregisterProducer()
@@ -700,6 +822,8 @@ class HTTPChannelRequest(HTTPParser):
 
     def connectionLost(self, reason):
         """connection was lost"""
+        if self._fileSender is not None:
+            self._fileSender.stop()
         if self.queued and self.producer:
             self.producer.stopProducing()
             self.producer = None
@@ -695,7 +695,7 @@ class DAVResource (DAVPropertyMixIn, StaticRenderMixin):
     @inlineCallbacks
     def findChildrenFaster(
         self, depth, request, okcallback, badcallback, missingcallback, unavailablecallback,
-        names, privileges, inherited_aces
+        names, privileges, inherited_aces, withData=False
     ):
         """
         See L{IDAVResource.findChildren}.
@@ -721,6 +721,8 @@ class DAVResource (DAVPropertyMixIn, StaticRenderMixin):
         @param privileges: a list of privileges to check.
         @param inherited_aces: the list of parent ACEs that are
             inherited by all children.
+        @param withData: C{True} if the caller will read the data of all
+            the named children, so sub-classes can load it in bulk.
         """
         assert depth in ("0", "1", "infinity"), "Invalid depth: %s" % (depth,)
 
@@ -1,21 +1,20 @@
 from __future__ import generators
+from collections import OrderedDict
 import struct
 import zlib
-from txweb2 import stream
+from txweb2 import stream, responsecode
 
 # TODO: ungzip (can any browsers actually generate gzipped
 # upload data?) But it's necessary for client anyways.
 
 
+# magic header, compression method, no flags, timestamp, uh.. stuff
+_GZIP_HEADER = '\037\213\010\000' + struct.pack('<L', 0) + '\002\377'
+
+
 def gzipStream(input, compressLevel=6):
     crc, size = zlib.crc32(''), 0
-    # magic header, compression method, no flags
-    header = '\037\213\010\000'
-    # timestamp
-    header += struct.pack('<L', 0)
-    # uh.. stuff
-    header += '\002\377'
-    yield header
+    yield _GZIP_HEADER
 
     compress = zlib.compressobj(compressLevel, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, 0)
     _compress = compress.compress
@@ -51,14 +50,122 @@ def deflateStream(input, compressLevel=6):
 deflateStream = stream.generatorToStream(deflateStream)
 
 
-def gzipfilter(request, response):
+def gzipData(data, compressLevel=6):
+    """
+    Compress a string in one go. Produces the same output as L{gzipStream}.
+    """
+    compress = zlib.compressobj(compressLevel, zlib.DEFLATED, -zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, 0)
+    return "".join((
+        _GZIP_HEADER,
+        compress.compress(data),
+        compress.flush(),
+        struct.pack('<LL', zlib.crc32(data) & 0xFFFFFFFFL, len(data) & 0xFFFFFFFFL),
+    ))
+
+
+def deflateData(data, compressLevel=6):
+    """
+    Compress a string in one go. Produces the same output as L{deflateStream}.
+    """
+    compress = zlib.compressobj(compressLevel, zlib.DEFLATED, zlib.MAX_WBITS, zlib.DEF_MEM_LEVEL, 0)
+    return compress.compress(data) + compress.flush()
+
+
+class CompressedBodyCache(object):
+    """
+    A small LRU cache of compressed GET response bodies, keyed by request
+    URI, strong ETag and content-coding, so that repeated GETs of a large
+    unchanged resource are not compressed again every time.  Only bodies that
+    are the same for every user (marked C{Cache-Control: public}) are kept,
+    e.g. the timezone service list.
+    """
+
+    def __init__(self, maxSize=20 * 1024 * 1024, maxEntrySize=5 * 1024 * 1024):
+        self.maxSize = maxSize
+        self.maxEntrySize = maxEntrySize
+        self.size = 0
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        data = self.entries.pop(key, None)
+        if data is not None:
+            self.entries[key] = data
+        return data
+
+    def set(self, key, data):
+        if len(data) > self.maxEntrySize:
+            return
+        old = self.entries.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self.entries[key] = data
+        self.size += len(data)
+        while self.size > self.maxSize:
+            _ignore_key, old = self.entries.popitem(last=False)
+            self.size -= len(old)
+
+
+def _compressible(mimetype):
+    if mimetype is None:
+        return False
+    if mimetype.mediaType == 'text':
+        return True
+    subtype = mimetype.mediaSubtype
+    return mimetype.mediaType == 'application' and (
+        subtype in ('json', 'xml') or subtype.endswith('+json') or subtype.endswith('+xml')
+    )
+
+
+_CODINGS = {
+    'gzip': (gzipStream, gzipData),
+    'deflate': (deflateStream, deflateData),
+}
+
+
+def _acceptedCoding(request):
+    """
+    The content-coding to compress with, or C{None} if the client accepts
+    neither.
+    """
+    ae = request.headers.getHeader('accept-encoding', {})
+    anyCoding = ae.get('*', 0)
+    # Always prefer gzip over deflate no matter what their q-values are.
+    if ae.get('gzip', anyCoding):
+        return 'gzip'
+    elif ae.get('deflate', anyCoding):
+        return 'deflate'
+    else:
+        return None
+
+
+def gzipfilter(request, response, minimumSize=0, cache=None):
+    """
+    Compress the response body with the best content-coding the client
+    accepts.  The ETag is left unchanged, with C{Vary: Accept-Encoding}
+    telling caches the representations differ, so that it still matches
+    the DAV:getetag clients get from PROPFIND and REPORT and can be used
+    in conditional requests.  Strictly, a strong ETag should differ
+    between content-codings, so a cache that ignores C{Vary} may treat
+    the compressed and identity bodies as the same.
+
+    @param minimumSize: bodies of known length smaller than this are left
+        alone, as compressing them saves nothing.
+    @param cache: a L{CompressedBodyCache} used for public GET responses with
+        a strong ETag, or C{None}.
+    """
     if response.stream is None or response.headers.getHeader('content-encoding'):
         # Empty stream, or already compressed.
         return response
 
-    # FIXME: make this a more flexible matching scheme
-    mimetype = response.headers.getHeader('content-type')
-    if not mimetype or mimetype.mediaType != 'text':
+    if response.code == responsecode.PARTIAL_CONTENT:
+        # Ranges refer to the uncompressed body
+        return response
+
+    if not _compressible(response.headers.getHeader('content-type')):
+        return response
+
+    length = response.stream.length
+    if length is not None and length < minimumSize:
         return response
 
     # Make sure to note we're going to return different content depending on
@@ -67,15 +174,37 @@ def gzipfilter(request, response):
     if 'accept-encoding' not in vary:
         response.headers.setHeader('vary', vary + ['accept-encoding'])
 
-    ae = request.headers.getHeader('accept-encoding', {})
-    # Always prefer gzip over deflate no matter what their q-values are.
-    if ae.get('gzip', 0):
-        response.stream = gzipStream(response.stream)
-        response.headers.setHeader('content-encoding', ['gzip'])
-    elif ae.get('deflate', 0):
-        response.stream = deflateStream(response.stream)
-        response.headers.setHeader('content-encoding', ['deflate'])
+    coding = _acceptedCoding(request)
+    if coding is None:
+        return response
+    compressStream, compressData = _CODINGS[coding]
+
+    etag = response.headers.getHeader('etag')
+    if isinstance(response.stream, stream.MemoryStream):
+        # The body is already in memory: compress it in one go, so that the
+        # response still has a content-length.  Bodies that may differ from
+        # one user to another (e.g. calendar data filtered by access) share
+        # their ETag, so only public ones are cached.
+        key = None
+        if (
+            cache is not None and request.method == 'GET' and
+            etag is not None and not etag.weak and
+            'public' in response.headers.getHeader('cache-control', {})
+        ):
+            key = (request.uri, etag.tag, coding)
+
+        data = cache.get(key) if key is not None else None
+        if data is None:
+            data = compressData(str(response.stream.read() or ''))
+            if key is not None:
+                cache.set(key, data)
+        else:
+            response.stream.close()
+        response.stream = stream.MemoryStream(data)
+    else:
+        response.stream = compressStream(response.stream)
+    response.headers.setHeader('content-encoding', [coding])
 
     return response
 
-__all__ = ['gzipfilter']
+__all__ = ['gzipfilter', 'CompressedBodyCache']
@@ -33,7 +33,8 @@ import time
 from twisted.internet import defer
 from twext.python.log import Logger
 from txweb2 import iweb, stream, resource
-from zope.interface import implements, Attribute, Interface
+from txweb2.stream import ISendfileableStream
+from zope.interface import implements, directlyProvides, Attribute, Interface
 
 log = Logger()
 
@@ -46,6 +47,10 @@ class _LogByteCounter(object):
         self.done = done
         self.len = 0
 
+        # Do not hide a stream's ability to be sent with sendfile(2)
+        if ISendfileableStream.providedBy(stream):
+            directlyProvides(self, ISendfileableStream)
+
     length = property(lambda self: self.stream.length)
 
     def _callback(self, data):
@@ -58,8 +63,11 @@ class _LogByteCounter(object):
             self.len += len(data)
         return data
 
-    def read(self):
-        data = self.stream.read()
+    def read(self, sendfile=False):
+        if sendfile:
+            data = self.stream.read(sendfile)
+        else:
+            data = self.stream.read()
         if isinstance(data, defer.Deferred):
             return data.addCallback(self._callback)
         return self._callback(data)
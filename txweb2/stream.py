@@ -80,6 +80,15 @@ if sys.version_info[0:3] != (2, 4, 2):
 else:
     mmap = None
 
+# sendfile(2): os.sendfile on Python 3, otherwise the pysendfile package
+try:
+    from os import sendfile as _sendfile
+except ImportError:
+    try:
+        from sendfile import sendfile as _sendfile
+    except ImportError:
+        _sendfile = None
+
 
 #
 # Interfaces
@@ -189,17 +198,54 @@ SENDFILE_THRESHOLD = 256
 
 def mmapwrapper(*args, **kwargs):
     """
-    Python's mmap call sucks and ommitted the "offset" argument for no
-    discernable reason. Replace this with a mmap module that has offset.
+    mmap only accepts an "offset" that is a multiple of
+    C{mmap.ALLOCATIONGRANULARITY}. Map from the preceding boundary instead
+    and return a buffer over the requested region, so that a file can be
+    mapped chunk by chunk from any position.
     """
 
-    offset = kwargs.get('offset', None)
-    if offset in [None, 0]:
-        if 'offset' in kwargs:
-            del kwargs['offset']
-    else:
-        raise mmap.error("mmap: Python sucks and does not support offset.")
-    return mmap.mmap(*args, **kwargs)
+    offset = kwargs.pop('offset', None)
+    if not offset:
+        return mmap.mmap(*args, **kwargs)
+
+    delta = offset % mmap.ALLOCATIONGRANULARITY
+    args = list(args)
+    args[1] += delta
+    kwargs['offset'] = offset - delta
+    return buffer(mmap.mmap(*args, **kwargs), delta)
+
+
+class SendfileBuffer(object):
+    """
+    A region of a file that is to be copied straight to a socket with
+    sendfile(2), rather than being read into memory first.  Returned by
+    L{FileStream.read} when asked to do so.
+    """
+
+    def __init__(self, f, offset, length):
+        self.f = f
+        self.offset = offset
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def sendTo(self, fd):
+        """
+        Copy as much of the region as the socket will take right now.
+
+        @param fd: the socket file descriptor to write to.
+        @type fd: C{int}
+
+        @return: the number of bytes sent.
+        @rtype: C{int}
+        """
+        sent = _sendfile(fd, self.f.fileno(), self.offset, self.length)
+        if not sent:
+            raise RuntimeError("Ran out of data sending file %r, expected %d more bytes" % (self.f, self.length))
+        self.offset += sent
+        self.length -= sent
+        return sent
 
 
 class FileStream(SimpleStream):
@@ -233,15 +279,14 @@ class FileStream(SimpleStream):
             self.f = None
             return None
 
-        # if sendfile and length > SENDFILE_THRESHOLD:
-        #    # XXX: Yay using non-existent sendfile support!
-        #    # FIXME: if we return a SendfileBuffer, and then sendfile
-        #    #        fails, then what? Or, what if file is too short?
-        #    readSize = min(length, SENDFILE_LIMIT)
-        #    res = SendfileBuffer(self.f, self.start, readSize)
-        #    self.length -= readSize
-        #    self.start += readSize
-        #    return res
+        if sendfile and _sendfile is not None and length > SENDFILE_THRESHOLD:
+            # The consumer copies the data itself (see StreamProducer), and
+            # fails the response if the file turns out to be too short.
+            readSize = min(length, SENDFILE_LIMIT)
+            res = SendfileBuffer(self.f, self.start, readSize)
+            self.length -= readSize
+            self.start += readSize
+            return res
 
         if self.useMMap and length > MMAP_THRESHOLD:
             readSize = min(length, MMAP_LIMIT)
@@ -755,7 +800,13 @@ class ProducerStream(object):
 
 
 class StreamProducer(object):
-    """A push producer which gets its data by reading a stream."""
+    """A push producer which gets its data by reading a stream.
+
+    If the consumer has a C{canSendfile} method that returns C{True}, file
+    backed streams are asked for L{SendfileBuffer}s, which are handed to the
+    consumer's C{writeFile} method. That returns a L{Deferred} which fires
+    once the data has been sent, and production resumes after that.
+    """
     implements(ti_interfaces.IPushProducer)
 
     deferred = None
@@ -783,7 +834,10 @@ class StreamProducer(object):
             return
 
         try:
-            data = self.stream.read()
+            if self._canSendfile():
+                data = self.stream.read(sendfile=True)
+            else:
+                data = self.stream.read()
         except:
             self.stopProducing(Failure())
             return
@@ -794,6 +848,12 @@ class StreamProducer(object):
         else:
             self._doWrite(data)
 
+    def _canSendfile(self):
+        if not ISendfileableStream.providedBy(self.stream):
+            return False
+        canSendfile = getattr(self.consumer, "canSendfile", None)
+        return canSendfile is not None and canSendfile()
+
     def _doWrite(self, data):
         if self.consumer is None:
             return
@@ -807,6 +867,11 @@ class StreamProducer(object):
             return
 
         self.deferred = None
+        if isinstance(data, SendfileBuffer):
+            self.deferred = self.consumer.writeFile(data)
+            self.deferred.addCallbacks(self._wroteFile, self.stopProducing)
+            return
+
         if self.enforceStr:
             # XXX: sucks that we have to do this. make transport.write(buffer) work!
             data = str(buffer(data))
@@ -815,6 +880,11 @@ class StreamProducer(object):
         if not self.paused:
             self.resumeProducing()
 
+    def _wroteFile(self, _ignore):
+        self.deferred = None
+        if self.stream is not None and not self.paused:
+            self.resumeProducing()
+
     def pauseProducing(self):
         self.paused = True
 
@@ -1190,7 +1260,7 @@ class MD5Stream(SimpleStream):
         return self._md5value
 
 
-__all__ = ['IStream', 'IByteStream', 'FileStream', 'MemoryStream', 'CompoundStream',
+__all__ = ['IStream', 'IByteStream', 'FileStream', 'SendfileBuffer', 'MemoryStream', 'CompoundStream',
            'readAndDiscard', 'fallbackSplit', 'ProducerStream', 'StreamProducer',
            'BufferedStream', 'MD5Stream', 'readStream', 'ProcessStreamer', 'readIntoFile',
            'generatorToStream']
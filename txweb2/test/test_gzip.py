@@ -0,0 +1,174 @@
+##
+# Copyright (c) 2017 Apple Inc. All rights reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+##
+
+"""
+Tests for L{txweb2.filter.gzip}.
+"""
+
+import zlib
+
+from twisted.trial import unittest
+
+from txweb2 import http, http_headers, responsecode, stream
+from txweb2.filter import gzip
+
+
+class FakeRequest(object):
+
+    def __init__(self, method="GET", path="/calendar/", acceptEncoding="gzip"):
+        self.method = method
+        self.path = path
+        self.uri = path
+        self.headers = http_headers.Headers()
+        if acceptEncoding is not None:
+            self.headers.setRawHeaders("accept-encoding", [acceptEncoding])
+
+
+class GzipFilterTests(unittest.TestCase):
+
+    text = "BEGIN:VCALENDAR\r\nEND:VCALENDAR\r\n" * 100
+
+    def makeResponse(self, text=None, contentType="text/calendar", etag="abc", code=responsecode.OK, public=False):
+        headers = {"content-type": http_headers.MimeType.fromString(contentType)}
+        if etag is not None:
+            headers["etag"] = http_headers.ETag(etag)
+        if public:
+            headers["cache-control"] = {"public": None}
+        return http.Response(code, headers, self.text if text is None else text)
+
+    def body(self, response):
+        return str(response.stream.read())
+
+    def test_gzip(self):
+        """
+        In-memory bodies are compressed in one go, so the length is still known.
+        """
+        response = gzip.gzipfilter(FakeRequest(), self.makeResponse())
+        self.assertEquals(response.headers.getHeader("content-encoding"), ["gzip"])
+        self.assertIn("accept-encoding", response.headers.getHeader("vary"))
+        self.assertNotEquals(response.stream.length, None)
+        self.assertEquals(zlib.decompress(self.body(response), 16 + zlib.MAX_WBITS), self.text)
+
+    def test_deflate(self):
+        response = gzip.gzipfilter(FakeRequest(acceptEncoding="deflate"), self.makeResponse())
+        self.assertEquals(response.headers.getHeader("content-encoding"), ["deflate"])
+        self.assertEquals(zlib.decompress(self.body(response)), self.text)
+
+    def test_notAccepted(self):
+        response = gzip.gzipfilter(FakeRequest(acceptEncoding=None), self.makeResponse())
+        self.assertEquals(response.headers.getHeader("content-encoding"), None)
+        self.assertEquals(self.body(response), self.text)
+
+    def test_contentTypes(self):
+        """
+        JSON and XML application types are compressed, other types are not.
+        """
+        for contentType, compressed in (
+            ("application/json", True),
+            ("application/problem+json", True),
+            ("application/xml", True),
+            ("image/png", False),
+            ("application/octet-stream", False),
+        ):
+            response = gzip.gzipfilter(FakeRequest(), self.makeResponse(contentType=contentType))
+            self.assertEquals(response.headers.getHeader("content-encoding") is not None, compressed, contentType)
+
+    def test_minimumSize(self):
+        response = gzip.gzipfilter(FakeRequest(), self.makeResponse(text="small"), minimumSize=1024)
+        self.assertEquals(response.headers.getHeader("content-encoding"), None)
+
+    def test_partialContent(self):
+        response = gzip.gzipfilter(FakeRequest(), self.makeResponse(code=responsecode.PARTIAL_CONTENT))
+        self.assertEquals(response.headers.getHeader("content-encoding"), None)
+
+    def test_streamed(self):
+        """
+        Bodies that are not in memory are compressed as they are read.
+        """
+        response = self.makeResponse()
+        response.stream = stream.CompoundStream([self.text])
+        response = gzip.gzipfilter(FakeRequest(), response)
+        self.assertEquals(response.stream.length, None)
+
+        data = []
+        d = stream.readStream(response.stream, data.append)
+        d.addCallback(lambda _: self.assertEquals(zlib.decompress("".join(data), 16 + zlib.MAX_WBITS), self.text))
+        return d
+
+    def test_cache(self):
+        """
+        Public GET bodies with a strong ETag are only compressed once.
+        """
+        cache = gzip.CompressedBodyCache()
+        response = gzip.gzipfilter(FakeRequest(), self.makeResponse(public=True), cache=cache)
+        compressed = self.body(response)
+        self.assertEquals(cache.entries.keys(), [("/calendar/", "abc", "gzip")])
+
+        # A cache hit does not look at the (stale) body at all
+        response = gzip.gzipfilter(FakeRequest(), self.makeResponse(text="X" * 5000, public=True), cache=cache)
+        self.assertEquals(self.body(response), compressed)
+
+        # Different ETag, weak ETag, REPORT or not public: not served from cache
+        response = gzip.gzipfilter(FakeRequest(), self.makeResponse(text="Y" * 5000, etag="def", public=True), cache=cache)
+        self.assertEquals(zlib.decompress(self.body(response), 16 + zlib.MAX_WBITS), "Y" * 5000)
+        response = self.makeResponse(text="Z" * 5000, public=True)
+        response.headers.setHeader("etag", http_headers.ETag("abc", weak=True))
+        response = gzip.gzipfilter(FakeRequest(), response, cache=cache)
+        self.assertEquals(zlib.decompress(self.body(response), 16 + zlib.MAX_WBITS), "Z" * 5000)
+        response = gzip.gzipfilter(FakeRequest(method="REPORT"), self.makeResponse(text="W" * 5000, public=True), cache=cache)
+        self.assertEquals(zlib.decompress(self.body(response), 16 + zlib.MAX_WBITS), "W" * 5000)
+        self.assertEquals(len(cache.entries), 2)
+
+    def test_cachePrivate(self):
+        """
+        Bodies that may differ from one user to another, even with the same
+        ETag, are never cached.
+        """
+        cache = gzip.CompressedBodyCache()
+        response = gzip.gzipfilter(FakeRequest(), self.makeResponse(), cache=cache)
+        self.assertEquals(zlib.decompress(self.body(response), 16 + zlib.MAX_WBITS), self.text)
+        self.assertEquals(len(cache.entries), 0)
+        response = gzip.gzipfilter(FakeRequest(), self.makeResponse(text="X" * 5000), cache=cache)
+        self.assertEquals(zlib.decompress(self.body(response), 16 + zlib.MAX_WBITS), "X" * 5000)
+
+    def test_etag(self):
+        """
+        The ETag is left unchanged, so a client can use the DAV:getetag value
+        it got from PROPFIND or REPORT in a conditional request for a
+        compressed resource.
+        """
+        for acceptEncoding in ("gzip", "deflate", None,):
+            response = gzip.gzipfilter(FakeRequest(acceptEncoding=acceptEncoding), self.makeResponse())
+            self.assertEquals(response.headers.getHeader("etag"), http_headers.ETag("abc"))
+        self.assertIn("accept-encoding", response.headers.getHeader("vary"))
+
+        response = gzip.gzipfilter(FakeRequest(), self.makeResponse())
+        request = FakeRequest()
+        request.headers.setRawHeaders("if-match", ['"abc"'])
+        http.checkPreconditions(request, response)
+        request.headers.setRawHeaders("if-match", ['"def"'])
+        self.assertRaises(http.HTTPError, http.checkPreconditions, request, response)
+
+    def test_cacheLimits(self):
+        cache = gzip.CompressedBodyCache(maxSize=10, maxEntrySize=6)
+        cache.set("a", "12345")
+        cache.set("b", "1234567")
+        self.assertEquals(cache.get("b"), None)
+        cache.set("c", "12345")
+        self.assertEquals(cache.get("a"), "12345")
+        cache.set("d", "123")
+        self.assertEquals(cache.entries.keys(), ["a", "d"])
+        self.assertEquals(cache.size, 8)
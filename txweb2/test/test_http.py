@@ -1,7 +1,9 @@
 
 from __future__ import nested_scopes
 
+import errno
 import os
+import socket
 import sys
 import time
 
@@ -10,13 +12,18 @@ from zope.interface import implements
 from twisted.trial import unittest
 from txweb2 import http, http_headers, responsecode, iweb, stream
 from txweb2 import channel
+from txweb2 import log as txweb2log
+from txweb2.log import logFilter
 
 from twisted.internet import reactor, protocol, address, interfaces, utils
 from twisted.internet import defer
-from twisted.internet.defer import waitForDeferred, deferredGenerator
+from twisted.internet.defer import waitForDeferred, deferredGenerator, inlineCallbacks
+from twisted.internet.error import ConnectionLost
 from twisted.protocols import loopback
 from twisted.python import util, runtime
+from twisted.python.failure import Failure
 from txweb2.channel.http import SSLRedirectRequest, HTTPFactory, HTTPChannel
+from txweb2.channel.http import _FileSender
 from twisted.internet.task import deferLater
 from twext.internet.ssl import ChainingOpenSSLContextFactory
 
@@ -1260,6 +1267,211 @@ class TCPServerTest(unittest.TestCase, AbstractServerTestMixin):
         return d.addCallback(finish)
 
 
+class SendfileRequest(http.Request):
+    """
+    Responds with the test case's file, which is big enough to be sent with
+    sendfile(2).
+    """
+
+    def process(self):
+        testcase = self.chanRequest.channel.factory.testcase
+        testcase.serverTransport = self.chanRequest.transport
+
+        # Keep the socket buffer small, so that it fills up
+        self.chanRequest.transport.socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_SNDBUF, 16384
+        )
+
+        if self.uri == "/chunked":
+            # Without a length the body is sent in chunks
+            writeHeaders = self.chanRequest.writeHeaders
+
+            def chunkedHeaders(code, headers):
+                headers.removeHeader("content-length")
+                writeHeaders(code, headers)
+            self.chanRequest.writeHeaders = chunkedHeaders
+
+        response = http.Response(200, stream=stream.FileStream(open(testcase.path, "rb")))
+        if self.uri == "/logged":
+            # Served as every server response is, through the log filter
+            response = logFilter(self, response)
+        self.writeResponse(response)
+
+    def timeStamp(self, tag):
+        pass
+
+
+class SendfileClient(protocol.Protocol):
+    """
+    Requests a URI and collects the response until the connection is closed.
+    """
+
+    def __init__(self, uri, paused=False):
+        self.uri = uri
+        self.paused = paused
+        self.data = []
+        self.done = defer.Deferred()
+
+    def connectionMade(self):
+        self.transport.socket.setsockopt(
+            socket.SOL_SOCKET, socket.SO_RCVBUF, 16384
+        )
+        if self.paused:
+            self.transport.pauseProducing()
+        self.transport.write(
+            "GET %s HTTP/1.1\r\nHost: localhost\r\nConnection: close\r\n\r\n"
+            % (self.uri,)
+        )
+
+    def dataReceived(self, data):
+        self.data.append(data)
+
+    def connectionLost(self, reason):
+        self.done.callback("".join(self.data))
+
+
+class SendfileServerTest(unittest.TestCase):
+    """
+    Plain file response bodies are copied to a real TCP connection with
+    sendfile(2), after anything the transport had already buffered.
+    """
+
+    def setUp(self):
+        self.text = os.urandom(4 * 1024 * 1024)
+        self.path = self.mktemp()
+        with open(self.path, "wb") as f:
+            f.write(self.text)
+
+        # Record how each copy finished
+        self.results = []
+        finished = _FileSender._finished
+
+        def _finished(sender, failure):
+            self.results.append(failure)
+            finished(sender, failure)
+        self.patch(_FileSender, "_finished", _finished)
+
+        # Note when the socket fills up, and optionally fail the first call
+        # with EAGAIN
+        self.sendfileCalls = 0
+        self.failFirstCall = False
+        self.blocked = defer.Deferred()
+        sendfile = stream._sendfile
+
+        def _sendfile(outfd, infd, offset, count):
+            self.sendfileCalls += 1
+            if self.failFirstCall and self.sendfileCalls == 1:
+                raise OSError(errno.EAGAIN, os.strerror(errno.EAGAIN))
+            sent = sendfile(outfd, infd, offset, count)
+            if sent < count and not self.blocked.called:
+                self.blocked.callback(None)
+            return sent
+        self.patch(stream, "_sendfile", _sendfile)
+
+        # Record what the log filter logs
+        self.logged = []
+        self.patch(txweb2log.log, "info", lambda *args, **kwargs: self.logged.append(kwargs["loginfo"]))
+
+        factory = SimpleFactory(requestFactory=SendfileRequest)
+        factory.testcase = self
+        self.factory = factory
+        self.connlost = defer.Deferred()
+
+        self.socket = reactor.listenTCP(0, factory, interface="127.0.0.1")
+        self.port = self.socket.getHost().port
+
+    def tearDown(self):
+        d = defer.maybeDeferred(self.socket.stopListening)
+        return d.addCallback(lambda _: self.connlost)
+
+    def connect(self, uri, paused=False):
+        return protocol.ClientCreator(
+            reactor, SendfileClient, uri, paused
+        ).connectTCP("127.0.0.1", self.port)
+
+    def assertSent(self):
+        self.assertTrue(self.sendfileCalls)
+        self.assertEquals(self.results, [None])
+        self.assertFalse("doWrite" in self.serverTransport.__dict__)
+
+    @inlineCallbacks
+    def test_bufferedHeaders(self):
+        """
+        The response headers, still buffered in the transport when the copy
+        starts, are sent before the file data.
+        """
+        client = yield self.connect("/file")
+        data = yield client.done
+        headers, body = data.split("\r\n\r\n", 1)
+        self.assertTrue(headers.startswith("HTTP/1.1 200 OK\r\n"))
+        self.assertIn("\r\nContent-Length: %d" % (len(self.text),), headers)
+        self.assertEquals(body, self.text)
+        self.assertSent()
+
+    @inlineCallbacks
+    def test_socketFull(self):
+        """
+        EAGAIN and short writes while the client is not reading leave the copy
+        waiting for the socket to become writable again.
+        """
+        self.failFirstCall = True
+        client = yield self.connect("/file", paused=True)
+        yield self.blocked
+        client.transport.resumeProducing()
+        data = yield client.done
+        self.assertEquals(data.split("\r\n\r\n", 1)[1], self.text)
+        self.assertTrue(self.sendfileCalls > 2)
+        self.assertSent()
+
+    @inlineCallbacks
+    def test_chunked(self):
+        """
+        Without a content length, the file data is sent as a single chunk.
+        """
+        client = yield self.connect("/chunked")
+        data = yield client.done
+        headers, body = data.split("\r\n\r\n", 1)
+        self.assertIn("\r\nTransfer-Encoding: chunked", headers)
+        self.assertEquals(
+            body, "%X\r\n%s\r\n0\r\n\r\n" % (len(self.text), self.text)
+        )
+        self.assertSent()
+
+    @inlineCallbacks
+    def test_logged(self):
+        """
+        Wrapping the response stream to count the bytes logged does not stop
+        it being sent with sendfile(2).
+        """
+        client = yield self.connect("/logged")
+        data = yield client.done
+        self.assertEquals(data.split("\r\n\r\n", 1)[1], self.text)
+        self.assertSent()
+        self.assertEquals(len(self.logged), 1)
+        self.assertEquals(self.logged[0].bytesSent, len(self.text))
+        self.assertTrue(self.logged[0].responseCompleted)
+
+    @inlineCallbacks
+    def test_connectionLost(self):
+        """
+        If the connection is lost part way through, the copy fails and the
+        transport is put back to normal.
+        """
+        client = yield self.connect("/file", paused=True)
+        yield self.blocked
+        client.transport.abortConnection()
+        yield client.done
+        yield self.connlost
+        self.assertEquals(len(self.results), 1)
+        self.assertIsInstance(self.results[0], Failure)
+        self.assertTrue(self.results[0].check(ConnectionLost))
+        self.assertFalse("doWrite" in self.serverTransport.__dict__)
+
+
+if stream._sendfile is None:
+    SendfileServerTest.skip = "sendfile(2) is not available"
+
+
 try:
     from twisted.internet import ssl
     ssl  # pyflakes
@@ -139,6 +139,105 @@ class MMapFileStreamTest(SimpleStreamTests, unittest.TestCase):
     if not stream.mmap:
         test_mmapwrapper.skip = 'mmap not supported here'
 
+    def test_mmapOffset(self):
+        """
+        Regions that do not start on an allocation boundary are still mapped.
+        """
+        s = self.makeStream(5)
+        data = s.read()
+        self.assertIsInstance(data, (buffer, stream.mmap.mmap))
+        self.assertEquals(bufstr(data), self.text[5:])
+        self.assertEquals(s.read(), None)
+
+    if not stream.mmap:
+        test_mmapOffset.skip = 'mmap not supported here'
+
+
+class SendfileConsumer(object):
+    """
+    A consumer that can take L{stream.SendfileBuffer}s, and copies them to a
+    pipe with sendfile(2).
+    """
+
+    def __init__(self):
+        self.readFD, self.writeFD = os.pipe()
+        self.data = []
+
+    def canSendfile(self):
+        return True
+
+    def registerProducer(self, producer, streaming):
+        pass
+
+    def unregisterProducer(self):
+        pass
+
+    def write(self, data):
+        self.data.append(data)
+
+    def writeFile(self, data):
+        return defer.maybeDeferred(self._copy, data)
+
+    def _copy(self, data):
+        while data.length:
+            data.sendTo(self.writeFD)
+            self.data.append(os.read(self.readFD, 1024 * 1024))
+
+    def close(self):
+        os.close(self.readFD)
+        os.close(self.writeFD)
+
+
+class SendfileFileStreamTest(unittest.TestCase):
+
+    text = "1234567890" * 100
+
+    def setUp(self):
+        f = tempfile.TemporaryFile('w+')
+        f.write(self.text)
+        f.seek(0, 0)
+        self.f = f
+
+    def test_read(self):
+        """
+        L{stream.FileStream.read} returns a L{stream.SendfileBuffer} when asked
+        for one, and plain data otherwise.
+        """
+        s = stream.FileStream(self.f, 10)
+        data = s.read(sendfile=True)
+        self.assertIsInstance(data, stream.SendfileBuffer)
+        self.assertEquals((data.offset, data.length), (10, len(self.text) - 10))
+        self.assertEquals(s.read(sendfile=True), None)
+
+        s = stream.FileStream(self.f, 10, useMMap=False)
+        self.assertEquals(bufstr(s.read()), self.text[10:])
+
+    def test_producer(self):
+        """
+        L{stream.StreamProducer} hands L{stream.SendfileBuffer}s to consumers
+        that can send them.
+        """
+        consumer = SendfileConsumer()
+        self.addCleanup(consumer.close)
+        s = stream.CompoundStream(["abc", stream.FileStream(self.f), "xyz"])
+        d = stream.StreamProducer(s).beginProducing(consumer)
+        d.addCallback(lambda _: self.assertEquals("".join(consumer.data), "abc" + self.text + "xyz"))
+        return d
+
+    def test_shortFile(self):
+        """
+        L{stream.SendfileBuffer.sendTo} fails when the file is shorter than
+        expected.
+        """
+        consumer = SendfileConsumer()
+        self.addCleanup(consumer.close)
+        s = stream.FileStream(self.f, 0, len(self.text) + 1000)
+        d = stream.StreamProducer(s).beginProducing(consumer)
+        return self.assertFailure(d, RuntimeError)
+
+    if stream._sendfile is None:
+        skip = 'sendfile not supported here'
+
 
 class MemoryStreamTest(SimpleStreamTests, unittest.TestCase):
 